@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+"""
+Benchmark the IPC convolution of full-frame ramps.
+
+A synthetic full-frame ramp is convolved with square 2-D kernels of
+increasing size, group by group (the original loop), with all the groups
+at once by shifted adds ('direct') and by FFT ('fft'). The run times and
+the largest difference from the group loop are reported.
+
+Usage:  python bench_ipc.py [--ngroups N] [--nints N] [--threads N]
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from jwst.ipc import ipc_corr
+
+NREF = ipc_corr.NumRefPixels(bottom_rows=4, top_rows=4,
+                             left_columns=4, right_columns=4)
+
+
+def time_convolution(data, kernel, method, nproc):
+    """
+    Run time of the convolution, in seconds, and the convolved data.
+    """
+    data = data.copy()
+    start = time.time()
+    if method == 'loop':
+        for i in range(data.shape[0]):
+            for j in range(data.shape[1]):
+                ipc_corr.ipc_convolve(data[i, j], kernel, NREF)
+    else:
+        ipc_corr.convolve_stack(data, kernel, NREF, method, nproc)
+    return time.time() - start, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--ngroups', type=int, default=10,
+                        help='number of groups')
+    parser.add_argument('--nints', type=int, default=1,
+                        help='number of integrations')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of threads')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    rng = np.random.RandomState(args.seed)
+    data = rng.normal(1000., 10., (args.nints, args.ngroups, 2048, 2048))
+    data = data.astype(np.float32)
+
+    print('{0} x {1} groups full frame, {2} thread(s)'.format(
+        args.nints, args.ngroups, args.threads))
+    for size in (3, 5, 7, 9, 11):
+        kernel = rng.uniform(0., 0.02, (size, size)).astype(np.float32)
+        kernel[size // 2, size // 2] = 0.9
+        loop_time, expected = time_convolution(data, kernel, 'loop', 1)
+        print('  {0} x {0} kernel'.format(size))
+        print('    group loop:  {0:8.2f} s'.format(loop_time))
+        for method in ('direct', 'fft'):
+            run_time, result = time_convolution(data, kernel, method,
+                                                args.threads)
+            print('    {0:11s}  {1:8.2f} s  max |diff| {2:8.2g}'.format(
+                method + ':', run_time, np.abs(result - expected).max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+"""
+Benchmark the two-point difference jump detection.
+
+Synthetic ramps with known injected jumps are processed by
+twopoint_difference.find_CRs twice: with the vectorized search for
+additional CRs (the default) and with the pixel-by-pixel search
+(pixel_loop=True). The run times, the agreement between the two paths
+and the fraction of injected jumps recovered are reported.
+
+Usage:  python bench_jump_twopoint.py [--ngroups N] [--size N] [--hit-fraction F]
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from jwst.datamodels import dqflags
+from jwst.jump.twopoint_difference import find_CRs
+
+
+def make_ramps(ngroups, size, hit_fraction, max_jumps, readnoise, seed):
+    """
+    Ramps with random slopes and read noise. A fraction hit_fraction of the
+    pixels get between 1 and max_jumps jumps at random groups.
+    Returns the data, an empty groupdq and the boolean (ngroups, size, size)
+    array of the injected jumps.
+    """
+    rng = np.random.RandomState(seed)
+    slopes = rng.uniform(0, 200, size=(size, size))
+    data = np.zeros((1, ngroups, size, size), dtype=np.float32)
+    data[0] = (np.arange(ngroups)[:, np.newaxis, np.newaxis] * slopes +
+               rng.normal(0, readnoise, size=(ngroups, size, size)))
+
+    injected = np.zeros((ngroups, size, size), dtype=bool)
+    hit = rng.uniform(size=(size, size)) < hit_fraction
+    njumps = rng.randint(1, max_jumps + 1, size=(size, size))
+    for k in range(max_jumps):
+        pixels = hit & (njumps > k)
+        jump_group = rng.randint(1, ngroups, size=(size, size))
+        jump_size = rng.uniform(1000, 10000, size=(size, size))
+        injected[jump_group[pixels], np.where(pixels)[0], np.where(pixels)[1]] = True
+        for group in range(1, ngroups):
+            jumped = pixels & (jump_group <= group)
+            data[0, group][jumped] += jump_size[jumped]
+
+    gdq = np.zeros(data.shape, dtype=np.uint8)
+    read_noise = np.full((size, size), readnoise, dtype=np.float32)
+    return data, gdq, read_noise, injected
+
+
+def run(data, gdq, read_noise, rej_threshold, pixel_loop):
+    data = data.copy()
+    gdq = gdq.copy()
+    t0 = time.time()
+    find_CRs(data, gdq, read_noise, rej_threshold, 1, pixel_loop=pixel_loop)
+    return time.time() - t0, gdq
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ngroups', type=int, default=50)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--hit-fraction', type=float, default=0.1)
+    parser.add_argument('--max-jumps', type=int, default=4)
+    parser.add_argument('--threshold', type=float, default=4.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    data, gdq, read_noise, injected = make_ramps(args.ngroups, args.size,
+                                                 args.hit_fraction,
+                                                 args.max_jumps, 10.0,
+                                                 args.seed)
+    print('ramps: ngroups=%d size=%dx%d injected jumps=%d' %
+          (args.ngroups, args.size, args.size, injected.sum()))
+
+    for label, pixel_loop in (('vectorized', False), ('pixel loop', True)):
+        elapsed, result = run(data, gdq, read_noise, args.threshold, pixel_loop)
+        found = np.bitwise_and(result[0], dqflags.group['JUMP_DET']) > 0
+        if pixel_loop:
+            loop_found = found
+        else:
+            vector_found = found
+        print('%-10s  %8.2f s  recovered %6.2f%%  false positives %d' %
+              (label, elapsed, 100.0 * (found & injected).sum() / injected.sum(),
+               (found & ~injected).sum()))
+
+    print('groups flagged differently by the two paths: %d' %
+          (vector_found != loop_found).sum())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+"""
+Benchmark the peak memory of the outlier detection median.
+
+Synthetic resampled images are combined by outlier_detection.create_median
+in memory (all of the images held at once, the default) and from scratch
+files a block of rows at a time (median_buffer_mb > 0), for an increasing
+number of images.  Each run is made in its own process, which generates
+the images one at a time, so that the peak resident memory of the
+process is that of the median.  The peak memory, the run time and
+whether the two medians agree are reported.
+
+Usage:  python bench_outlier_median.py [--size N] [--counts N,N,...] [--buffer-mb MB]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from jwst.outlier_detection.outlier_detection import create_median
+
+
+class Resampled(object):
+    """The arrays of a resampled image used by create_median"""
+    def __init__(self, data, wht):
+        self.data = data
+        self.wht = wht
+
+
+def resampled_images(count, size, seed):
+    """Generate dithered images of a size x size mosaic, one at a time"""
+    rng = np.random.RandomState(seed)
+    for i in range(count):
+        data = rng.normal(10., 1., (size, size)).astype(np.float32)
+        wht = np.zeros((size, size), dtype=np.float32)
+        # Each image covers most of the mosaic
+        y, x = rng.randint(0, size // 8, 2)
+        wht[y:y + size * 7 // 8, x:x + size * 7 // 8] = 1.
+        yield Resampled(data, wht)
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 2. ** 20
+    return maxrss / 2. ** 10
+
+
+def run_one(count, size, buffer_mb, seed):
+    """Run one median in this process and print the result as JSON"""
+    before = peak_rss_mb()
+    t0 = time.time()
+    images = resampled_images(count, size, seed)
+    if buffer_mb <= 0:
+        images = list(images)
+    median_image = create_median(images, nlow=0, nhigh=0, maskpt=0.7,
+                                 median_buffer_mb=buffer_mb)
+    print(json.dumps({'peak_mb': peak_rss_mb() - before,
+                      'time': time.time() - t0,
+                      'checksum': float(np.nansum(median_image, dtype=np.float64))}))
+
+
+def measure(count, size, buffer_mb, seed):
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--run', '--counts', str(count),
+         '--size', str(size), '--buffer-mb', str(buffer_mb),
+         '--seed', str(seed)])
+    return json.loads(output.decode('ascii').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=2048)
+    parser.add_argument('--counts', type=str, default='4,8,16,32')
+    parser.add_argument('--buffer-mb', type=float, default=64.)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_one(int(args.counts), args.size, args.buffer_mb, args.seed)
+        return
+
+    image_mb = args.size * args.size * 4 / 2. ** 20
+    print('mosaic: %dx%d (%.0f MB per image), buffer %.0f MB' %
+          (args.size, args.size, image_mb, args.buffer_mb))
+    print('%6s  %20s  %20s  %s' % ('images', 'in memory', 'buffered', 'same'))
+    for count in [int(c) for c in args.counts.split(',')]:
+        memory = measure(count, args.size, 0, args.seed)
+        buffered = measure(count, args.size, args.buffer_mb, args.seed)
+        print('%6d  %8.0f MB %7.2f s  %8.0f MB %7.2f s  %s' %
+              (count, memory['peak_mb'], memory['time'],
+               buffered['peak_mb'], buffered['time'],
+               memory['checksum'] == buffered['checksum']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+"""
+Benchmark the reference pixel correction of full-frame NIR ramps.
+
+Synthetic full-frame NIRCam (NRCA1) and NIRSpec (NRS1) ramps are corrected
+by NIRDataset.do_corrections twice: with all the groups of an integration
+corrected at once (the default) and group by group (group_loop=True). The
+run times and the largest difference between the two paths are reported.
+
+Usage:  python bench_refpix.py [--ngroups N] [--nints N] [--smoothing N]
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from jwst import datamodels
+from jwst.datamodels import dqflags
+from jwst.refpix import reference_pixels
+
+
+def make_ramp(detector, nints, ngroups, seed):
+    """
+    A full-frame ramp with a bias drift and 1% of DO_NOT_USE pixels.
+    """
+    rng = np.random.RandomState(seed)
+    model = datamodels.RampModel((nints, ngroups, 2048, 2048))
+    model.meta.instrument.detector = detector
+    model.meta.subarray.name = 'FULL'
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.xsize = 2048
+    model.meta.subarray.ysize = 2048
+    model.data[:] = rng.normal(1000., 10., model.data.shape)
+    model.data += 20. * np.arange(ngroups)[:, np.newaxis, np.newaxis]
+    model.pixeldq[rng.uniform(size=(2048, 2048)) < 0.01] = \
+        dqflags.pixel['DO_NOT_USE']
+    return model
+
+
+def time_correction(model, smoothing, group_loop):
+    """
+    Run time of the correction, in seconds, and the corrected data.
+    """
+    dataset = reference_pixels.create_dataset(
+        model, True, True, smoothing, 1.0, True)
+    start = time.time()
+    dataset.do_corrections(group_loop=group_loop)
+    return time.time() - start, dataset.data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--ngroups', type=int, default=10,
+                        help='number of groups')
+    parser.add_argument('--nints', type=int, default=1,
+                        help='number of integrations')
+    parser.add_argument('--smoothing', type=int, default=11,
+                        help='side reference pixel smoothing length')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    for detector in ('NRCA1', 'NRS1'):
+        model = make_ramp(detector, args.nints, args.ngroups, args.seed)
+        loop_time, expected = time_correction(model.copy(), args.smoothing,
+                                              True)
+        batch_time, result = time_correction(model.copy(), args.smoothing,
+                                             False)
+        print('{0}: {1} x {2} groups full frame'.format(
+            detector, args.nints, args.ngroups))
+        print('  group loop:  {0:8.2f} s'.format(loop_time))
+        print('  all groups:  {0:8.2f} s'.format(batch_time))
+        print('  speedup:     {0:8.2f}'.format(loop_time / batch_time))
+        print('  max |diff|:  {0:8.2g}'.format(
+            np.nanmax(np.abs(result - expected))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+"""
+Benchmark the per-step overhead of a pipeline.
+
+A pipeline chaining a number of LastFrameStep instances (a step that needs
+no reference file and does very little work) is run on a small subarray
+ramp, with and without `fast_chaining`. With fast chaining the steps do not
+run garbage collection and the models are only validated once, at the end
+of the pipeline. The mean time per step of each mode is reported.
+
+Usage:  python bench_step_chaining.py [--nsteps N] [--size N] [--repeat N]
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import time
+
+from jwst import datamodels
+from jwst.stpipe import Pipeline
+from jwst.lastframe.lastframe_step import LastFrameStep
+
+
+def make_pipeline_class(nsteps):
+    """
+    A pipeline class running `nsteps` LastFrameStep one after the other.
+    """
+    names = ['lastframe{0:02d}'.format(i) for i in range(nsteps)]
+
+    class ChainPipeline(Pipeline):
+        step_defs = dict((name, LastFrameStep) for name in names)
+
+        def process(self, input):
+            model = input
+            for name in names:
+                model = getattr(self, name)(model)
+            return model
+
+    return ChainPipeline
+
+
+def make_ramp(ngroups, size):
+    """
+    A MIRI subarray ramp of size x size pixels.
+    """
+    model = datamodels.RampModel((1, ngroups, size, size))
+    model.meta.instrument.name = 'MIRI'
+    model.meta.instrument.detector = 'MIRIMAGE'
+    model.meta.subarray.name = 'SUB64'
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.xsize = size
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.ysize = size
+    model.meta.exposure.ngroups = ngroups
+    model.meta.exposure.nframes = 1
+    return model
+
+
+def time_pipeline(pipeline_class, model, repeat, fast_chaining):
+    """
+    Mean run time of the pipeline, in seconds.
+    """
+    pipeline = pipeline_class(fast_chaining=fast_chaining)
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        result = pipeline.run(model)
+        times.append(time.time() - start)
+        result.close()
+    return sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--nsteps', type=int, default=13,
+                        help='number of chained steps')
+    parser.add_argument('--size', type=int, default=64,
+                        help='size of the subarray')
+    parser.add_argument('--ngroups', type=int, default=5,
+                        help='number of groups')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs of each mode')
+    args = parser.parse_args()
+
+    # The step log messages would dominate the timing
+    logging.disable(logging.INFO)
+
+    pipeline_class = make_pipeline_class(args.nsteps)
+    model = make_ramp(args.ngroups, args.size)
+
+    print('{0} steps on a {1} group {2}x{2} ramp'.format(
+        args.nsteps, args.ngroups, args.size))
+    default = time_pipeline(pipeline_class, model, args.repeat, False)
+    fast = time_pipeline(pipeline_class, model, args.repeat, True)
+    print('default:        {0:8.2f} ms/step'.format(
+        1e3 * default / args.nsteps))
+    print('fast chaining:  {0:8.2f} ms/step'.format(
+        1e3 * fast / args.nsteps))
+    print('speedup:        {0:8.2f}'.format(default / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -37,9 +37,12 @@ def klip(target_model, refs_model, truncate):
         Indicates how many rows to keep in the Karhunen-Loeve transform.
     """
 
-    # Initialize the output models as copies of the input target model
-    output_target = target_model.copy()
-    output_psf = target_model.copy()
+    # Initialize the output models as copies of the input target model,
+    # sharing the arrays that are not modified
+    output_target = target_model.copy(copy_on_write=True)
+    output_target.unshare('data', 'err')
+    output_psf = target_model.copy(copy_on_write=True)
+    output_psf.unshare('data')
 
     # Loop over the target integrations
     for i in range(target_model.data.shape[0]):
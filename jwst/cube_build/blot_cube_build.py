@@ -18,6 +18,7 @@ from ..assign_wcs import pointing
 from gwcs import wcstools
 from . import instrument_defaults
 from . import coord
+from . import spaxel
 
 
 
@@ -134,9 +135,9 @@ class CubeBlot(object):
 #                xdet,ydet = wcstools.grid_from_bounding_box(model.meta.wcs.bounding_box, step=(1,1))
                 ydet, xdet = np.mgrid[:1024, :1032]                                    
 
-                blot_flux = np.zeros(model.shape,dtype=np.float32)
-                blot_weight = np.zeros(model.shape,dtype=np.float32)
-                blot_iflux = np.zeros(model.shape,dtype=np.float32)
+                # one element for each detector pixel of the blotted image
+                blot_spaxel = spaxel.SpaxelArrays(model.data.size)
+                ncols = model.data.shape[1]
 
                 pixel_mask = np.full(model.shape,False,dtype=bool)
                 pixel_mask[:,xstart:xend] = True
@@ -181,7 +182,8 @@ class CubeBlot(object):
                     # xx,yy are the index value of the orginal detector frame -
                     # blot image
                     yy = y[ipt]
-                    xx = x[ipt]                    
+                    xx = x[ipt]
+                    ipixel = yy * ncols + xx
                     # find the cube values that fall withing ROI of detector xx,yy
                     xdistance = (xi_blot[ipt] - self.xi_centers)
                     ydistance = (eta_blot[ipt] -self.eta_centers)
@@ -224,21 +226,20 @@ class CubeBlot(object):
                             weight_distance = 1.0 / weight_distance
 
 
-                            blot_flux[yy,xx] = blot_flux[yy,xx]  + \
+                            blot_spaxel.flux[ipixel] = blot_spaxel.flux[ipixel]  + \
                                 weight_distance*self.cube_flux[zz,yy_cube,xx_cube]
-                            blot_weight[yy,xx] =blot_weight[yy,xx]  + weight_distance
-                            blot_iflux[yy,xx] = blot_iflux[yy,xx] + 1
+                            blot_spaxel.flux_weight[ipixel] = blot_spaxel.flux_weight[ipixel]  + weight_distance
+                            blot_spaxel.iflux[ipixel] = blot_spaxel.iflux[ipixel] + 1
 #________________________________________________________________________________  
                         
-                    # determine finnal flux    
-                    if(blot_iflux[yy,xx] > 0) :
-                        blot_flux[yy,xx] = blot_flux[yy,xx]/blot_weight[yy,xx]
-                    
 #                    iprint = iprint+1
 #                    if(iprint == 40960):
 #                        iprint = 0 
                         
-                blot.data = blot_flux
+                # determine final flux
+                blot_spaxel.find_flux()
+                blot.data = np.reshape(blot_spaxel.flux,
+                                       model.data.shape).astype(np.float32)
             blot_models.append(blot)
         return blot_models
 
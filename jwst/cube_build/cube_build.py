@@ -69,6 +69,7 @@ class CubeData(object):
         self.wavemax = pars.get('wavemax')
         self.weighting = pars.get('weighting')
         self.weight_power = pars.get('weight_power')
+        self.pointcloud_engine = pars.get('pointcloud_engine', 'loop')
         self.xdebug = pars.get('xdebug')
         self.ydebug = pars.get('ydebug')
         self.zdebug = pars.get('zdebug')
@@ -110,8 +111,9 @@ class CubeData(object):
         self.xcoord = None
         self.ycoord = None
         self.zcoord = None
+        self.spaxel_tree = None # KD-tree of spaxel centers (kdtree point cloud engine)
 
-        self.spaxel = []        # list of spaxel classes
+        self.spaxel = None      # SpaxelArrays holding the spaxel information
 #********************************************************************************
     def setup(self):
 
@@ -387,6 +389,7 @@ class CubeData(object):
             cube_build_wcs_util.set_geometryAB(self,cube_footprint) # local coordinate system
 
         cube_build_wcs_util.print_cube_geometry(self)
+        self.spaxel_tree = None
 
 
 #********************************************************************************
@@ -401,7 +404,7 @@ class CubeData(object):
 
         Parameter
         ----------
-        spaxel - a list of spaxel members holding the detector flux information
+        spaxel - SpaxelArrays holding the detector flux information
 
         Returns
         -------
@@ -460,7 +463,7 @@ class CubeData(object):
 
         Parameter
         ----------
-        spaxel - a list of spaxel members holding the detector flux information
+        spaxel - SpaxelArrays holding the detector flux information
 
         Returns
         -------
@@ -481,7 +484,6 @@ class CubeData(object):
         for j in range(n):
             t0 = time.time()
 # for each new data model create a new spaxel
-            spaxel = []
             spaxel = CubeData.create_spaxel(self)
 
             with datamodels.ImageModel(self.input_models[j]) as input_model:
@@ -494,7 +496,7 @@ class CubeData(object):
                     y = np.reshape(y, y.size)
                     x = np.reshape(x, x.size)
 
-                    cube_cloud.match_det2cube(self,input_model,
+                    CubeData.match_det2cube(self,input_model,
                                               x, y, j,
                                               this_par1,this_par2,
                                               spaxel,
@@ -514,7 +516,7 @@ class CubeData(object):
                         x,y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box)
 
 
-                        cube_cloud.match_det2cube(self,input_model,
+                        CubeData.match_det2cube(self,input_model,
                                                   x, y, ii,
                                                   this_par1,this_par2,
                                                   spaxel,
@@ -540,7 +542,6 @@ class CubeData(object):
 
 #_______________________________________________________________________
             single_IFUCube.append(IFUCube)
-            del spaxel[:]
         return single_IFUCube
 
 #********************************************************************************
@@ -549,27 +550,21 @@ class CubeData(object):
         """
         Short Summary
         -------------
-        # now you have the size of cube - create an instance for each spaxel
-        # create an empty spaxel list - this will become a list of Spaxel classses
+        # now you have the size of cube - create the spaxel arrays
+        # one element for each spaxel in the cube
 
         Parameter
         ----------
 
         Returns
         -------
-        list of classes contained in spaxel
+        SpaxelArrays holding the flux, weight, number of mapped pixels and error
+        of each spaxel
         """
 #________________________________________________________________________________
 
-
         total_num = self.naxis1*self.naxis2*self.naxis3
-
-        if(self.interpolation == 'pointcloud'):
-            for t in range(total_num):
-                self.spaxel.append(spaxel.Spaxel())
-        else:
-            for t in range(total_num):
-                self.spaxel.append(spaxel.SpaxelAB())
+        self.spaxel = spaxel.SpaxelArrays(total_num)
 
         return self.spaxel
 
@@ -639,7 +634,7 @@ class CubeData(object):
 
         Parameter
         ----------
-        spaxel: List of Spaxels
+        spaxel: SpaxelArrays of the cube
 
         Returns
         -------
@@ -677,7 +672,7 @@ class CubeData(object):
                         y = np.reshape(y, y.size)
                         x = np.reshape(x, x.size)
                         t0 = time.time()
-                        cube_cloud.match_det2cube(self,input_model,
+                        CubeData.match_det2cube(self,input_model,
                                             x, y, k,
                                             this_par1,this_par2,
                                             spaxel,
@@ -747,7 +742,7 @@ class CubeData(object):
                         x,y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box,
                                                               step=(1,1), center=True)
                         t0 = time.time()
-                        cube_cloud.match_det2cube(self,input_model,
+                        CubeData.match_det2cube(self,input_model,
                                                   x, y, i,
                                                   this_par1,this_par2,
                                                   spaxel,
@@ -756,6 +751,46 @@ class CubeData(object):
 
                         t1 = time.time()
                         log.debug("Time Match one NIRSPEC slice  to IFUCube = %.1f.s" % (t1 - t0,))
+#********************************************************************************
+    def match_det2cube(self, input_model,
+                       x, y, file_slice_no,
+                       this_par1, this_par2,
+                       spaxel,
+                       c1_offset, c2_offset):
+#********************************************************************************
+        """
+        Short Summary
+        -------------
+        Map the detector pixels to the point cloud and update the spaxels using the
+        point cloud engine selected by the pointcloud_engine parameter:
+        loop: loop over every point cloud member (cube_cloud.match_det2cube)
+        kdtree: find the spaxels within the roi of all the point cloud members
+        at once (cube_cloud.match_det2cube_kdtree). Only valid for msm weighting,
+        for miripsf weighting or when debugging a spaxel the loop engine is used.
+
+        Parameter
+        ----------
+        same as cube_cloud.match_det2cube
+
+        Returns
+        -------
+        spaxel updated with the mapped detector values
+        """
+
+        if(self.pointcloud_engine == 'kdtree' and self.weighting == 'msm' and
+           self.debug_pixel != 1):
+            cube_cloud.match_det2cube_kdtree(self, input_model,
+                                             x, y, file_slice_no,
+                                             this_par1, this_par2,
+                                             spaxel,
+                                             c1_offset, c2_offset)
+        else:
+            cube_cloud.match_det2cube(self, input_model,
+                                      x, y, file_slice_no,
+                                      this_par1, this_par2,
+                                      spaxel,
+                                      c1_offset, c2_offset)
+
 #********************************************************************************
     def find_spaxel_flux(self, spaxel):
 #********************************************************************************
@@ -766,7 +801,7 @@ class CubeData(object):
 
         Parameter
         ----------
-        spaxel: List of Spaxels
+        spaxel: SpaxelArrays of the cube
         PixelCloud - pixel point cloud, only filled in if doing 3-D interpolation
 
         Returns
@@ -777,35 +812,20 @@ class CubeData(object):
         """
 
 
-        if self.interpolation == 'area':
-            nspaxel = len(spaxel)
-
-            for i in range(nspaxel):
-                if(spaxel[i].iflux > 0):
-                    spaxel[i].flux = spaxel[i].flux/spaxel[i].flux_weight
-
-        elif self.interpolation == 'pointcloud':
-            icube = 0
-            t0 = time.time()
-            for iz, z in enumerate(self.zcoord):
-                for iy, y in enumerate(self.ycoord):
-                    for ix, x in enumerate(self.xcoord):
-
-                        if(spaxel[icube].iflux > 0):
-                            spaxel[icube].flux = spaxel[icube].flux/spaxel[icube].flux_weight
-
-                            if(self.debug_pixel == 1 and self.xdebug == ix and
-                               self.ydebug == iy and self.zdebug == iz ):
-
-                                log.debug('For spaxel %d %d %d final flux %f '
-                                          %(self.xdebug+1,self.ydebug+1,
-                                            self.zdebug+1,spaxel[icube].flux))
-                                self.spaxel_debug.write('For spaxel %d %d %d, final flux %f '
-                                                        %(self.xdebug+1,self.ydebug+1,
-                                                          self.zdebug+1,spaxel[icube].flux) +' \n')
-                        icube = icube + 1
-            t1 = time.time()
-            log.info("Time to interpolate at spaxel values = %.1f.s" % (t1 - t0,))
+        t0 = time.time()
+        spaxel.find_flux()
+        t1 = time.time()
+        log.info("Time to interpolate at spaxel values = %.1f.s" % (t1 - t0,))
+
+        if(self.interpolation == 'pointcloud' and self.debug_pixel == 1):
+            icube = (self.zdebug*self.naxis2 + self.ydebug)*self.naxis1 + self.xdebug
+            if(spaxel.iflux[icube] > 0):
+                log.debug('For spaxel %d %d %d final flux %f '
+                          %(self.xdebug+1,self.ydebug+1,
+                            self.zdebug+1,spaxel.flux[icube]))
+                self.spaxel_debug.write('For spaxel %d %d %d, final flux %f '
+                                        %(self.xdebug+1,self.ydebug+1,
+                                          self.zdebug+1,spaxel.flux[icube]) +' \n')
 
 #********************************************************************************
     def setup_IFUCube(self,j):
@@ -818,7 +838,7 @@ class CubeData(object):
         Parameters
         ----------
         Cube: holds meta data of cube
-        spaxel: list of spaxels in cube
+        spaxel: SpaxelArrays of the cube
 
 
         Returns
@@ -961,7 +981,7 @@ class CubeData(object):
         Parameters
         ----------
         Cube: holds meta data of cube
-        spaxel: list of spaxels in cube
+        spaxel: SpaxelArrays of the cube
 
 
         Returns
@@ -972,9 +992,9 @@ class CubeData(object):
     #pull out data into array
 
 
-        temp_flux =np.reshape(np.array([s.flux for s in spaxel]),
+        temp_flux =np.reshape(spaxel.flux,
                           [self.naxis3,self.naxis2,self.naxis1])
-        temp_wmap =np.reshape(np.array([s.iflux for s in spaxel]),
+        temp_wmap =np.reshape(spaxel.iflux,
                           [self.naxis3,self.naxis2,self.naxis1])
 
 
@@ -34,6 +34,7 @@ class CubeBuildStep (Step):
          rois = float(default=0.0)
          roiw = float(default=0.0)
          weight_power = float(default=2.0)
+         pointcloud_engine = option('loop','kdtree',default='loop')
          offset_list = string(default='NA')
          wavemin = float(default=None)
          wavemax = float(default=None)
@@ -111,6 +112,7 @@ class CubeBuildStep (Step):
         if self.interpolation =='pointcloud':
             self.log.info('Weighting method for point cloud: %s',self.weighting)
             self.log.info('Power Weighting distance : %f',self.weight_power)
+            self.log.info('Point cloud engine: %s',self.pointcloud_engine)
 
         if self.single :
             self.log.info(' Single = true, creating a set of single exposures mapped' +
@@ -177,6 +179,7 @@ class CubeBuildStep (Step):
             'interpolation': self.interpolation,
             'weighting': self.weighting,
             'weight_power': self.weight_power,
+            'pointcloud_engine': self.pointcloud_engine,
             'coord_system': self.coord_system,
             'rois': self.rois,
             'roiw': self.roiw,
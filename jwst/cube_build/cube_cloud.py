@@ -12,6 +12,7 @@ from ..datamodels import dqflags
 from . import coord
 from . import instrument_defaults
 from gwcs import wcstools
+from scipy.spatial import cKDTree
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 #________________________________________________________________________________
@@ -43,106 +44,23 @@ def match_det2cube(self, input_model,
 
     Returns
     -------
-    spaxel class matched to detector pixels with flux and weighting updated for each
+    spaxel arrays matched to detector pixels with flux and weighting updated for each
     match
 
 
     """
 
-#________________________________________________________________________________
-    if self.instrument == 'MIRI':
-        file_no = file_slice_no
-        det2ab_transform = input_model.meta.wcs.get_transform('detector','alpha_beta')
-        detector2v23 = input_model.meta.wcs.get_transform('detector', 'v2v3')
-        v23toworld = input_model.meta.wcs.get_transform("v2v3","world")
+    cloud = setup_point_cloud(self, input_model, x, y, file_slice_no,
+                              c1_offset, c2_offset)
+    coord1, coord2, wave, flux, error, alpha_det, beta_det, xpix, ypix = cloud
+
+    if self.instrument == 'MIRI' and self.weighting == 'miripsf':
         worldtov23 = input_model.meta.wcs.get_transform("world","v2v3")
         v2ab_transform = input_model.meta.wcs.get_transform('v2v3',
                                                             'alpha_beta')
-
-        alpha, beta, wave = det2ab_transform(x, y)
-        v2, v3, lam23 = detector2v23(x, y)
-        ra,dec,lam = v23toworld(v2,v3,lam23)
-
-        valid1 = np.isfinite(v2)
-        valid2 = np.isfinite(v3)
-
-        if self.weighting == 'miripsf':
-            wave_resol = self.instrument_info.Get_RP_ave_Wave(this_par1,this_par2)
-            alpha_resol = self.instrument_info.Get_psf_alpha_parameters()
-            beta_resol = self.instrument_info.Get_psf_beta_parameters()
-
-            # transform Cube Spaxel centers to alpha,beta of exposure
-            # for MIRI weighting parameters are based on distance in 
-            # alpha-beta coord system
-            # transform the cube coordinate values to alpha and beta values
-            # xi,eta -> ra,dec
-            # ra-dec -> v2,v3
-            # v2,v3 -> local alpha,beta
-
-    elif self.instrument == 'NIRSPEC':
-        islice = file_slice_no
-        slice_wcs = nirspec.nrs_wcs_set_input(input_model, islice)
-        yrange = slice_wcs.bounding_box[1][0],slice_wcs.bounding_box[1][1]
-        xrange = slice_wcs.bounding_box[0][0],slice_wcs.bounding_box[0][1]
-        x,y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box, step=(1,1), center=True)
-        x = x.astype(np.int)
-        y = y.astype(np.int)
-
-        ra, dec, lam = slice_wcs(x, y) # return v2,v3 are in degrees
-        valid1 = np.isfinite(ra)
-        valid2 = np.isfinite(dec)
-#________________________________________________________________________________
-#________________________________________________________________________________
-# Slices are curved on detector. A slice region is grabbed by corner regions so
-# the region returned may include pixels not value for slice. There are gaps 
-# between the slices. Pixels not belonging to a slice are assigned NaN values.
-
-    flux_all = input_model.data[y, x]
-    error_all = input_model.err[y, x]
-    dq_all = input_model.dq[y,x]
-
-    valid3 = np.isfinite(lam)
-    valid4 = np.isfinite(flux_all)
-    valid = valid1 & valid2 & valid3 &valid4
-#________________________________________________________________________________
-# using the DQFlags from the input_image find pixels that should be excluded
-# from the cube mapping
-    all_flags = (dqflags.pixel['DO_NOT_USE'] + dqflags.pixel['DROPOUT'] + 
-                 dqflags.pixel['NON_SCIENCE'] +
-                 dqflags.pixel['DEAD'] + dqflags.pixel['HOT'] +
-                 dqflags.pixel['RC'] + dqflags.pixel['NONLINEAR'])
-
-    # find the location of all the values to reject in cube building
-    good_data = np.where((np.bitwise_and(dq_all, all_flags)==0) & (valid == True))
-
-    # good data holds the location of pixels we want to map to cube
-    flux = flux_all[good_data]
-    error = error_all[good_data]
-    wave = lam[good_data]
-
-    xpix = x[good_data] # only used for testing
-    ypix = y[good_data] # only used for testing
-
-    
-    ra = ra - c1_offset/3600.0
-    dec = dec - c2_offset/3600.0
-    ra_use = ra[good_data]
-    dec_use = dec[good_data]
-    if self.instrument == 'MIRI':
-        # need alpha,beta if weigthing is miripsf or cubes in alpha-beta space
-        alpha_det = alpha[good_data]
-        beta_det = beta[good_data]
-# MIRI can make cubes in alpha-beta:
-    if self.coord_system == 'alpha-beta':
-        coord1 = alpha[good_data]
-        coord2 = beta[good_data]
-
-    else:
-# xi,eta in arc seconds
-        xi,eta = coord.radec2std(self.Crval1, self.Crval2,ra_use,dec_use) 
-        coord1 = xi
-        coord2 = eta
-
+        wave_resol = self.instrument_info.Get_RP_ave_Wave(this_par1,this_par2)
+        alpha_resol = self.instrument_info.Get_psf_alpha_parameters()
+        beta_resol = self.instrument_info.Get_psf_beta_parameters()
 
     nplane = self.naxis1 * self.naxis2
     lower_limit = 0.01
@@ -240,9 +158,9 @@ def match_det2cube(self, input_model,
 
 
 #                print('Cube_index',cube_index,istart,rr)
-                spaxel[cube_index].flux = spaxel[cube_index].flux + weight_distance*flux[ipt]
-                spaxel[cube_index].flux_weight = spaxel[cube_index].flux_weight + weight_distance
-                spaxel[cube_index].iflux = spaxel[cube_index].iflux + 1
+                spaxel.flux[cube_index] = spaxel.flux[cube_index] + weight_distance*flux[ipt]
+                spaxel.flux_weight[cube_index] = spaxel.flux_weight[cube_index] + weight_distance
+                spaxel.iflux[cube_index] = spaxel.iflux[cube_index] + 1
 
 
                 if( self.debug_pixel == 1 and self.xdebug == xx_cube and
@@ -261,6 +179,247 @@ def match_det2cube(self, input_model,
         if iprint == 10000:
             log.debug('Mapping point and finding ROI for point cloud # %d %d' %(ipt,nn))
             iprint = 0
+#________________________________________________________________________________
+def setup_point_cloud(self, input_model, x, y, file_slice_no,
+                      c1_offset, c2_offset):
+    """
+    Short Summary
+    -------------
+    map x,y detector pixels to the point cloud in the final coordinate system
+    (xi,eta of cube or alpha,beta) and reject pixels that should not be
+    used in building the cube
+
+    Parameters
+    ----------
+    input_model: slope image
+    x,y list of x and y values to map
+    file_slice_no: the index on the files (MIRI) or the slice number (NIRSPEC)
+    c1_offset, c2_offset: dither offsets for each file (default = 0)
+
+    Returns
+    -------
+    coord1, coord2, wave, flux, error of the good point cloud members,
+    alpha_det, beta_det (MIRI only, otherwise None) and xpix, ypix the detector
+    pixels the point cloud members came from
+    """
+    alpha = None
+    beta = None
+    if self.instrument == 'MIRI':
+        det2ab_transform = input_model.meta.wcs.get_transform('detector','alpha_beta')
+        detector2v23 = input_model.meta.wcs.get_transform('detector', 'v2v3')
+        v23toworld = input_model.meta.wcs.get_transform("v2v3","world")
+
+        alpha, beta, wave = det2ab_transform(x, y)
+        v2, v3, lam23 = detector2v23(x, y)
+        ra,dec,lam = v23toworld(v2,v3,lam23)
+
+        valid1 = np.isfinite(v2)
+        valid2 = np.isfinite(v3)
+
+    elif self.instrument == 'NIRSPEC':
+        islice = file_slice_no
+        slice_wcs = nirspec.nrs_wcs_set_input(input_model, islice)
+        x,y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box, step=(1,1), center=True)
+        x = x.astype(np.int)
+        y = y.astype(np.int)
+
+        ra, dec, lam = slice_wcs(x, y) # return v2,v3 are in degrees
+        valid1 = np.isfinite(ra)
+        valid2 = np.isfinite(dec)
+#________________________________________________________________________________
+# Slices are curved on detector. A slice region is grabbed by corner regions so
+# the region returned may include pixels not value for slice. There are gaps
+# between the slices. Pixels not belonging to a slice are assigned NaN values.
+
+    flux_all = input_model.data[y, x]
+    error_all = input_model.err[y, x]
+    dq_all = input_model.dq[y,x]
+
+    valid3 = np.isfinite(lam)
+    valid4 = np.isfinite(flux_all)
+    valid = valid1 & valid2 & valid3 &valid4
+#________________________________________________________________________________
+# using the DQFlags from the input_image find pixels that should be excluded
+# from the cube mapping
+    all_flags = (dqflags.pixel['DO_NOT_USE'] + dqflags.pixel['DROPOUT'] +
+                 dqflags.pixel['NON_SCIENCE'] +
+                 dqflags.pixel['DEAD'] + dqflags.pixel['HOT'] +
+                 dqflags.pixel['RC'] + dqflags.pixel['NONLINEAR'])
+
+    # find the location of all the values to reject in cube building
+    good_data = np.where((np.bitwise_and(dq_all, all_flags)==0) & (valid == True))
+
+    # good data holds the location of pixels we want to map to cube
+    flux = flux_all[good_data]
+    error = error_all[good_data]
+    wave = lam[good_data]
+
+    xpix = x[good_data] # only used for testing
+    ypix = y[good_data] # only used for testing
+
+    ra = ra - c1_offset/3600.0
+    dec = dec - c2_offset/3600.0
+    ra_use = ra[good_data]
+    dec_use = dec[good_data]
+    alpha_det = None
+    beta_det = None
+    if self.instrument == 'MIRI':
+        # need alpha,beta if weigthing is miripsf or cubes in alpha-beta space
+        alpha_det = alpha[good_data]
+        beta_det = beta[good_data]
+# MIRI can make cubes in alpha-beta:
+    if self.coord_system == 'alpha-beta':
+        coord1 = alpha[good_data]
+        coord2 = beta[good_data]
+
+    else:
+# xi,eta in arc seconds
+        xi,eta = coord.radec2std(self.Crval1, self.Crval2,ra_use,dec_use)
+        coord1 = xi
+        coord2 = eta
+
+    return coord1, coord2, wave, flux, error, alpha_det, beta_det, xpix, ypix
+#________________________________________________________________________________
+def match_det2cube_kdtree(self, input_model,
+                          x, y, file_slice_no,
+                          this_par1,this_par2,
+                          spaxel,
+                          c1_offset, c2_offset):
+    """
+    Short Summary
+    -------------
+    map x,y to Point cloud in final coordinate system (xi,eta of cube) and
+    find the spaxels within the region of interest of every point cloud member
+    in bulk. The spaxel centers in the xi,eta plane are held in a KD-tree and
+    the weighted fluxes (msm weighting) are accumulated into flat arrays.
+
+    Parameters
+    ----------
+    same as match_det2cube
+
+    Returns
+    -------
+    spaxel arrays matched to detector pixels with flux and weighting updated for each
+    match
+    """
+    cloud = setup_point_cloud(self, input_model, x, y, file_slice_no,
+                              c1_offset, c2_offset)
+    coord1, coord2, wave, flux = cloud[0:4]
+
+    if getattr(self, 'spaxel_tree', None) is None:
+        self.spaxel_tree = cKDTree(np.column_stack((self.Xcenters, self.Ycenters)))
+
+    accumulate_msm(self.spaxel_tree, self.Xcenters, self.Ycenters, self.zcoord,
+                   coord1, coord2, wave, flux,
+                   self.rois, self.roiw,
+                   self.Cdelt1, self.Cdelt2, self.Cdelt3,
+                   self.weight_power,
+                   spaxel.flux, spaxel.flux_weight, spaxel.iflux)
+#________________________________________________________________________________
+def accumulate_msm(tree, xcenters, ycenters, zcoord,
+                   coord1, coord2, wave, flux,
+                   rois, roiw,
+                   cdelt1, cdelt2, cdelt3,
+                   weight_power,
+                   spaxel_flux, spaxel_weight, spaxel_iflux,
+                   max_elements=4000000):
+    """
+    Short Summary
+    -------------
+    Accumulate the modified shepard method (msm) weighted flux of the point
+    cloud members onto the spaxels. A spaxel is matched to a point cloud member
+    if the spaxel center is within rois (in the xi,eta plane) and roiw (in
+    wavelength) of the point. The weight of each match is 1/d**weight_power,
+    with d the distance between the spaxel center and the point normalized by
+    the spaxel size (d is not allowed to be smaller than 0.01).
+
+    Parameters
+    ----------
+    tree: cKDTree of the (xcenters, ycenters) spaxel centers of one cube plane
+    xcenters, ycenters: flattened spaxel centers of one cube plane
+    zcoord: wavelength of the cube planes (regularly spaced)
+    coord1, coord2, wave, flux: point cloud members
+    rois, roiw: spatial and wavelength region of interest
+    cdelt1, cdelt2, cdelt3: spaxel size
+    weight_power: power of the msm weighting
+    max_elements: the point cloud is processed in chunks holding at most
+        roughly this number of (point, spaxel) candidate matches
+
+    Returns
+    -------
+    spaxel_flux, spaxel_weight, spaxel_iflux (flattened cube arrays) are
+    updated in place
+    """
+    lower_limit = 0.01
+    nplane = xcenters.size
+    naxis3 = zcoord.size
+    ncube = spaxel_flux.size
+    npts = coord1.size
+    if npts == 0 or nplane == 0 or naxis3 == 0:
+        return
+
+    # upper limit on the number of spaxel centers within the spatial and
+    # wavelength roi of a point
+    nx = int(math.ceil(rois / abs(cdelt1)))
+    ny = int(math.ceil(rois / abs(cdelt2)))
+    kmax = min((2 * nx + 1) * (2 * ny + 1), nplane)
+    nzmax = int(math.ceil(2.0 * roiw / abs(cdelt3))) + 3
+    chunk = max(1, max_elements // (kmax * nzmax))
+    zoffset = np.arange(nzmax) - 1
+
+    # the tree search is only used to find candidates, the roi tests
+    # below are the same as the ones used by match_det2cube
+    search_radius = rois * (1.0 + 1.0e-6)
+
+    for istart in range(0, npts, chunk):
+        iend = min(istart + chunk, npts)
+        c1 = coord1[istart:iend]
+        c2 = coord2[istart:iend]
+        w = wave[istart:iend]
+        f = flux[istart:iend]
+
+        # spatial roi
+        dist, index_xy = tree.query(np.column_stack((c1, c2)), k=kmax,
+                                    distance_upper_bound=search_radius)
+        index_xy = np.reshape(index_xy, (c1.size, kmax))
+        valid_xy = index_xy < nplane
+        index_xy = np.where(valid_xy, index_xy, 0)
+        xdistance = xcenters[index_xy] - c1[:, np.newaxis]
+        ydistance = ycenters[index_xy] - c2[:, np.newaxis]
+        radius = np.sqrt(xdistance * xdistance + ydistance * ydistance)
+        valid_xy = valid_xy & (radius <= rois)
+
+        # wavelength roi
+        index_z = (np.searchsorted(zcoord, w - roiw)[:, np.newaxis] +
+                   zoffset[np.newaxis, :])
+        valid_z = (index_z >= 0) & (index_z < naxis3)
+        index_z = np.where(valid_z, index_z, 0)
+        zdistance = zcoord[index_z] - w[:, np.newaxis]
+        valid_z = valid_z & (np.abs(zdistance) <= roiw)
+
+        match = valid_xy[:, :, np.newaxis] & valid_z[:, np.newaxis, :]
+        if not match.any():
+            continue
+
+        d1 = (xdistance / cdelt1)[:, :, np.newaxis]
+        d2 = (ydistance / cdelt2)[:, :, np.newaxis]
+        d3 = (zdistance / cdelt3)[:, np.newaxis, :]
+        weight_distance = np.sqrt(d1 * d1 + d2 * d2 + d3 * d3)[match]
+        weight_distance = np.power(weight_distance, weight_power)
+        weight_distance[weight_distance < lower_limit] = lower_limit
+        weight_distance = 1.0 / weight_distance
+
+        cube_index = (index_z[:, np.newaxis, :] * nplane +
+                      index_xy[:, :, np.newaxis])[match]
+        point_flux = np.broadcast_to(f[:, np.newaxis, np.newaxis],
+                                     match.shape)[match]
+
+        spaxel_flux += np.bincount(cube_index,
+                                   weights=weight_distance * point_flux,
+                                   minlength=ncube)
+        spaxel_weight += np.bincount(cube_index, weights=weight_distance,
+                                     minlength=ncube)
+        spaxel_iflux += np.bincount(cube_index, minlength=ncube)
 #_______________________________________________________________________
 def FindWaveWeights(channel, subchannel):
     """
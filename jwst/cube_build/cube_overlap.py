@@ -351,7 +351,7 @@ def match_det2cube(self, x, y, sliceno, start_slice, input_model, transform, spa
     sliceno
     input_model: input slope model or file
     transform: wcs transform to transform x,y to alpha,beta, lambda
-    spaxel: list of spaxels holding information on each cube pixel.
+    spaxel: SpaxelArrays holding information on each cube pixel.
 
     Returns
     -------
@@ -461,9 +461,9 @@ def match_det2cube(self, x, y, sliceno, start_slice, input_model, transform, spa
 
                 if AreaOverlap > 0.0:
                     AreaRatio = AreaOverlap / Area
-                    spaxel[cube_index].flux = spaxel[cube_index].flux + (AreaRatio * pixel_flux[ipixel])
-                    spaxel[cube_index].flux_weight = spaxel[cube_index].flux_weight + AreaRatio
-                    spaxel[cube_index].iflux = spaxel[cube_index].iflux + 1
+                    spaxel.flux[cube_index] = spaxel.flux[cube_index] + (AreaRatio * pixel_flux[ipixel])
+                    spaxel.flux_weight[cube_index] = spaxel.flux_weight[cube_index] + AreaRatio
+                    spaxel.iflux[cube_index] = spaxel.iflux[cube_index] + 1
 #________________________________________________________________________________
 
 
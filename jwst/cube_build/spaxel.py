@@ -1,12 +1,7 @@
-# Cube Class
 # Spaxel Class
 
-import sys
 import numpy as np
-import math
 import logging
-from .. import datamodels
-from . import coord
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -14,24 +9,38 @@ log.setLevel(logging.DEBUG)
 
 
 ##################################################################################
-class Spaxel(object):
-
-
-    __slots__ = ['flux', 'error','flux_weight','iflux']
-
-    def __init__(self):
-        self.flux = 0.0
-        self.flux_weight = 0.0
-        self.iflux = 0
-        self.error = 0
-
-class SpaxelAB(object):
-
-    __slots__ = ['flux', 'error', 'flux_weight','iflux']
-
-    def __init__(self):
-
-        self.flux = 0
-        self.error = 0
-        self.flux_weight = 0.0
-        self.iflux = 0.0
+class SpaxelArrays(object):
+    """
+    Structure of arrays holding the spaxel information of an IFU cube
+    (or of any other flattened grid, e.g. a blotted detector image).
+
+    Element i of each array is the value of spaxel i, where the spaxels are
+    ordered as the flattened (naxis3, naxis2, naxis1) cube.
+
+    flux: sum of the weighted flux of the mapped detector pixels
+          (the spaxel flux once find_flux has been called)
+    flux_weight: sum of the weights
+    iflux: number of detector pixels mapped to the spaxel
+    error: spaxel error
+    """
+
+    __slots__ = ['flux', 'error', 'flux_weight', 'iflux']
+
+    def __init__(self, num):
+        self.flux = np.zeros(num)
+        self.flux_weight = np.zeros(num)
+        self.iflux = np.zeros(num)
+        self.error = np.zeros(num)
+
+    def __len__(self):
+        return self.flux.size
+
+    def find_flux(self):
+        """
+        Short Summary
+        -------------
+        Determine the final spaxel flux: the weighted flux divided by the sum
+        of the weights, for all the spaxels with mapped detector pixels
+        """
+        good = self.iflux > 0
+        self.flux[good] = self.flux[good] / self.flux_weight[good]
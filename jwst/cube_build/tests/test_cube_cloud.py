@@ -0,0 +1,95 @@
+"""
+Test the bulk (kdtree) msm weighting of the point cloud against a
+spaxel by spaxel calculation
+"""
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ..cube_cloud import accumulate_msm
+from ..spaxel import SpaxelArrays
+
+
+def setup_cube():
+    naxis1, naxis2, naxis3 = 12, 10, 25
+    cdelt1, cdelt2, cdelt3 = 0.13, 0.13, 0.002
+    xcoord = (np.arange(naxis1) - naxis1 / 2.0) * cdelt1
+    ycoord = (np.arange(naxis2) - naxis2 / 2.0) * cdelt2
+    zcoord = 5.0 + np.arange(naxis3) * cdelt3
+    ycenters, xcenters = np.meshgrid(ycoord, xcoord, indexing='ij')
+    return (np.ravel(xcenters), np.ravel(ycenters), zcoord,
+            cdelt1, cdelt2, cdelt3)
+
+
+def msm_loop(xcenters, ycenters, zcoord, coord1, coord2, wave, flux,
+             rois, roiw, cdelt1, cdelt2, cdelt3, weight_power):
+    nplane = xcenters.size
+    ncube = nplane * zcoord.size
+    spaxel_flux = np.zeros(ncube)
+    spaxel_weight = np.zeros(ncube)
+    spaxel_iflux = np.zeros(ncube)
+    for ipt in range(coord1.size):
+        xdistance = xcenters - coord1[ipt]
+        ydistance = ycenters - coord2[ipt]
+        radius = np.sqrt(xdistance * xdistance + ydistance * ydistance)
+        indexr = np.where(radius <= rois)[0]
+        indexz = np.where(abs(zcoord - wave[ipt]) <= roiw)[0]
+        for zz in indexz:
+            for rr in indexr:
+                d1 = xdistance[rr] / cdelt1
+                d2 = ydistance[rr] / cdelt2
+                d3 = (zcoord[zz] - wave[ipt]) / cdelt3
+                weight_distance = math.sqrt(d1 * d1 + d2 * d2 + d3 * d3)
+                weight_distance = math.pow(weight_distance, weight_power)
+                weight_distance = 1.0 / max(weight_distance, 0.01)
+                cube_index = zz * nplane + rr
+                spaxel_flux[cube_index] += weight_distance * flux[ipt]
+                spaxel_weight[cube_index] += weight_distance
+                spaxel_iflux[cube_index] += 1
+    return spaxel_flux, spaxel_weight, spaxel_iflux
+
+
+def test_accumulate_msm_matches_loop():
+    xcenters, ycenters, zcoord, cdelt1, cdelt2, cdelt3 = setup_cube()
+    rng = np.random.RandomState(42)
+    npts = 2000
+    coord1 = rng.uniform(-1.0, 1.0, npts)
+    coord2 = rng.uniform(-0.8, 0.8, npts)
+    wave = rng.uniform(4.99, 5.06, npts)
+    flux = rng.normal(10.0, 2.0, npts)
+    # put one point exactly on a spaxel center to test the lower limit
+    coord1[0] = xcenters[5]
+    coord2[0] = ycenters[5]
+    wave[0] = zcoord[3]
+    rois = 0.3
+    roiw = 0.004
+
+    ncube = xcenters.size * zcoord.size
+    spaxel_flux = np.zeros(ncube)
+    spaxel_weight = np.zeros(ncube)
+    spaxel_iflux = np.zeros(ncube)
+    tree = cKDTree(np.column_stack((xcenters, ycenters)))
+    accumulate_msm(tree, xcenters, ycenters, zcoord,
+                   coord1, coord2, wave, flux,
+                   rois, roiw, cdelt1, cdelt2, cdelt3, 2.0,
+                   spaxel_flux, spaxel_weight, spaxel_iflux,
+                   max_elements=5000)
+
+    expected = msm_loop(xcenters, ycenters, zcoord, coord1, coord2, wave,
+                        flux, rois, roiw, cdelt1, cdelt2, cdelt3, 2.0)
+
+    assert spaxel_iflux.sum() > 0
+    np.testing.assert_array_equal(spaxel_iflux, expected[2])
+    np.testing.assert_allclose(spaxel_flux, expected[0], rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(spaxel_weight, expected[1], rtol=1e-10, atol=1e-10)
+
+
+def test_spaxel_arrays_find_flux():
+    spaxel = SpaxelArrays(4)
+    spaxel.flux[:] = [2.0, 0.0, 9.0, 1.0]
+    spaxel.flux_weight[:] = [4.0, 0.0, 3.0, 0.5]
+    spaxel.iflux[:] = [2, 0, 1, 1]
+    spaxel.find_flux()
+    np.testing.assert_allclose(spaxel.flux, [0.5, 0.0, 3.0, 2.0])
+    assert len(spaxel) == 4
@@ -0,0 +1,164 @@
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+#
+#  On-disk cache of the frame-averaged darks made for the readout patterns
+#  of the science data.
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from ..lib import file_utils
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Extension of the files of the cache
+EXTENSION = ".npz"
+
+# Name of the cache directory, next to the CRDS cache
+DIRNAME = "averaged_darks"
+
+
+def file_signature(filename):
+    """
+    The size and modification time of a file, to tell whether it changed.
+    """
+    stat = os.stat(filename)
+    return np.array([stat.st_size, stat.st_mtime], dtype=np.float64)
+
+
+class AveragedDarkCache(object):
+    """
+    A directory of frame-averaged darks, one file per dark reference file
+    and readout pattern.
+
+    The averaged dark depends only on the dark reference file and on the
+    number of groups, frames per group and frames skipped between groups
+    of the science data (and, for MIRI, on the number of integrations
+    averaged), so that the darks made for one exposure may be used for
+    all of the exposures with the same readout pattern.  Each file holds
+    the SCI and ERR arrays of the averaged dark, with the size and
+    modification time of the reference file they were made from: when
+    the reference file changes, the averaged dark is made again.
+
+    Parameters
+    ----------
+    directory: str
+        The directory of the cache; it is created if it does not exist.
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, dark_name, dark_model, nints, ngroups, nframes,
+                  groupgap):
+        subarray = dark_model.meta.subarray
+        key = repr((os.path.abspath(dark_name), type(dark_model).__name__,
+                    dark_model.data.shape, subarray.xstart, subarray.ystart,
+                    subarray.xsize, subarray.ysize, nints, ngroups, nframes,
+                    groupgap))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        base = os.path.splitext(os.path.basename(dark_name))[0]
+        return os.path.join(self.directory,
+                            "{0}_{1}{2}".format(base, digest, EXTENSION))
+
+    def load(self, dark_name, dark_model, nints, ngroups, nframes,
+             groupgap):
+        """Get the averaged dark for a readout pattern, if it was saved.
+
+        Parameters
+        ----------
+        dark_name: str
+            The path of the dark reference file.
+
+        dark_model: DarkModel or DarkMIRIModel
+            The dark reference data.
+
+        nints: int
+            The number of integrations averaged (for MIRI; None otherwise).
+
+        ngroups, nframes, groupgap: int
+            The readout pattern of the science data.
+
+        Returns
+        -------
+        avg_dark: dark data model, or None
+            The averaged dark, as made by `dark_sub.average_dark_frames` or
+            `dark_sub.average_MIRIdark_frames`, or None if it is not in the
+            cache or was made from an earlier version of the reference
+            file.
+        """
+
+        filename = self._filename(dark_name, dark_model, nints, ngroups,
+                                  nframes, groupgap)
+        if not os.path.exists(filename):
+            log.debug("No averaged dark %s", filename)
+            return None
+
+        try:
+            with np.load(filename) as cached:
+                if not np.array_equal(cached["signature"],
+                                      file_signature(dark_name)):
+                    log.info("Averaged dark %s is out of date", filename)
+                    return None
+                data = cached["data"]
+                err = cached["err"]
+        except (IOError, ValueError, KeyError) as error:
+            log.warning("Ignoring averaged dark %s: %s", filename, error)
+            return None
+
+        log.info("Using averaged dark %s", filename)
+        avg_dark = type(dark_model)(data=data, err=err)
+        avg_dark.update(dark_model)
+        avg_dark.dq = dark_model.dq
+        avg_dark.meta.exposure.nframes = nframes
+        avg_dark.meta.exposure.ngroups = ngroups
+        avg_dark.meta.exposure.groupgap = groupgap
+        return avg_dark
+
+    def save(self, dark_name, dark_model, nints, avg_dark):
+        """Add an averaged dark to the cache.
+
+        Parameters
+        ----------
+        dark_name: str
+            The path of the dark reference file.
+
+        dark_model: DarkModel or DarkMIRIModel
+            The dark reference data.
+
+        nints: int
+            The number of integrations averaged (for MIRI; None otherwise).
+
+        avg_dark: dark data model
+            The averaged dark, with the readout pattern in its metadata.
+
+        Returns
+        -------
+        str, or None
+            The name of the file written, or None if it could not be
+            written.
+        """
+
+        exposure = avg_dark.meta.exposure
+        filename = self._filename(dark_name, dark_model, nints,
+                                  exposure.ngroups, exposure.nframes,
+                                  exposure.groupgap)
+        # Written to a temporary file first, so that a dark is never read
+        # while partly written by another process.
+        try:
+            with file_utils.atomic_write(filename) as fd:
+                np.savez(fd, data=avg_dark.data, err=avg_dark.err,
+                         signature=file_signature(dark_name))
+        except (IOError, OSError) as error:
+            log.warning("Could not save averaged dark %s: %s", filename,
+                        error)
+            return None
+        log.info("Saved averaged dark %s", filename)
+        return filename
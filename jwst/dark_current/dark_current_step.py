@@ -1,5 +1,8 @@
-from ..stpipe import Step
+import os
+
+from ..stpipe import Step, crds_client
 from .. import datamodels
+from . import dark_cache
 from . import dark_sub
 
 
@@ -11,6 +14,8 @@ class DarkCurrentStep(Step):
 
     spec = """
         dark_output = output_file(default = None) # Dark model or averaged dark subtracted
+        cache_averaged_dark = boolean(default=False) # keep the frame-averaged darks on disk for later exposures
+        averaged_dark_dir = string(default=None) # directory of the averaged darks (default: next to the CRDS cache)
     """
 
     reference_file_types = ['dark']
@@ -35,15 +40,34 @@ class DarkCurrentStep(Step):
             # Open the dark ref file data model - based on Instrument
             instrument = input_model.meta.instrument.name
             if(instrument == 'MIRI'):
-                dark_model = datamodels.DarkMIRIModel(self.dark_name)
+                dark_model = self.open_reference_model(
+                    self.dark_name, datamodels.DarkMIRIModel)
             else:
-                dark_model = datamodels.DarkModel(self.dark_name)
+                dark_model = self.open_reference_model(
+                    self.dark_name, datamodels.DarkModel)
 
             # Do the dark correction
             result = dark_sub.do_correction(
-                input_model, dark_model, self.dark_output
+                input_model, dark_model, self.dark_output,
+                self.get_dark_cache(), self.dark_name
             )
             dark_model.close()
 
 
         return result
+
+    def get_dark_cache(self):
+        """
+        The cache of frame-averaged darks, or None if it is not used.
+        """
+        if not self.cache_averaged_dark:
+            return None
+        directory = self.averaged_dark_dir
+        if directory is None:
+            directory = os.path.join(crds_client.get_crds_path(),
+                                     dark_cache.DIRNAME)
+        try:
+            return dark_cache.AveragedDarkCache(directory)
+        except OSError as error:
+            self.log.warning('Averaged darks will not be cached: %s', error)
+            return None
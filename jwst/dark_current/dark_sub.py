@@ -12,7 +12,8 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
-def do_correction(input_model, dark_model, dark_output=None):
+def do_correction(input_model, dark_model, dark_output=None,
+                  dark_cache=None, dark_name=None):
     """
     Short Summary
     -------------
@@ -29,6 +30,12 @@ def do_correction(input_model, dark_model, dark_output=None):
     dark_output: string
         file name in which to optionally save averaged dark data
 
+    dark_cache: AveragedDarkCache or None
+        cache of averaged darks (see `match_dark`)
+
+    dark_name: string
+        path of the dark reference file, if `dark_cache` is given
+
     Returns
     -------
     output_model: data model object
@@ -36,6 +43,61 @@ def do_correction(input_model, dark_model, dark_output=None):
 
     """
 
+    # Get the dark data matching the group structure of the science data
+    dark = match_dark(input_model, dark_model, dark_output, dark_cache,
+                      dark_name)
+    if dark is None:
+        log.warning("Input will be returned without subtracting dark current.")
+        input_model.meta.cal_step.dark_sub = 'SKIPPED'
+        return input_model.copy()
+
+    # Subtract the dark data from the science data
+    output_model = subtract_dark(input_model, dark)
+
+    if dark is not dark_model:
+        dark.close()
+
+    output_model.meta.cal_step.dark_sub = 'COMPLETE'
+
+    return output_model
+
+
+def match_dark(input_model, dark_model, dark_output=None, dark_cache=None,
+               dark_name=None):
+    """
+    Short Summary
+    -------------
+    Get the dark current data matching the group structure of the science
+    data: either the dark reference data itself or a frame-averaged version
+    of it.
+
+    Parameters
+    ----------
+    input_model: data model object
+        science data to be corrected
+
+    dark_model: dark model object
+        dark data
+
+    dark_output: string
+        file name in which to optionally save the dark data
+
+    dark_cache: AveragedDarkCache or None
+        if given, the frame-averaged dark is taken from this cache when it
+        was made for an earlier exposure with the same readout pattern,
+        and saved to it otherwise
+
+    dark_name: string
+        path of the dark reference file, if `dark_cache` is given
+
+    Returns
+    -------
+    dark: dark model object
+        dark data to subtract from the science data, or None if
+        the dark data can not be matched to the science data
+
+    """
+
     # Save some data params for easy use later
     instrument = input_model.meta.instrument.name
     sci_nints = input_model.data.shape[0]
@@ -70,9 +132,7 @@ def do_correction(input_model, dark_model, dark_output=None):
             "Not enough data in dark reference file to match to "
             "science data."
         )
-        log.warning("Input will be returned without subtracting dark current.")
-        input_model.meta.cal_step.dark_sub = 'SKIPPED'
-        return input_model.copy()
+        return None
 
     # Check that the value of nframes and groupgap in the dark
     # are not greater than those of the science data
@@ -80,20 +140,22 @@ def do_correction(input_model, dark_model, dark_output=None):
         log.warning(
             "The value of nframes or groupgap in the dark data is "
             "greater than that of the science data."
-            "Input will be returned without subtracting dark current."
         )
-        input_model.meta.cal_step.dark_sub = 'SKIPPED'
-        return input_model.copy()
+        return None
 
-    # Replace NaN's in the dark with zeros
-    dark_model.data[np.isnan(dark_model.data)] = 0.0
+    # Replace NaN's in the dark with zeros; the data of a cached dark are
+    # only copied if there are any
+    nans = np.isnan(dark_model.data)
+    if nans.any():
+        dark_model.unshare('data')
+        dark_model.data[nans] = 0.0
 
     # Check whether the dark and science data have matching
     # nframes and groupgap settings.
     if sci_nframes == drk_nframes and sci_groupgap == drk_groupgap:
 
         # They match, so we can subtract the dark ref file data directly
-        output_model = subtract_dark(input_model, dark_model)
+        dark = dark_model
 
         # If the user requested to have the dark file saved,
         # save the reference model as this file. This will
@@ -109,29 +171,38 @@ def do_correction(input_model, dark_model, dark_output=None):
         # If the data are from MIRI, the darks are integration-dependent and
         # we average them with a seperate routine.
 
+        # The MIRI average only depends on the number of integrations of
+        # the science data up to that of the dark.
         if instrument == 'MIRI':
-            averaged_dark = average_MIRIdark_frames(
-                dark_model, sci_nints, sci_ngroups, sci_nframes, sci_groupgap
-            )
+            cache_nints = min(drk_nints, sci_nints)
         else:
-            averaged_dark = average_dark_frames(
-                dark_model, sci_ngroups, sci_nframes, sci_groupgap
-            )
+            cache_nints = None
+
+        dark = None
+        if dark_cache is not None:
+            dark = dark_cache.load(dark_name, dark_model, cache_nints,
+                                   sci_ngroups, sci_nframes, sci_groupgap)
+
+        if dark is None:
+            if instrument == 'MIRI':
+                dark = average_MIRIdark_frames(
+                    dark_model, sci_nints, sci_ngroups, sci_nframes,
+                    sci_groupgap
+                )
+            else:
+                dark = average_dark_frames(
+                    dark_model, sci_ngroups, sci_nframes, sci_groupgap
+                )
+            if dark_cache is not None:
+                dark_cache.save(dark_name, dark_model, cache_nints, dark)
 
         # Save the frame-averaged dark data that was just created,
         # if requested by the user
         if dark_output is not None:
             log.info('Writing dark current data to %s', dark_output)
-            averaged_dark.save(dark_output)
+            dark.save(dark_output)
 
-        # Subtract the frame-averaged dark data from the science data
-        output_model = subtract_dark(input_model, averaged_dark)
-
-        averaged_dark.close()
-
-    output_model.meta.cal_step.dark_sub = 'COMPLETE'
-
-    return output_model
+    return dark
 
 
 def average_dark_frames(input_dark, ngroups, nframes, groupgap):
@@ -286,6 +357,38 @@ def average_MIRIdark_frames(input_dark, nints, ngroups, nframes, groupgap):
     return avg_dark
 
 
+def get_dark_dq(dark, instrument):
+    """
+    Get the 2-D DQ array of the dark current data.
+
+    Parameters
+    ----------
+    dark: dark model object
+        the dark current data
+
+    instrument: string
+        name of the instrument of the science data
+
+    Returns
+    -------
+    darkdq: 2-D array
+        the DQ flags of the dark data
+
+    """
+
+    if instrument == 'MIRI':
+        # MIRI dark reference file has a DQ plane for each integration,
+        # so we collapse the dark DQ planes into a single 2-D array
+        darkdq = dark.dq[0, 0, :, :].copy()
+        for i in range(1, dark.data.shape[0]):
+            darkdq = np.bitwise_or(darkdq, dark.dq[i, 0, :, :])
+    else:
+        # All other instruments have a single 2D dark DQ array
+        darkdq = dark.dq
+
+    return darkdq
+
+
 def subtract_dark(input, dark):
     """
     Subtracts dark current data from science arrays, combines
@@ -317,24 +420,16 @@ def subtract_dark(input, dark):
               input.data.shape[0], input.data.shape[1],
               input.data.shape[2], input.data.shape[3])
 
-    # Create output as a copy of the input science data model
-    output = input.copy()
-
-    if instrument == 'MIRI':
-        # MIRI dark reference file has a DQ plane for each integration,
-        # so we collapse the dark DQ planes into a single 2-D array
-        darkdq = dark.dq[0, 0, :, :].copy()
-        for i in range(1, dark_nints):
-            darkdq = np.bitwise_or(darkdq, dark.dq[i, 0, :, :])
-    else:
-        # All other instruments have a single 2D dark DQ array
-        darkdq = dark.dq
+    # Create output as a copy of the input science data model, sharing
+    # the arrays that are not modified
+    output = input.copy(copy_on_write=True)
+    output.unshare('data')
 
     # Combine the dark and science DQ data
-    output.pixeldq = np.bitwise_or(input.pixeldq, darkdq)
+    output.pixeldq = np.bitwise_or(output.pixeldq, get_dark_dq(dark, instrument))
 
     # loop over all integrations and groups in input science data
-    for i in range(input.data.shape[0]):
+    for i in range(output.data.shape[0]):
 
         if instrument == 'MIRI':
             if i < dark_nints:
@@ -342,7 +437,7 @@ def subtract_dark(input, dark):
             else:
                 dark_int = dark.data[dark_nints - 1]
 
-        for j in range(input.data.shape[1]):
+        for j in range(output.data.shape[1]):
             # subtract the SCI arrays
             if instrument == 'MIRI':
                 output.data[i, j] -= dark_int[j]
@@ -0,0 +1,87 @@
+"""Test the cache of frame-averaged darks"""
+import os
+
+import numpy as np
+
+from ... import datamodels
+from .. import dark_cache, dark_sub
+
+NGROUPS, NROWS, NCOLS = 10, 4, 5
+
+
+def make_dark(tmpdir):
+    np.random.seed(1)
+    dark = datamodels.DarkModel(
+        data=np.random.uniform(0., 5., (NGROUPS, NROWS, NCOLS)).astype(
+            np.float32),
+        err=np.random.uniform(0., 1., (NGROUPS, NROWS, NCOLS)).astype(
+            np.float32),
+        dq=np.zeros((NROWS, NCOLS), dtype=np.uint32))
+    dark.meta.exposure.nframes = 1
+    dark.meta.exposure.groupgap = 0
+    path = str(tmpdir.join('dark.fits'))
+    dark.save(path)
+    return path, dark
+
+
+def make_ramp(ngroups=3, nframes=2, groupgap=1):
+    model = datamodels.RampModel((1, ngroups, NROWS, NCOLS))
+    model.meta.instrument.name = 'NIRCAM'
+    model.meta.exposure.nframes = nframes
+    model.meta.exposure.groupgap = groupgap
+    return model
+
+
+def test_match_dark_cached(tmpdir):
+    """The cached averaged dark is the one made by averaging"""
+    path, dark = make_dark(tmpdir)
+    cache = dark_cache.AveragedDarkCache(str(tmpdir.join('cache')))
+
+    expected = dark_sub.match_dark(make_ramp(), dark)
+    first = dark_sub.match_dark(make_ramp(), dark, dark_cache=cache,
+                                dark_name=path)
+    assert len(os.listdir(cache.directory)) == 1
+    second = dark_sub.match_dark(make_ramp(), dark, dark_cache=cache,
+                                 dark_name=path)
+
+    for result in first, second:
+        assert np.array_equal(result.data, expected.data)
+        assert np.array_equal(result.err, expected.err)
+        assert result.meta.exposure.nframes == 2
+        assert result.meta.exposure.groupgap == 1
+
+    # Another readout pattern is another entry
+    dark_sub.match_dark(make_ramp(nframes=3), dark, dark_cache=cache,
+                        dark_name=path)
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_invalidated(tmpdir):
+    """A change of the reference file invalidates its averaged darks"""
+    path, dark = make_dark(tmpdir)
+    cache = dark_cache.AveragedDarkCache(str(tmpdir.join('cache')))
+
+    avg = dark_sub.average_dark_frames(dark, 3, 2, 1)
+    cache.save(path, dark, None, avg)
+    assert cache.load(path, dark, None, 3, 2, 1) is not None
+    assert cache.load(path, dark, None, 4, 2, 1) is None
+
+    dark.data += 1.
+    dark.save(path)
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert cache.load(path, dark, None, 3, 2, 1) is None
+
+
+def test_save_failure(tmpdir, monkeypatch):
+    """A dark that can't be written leaves no temporary file behind"""
+    path, dark = make_dark(tmpdir)
+    cache = dark_cache.AveragedDarkCache(str(tmpdir.join('cache')))
+    avg = dark_sub.average_dark_frames(dark, 3, 2, 1)
+
+    def fail(*args, **kwargs):
+        raise IOError("disk full")
+    monkeypatch.setattr(dark_cache.np, 'savez', fail)
+
+    assert cache.save(path, dark, None, avg) is None
+    assert os.listdir(cache.directory) == []
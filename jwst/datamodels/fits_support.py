@@ -564,6 +564,31 @@ def from_fits(hdulist, schema, extensions, pass_invalid_values):
 
     return ff
 
+def get_memmap_sources(hdulist):
+    """
+    Find the image arrays of `hdulist` that are memory mapped from a file.
+
+    Returns a dict mapping the buffer address of each such array to the
+    file name and offset of its data in the file. Scaled arrays are
+    not included, as their data is no longer the data in the file.
+    """
+    sources = {}
+    for index, hdu in enumerate(hdulist):
+        if not isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)):
+            continue
+        if hdu.header.get('NAXIS', 0) == 0:
+            continue
+        data = hdu.data
+        if data is None or not util.is_memmapped(data):
+            continue
+        info = hdulist.fileinfo(index)
+        if info is None or info.get('filename') is None:
+            continue
+        sources[util.buffer_address(data)] = (info['filename'],
+                                              info['datLoc'])
+    return sources
+
+
 def from_fits_hdu(hdu, schema):
     """
     Read the data from a fits hdu into a numpy ndarray
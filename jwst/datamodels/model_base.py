@@ -30,6 +30,7 @@ from . import filetype
 from . import fits_support
 from . import properties
 from . import schema as mschema
+from . import util
 
 from .extension import BaseExtension
 from jwst.transforms.jwextension import JWSTExtension
@@ -38,6 +39,21 @@ from gwcs.extension import GWCSExtension
 
 jwst_extensions = [GWCSExtension(), JWSTExtension(), BaseExtension()]
 
+# Flattened schemas of the model classes, by schema path and extensions,
+# so that each schema is only loaded and resolved once
+_schema_cache = {}
+
+
+def _array_bytes(tree, memo):
+    """
+    Number of bytes of the arrays of `tree` that a deep copy with `memo`
+    will copy.
+    """
+    from asdf import treeutil
+
+    return sum(node.nbytes for node in treeutil.iter_tree(tree)
+               if isinstance(node, np.ndarray) and id(node) not in memo)
+
 
 class DataModel(properties.ObjectNode, ndmodel.NDModel):
     """
@@ -46,7 +62,7 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
     schema_url = "core.schema.yaml"
 
     def __init__(self, init=None, schema=None, extensions=None,
-                 pass_invalid_values=False):
+                 pass_invalid_values=False, memmap=False):
         """
         Parameters
         ----------
@@ -79,6 +95,11 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
 
         pass_invalid_values: If true, values that do not validate the schema can
             be read and written and only a warning will be generated
+
+        memmap : bool
+            If true, the arrays that astropy memory maps from a FITS file
+            (all but the scaled ones) are also mapped by `copy`, which maps
+            the unmodified arrays copy-on-write rather than duplicating them.
         """
         # Set the extensions
         if extensions is None:
@@ -96,6 +117,11 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
                 pass_invalid_values = False
 
         self._pass_invalid_values = pass_invalid_values
+        self._memmap = memmap
+
+        # If true, the model is not validated when its values are set,
+        # the validation is left to the code that set this flag
+        self._validation_deferred = False
 
         # Construct the path to the schema files
         filename = os.path.abspath(inspect.getfile(self.__class__))
@@ -105,14 +131,23 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
         # Load the schema files
         if schema is None:
             schema_path = os.path.join(base_url, self.schema_url)
-            extension_list = asdf_extension.AsdfExtensionList(self._extensions)
-            schema = asdf_schema.load_schema(schema_path,
-                resolver=extension_list.url_mapping, resolve_references=True)
-
-        self._schema = mschema.flatten_combiners(schema)
+            key = (schema_path,
+                   tuple(ext.__class__ for ext in self._extensions))
+            if key not in _schema_cache:
+                extension_list = asdf_extension.AsdfExtensionList(
+                    self._extensions)
+                schema = asdf_schema.load_schema(schema_path,
+                    resolver=extension_list.url_mapping,
+                    resolve_references=True)
+                _schema_cache[key] = mschema.flatten_combiners(schema)
+            self._schema = _schema_cache[key]
+        else:
+            self._schema = mschema.flatten_combiners(schema)
         # Determine what kind of input we have (init) and execute the
         # proper code to intiailize the model
         self._files_to_close = []
+        self._memmap_sources = {}
+        self._shared_arrays = util.SharedArrays()
         self._iscopy = False
     
         is_array = False
@@ -146,6 +181,8 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
         elif isinstance(init, fits.HDUList):
             asdf = fits_support.from_fits(init, self._schema, extensions,
                                           pass_invalid_values)
+            if memmap:
+                self._memmap_sources = fits_support.get_memmap_sources(init)
 
         elif isinstance(init, (six.string_types, bytes)):
             if isinstance(init, bytes):
@@ -157,6 +194,9 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
                 asdf = fits_support.from_fits(hdulist, self._schema,
                                               extensions, pass_invalid_values)
                 self._files_to_close.append(hdulist)
+                if memmap:
+                    self._memmap_sources = \
+                        fits_support.get_memmap_sources(hdulist)
      
             elif file_type == "asdf":
                 asdf = AsdfFile.open(init, extensions=extensions)
@@ -228,34 +268,105 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
                 self._asdf.close()
 
     @staticmethod
-    def clone(target, source, deepcopy=False, memo=None):
+    def clone(target, source, deepcopy=False, memo=None,
+              copy_on_write=False):
+        """
+        Make `target` a clone of `source`.
+
+        If `deepcopy` is False, `target` shares the tree of `source`.
+        Otherwise the tree is deep copied, and with `copy_on_write`
+        `target` gets read-only views of the arrays of `source` (see
+        `copy`).
+        """
         if deepcopy:
+            if memo is None:
+                memo = {}
+            shared_arrays = util.SharedArrays()
+            if copy_on_write:
+                util.share_arrays(source._instance, shared_arrays, memo)
+            util.count_copied(_array_bytes(source._instance, memo))
             instance = copy.deepcopy(source._instance, memo=memo)
             target._asdf = AsdfFile(instance, extensions=source._extensions)
             target._instance = instance
             target._iscopy = source._iscopy
+            target._shared_arrays = shared_arrays
         else:
             target._asdf = source._asdf
             target._instance = source._instance
             target._iscopy = True
+            target._memmap_sources = source._memmap_sources
+            target._shared_arrays = source._shared_arrays
 
         target._files_to_close = source._files_to_close[:]
+        target._validation_deferred = source._validation_deferred
         target._schema = source._schema
         target._shape = source._shape
         target._ctx = target
 
-    def copy(self, memo=None):
+    def copy(self, memo=None, copy_on_write=False):
         """
         Returns a deep copy of this model.
-        """
+
+        If the model was opened with ``memmap=True``, the arrays that are
+        still identical to their data in the file are not duplicated:
+        the copy gets its own copy-on-write memory map of the file, so
+        memory is only allocated for the pages that either model modifies.
+
+        With ``copy_on_write=True`` no array is copied: the arrays of
+        the copy are read-only views of those of this model, which is
+        left as it is. An array of the copy that is to be modified must
+        first be copied with `unshare`; reading the arrays copies
+        nothing. Steps that modify a few of the arrays of their input
+        use this to leave the others alone. Until `release_shared` is
+        called, the copy sees the changes made to the arrays of this
+        model.
+        """
+        if memo is None:
+            memo = {}
         result = self.__class__(init=None,
                                 extensions=self._extensions,
                                 pass_invalid_values=self._pass_invalid_values)
-        self.clone(result, self, deepcopy=True, memo=memo)
+        memmap_sources = {}
+        if copy_on_write:
+            memmap_sources = self._memmap_sources
+        elif self._memmap_sources:
+            memmap_sources = util.map_copy_on_write(
+                self._instance, self._memmap_sources, memo)
+        self.clone(result, self, deepcopy=True, memo=memo,
+                   copy_on_write=copy_on_write)
+        result._memmap = self._memmap
+        result._memmap_sources = memmap_sources
         return result
 
     __copy__ = __deepcopy__ = copy
 
+    def unshare(self, *names):
+        """
+        Make the arrays `names` of a copy-on-write copy (see `copy`)
+        writeable, by copying the ones still shared with the model it
+        was copied from.
+
+        Parameters
+        ----------
+        names : str
+            The names of the array attributes of the model, such as
+            ``'data'``.
+        """
+        for name in names:
+            value = self._instance.get(name)
+            if isinstance(value, np.ndarray):
+                self._instance[name] = self._shared_arrays.unshare(value)
+
+    def release_shared(self):
+        """
+        End the copy-on-write sharing of the arrays of this model (see
+        `copy`): the arrays it still shares become writeable, and the
+        model shares them with the model it was copied from as a
+        shallow copy would.  Steps call this on the models they return,
+        so that read-only arrays are not handed to the next steps.
+        """
+        self._shared_arrays.release()
+
     def get_primary_array_name(self):
         """
         Returns the name "primary" array for this model, which
@@ -346,6 +457,8 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
             `asdf.AsdfFile.write_to`.
         """
         self.on_save(init)
+        if self._validation_deferred:
+            self.validate()
 
         AsdfFile(self._instance, extensions=self._extensions).write_to(init, *args, **kwargs)
 
@@ -384,6 +497,8 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
             `astropy.io.fits.writeto`.
         """
         self.on_save(init)
+        if self._validation_deferred:
+            self.validate()
 
         with fits_support.to_fits(self._instance, self._schema,
                                   extensions=self._extensions) as ff:
@@ -412,6 +527,20 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
         else:
             properties.ObjectNode.__setattr__(self, attr, value)
 
+    def validate(self):
+        """
+        Validate the model against its schema, even if validation is
+        deferred (see `properties.deferred_validation`).
+        """
+        return self._validate(force=True)
+
+    def deferred_validation(self):
+        """
+        Context manager deferring the validation of the model to the end
+        of the block. See `properties.deferred_validation`.
+        """
+        return properties.deferred_validation(self)
+
     def extend_schema(self, new_schema):
         """
         Extend the model's schema using the given schema, by combining
@@ -3,6 +3,7 @@
 
 from __future__ import absolute_import, division, unicode_literals, print_function
 
+import contextlib
 import copy
 import numpy as np
 import jsonschema
@@ -23,7 +24,7 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.NullHandler())
 
-__all__ = ['ObjectNode', 'ListNode']
+__all__ = ['ObjectNode', 'ListNode', 'deferred_validation']
 
 def _cast(val, schema):
     val = _unmake_node(val)
@@ -165,11 +166,15 @@ class Node(object):
             raise jsonschema.ValidationError(errmsg)
 
 
-    def _validate(self):
-        instance = yamlutil.custom_tree_to_tagged_tree(
-            self._instance, self._ctx._asdf)
+    def _validate(self, force=False):
+        if not force and getattr(self._ctx, '_validation_deferred', False):
+            return True
+        ctx = getattr(self._ctx, '_asdf', None)
+        instance = yamlutil.custom_tree_to_tagged_tree(self._instance, ctx)
         try:
-            schema.validate(instance, schema=self._schema)
+            # Pass the AsdfFile of the model, so that validate does not
+            # make a new one for every assignment
+            schema.validate(instance, ctx=ctx, schema=self._schema)
             valid = True
         except jsonschema.ValidationError as errmsg:
             self._report(str(errmsg))
@@ -406,6 +411,36 @@ class NodeIterator(six.Iterator):
                 
         raise StopIteration
 
+@contextlib.contextmanager
+def deferred_validation(node):
+    """
+    Context manager deferring the validation of a model.
+
+    Inside the block, setting values on the model does not validate
+    them against the schema. `node`, the model or one of its nodes, is
+    validated once at the end of the block, unless the validation was
+    already deferred, in which case it is left to the outer block. It
+    is not validated if the block raises an exception. Invalid values
+    are reported (see `Node._report`), but not reverted.
+
+    Models also validate deferred changes when they are saved.
+
+    Parameters
+    ----------
+    node : DataModel or ObjectNode
+        The model, or the node of the model, to validate at the end.
+    """
+    model = node._ctx
+    deferred = model._validation_deferred
+    model._validation_deferred = True
+    try:
+        yield node
+    finally:
+        model._validation_deferred = deferred
+    if not deferred:
+        node._validate()
+
+
 def put_value(path, value, tree):
     """
     Put a value at the given path into tree, replacing it if it is
@@ -6,6 +6,7 @@ import os
 import shutil
 import tempfile
 
+import jsonschema
 import pytest
 try:
     import yaml
@@ -23,6 +24,7 @@ from .. import (DataModel, ImageModel, QuadModel, MultiSlitModel,
                 ModelContainer)
 from ..util import open as open_model
 from .. import schema
+from .. import util
 
 
 ROOT_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -163,6 +165,87 @@ def test_copy():
             assert dm.meta.observation.obs_id is None
 
 
+def test_copy_memmap():
+    with ImageModel((50, 50)) as dm:
+        dm.data[:] = np.arange(2500).reshape(50, 50)
+        dm.err[:] = 1.
+        dm.save(TMP_FITS)
+
+    with ImageModel(TMP_FITS, memmap=True) as dm:
+        # Modified arrays are copied, not mapped
+        dm.err[0, 0] = 7.
+
+        with dm.copy() as dm2:
+            assert isinstance(dm2.data, np.memmap)
+            assert not isinstance(dm2.err, np.memmap)
+            assert dm2.err[0, 0] == 7.
+            assert_array_equal(dm2.data, dm.data)
+
+            dm2.data[0, 0] = -1.
+            assert dm.data[0, 0] == 0.
+
+            dm.data[1, 1] = -2.
+            assert dm2.data[1, 1] == 51.
+
+            with dm2.copy() as dm3:
+                assert dm3.data[0, 0] == -1.
+                assert dm3.data[1, 1] == 51.
+
+
+def test_copy_on_write():
+    with ImageModel((50, 50)) as dm:
+        dm.meta.instrument.name = "NIRCAM"
+        data = dm.data
+        dq = dm.dq
+
+        copied = util.bytes_copied()
+        with dm.copy(copy_on_write=True) as dm2:
+            # The arrays of the copy are read-only views; reading them
+            # copies nothing, and the original is left alone
+            assert util.bytes_copied() == copied
+            assert not dm2.data.flags.writeable
+            assert np.may_share_memory(dm2.dq, dq)
+            assert dm.data is data
+            assert data.flags.writeable
+            data += 1
+            assert dm2.data[0, 0] == 1
+
+            dm2.unshare('data')
+            dm2.data[0, 0] = 42
+            assert dm.data[0, 0] == 1
+            assert util.bytes_copied() == copied + data.nbytes
+
+            dm2.meta.instrument.name = "NIRSPEC"
+            assert dm.meta.instrument.name == "NIRCAM"
+
+            # Once released, the arrays still shared are writeable
+            dm2.release_shared()
+            dm2.dq[0, 0] = 1
+            assert dq[0, 0] == 1
+            assert util.bytes_copied() == copied + data.nbytes
+
+
+def test_deferred_validation():
+    with ImageModel((50, 50)) as dm:
+        with dm.deferred_validation():
+            dm.meta.exposure.ngroups = 'many'
+            assert dm.meta.exposure.ngroups == 'many'
+            with pytest.raises(jsonschema.ValidationError):
+                dm.validate()
+            dm.meta.exposure.ngroups = 10
+        assert not dm._validation_deferred
+
+        with pytest.raises(jsonschema.ValidationError):
+            with dm.deferred_validation():
+                dm.meta.exposure.nframes = 'few'
+
+
+def test_schema_cache():
+    with ImageModel() as dm:
+        with ImageModel() as dm2:
+            assert dm._schema is dm2._schema
+
+
 def test_section():
     with QuadModel((5, 35, 40, 32)) as dm:
         section = dm.get_section('data')[3:4, 1:3]
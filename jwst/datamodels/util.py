@@ -3,7 +3,9 @@ Various utility functions and data types
 """
 from __future__ import absolute_import, unicode_literals, division, print_function
 
+import mmap
 import sys
+import weakref
 from os.path import basename
 import numpy as np
 from astropy.extern import six
@@ -14,6 +16,11 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 log.addHandler(logging.NullHandler())
 
+# Number of bytes of array data copied by DataModel.copy, including
+# the copies of the arrays shared by copy-on-write made by
+# DataModel.unshare
+_copy_stats = {'bytes_copied': 0}
+
 
 def open(init=None, extensions=None, **kwargs):
     """
@@ -44,6 +51,10 @@ def open(init=None, extensions=None, **kwargs):
         A list of extensions to the ASDF to support when reading
         and writing ASDF files.
 
+    kwargs : dict
+        Passed to the model class. With ``memmap=True`` the arrays of
+        a FITS file are kept memory mapped, also by `DataModel.copy`.
+
     Returns
     -------
     model : DataModel instance
@@ -352,6 +363,178 @@ def gentle_asarray(a, dtype):
             raise ValueError("Can't convert {0!s} to ndarray".format(type(a)))
         return a
 
+def buffer_address(a):
+    """
+    Returns the address of the first byte of the data of an array.
+    """
+    return a.__array_interface__['data'][0]
+
+
+def is_memmapped(a):
+    """
+    Returns True if the data of an array is a memory mapped file.
+    """
+    base = a
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return True
+        base = getattr(base, 'base', None)
+    return False
+
+
+def _same_bytes(a, b, chunk_size=2 ** 24):
+    """
+    Compare the data of two contiguous arrays of the same dtype and
+    shape, a chunk of bytes at a time to avoid large temporaries.
+    """
+    a = a.reshape(-1).view(np.uint8)
+    b = b.reshape(-1).view(np.uint8)
+    for start in range(0, a.size, chunk_size):
+        stop = start + chunk_size
+        if not np.array_equal(a[start:stop], b[start:stop]):
+            return False
+    return True
+
+
+def map_copy_on_write(tree, sources, memo):
+    """
+    Prepare the deep copy of a model tree whose arrays are memory mapped.
+
+    Each array of `tree` found in `sources` whose data is still the same
+    as in the file is mapped again, copy-on-write, and the new map is
+    stored in `memo`, so that `copy.deepcopy(tree, memo)` uses it instead
+    of copying the data. Arrays that were modified are left to be copied.
+
+    Parameters
+    ----------
+    tree : dict
+        The model tree.
+
+    sources : dict
+        Maps the buffer address of the memory mapped arrays to the
+        file name and offset of their data in the file.
+
+    memo : dict
+        The memo of the deep copy.
+
+    Returns
+    -------
+    new_sources : dict
+        The `sources` of the new maps.
+    """
+    from asdf import treeutil
+
+    new_sources = {}
+    for node in treeutil.iter_tree(tree):
+        if not isinstance(node, np.ndarray) or id(node) in memo:
+            continue
+        if node.size == 0 or not node.flags.c_contiguous:
+            continue
+        source = sources.get(buffer_address(node))
+        if source is None:
+            continue
+        filename, offset = source
+        try:
+            mapped = np.memmap(filename, dtype=node.dtype, mode='c',
+                               offset=offset, shape=node.shape)
+        except (IOError, OSError, ValueError):
+            continue
+        if not _same_bytes(node, mapped):
+            continue
+        memo[id(node)] = mapped
+        new_sources[buffer_address(mapped)] = source
+    return new_sources
+
+
+def bytes_copied():
+    """
+    Returns the number of bytes of array data copied by `DataModel.copy`
+    since the start of the process.
+    """
+    return _copy_stats['bytes_copied']
+
+
+def count_copied(nbytes):
+    """
+    Add to the number of bytes of array data copied by `DataModel.copy`.
+    """
+    _copy_stats['bytes_copied'] += nbytes
+
+
+class SharedArrays(object):
+    """
+    The arrays of the copy-on-write copy of a model tree that are still
+    shared with the tree it was copied from.
+
+    They are read-only views of the arrays of the other tree, which is
+    left as it is.  `unshare` replaces one of them by a copy that may be
+    modified; `release` makes them writeable, so that the two trees then
+    simply share the data.
+    """
+    def __init__(self):
+        # The shared views, by id; they are gone with the tree
+        self._arrays = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def share(self, array):
+        """
+        Returns a read-only view of `array`, of the other tree, for the
+        tree of this registry.
+        """
+        view = array.view()
+        view.flags.writeable = False
+        self._arrays[id(view)] = view
+        return view
+
+    def is_shared(self, array):
+        """
+        Whether `array` is a view shared with the other tree.
+        """
+        return self._arrays.get(id(array)) is array
+
+    def unshare(self, array):
+        """
+        Returns an array that may be modified, to be used in place of
+        `array`: a copy of it if it is shared, `array` itself otherwise.
+        """
+        if not self.is_shared(array):
+            return array
+        del self._arrays[id(array)]
+        array = array.copy()
+        count_copied(array.nbytes)
+        return array
+
+    def release(self):
+        """
+        Make the shared views writeable, unless the arrays they view are
+        read-only, and stop tracking them.
+        """
+        for view in list(self._arrays.values()):
+            try:
+                view.flags.writeable = True
+            except ValueError:
+                pass
+        self._arrays.clear()
+
+
+def share_arrays(tree, targets, memo):
+    """
+    Prepare the copy-on-write copy of a model tree.
+
+    A read-only view of each array of `tree`, shared through the
+    `targets` registry of the copy, is added to the `memo` of
+    `copy.deepcopy(tree, memo)`, so that the copy gets the view instead
+    of a copy of the data.  `tree` itself is not modified.
+    """
+    from asdf import treeutil
+
+    for node in treeutil.iter_tree(tree):
+        if isinstance(node, np.ndarray) and id(node) not in memo:
+            memo[id(node)] = targets.share(node)
+
+
 def get_short_doc(schema):
     title = schema.get('title', None)
     description = schema.get('description', None)
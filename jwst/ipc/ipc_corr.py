@@ -6,8 +6,12 @@ from __future__ import division, print_function, absolute_import
 
 from collections import namedtuple
 import logging
+import os
+
 import numpy as np
 
+from ..lib import parallel
+from ..lib.array_cache import ArrayCache
 from . import x_irs2
 
 log = logging.getLogger(__name__)
@@ -17,8 +21,26 @@ NumRefPixels = namedtuple("NumRefPixels",
                           ["bottom_rows", "top_rows",
                            "left_columns", "right_columns"])
 
+# Allowed values of the `method` argument
+METHODS = ('direct', 'fft', 'auto')
+
+# With method 'auto', 2-D kernels with at least this many elements are
+# applied by FFT convolution
+FFT_MIN_KERNEL_SIZE = 49
+
+# The groups of the science data are convolved in blocks of at most this
+# many bytes, to bound the size of the temporary arrays
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
 
-def do_correction(input_model, ipc_model):
+# IPC kernels sliced to the science data, by reference file path and
+# modification time, and subarray, within this many bytes (a full-frame
+# 4-D kernel is about 150 MB)
+MAX_KERNEL_CACHE_BYTES = 256 * 1024 * 1024
+_kernels = ArrayCache(MAX_KERNEL_CACHE_BYTES)
+
+
+def do_correction(input_model, ipc_model, method='auto', max_cores=None,
+                  cache=False, group_loop=False, ref_path=None):
     """
     Short Summary
     -------------
@@ -33,6 +55,24 @@ def do_correction(input_model, ipc_model):
         Deconvolution kernel, either a 2-D or 4-D image in the first
         extension.
 
+    method: str
+        How a 2-D kernel is applied (see `ipc_convolve`).
+
+    max_cores: str or int
+        Maximum number of threads to use (see
+        `jwst.lib.parallel.number_of_processes`).
+
+    cache: bool
+        If True, keep the kernel sliced to the subarray, to be reused for
+        later exposures corrected with the same reference file.
+
+    group_loop: bool
+        If True, convolve the groups one at a time (the original
+        implementation).
+
+    ref_path: str
+        The path of the IPC reference file, by which the kernel is cached.
+
     Returns
     -------
     output_model: data model object
@@ -49,12 +89,15 @@ def do_correction(input_model, ipc_model):
               (sci_nints, sci_ngroups, sci_nframes, sci_groupgap))
 
     # Apply the correction.
-    output_model = ipc_correction(input_model, ipc_model)
+    output_model = ipc_correction(input_model, ipc_model, method=method,
+                                  max_cores=max_cores, cache=cache,
+                                  group_loop=group_loop, ref_path=ref_path)
 
     return output_model
 
 
-def ipc_correction(input_model, ipc_model):
+def ipc_correction(input_model, ipc_model, method='auto', max_cores=None,
+                   cache=False, group_loop=False, ref_path=None):
     """Apply the IPC correction to the science arrays.
 
     Parameters
@@ -66,6 +109,24 @@ def ipc_correction(input_model, ipc_model):
         The IPC kernel.  The input is corrected for IPC by convolving
         with this 2-D or 4-D array.
 
+    method: str
+        'direct', 'fft' or 'auto'; see `ipc_convolve`.
+
+    max_cores: str or int
+        Maximum number of threads to use.  The integrations and groups
+        are split among the threads.
+
+    cache: bool
+        If True, cache the kernel sliced to the subarray.
+
+    group_loop: bool
+        If True, convolve the groups one at a time with shifted adds.
+        Otherwise the groups are convolved in blocks of up to
+        MAX_BLOCK_BYTES (see `convolve_stack`).
+
+    ref_path: str
+        The path of the IPC reference file, by which the kernel is cached.
+
     Returns
     -------
     output: data model object
@@ -94,7 +155,8 @@ def ipc_correction(input_model, ipc_model):
 
     # Get the data for the IPC kernel.  This can be a slice, if input_model
     # is a subarray.
-    kernel = get_ipc_slice(input_model, ipc_model)
+    kernel = get_ipc_slice(input_model, ipc_model, cache=cache,
+                           ref_path=ref_path)
 
     log.debug("substrt1 = %d, subsize1 = %d, substrt2 = %d, subsize2 = %d" %
           (input_model.meta.subarray.xstart, input_model.meta.subarray.xsize,
@@ -103,7 +165,19 @@ def ipc_correction(input_model, ipc_model):
               ' %d, %d, %d, %d' %
               (nref.bottom_rows, nref.top_rows,
                nref.left_columns, nref.right_columns))
-    log.debug("Shape of ipc image = %s" % repr(ipc_model.data.shape))
+    log.debug("Shape of ipc kernel = %s" % repr(kernel.shape))
+
+    if not group_loop:
+        nproc = parallel.number_of_processes(max_cores)
+        if is_irs2_format:
+            # Extract normal data from input IRS2-format data.
+            temp = x_irs2.from_irs2(output.data, irs2_mask, detector)
+            convolve_stack(temp, kernel, nref, method, nproc)
+            # Insert normal data back into original, IRS2-format data.
+            x_irs2.to_irs2(output.data, temp, irs2_mask, detector)
+        else:
+            convolve_stack(output.data, kernel, nref, method, nproc)
+        return output
 
     # Loop over all integrations and groups in input science data.
     for i in range(input_model.data.shape[0]):                  # integrations
@@ -156,7 +230,7 @@ def get_num_ref_pixels(input_model):
 
     return nref
 
-def get_ipc_slice(input_model, ipc_model):
+def get_ipc_slice(input_model, ipc_model, cache=False, ref_path=None):
     """Extract a slice from IPC kernel corresponding to science data.
 
     Parameters
@@ -167,6 +241,15 @@ def get_ipc_slice(input_model, ipc_model):
     ipc_model: data model object
         The IPC kernel model.
 
+    cache: bool
+        If True, the slice is kept, and the slice kept for the same
+        reference file (path and modification time) and the same subarray
+        is returned.  The kernel is then not read again from the reference
+        file.  Nothing is cached without `ref_path`.
+
+    ref_path: str
+        The path of the IPC reference file.
+
     Returns
     -------
     kernel: ndarray, either 2-D or 4-D
@@ -174,14 +257,38 @@ def get_ipc_slice(input_model, ipc_model):
         IPC kernel if it is 4-D and the science data array is a subarray.
     """
 
-    if len(ipc_model.data.shape) == 2:
-        return ipc_model.data
-
     # Convert xstart and ystart from one indexing to zero indexing.
     xstart = input_model.meta.subarray.xstart - 1
     ystart = input_model.meta.subarray.ystart - 1
     xsize = input_model.meta.subarray.xsize
     ysize = input_model.meta.subarray.ysize
+
+    key = None
+    if cache and ref_path is not None:
+        # The modification time, so that a file replaced by another of the
+        # same name is read again
+        path = os.path.abspath(ref_path)
+        key = (path, os.path.getmtime(path),
+               input_model.meta.instrument.name,
+               xstart, ystart, xsize, ysize)
+    if key is not None:
+        kernel = _kernels.get(key)
+        if kernel is not None:
+            return kernel
+
+    kernel = _ipc_slice(input_model, ipc_model,
+                        xstart, ystart, xsize, ysize)
+    if key is not None:
+        # A copy, so that the whole reference array is not kept
+        kernel = np.ascontiguousarray(kernel)
+        _kernels.put(key, kernel)
+    return kernel
+
+def _ipc_slice(input_model, ipc_model, xstart, ystart, xsize, ysize):
+
+    if len(ipc_model.data.shape) == 2:
+        return ipc_model.data
+
     if input_model.meta.instrument.name == 'MIRI':
         is_subarray = (xsize < 1032 or ysize < 1024)
     else:
@@ -192,14 +299,68 @@ def get_ipc_slice(input_model, ipc_model):
     else:
         return ipc_model.data
 
-def ipc_convolve(output_data, kernel, nref):
+def convolve_stack(data, kernel, nref, method='auto', nproc=1,
+                   max_block_bytes=MAX_BLOCK_BYTES):
+    """Convolve all the groups of all the integrations with the IPC kernel.
+
+    The groups are convolved in blocks of groups of one integration, of at
+    most `max_block_bytes` (and at least one group), so that the temporary
+    arrays of the convolution are a few times the size of a block rather
+    than of the whole ramp.
+
+    Parameters
+    ----------
+    data: ndarray, 4-D
+        The science data, (nints, ngroups, ny, nx); this will be modified
+        in-place.
+
+    kernel: ndarray, 2-D or 4-D
+        The IPC kernel.
+
+    nref: NumRefPixels object
+        The number of reference rows and columns on each edge.
+
+    method: str
+        'direct', 'fft' or 'auto'; see `ipc_convolve`.
+
+    nproc: int
+        Number of threads.  If more than 1, the blocks are split among the
+        threads.
+
+    max_block_bytes: int
+        The maximum size of a block of groups.
+    """
+
+    max_groups = max(1, max_block_bytes // data[0, 0].nbytes)
+    tasks = ((part, kernel, nref, method)
+             for part in _split_stack(data, nproc, max_groups))
+    for _ in parallel.imap_ordered(_convolve_task, tasks, nproc,
+                                   threads=True):
+        pass
+
+def _split_stack(data, nparts, max_groups=None):
+    """Split the integrations and groups of data in at least nparts views,
+    of at most max_groups groups each"""
+    nints, ngroups = data.shape[:2]
+    per_int = min(ngroups, -(-nparts // nints))
+    size = -(-ngroups // per_int)
+    if max_groups is not None:
+        size = min(size, max_groups)
+    return [data[i, j:j + size]
+            for i in range(nints) for j in range(0, ngroups, size)]
+
+def _convolve_task(task):
+    ipc_convolve(*task)
+
+def ipc_convolve(output_data, kernel, nref, method='direct'):
     """Convolve the science data with the IPC kernel.
 
     Parameters
     ----------
     output_data: ndarray
-        A copy of the input science data for one group; this will be
-        modified in-place.
+        A copy of the input science data for one group, or for several
+        groups stacked along the leading axes; this will be modified
+        in-place.
 
     kernel: ndarray, 2-D or 4-D
         The IPC kernel; the input is corrected for IPC by convolving with
@@ -211,8 +372,20 @@ def ipc_convolve(output_data, kernel, nref):
         top_rows: at the top of the image
         left_columns: the number of reference columns at the left edge
         right_columns: at the right edge
+
+    method: str
+        How a 2-D kernel is applied: 'direct' adds the data shifted and
+        multiplied by each kernel element, 'fft' multiplies the Fourier
+        transforms, and 'auto' uses 'fft' for kernels with at least
+        FFT_MIN_KERNEL_SIZE elements.  The 'fft' result is the same within
+        rounding errors.  4-D kernels, and 2-D kernels with an even axis
+        length, are always applied by shifted adds.
     """
 
+    if method not in METHODS:
+        raise ValueError('Invalid IPC method "{}", must be one of {}'
+                         .format(method, METHODS))
+
     bottom_rows = nref.bottom_rows
     top_rows = nref.top_rows
     left_columns = nref.left_columns
@@ -225,8 +398,8 @@ def ipc_convolve(output_data, kernel, nref):
     shape = output_data.shape
 
     # These axis lengths exclude reference pixels, if there are any.
-    ny = shape[0] - (bottom_rows + top_rows)
-    nx = shape[1] - (left_columns + right_columns)
+    ny = shape[-2] - (bottom_rows + top_rows)
+    nx = shape[-1] - (left_columns + right_columns)
 
     # The temporary array temp is larger than the science part of
     # output_data by a border (set to zero) that's about half of the
@@ -244,21 +417,30 @@ def ipc_convolve(output_data, kernel, nref):
     xoff = left_columns                     # offset in output_data
 
     # Note that when we accumulate sums to output_data below, we will
-    # always use the same slice:  output_data[yoff:yoff+ny, xoff:xoff+nx].
+    # always use the same slice:  output_data[..., yoff:yoff+ny, xoff:xoff+nx].
+    science = output_data[..., yoff:yoff + ny, xoff:xoff + nx]
+
+    # The shifted adds apply the middle element of a kernel with an even
+    # axis length at an offset of its own, so only odd kernels use FFTs.
+    use_fft = (len(kshape) == 2 and kshape[0] % 2 == 1 and
+               kshape[1] % 2 == 1 and
+               (method == 'fft' or
+                method == 'auto' and kernel.size >= FFT_MIN_KERNEL_SIZE))
+    if use_fft:
+        fft_convolve(science, kernel, t_b, r_b)
+        return
 
     # Copy the science portion (not the reference pixels) of output_data
     # to this temporary array, then make subsequent changes in-place to
     # output_data.
-    temp = np.zeros((tny, tnx), dtype=output_data.dtype)
-    temp[b_b:b_b + ny, l_b:l_b + nx] = \
-        output_data[yoff:yoff + ny, xoff:xoff + nx].copy()
+    temp = np.zeros(shape[:-2] + (tny, tnx), dtype=output_data.dtype)
+    temp[..., b_b:b_b + ny, l_b:l_b + nx] = science
 
     # After setting this slice to zero, we'll incrementally add to it.
-    output_data[yoff:yoff + ny, xoff:xoff + nx] = 0.
+    science[...] = 0.
 
     if len(kshape) == 2:
         # 2-D IPC kernel.  Loop over pixels of the deconvolution kernel.
-        # In this section, `part` has the same shape as `temp`.
         middle_j = kshape[0] // 2
         middle_i = kshape[1] // 2
         for j in range(kshape[0]):
@@ -266,28 +448,23 @@ def ipc_convolve(output_data, kernel, nref):
             for i in range(kshape[1]):
                 if i == middle_i and j == middle_j:
                     continue                # the middle pixel is done last
-                part = kernel[j, i] * temp
                 istart = kshape[1] - i - 1
-                output_data[yoff:yoff + ny, xoff:xoff + nx] += \
-                        part[jstart:jstart + ny, istart:istart + nx]
+                science += kernel[j, i] * \
+                    temp[..., jstart:jstart + ny, istart:istart + nx]
         # The middle pixel of the IPC kernel is expected to be the largest,
         # so add that last.
-        part = kernel[middle_j, middle_i] * temp
-        output_data[yoff:yoff + ny, xoff:xoff + nx] += \
-                part[middle_j:middle_j + ny, middle_i:middle_i + nx]
+        science += kernel[middle_j, middle_i] * \
+            temp[..., middle_j:middle_j + ny, middle_i:middle_i + nx]
 
     else:
-        # 4-D IPC kernel.  Extract a subset of the kernel:  all of the
+        # 4-D IPC kernel.  Use a subset of the kernel:  all of the
         # first two axes, but only the portion of the last two axes
         # corresponding to the science data (i.e. possibly a subarray,
         # and certainly excluding reference pixels).
-        k_temp = np.zeros((kshape[0], kshape[1], tny, tnx),
-                          dtype=kernel.dtype)
-        k_temp[:, :, b_b:b_b + ny, l_b:l_b + nx] = \
-            kernel[:, :, yoff:yoff + ny, xoff:xoff + nx]
+        k_sci = kernel[:, :, yoff:yoff + ny, xoff:xoff + nx]
 
-        # In this section, `part` has shape (ny, nx), which is smaller
-        # than `temp`.
+        # In this section, `part` has the shape of `science`, which is
+        # smaller than `temp`.
         middle_j = kshape[0] // 2
         middle_i = kshape[1] // 2
         for j in range(kshape[0]):
@@ -296,15 +473,39 @@ def ipc_convolve(output_data, kernel, nref):
                 if i == middle_i and j == middle_j:
                     continue                # the middle pixel is done last
                 istart = kshape[1] - i - 1
-                # The slice of k_temp includes different pixels for the
-                # first or second axes within each loop, but the same slice
-                # for the last two axes.
+                # The slice of k_sci includes different pixels for the
+                # first or second axes within each loop.
                 # The slice of temp (a copy of the science data) includes
                 # a different offset for each loop.
-                part = k_temp[j, i, b_b:b_b + ny, l_b:l_b + nx] * \
-                       temp[jstart:jstart + ny, istart:istart + nx]
-                output_data[yoff:yoff + ny, xoff:xoff + nx] += part
+                part = k_sci[j, i] * \
+                       temp[..., jstart:jstart + ny, istart:istart + nx]
+                science += part
         # Add the product for the middle pixel last.
-        part = k_temp[middle_j, middle_i, b_b:b_b + ny, l_b:l_b + nx] * \
-               temp[middle_j:middle_j + ny, middle_i:middle_i + nx]
-        output_data[yoff:yoff + ny, xoff:xoff + nx] += part
+        part = k_sci[middle_j, middle_i] * \
+               temp[..., middle_j:middle_j + ny, middle_i:middle_i + nx]
+        science += part
+
+def fft_convolve(science, kernel, t_b, r_b):
+    """Convolve images with a 2-D kernel by FFT.
+
+    Parameters
+    ----------
+    science: ndarray
+        The science portion of one or more images (the last two axes);
+        this will be modified in-place.
+
+    kernel: ndarray, 2-D
+        The IPC kernel.
+
+    t_b, r_b: int
+        The widths of the kernel above and to the right of its center.
+    """
+
+    ny, nx = science.shape[-2:]
+    fshape = (ny + kernel.shape[0] - 1, nx + kernel.shape[1] - 1)
+    kernel_f = np.fft.rfft2(kernel, fshape)
+    # One image at a time, to limit the memory used by the transforms.
+    for index in np.ndindex(science.shape[:-2]):
+        full = np.fft.irfft2(np.fft.rfft2(science[index], fshape) * kernel_f,
+                             fshape)
+        science[index] = full[t_b:t_b + ny, r_b:r_b + nx]
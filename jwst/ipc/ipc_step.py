@@ -9,6 +9,12 @@ class IPCStep(Step):
     data model with the IPC reference data.
     """
 
+    spec = """
+        method = option('direct','fft','auto',default='auto') # how to convolve with a 2-D kernel
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of threads to use
+        cache_kernel = boolean(default=False) # keep the kernel sliced to the subarray for later exposures
+    """
+
     reference_file_types = ['ipc']
 
     def process(self, input):
@@ -32,7 +38,13 @@ class IPCStep(Step):
             ipc_model = datamodels.IPCModel(self.ipc_name)
 
             # Do the ipc correction
-            result = ipc_corr.do_correction(input_model, ipc_model)
+            if self.maximum_cores != 'none':
+                self.log.info('Maximum cores to use = %s', self.maximum_cores)
+            result = ipc_corr.do_correction(input_model, ipc_model,
+                                            method=self.method,
+                                            max_cores=self.maximum_cores,
+                                            cache=self.cache_kernel,
+                                            ref_path=self.ipc_name)
 
             # Close the reference file and update the step status
             ipc_model.close()
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+
+from .. import ipc_corr
+
+NREF = ipc_corr.NumRefPixels(bottom_rows=4, top_rows=4,
+                             left_columns=4, right_columns=0)
+
+
+def make_data(seed=1):
+    rng = np.random.RandomState(seed)
+    return rng.normal(1000., 10., (2, 3, 60, 50)).astype(np.float32)
+
+
+def make_kernel(shape, seed=2):
+    rng = np.random.RandomState(seed)
+    kernel = rng.uniform(0., 0.02, shape).astype(np.float32)
+    if len(shape) == 2:
+        kernel[shape[0] // 2, shape[1] // 2] = 0.9
+    return kernel
+
+
+def group_loop(data, kernel):
+    """The original convolution, one group at a time"""
+    for i in range(data.shape[0]):
+        for j in range(data.shape[1]):
+            ipc_corr.ipc_convolve(data[i, j], kernel, NREF)
+
+
+@pytest.mark.parametrize('kshape', [(3, 3), (4, 5), (3, 3, 60, 50)])
+@pytest.mark.parametrize('nproc', [1, 3])
+def test_stack_matches_group_loop(kshape, nproc):
+    """Convolving all the groups at once matches the group by group loop"""
+    data = make_data()
+    kernel = make_kernel(kshape)
+    expected = data.copy()
+    group_loop(expected, kernel)
+
+    result = data.copy()
+    ipc_corr.convolve_stack(result, kernel, NREF, 'direct', nproc)
+
+    assert np.array_equal(result, expected)
+    # reference pixels are not changed
+    assert np.array_equal(result[..., :4, :], data[..., :4, :])
+    assert np.array_equal(result[..., :, :4], data[..., :, :4])
+
+
+@pytest.mark.parametrize('kshape', [(3, 3), (9, 7)])
+def test_fft_matches_direct(kshape):
+    data = make_data()
+    kernel = make_kernel(kshape)
+    expected = data.copy()
+    ipc_corr.convolve_stack(expected, kernel, NREF, 'direct')
+
+    result = data.copy()
+    ipc_corr.convolve_stack(result, kernel, NREF, 'fft', 2)
+
+    assert np.allclose(result, expected, rtol=0., atol=1.e-3)
+    assert np.array_equal(result[..., :4, :], data[..., :4, :])
+
+
+def test_split_stack():
+    data = make_data()
+    parts = ipc_corr._split_stack(data, 4)
+    assert sum(part.shape[0] for part in parts) == 6
+    assert len(parts) >= 4
+    assert len(ipc_corr._split_stack(data, 1)) == 2
+    parts = ipc_corr._split_stack(data, 1, max_groups=2)
+    assert [part.shape[0] for part in parts] == [2, 1, 2, 1]
+
+
+def test_stack_in_blocks():
+    """The result does not depend on the size of the blocks of groups"""
+    data = make_data()
+    kernel = make_kernel((3, 3))
+    expected = data.copy()
+    group_loop(expected, kernel)
+
+    result = data.copy()
+    ipc_corr.convolve_stack(result, kernel, NREF, 'direct',
+                            max_block_bytes=2 * data[0, 0].nbytes)
+    assert np.array_equal(result, expected)
+
+
+def test_kernel_cache(tmpdir):
+    """The kernel cache is keyed by the path and time of the file"""
+    class Model(object):
+        pass
+
+    path = str(tmpdir.join('ipc.fits'))
+    open(path, 'w').close()
+    input_model = Model()
+    input_model.meta = Model()
+    input_model.meta.instrument = Model()
+    input_model.meta.instrument.name = 'NIRCAM'
+    input_model.meta.subarray = Model()
+    input_model.meta.subarray.xstart = 1
+    input_model.meta.subarray.ystart = 1
+    input_model.meta.subarray.xsize = 50
+    input_model.meta.subarray.ysize = 60
+    ipc_model = Model()
+    ipc_model.data = make_kernel((3, 3))
+
+    kernel = ipc_corr.get_ipc_slice(input_model, ipc_model, cache=True,
+                                    ref_path=path)
+    ipc_model.data = make_kernel((3, 3), seed=3)
+    assert ipc_corr.get_ipc_slice(input_model, ipc_model, cache=True,
+                                  ref_path=path) is kernel
+
+    # A new file at the same path is read again
+    os.utime(path, (0, 0))
+    assert ipc_corr.get_ipc_slice(input_model, ipc_model, cache=True,
+                                  ref_path=path) is not kernel
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        ipc_corr.ipc_convolve(make_data(), make_kernel((3, 3)), NREF, 'bad')
@@ -7,13 +7,17 @@ import numpy as np
 from ..datamodels import dqflags 
 from . import twopoint_difference as twopt
 from . import yintercept as yint
+from ..lib import parallel
 
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+BUFSIZE = 1024 * 30000  # 30Mb of science data in each slab of rows
+
 def detect_jumps (input_model, gain_model, readnoise_model,
-                  rejection_threshold, do_yint, signal_threshold):
+                  rejection_threshold, do_yint, signal_threshold,
+                  max_cores='none', buffsize=BUFSIZE):
     """
     This is the high-level controlling routine for the jump detection process.
     It loads and sets the various input data and parameters needed by each of
@@ -30,14 +34,22 @@ def detect_jumps (input_model, gain_model, readnoise_model,
     appropriate instrument- and detector-dependent values for each pixel of an
     image.  Also, a 2-dimensional read noise array with appropriate values for
     each pixel is passed to the detection methods.
+
+    The detector is processed in slabs of rows, each slab holding at most
+    about `buffsize` bytes of science data. The gain is applied to a copy of
+    each slab only, so the input model is not modified. If `max_cores` is
+    not 'none', the slabs are distributed to a pool of worker processes
+    (see `jwst.lib.parallel.number_of_processes`). The jump flags found in
+    each slab are stitched back into the groupdq array of the output model.
     """
 
     # Load the data arrays that we need from the input model
-    output_model = input_model.copy()
-    data = input_model.data
-    err  = input_model.err
-    gdq  = input_model.groupdq
-    pdq  = input_model.pixeldq
+    output_model = input_model.copy(copy_on_write=True)
+    output_model.unshare('groupdq', 'pixeldq')
+    data = output_model.data
+    err  = output_model.err
+    gdq  = output_model.groupdq
+    pdq  = output_model.pixeldq
 
     ngroups = data.shape[1]
     nframes = input_model.meta.exposure.nframes
@@ -75,44 +87,95 @@ def detect_jumps (input_model, gain_model, readnoise_model,
         pdq[wh_g] = np.bitwise_or( pdq[wh_g], dqflags.pixel['NO_GAIN_VALUE'] )
         pdq[wh_g] = np.bitwise_or( pdq[wh_g], dqflags.pixel['DO_NOT_USE'] ) 
 
-    # Apply gain to the SCI, ERR, and readnoise arrays so they're in units 
-    #   of electrons
-
-    data *= gain_2d
-    err  *= gain_2d
-    readnoise_2d *= gain_2d
+    # Set up the ramp time array for the y-intercept method
+    group_time = None
+    if do_yint:
+        group_time = output_model.meta.exposure.group_time
 
-    # Apply the 2-point difference method as a first pass
+    # Divide the detector in slabs of rows
+    nrows = data.shape[2]
+    nproc = parallel.number_of_processes(max_cores)
+    slab_rows = calc_slab_rows(data, buffsize, nproc)
+    slabs = [(row, min(row + slab_rows, nrows))
+             for row in range(0, nrows, slab_rows)]
+    log.info('Processing %d slabs of %d rows using %d process(es)',
+             len(slabs), slab_rows, nproc)
+
+    # The ERR array is only used by the y-intercept method
+    tasks = ((data[:, :, r0:r1], err[:, :, r0:r1] if do_yint else None,
+              gdq[:, :, r0:r1],
+              readnoise_2d[r0:r1], gain_2d[r0:r1], rejection_threshold,
+              nframes, do_yint, signal_threshold, group_time)
+             for (r0, r1) in slabs)
+
+    # Apply the 2-point difference method as a first pass and the y-intercept
+    # method as a second pass, if requested
     log.info('Executing two-point difference method')
+    if do_yint:
+        log.info('Executing yintercept method')
     start = time.time()
-
-    median_slopes = twopt.find_CRs( data, gdq, readnoise_2d,
-                                    rejection_threshold, nframes)
+    for (r0, r1), gdq_slab in zip(slabs, parallel.imap_ordered(
+            detect_jumps_slab, tasks, nproc)):
+        gdq[:, :, r0:r1] = gdq_slab
 
     elapsed = time.time() - start
     log.debug('Elapsed time = %g sec' %elapsed)
 
+    return output_model
+
+
+def detect_jumps_slab(args):
+    """
+    Run the jump detection methods on one slab of rows.
+
+    Parameters
+    ----------
+    args: tuple
+        (data, err, gdq, readnoise_2d, gain_2d, rejection_threshold, nframes,
+        do_yint, signal_threshold, group_time) for the slab; data and gdq
+        are 4-D arrays, readnoise_2d and gain_2d are 2-D arrays.  err is
+        the 4-D ERR array, or None if do_yint is False.
+
+    Returns
+    -------
+    gdq: 4-D array
+        groupdq of the slab with the jump flags set
+    """
+    (data, err, gdq, readnoise_2d, gain_2d, rejection_threshold, nframes,
+     do_yint, signal_threshold, group_time) = args
+
+    # Apply gain to the SCI, ERR, and readnoise arrays so they're in units
+    #   of electrons
+    data = data * gain_2d
+    readnoise_2d = readnoise_2d * gain_2d
+    gdq = gdq.copy()
+
+    # Apply the 2-point difference method as a first pass
+    median_slopes = twopt.find_CRs( data, gdq, readnoise_2d,
+                                    rejection_threshold, nframes)
+
     # Apply the y-intercept method as a second pass, if requested
     if do_yint:
-
-        # Set up the ramp time array for the y-intercept method
-        group_time = output_model.meta.exposure.group_time
+        err = err * gain_2d
+        ngroups = data.shape[1]
         times = np.array([(k+1)*group_time for k in range(ngroups)])
         median_slopes /= group_time
 
-        # Now apply the y-intercept method
-        log.info('Executing yintercept method')
-        start = time.time()
         yint.find_CRs( data, err, gdq, times, readnoise_2d,
                        rejection_threshold, signal_threshold, median_slopes)
-        elapsed = time.time() - start
-        log.debug('Elapsed time = %g sec' %elapsed)
 
-    # Update the DQ arrays of the output model with the jump detection results
-    output_model.groupdq = gdq
-    output_model.pixeldq = pdq
-
-    return output_model
+    return gdq
 
 
+def calc_slab_rows(data, buffsize, nproc):
+    """
+    Number of rows of a slab, such that the science data of a slab is
+    at most about `buffsize` bytes and there are at least `nproc` slabs.
+    """
+    (nints, ngroups, nrows, ncols) = data.shape
+    row_bytes = nints * ngroups * ncols * data.itemsize
+    slab_rows = max(1, min(nrows, buffsize // row_bytes))
+    if nproc > 1:
+        slab_rows = min(slab_rows, -(-nrows // nproc))
 
+    return slab_rows
@@ -13,6 +13,7 @@ class JumpStep(Step):
 
     spec = """
         rejection_threshold = float(default=4.0,min=0) # CR rejection threshold
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of processes to use
     """
 
     # Prior to 04/26/17, the following were also in the spec above:
@@ -49,6 +50,8 @@ class JumpStep(Step):
             do_yint = self.do_yintercept
             sig_thresh = self.yint_threshold
             self.log.info('CR rejection threshold = %g sigma', rej_thresh)
+            if self.maximum_cores != 'none':
+                self.log.info('Maximum cores to use = %s', self.maximum_cores)
             if do_yint:
                 self.log.info('Y-intercept signal threshold = %g', sig_thresh)
 
@@ -56,17 +59,20 @@ class JumpStep(Step):
             gain_filename = self.get_reference_file(input_model, 'gain')
             self.log.info('Using GAIN reference file: %s', gain_filename)
 
-            gain_model = datamodels.GainModel( gain_filename )
+            gain_model = self.open_reference_model(
+                gain_filename, datamodels.GainModel)
 
             readnoise_filename = self.get_reference_file(input_model,
                                                           'readnoise')
             self.log.info('Using READNOISE reference file: %s',
                           readnoise_filename)
-            readnoise_model = datamodels.ReadnoiseModel( readnoise_filename )
+            readnoise_model = self.open_reference_model(
+                readnoise_filename, datamodels.ReadnoiseModel)
 
             # Call the jump detection routine
             result = detect_jumps(input_model, gain_model, readnoise_model,
-                                   rej_thresh, do_yint, sig_thresh)
+                                   rej_thresh, do_yint, sig_thresh,
+                                   max_cores=self.maximum_cores)
 
             gain_model.close()
             readnoise_model.close()
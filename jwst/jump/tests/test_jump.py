@@ -0,0 +1,62 @@
+import numpy as np
+
+from ...datamodels import dqflags
+from ...lib import parallel
+from ..jump import detect_jumps_slab, calc_slab_rows
+
+
+def setup_ramps(ngroups=10, nrows=60, ncols=40, seed=3):
+    rng = np.random.RandomState(seed)
+    data = np.zeros((2, ngroups, nrows, ncols), dtype=np.float32)
+    data[:] = (np.arange(ngroups)[:, np.newaxis, np.newaxis] *
+               rng.uniform(0, 100, size=(nrows, ncols)))
+    data += rng.normal(0, 5, size=data.shape).astype(np.float32)
+    # jumps in a few pixels
+    data[0, 4:, 10, 10] += 3000.
+    data[1, 7:, 33, 5] += 2000.
+    data[1, 2:, 50, 39] += 1000.
+    data[1, 6:, 50, 39] += 1000.
+    gdq = np.zeros(data.shape, dtype=np.uint8)
+    readnoise = np.full((nrows, ncols), 5., dtype=np.float32)
+    gain = np.full((nrows, ncols), 2., dtype=np.float32)
+    return data, gdq, readnoise, gain
+
+
+def slab_tasks(data, gdq, readnoise, gain, slab_rows):
+    nrows = data.shape[2]
+    for r0 in range(0, nrows, slab_rows):
+        r1 = min(r0 + slab_rows, nrows)
+        yield (data[:, :, r0:r1], None, gdq[:, :, r0:r1],
+               readnoise[r0:r1], gain[r0:r1], 4.0, 1, False, 1.0, None)
+
+
+def test_slabs_match_full_frame():
+    data, gdq, readnoise, gain = setup_ramps()
+    data_in = data.copy()
+    full = detect_jumps_slab((data, None, gdq, readnoise, gain,
+                              4.0, 1, False, 1.0, None))
+
+    # the inputs are not modified
+    assert np.array_equal(data, data_in)
+    assert gdq.max() == 0
+
+    for nproc in (1, 2):
+        slabs = list(parallel.imap_ordered(
+            detect_jumps_slab,
+            slab_tasks(data, gdq, readnoise, gain, 7), nproc))
+        assert np.array_equal(np.concatenate(slabs, axis=2), full)
+
+    jump = dqflags.group['JUMP_DET']
+    assert full[0, 4, 10, 10] == jump
+    assert full[1, 7, 33, 5] == jump
+    assert full[1, 2, 50, 39] == jump
+    assert full[1, 6, 50, 39] == jump
+
+
+def test_calc_slab_rows():
+    data = np.zeros((1, 10, 100, 50), dtype=np.float32)
+    # 2000 bytes per row
+    assert calc_slab_rows(data, 20000, 1) == 10
+    assert calc_slab_rows(data, 1, 1) == 1
+    assert calc_slab_rows(data, 10 ** 9, 1) == 100
+    assert calc_slab_rows(data, 10 ** 9, 3) == 34
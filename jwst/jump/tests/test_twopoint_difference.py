@@ -410,6 +410,40 @@ def test_10grps_Satat8_CRsat3and6():
                             0,dqflags.group['SATURATED'],dqflags.group['SATURATED'],dqflags.group['SATURATED']], gdq[0, :, 100, 100]))
 
 
+def test_multiple_crs_vectorized_matches_pixel_loop():
+    ngroups = 20
+    data, gdq, nframes, read_noise, rej_threshold = setup_cube(ngroups, readnoise=5)
+    data, gdq = random_ramps_with_jumps(data, gdq, read_noise, seed=10)
+    data_loop = data.copy()
+    gdq_loop = gdq.copy()
+    median_slopes = find_CRs(data, gdq, read_noise, rej_threshold, nframes)
+    median_slopes_loop = find_CRs(data_loop, gdq_loop, read_noise, rej_threshold,
+                                  nframes, pixel_loop=True)
+    assert np.sum(gdq == dqflags.group['JUMP_DET']) > 0
+    assert np.array_equal(gdq, gdq_loop)
+    assert np.allclose(median_slopes, median_slopes_loop, rtol=1e-6)
+
+
+def random_ramps_with_jumps(data, gdq, read_noise, seed=1):
+    # ramps with random slopes and read noise, with up to three jumps
+    # injected in a quarter of the pixels and saturation in a few of them
+    rng = np.random.RandomState(seed)
+    nints, ngroups, nrows, ncols = data.shape
+    slopes = rng.uniform(0, 500, size=(nrows, ncols))
+    ramp = np.arange(ngroups)[:, np.newaxis, np.newaxis] * slopes
+    data[0] = ramp + rng.normal(0, 1, size=ramp.shape) * read_noise
+    hit = rng.uniform(size=(nrows, ncols)) < 0.25
+    for njump in range(3):
+        jump_group = rng.randint(1, ngroups, size=(nrows, ncols))
+        jump_size = rng.uniform(500, 5000, size=(nrows, ncols))
+        for group in range(1, ngroups):
+            jumped = hit & (jump_group <= group)
+            data[0, group][jumped] += jump_size[jumped]
+    saturated = data[0] > 0.9 * data.max()
+    gdq[0][saturated] = dqflags.group['SATURATED']
+    return data, gdq
+
+
 def setup_cube(ngroups,readnoise=10):
     nints = 1
     nrows = 200
@@ -4,9 +4,11 @@ Two-Point Difference method for finding outliers in a 3-d ramp data cube.
 The scheme used in this variation of the method uses numpy array methods
 to compute first-differences and find the max outlier in each pixel while
 still working in the full 3-d data array. This makes detection of the first
-outlier very fast. We then iterate pixel-by-pixel over only those pixels
-that are already known to contain an outlier, to look for any additional
-outliers and set the appropriate DQ mask for all outliers in the pixel.
+outlier very fast. We then iterate over only those pixels that are already
+known to contain an outlier, to look for any additional outliers and set the
+appropriate DQ mask for all outliers in the pixel. Each iteration works on all
+of these pixels at once, recomputing the clipped median of every pixel that
+is still being searched.
 
 This is MUCH faster than doing all the work on a pixel-by-pixel basis.
 """
@@ -22,7 +24,7 @@ log.setLevel(logging.DEBUG)
 
 HUGE_NUM = np.finfo(np.float32).max
 
-def find_CRs(data, gdq, read_noise, rej_threshold, nframes):
+def find_CRs(data, gdq, read_noise, rej_threshold, nframes, pixel_loop=False):
 
     """
     Find CRs/Jumps in each integration within the input data array.
@@ -30,6 +32,11 @@ def find_CRs(data, gdq, read_noise, rej_threshold, nframes):
     The input data array is assumed to be in units of electrons, i.e. already
     multiplied by the gain. We also assume that the read noise is in units of
     electrons.
+
+    The search for additional CRs in the pixels that contain at least one CR
+    is done for all these pixels at once (find_additional_CRs). If pixel_loop
+    is True the original pixel-by-pixel search (find_additional_CRs_loop) is
+    used instead.
     """
 
     # Get data characteristics
@@ -105,47 +112,28 @@ def find_CRs(data, gdq, read_noise, rej_threshold, nframes):
         r, c = np.indices(max_index1.shape)
         row1, col1 = np.where(ratio[r, c, max_index1 - number_sat_groups] > rej_threshold)
         log.debug('From highest outlier Twopt found %d pixels with at least one CR' % (len(row1)))
-        number_pixels_with_cr = len(row1)
-        for j in range(number_pixels_with_cr):
-            pixel_masked_diffs = first_diffs[row1[j], col1[j]]
-            pixel_rn2 = read_noise_2[row1[j], col1[j]]
-            pixel_sat_groups = number_sat_groups[row1[j], col1[j]]
-            sorted_index_of_cr = max_index1[row1[j], col1[j]] - pixel_sat_groups
-
-            # Create a CR mask and set 1st CR to be found
-            # cr_mask=0 designates a CR
-            pixel_cr_mask = np.ones(pixel_masked_diffs.shape, dtype=bool)
-            number_CRs_found = 1
-            pixel_sorted_index = sort_index[row1[j], col1[j], :]
-            pixel_cr_mask[pixel_sorted_index[ndiffs - pixel_sat_groups - 1]] = 0
-            new_CR_found = True
-
-            # Loop over all the found CRs and see if there is more than one CR, setting the mask as you go
-            while new_CR_found and ((ndiffs - number_CRs_found - pixel_sat_groups) > 1):
-                new_CR_found = False
-                pixel_med_diff = return_clipped_median(ndiffs, number_CRs_found + pixel_sat_groups,
-                                                       pixel_masked_diffs, pixel_sorted_index)
-                poisson_noise = np.sqrt(np.abs(pixel_med_diff))
-                sigma = np.sqrt(poisson_noise * poisson_noise + pixel_rn2 / nframes)
-                ratio = np.abs(pixel_masked_diffs - pixel_med_diff) / sigma
-                pixel_sorted_ratio = ratio[pixel_sorted_index[:]]
-
-                # Check if largest remaining difference is above threshold
-                if ratio[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] > rej_threshold:
-                    new_CR_found = True
-                    pixel_cr_mask[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] = 0
-                    number_CRs_found += 1
-
-            # Found all CRs. Set CR flags in input DQ array for this pixel
-            gdq[integration, 1:, row1[j], col1[j]] = \
-                np.bitwise_or(gdq[integration, 1:, row1[j], col1[j]],
-                              dqflags.group['JUMP_DET'] * np.invert(pixel_cr_mask))
-
-            # Save the CR-cleaned median slope for this pixel
-            if not new_CR_found: # the loop ran at least one time
-                median_slopes[integration, row1[j], col1[j]] = pixel_med_diff
-
-        # Next pixel with an outlier (j loop)
+
+        # Look for additional CRs in the pixels known to contain one
+        if pixel_loop:
+            cr_mask, pixel_med_diffs, update_slope = find_additional_CRs_loop(
+                first_diffs[row1, col1], sort_index[row1, col1],
+                number_sat_groups[row1, col1], read_noise_2[row1, col1],
+                rej_threshold, nframes)
+        else:
+            cr_mask, pixel_med_diffs, update_slope = find_additional_CRs(
+                first_diffs[row1, col1], sort_index[row1, col1],
+                number_sat_groups[row1, col1], read_noise_2[row1, col1],
+                rej_threshold, nframes)
+
+        # Found all CRs. Set CR flags in input DQ array for these pixels
+        gdq[integration, 1:, row1, col1] = \
+            np.bitwise_or(gdq[integration, 1:, row1, col1],
+                          dqflags.group['JUMP_DET'] * np.invert(cr_mask))
+
+        # Save the CR-cleaned median slope for these pixels
+        median_slopes[integration, row1[update_slope], col1[update_slope]] = \
+            pixel_med_diffs[update_slope]
+
     # Next integration (integration loop)
 
     return median_slopes
@@ -182,3 +170,142 @@ def return_clipped_median(num_differences, diffs_to_ignore, differences, sorted_
             pixel_med_diff = (pixel_med_diff + differences[pixel_med_index2]) / 2.0
 
     return pixel_med_diff
+
+
+def find_additional_CRs(masked_diffs, sorted_index, sat_groups, rn2,
+                        rej_threshold, nframes):
+
+    """
+    Search for additional CRs in the pixels known to contain at least one CR.
+
+    All the pixels are processed together: in each iteration the clipped median
+    of the first differences is recomputed, ignoring the saturated groups and
+    the CRs found so far, for every pixel still being searched. The largest
+    remaining difference of each of these pixels is flagged as a CR if it is
+    above the rejection threshold, otherwise the search for that pixel stops.
+
+    Parameters
+    ----------
+    masked_diffs : 2-D array (npixels, ndiffs)
+        first differences of each pixel, saturated differences set to 100000
+
+    sorted_index : 2-D array (npixels, ndiffs)
+        indices that sort the absolute first differences of each pixel
+
+    sat_groups : 1-D array (npixels)
+        number of saturated first differences of each pixel
+
+    rn2 : 1-D array (npixels)
+        square of the read noise of each pixel
+
+    rej_threshold : float
+        CR rejection threshold
+
+    nframes : int
+        number of frames averaged into each group
+
+    Returns
+    -------
+    cr_mask : 2-D boolean array (npixels, ndiffs)
+        False for the first differences that contain a CR
+
+    pixel_med_diffs : 1-D array (npixels)
+        CR-cleaned median difference of each pixel
+
+    update_slope : 1-D boolean array (npixels)
+        True for the pixels where the search ended because no further CR was
+        found, i.e. the pixels whose median slope is to be updated
+    """
+
+    npixels, ndiffs = masked_diffs.shape
+    pixels = np.arange(npixels)
+
+    # Create a CR mask and set 1st CR to be found
+    # cr_mask=0 designates a CR
+    cr_mask = np.ones(masked_diffs.shape, dtype=bool)
+    cr_mask[pixels, sorted_index[pixels, ndiffs - sat_groups - 1]] = 0
+    number_CRs_found = np.ones(npixels, dtype=np.int32)
+    pixel_med_diffs = np.zeros(npixels, dtype=np.float64)
+    new_CR_found = np.ones(npixels, dtype=bool)
+
+    while True:
+        # pixels still being searched that have enough differences left
+        searching = np.where(new_CR_found &
+                             ((ndiffs - number_CRs_found - sat_groups) > 1))[0]
+        if len(searching) == 0:
+            break
+        diffs = masked_diffs[searching]
+        index = sorted_index[searching]
+        rows = np.arange(len(searching))
+
+        # clipped median ignoring the saturated groups and CRs found so far
+        ignore = number_CRs_found[searching] + sat_groups[searching]
+        nleft = ndiffs - 1 - ignore
+        med_diff = diffs[rows, index[rows, nleft // 2]].astype(np.float64)
+        even = np.where(nleft % 2 == 0)[0]
+        med_diff[even] = (diffs[even, index[even, nleft[even] // 2]] +
+                          diffs[even, index[even, nleft[even] // 2 - 1]]) / 2.0
+        pixel_med_diffs[searching] = med_diff
+
+        poisson_noise = np.sqrt(np.abs(med_diff))
+        sigma = np.sqrt(poisson_noise * poisson_noise + rn2[searching] / nframes)
+
+        # Check if largest remaining difference is above threshold
+        next_cr = index[rows, nleft]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.abs(diffs[rows, next_cr] - med_diff) / sigma
+        found = ratio > rej_threshold
+
+        cr_mask[searching[found], next_cr[found]] = 0
+        number_CRs_found[searching[found]] += 1
+        new_CR_found[searching[~found]] = False
+
+    return cr_mask, pixel_med_diffs, ~new_CR_found
+
+
+def find_additional_CRs_loop(masked_diffs, sorted_index, sat_groups, rn2,
+                             rej_threshold, nframes):
+
+    """
+    Pixel-by-pixel version of find_additional_CRs, with the same parameters
+    and return values.
+    """
+
+    npixels, ndiffs = masked_diffs.shape
+    cr_mask = np.ones(masked_diffs.shape, dtype=bool)
+    pixel_med_diffs = np.zeros(npixels, dtype=np.float64)
+    update_slope = np.zeros(npixels, dtype=bool)
+
+    for j in range(npixels):
+        pixel_masked_diffs = masked_diffs[j]
+        pixel_rn2 = rn2[j]
+        pixel_sat_groups = sat_groups[j]
+
+        # Create a CR mask and set 1st CR to be found
+        # cr_mask=0 designates a CR
+        pixel_cr_mask = cr_mask[j]
+        number_CRs_found = 1
+        pixel_sorted_index = sorted_index[j]
+        pixel_cr_mask[pixel_sorted_index[ndiffs - pixel_sat_groups - 1]] = 0
+        new_CR_found = True
+
+        # Loop over all the found CRs and see if there is more than one CR, setting the mask as you go
+        while new_CR_found and ((ndiffs - number_CRs_found - pixel_sat_groups) > 1):
+            new_CR_found = False
+            pixel_med_diff = return_clipped_median(ndiffs, number_CRs_found + pixel_sat_groups,
+                                                   pixel_masked_diffs, pixel_sorted_index)
+            poisson_noise = np.sqrt(np.abs(pixel_med_diff))
+            sigma = np.sqrt(poisson_noise * poisson_noise + pixel_rn2 / nframes)
+            ratio = np.abs(pixel_masked_diffs - pixel_med_diff) / sigma
+
+            # Check if largest remaining difference is above threshold
+            if ratio[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] > rej_threshold:
+                new_CR_found = True
+                pixel_cr_mask[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] = 0
+                number_CRs_found += 1
+
+        if not new_CR_found: # the loop ran at least one time
+            pixel_med_diffs[j] = pixel_med_diff
+            update_slope[j] = True
+
+    return cr_mask, pixel_med_diffs, update_slope
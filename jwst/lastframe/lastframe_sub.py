@@ -33,12 +33,14 @@ def do_correction(input_model):
     # Save some data params for easy use later
     sci_ngroups = input_model.data.shape[1]
 
-    # Create output as a copy of the input science data model
-    output = input_model.copy()
+    # Create output as a copy of the input science data model, sharing
+    # the arrays that are not modified
+    output = input_model.copy(copy_on_write=True)
 
     # Update the step status, and if ngroups > 1, set all of the GROUPDQ in
     # the final group to 'DO_NOT_USE'
     if sci_ngroups > 1:
+        output.unshare('groupdq')
         output.groupdq[:, -1, :, :] = dqflags.group['DO_NOT_USE']
         log.debug("LastFrame Sub: resetting GROUPDQ in last frame to DO_NOT_USE")
         output.meta.cal_step.lastframe = 'COMPLETE'
@@ -0,0 +1,76 @@
+"""
+A least recently used cache of arrays within a byte budget
+"""
+from __future__ import division
+
+from collections import OrderedDict
+import logging
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = ['ArrayCache']
+
+
+def _nbytes(value):
+    """Number of bytes of an array, or of a tuple of arrays"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sum(item.nbytes for item in value
+               if isinstance(item, np.ndarray))
+
+
+class ArrayCache(object):
+    """A least recently used cache of arrays within a byte budget
+
+    The values are arrays, or tuples of arrays, computed from reference
+    files, e.g. kernels sliced to a subarray.  The least recently used
+    values are dropped to keep the arrays within the budget.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The budget for the cached arrays. A value larger than the budget
+        is not cached.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._values = OrderedDict()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key):
+        """The value of `key`, or None if it is not cached"""
+        value = self._values.pop(key, None)
+        if value is not None:
+            self._values[key] = value
+        return value
+
+    def put(self, key, value):
+        """Cache `value`, dropping the least recently used values as needed"""
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            logger.debug('Not caching %d bytes, over the budget of %d',
+                         nbytes, self.max_bytes)
+            return
+        old = self._values.pop(key, None)
+        if old is not None:
+            self.nbytes -= _nbytes(old)
+        self._values[key] = value
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._values.popitem(last=False)
+            self.nbytes -= _nbytes(old)
+
+    def clear(self):
+        """Drop all of the cached values"""
+        self._values.clear()
+        self.nbytes = 0
@@ -0,0 +1,60 @@
+"""
+Utilities to write files safely when several processes share a directory
+"""
+from __future__ import division
+
+import contextlib
+import os
+
+__all__ = [
+    'replace',
+    'atomic_write',
+]
+
+
+def replace(src, dst):
+    """Rename `src` to `dst`, replacing `dst` if it exists
+
+    This is `os.replace`, which Python 2 does not have. On POSIX systems
+    `os.rename` replaces the destination atomically; on Windows the
+    destination is removed first.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb'):
+    """Write a file through a temporary file, moved into place when done
+
+    The file is never seen partly written by another process. The
+    temporary file, in the same directory, is named after `filename`
+    and the process id, so that processes writing the same file do not
+    share it. It is removed if the write fails.
+
+    Parameters
+    ----------
+    filename: str
+        The file to write.
+
+    mode: str
+        The mode in which the temporary file is opened.
+
+    Yields
+    ------
+    fd: file object
+        The open temporary file.
+    """
+    temp = '{0}.{1}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp, mode) as fd:
+            yield fd
+        replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
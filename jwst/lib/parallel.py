@@ -0,0 +1,136 @@
+"""
+Utilities to run step computations on a pool of worker processes or threads
+"""
+from __future__ import division
+
+from collections import deque
+import itertools
+import logging
+import multiprocessing
+import multiprocessing.pool
+
+# Configure logging
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+__all__ = [
+    'MAX_CORES_OPTIONS',
+    'number_of_processes',
+    'imap_ordered',
+]
+
+# Allowed values of the `maximum_cores` step parameters
+MAX_CORES_OPTIONS = ('none', 'quarter', 'half', 'all')
+
+
+def number_of_processes(max_cores):
+    """Number of worker processes to use
+
+    Parameters
+    ----------
+    max_cores: str or int
+        One of 'none', 'quarter', 'half', 'all' (fraction of the
+        available cores) or an explicit number of processes.
+
+    Returns
+    -------
+    nproc: int
+        Number of processes, at least 1. A value of 1 means the work
+        is to be done in the calling process.
+    """
+    if max_cores is None:
+        return 1
+    try:
+        return max(1, int(max_cores))
+    except ValueError:
+        pass
+
+    max_cores = max_cores.lower()
+    if max_cores not in MAX_CORES_OPTIONS:
+        raise ValueError(
+            'Invalid maximum_cores value "{}", must be one of {}'
+            ' or an integer'.format(max_cores, MAX_CORES_OPTIONS)
+        )
+    if max_cores == 'none':
+        return 1
+
+    ncpus = multiprocessing.cpu_count()
+    if max_cores == 'quarter':
+        nproc = ncpus // 4
+    elif max_cores == 'half':
+        nproc = ncpus // 2
+    else:
+        nproc = ncpus
+    return max(1, nproc)
+
+
+def imap_ordered(func, tasks, nproc, threads=False, initializer=None,
+                 initargs=()):
+    """Apply `func` to every task, in order
+
+    Parameters
+    ----------
+    func: callable
+        Module-level function (it must be picklable) taking one task.
+
+    tasks: iterable
+        The task arguments. Tasks are taken from `tasks` as results are
+        returned, at most twice `nproc` ahead of the results, so only
+        the tasks in flight are held in memory.
+
+    nproc: int
+        Number of worker processes. If 1, the tasks are run
+        in the calling process.
+
+    threads: bool
+        Run the tasks on a pool of threads instead of processes. The
+        tasks and results are then shared, not pickled, which suits
+        large arrays processed by numpy routines that release the GIL.
+
+    initializer: callable, optional
+        Module-level function called with `initargs` in each worker
+        before its tasks (or in the calling process if `nproc` is 1), to
+        set up state shared by the tasks.  With the default start method
+        on Unix (fork), `initargs` are inherited by the workers, not
+        pickled.
+
+    initargs: tuple, optional
+        The arguments of `initializer`.
+
+    Returns
+    -------
+    results: generator
+        The results of `func`, in the same order as `tasks`.
+    """
+    if nproc <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield func(task)
+        return
+
+    if threads:
+        logger.debug('Starting pool of %d threads', nproc)
+        pool = multiprocessing.pool.ThreadPool(processes=nproc,
+                                               initializer=initializer,
+                                               initargs=initargs)
+    else:
+        logger.debug('Starting pool of %d processes', nproc)
+        pool = multiprocessing.Pool(processes=nproc, initializer=initializer,
+                                    initargs=initargs)
+    # Pool.imap would consume all of the tasks ahead of the workers
+    tasks = iter(tasks)
+    try:
+        pending = deque(pool.apply_async(func, (task,))
+                        for task in itertools.islice(tasks, 2 * nproc))
+        while pending:
+            result = pending.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(func, (task,)))
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,31 @@
+"""Test the cache of arrays"""
+import numpy as np
+
+from ..array_cache import ArrayCache
+
+
+def test_array_cache():
+    cache = ArrayCache(max_bytes=200)
+    a, b, c = [np.zeros(10) for _ in range(3)]      # 80 bytes each
+
+    cache.put('a', a)
+    cache.put('b', (b, None))
+    assert cache.get('a') is a
+    assert cache.get('b')[0] is b
+    assert cache.nbytes == 160
+
+    # The least recently used is dropped
+    cache.get('a')
+    cache.put('c', c)
+    assert 'b' not in cache
+    assert len(cache) == 2
+    assert cache.nbytes == 160
+    assert cache.get('b') is None
+
+    # Over the budget, not cached
+    cache.put('d', np.zeros(100))
+    assert 'd' not in cache
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
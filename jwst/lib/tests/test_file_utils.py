@@ -0,0 +1,36 @@
+"""Test the safe file writing utilities"""
+import os
+
+import pytest
+
+from ..file_utils import replace, atomic_write
+
+
+def test_replace(tmpdir):
+    src = str(tmpdir.join('src'))
+    dst = str(tmpdir.join('dst'))
+    for name, text in [(src, 'new'), (dst, 'old')]:
+        with open(name, 'w') as fd:
+            fd.write(text)
+    replace(src, dst)
+    assert os.listdir(str(tmpdir)) == ['dst']
+    with open(dst) as fd:
+        assert fd.read() == 'new'
+
+
+def test_atomic_write(tmpdir):
+    filename = str(tmpdir.join('file'))
+    with atomic_write(filename) as fd:
+        fd.write(b'data')
+        assert not os.path.exists(filename)
+    with open(filename, 'rb') as fd:
+        assert fd.read() == b'data'
+
+
+def test_atomic_write_failure(tmpdir):
+    filename = str(tmpdir.join('file'))
+    with pytest.raises(IOError):
+        with atomic_write(filename) as fd:
+            fd.write(b'part')
+            raise IOError('disk full')
+    assert os.listdir(str(tmpdir)) == []
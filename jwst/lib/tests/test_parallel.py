@@ -0,0 +1,66 @@
+"""Test the worker pool utilities"""
+import multiprocessing
+
+import pytest
+
+from ..parallel import number_of_processes, imap_ordered
+
+
+def square(x):
+    return x * x
+
+
+_offset = [0]
+
+
+def set_offset(offset):
+    _offset[0] = offset
+
+
+def add_offset(x):
+    return x + _offset[0]
+
+
+def test_number_of_processes():
+    ncpus = multiprocessing.cpu_count()
+    assert number_of_processes('none') == 1
+    assert number_of_processes(None) == 1
+    assert number_of_processes('all') == ncpus
+    assert number_of_processes('half') == max(1, ncpus // 2)
+    assert number_of_processes('quarter') == max(1, ncpus // 4)
+    assert number_of_processes(3) == 3
+    assert number_of_processes('0') == 1
+
+
+def test_number_of_processes_invalid():
+    with pytest.raises(ValueError):
+        number_of_processes('most')
+
+
+@pytest.mark.parametrize('threads', [False, True])
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_imap_ordered(nproc, threads):
+    assert list(imap_ordered(square, range(10), nproc, threads=threads)) == \
+        [x * x for x in range(10)]
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_imap_ordered_initializer(nproc):
+    results = imap_ordered(add_offset, range(10), nproc,
+                           initializer=set_offset, initargs=(100,))
+    assert list(results) == [x + 100 for x in range(10)]
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_imap_ordered_lazy(nproc):
+    taken = []
+
+    def tasks():
+        for x in range(100):
+            taken.append(x)
+            yield x
+
+    results = imap_ordered(square, tasks(), nproc, threads=True)
+    assert next(results) == 0
+    assert len(taken) <= 2 * nproc + 1
+    assert list(results) == [x * x for x in range(1, 100)]
@@ -30,8 +30,9 @@ def do_correction(input_model, lin_model):
         linearity corrected data
 
     """
-    # Create the output model as a copy of the input
-    output_model = input_model.copy()
+    # Create the output model as a copy of the input, sharing the arrays
+    # that are not modified
+    output_model = input_model.copy(copy_on_write=True)
 
     # Propagate the DQ flags from the linearity ref data into the 2D science DQ
     propagate_dq_info(output_model, lin_model)
@@ -91,6 +92,8 @@ def apply_linearity(input, linearity_ref_model):
     -------
     """
 
+    # The ramp is corrected in place
+    input.unshare('data')
     ramp = input.data
     dq = input.groupdq
 
@@ -98,6 +101,37 @@ def apply_linearity(input, linearity_ref_model):
     if len(dq) == 0:
         dq = (ramp * 0).astype(np.uint32)
 
+    lin_coeffs = get_coeffs(input, linearity_ref_model)
+
+    # Get the DQ bit value that represents saturation
+    sat_val = dqflags.group['SATURATED']
+
+    # Apply the correction function
+    input.data = apply_linearity_func(ramp, dq, lin_coeffs, sat_val)
+
+
+def get_coeffs(input, linearity_ref_model):
+    """
+    Short Summary
+    -------------
+    Get the linearity correction coefficients matching the science data,
+    with benign coefficients for the pixels flagged NO_LIN_CORR or having
+    NaN coefficients in the reference file. The pixels having NaN
+    coefficients are flagged in place in the pixeldq of the science data.
+
+    Parameters
+    ----------
+    input: data model object
+        The input science data
+
+    linearity_ref_model: linearity reference file model object
+
+    Returns
+    -------
+    lin_coeffs: 3D array
+        array of correction coefficients
+    """
+
     # Check for subarray mode
     if ref_matches_sci(linearity_ref_model, input):
         lin_coeffs = linearity_ref_model.coeffs
@@ -112,11 +146,7 @@ def apply_linearity(input, linearity_ref_model):
     # Check for NaNs in the COEFFS extension of the ref file
     lin_coeffs = correct_for_NaN(lin_coeffs, input)
 
-    # Get the DQ bit value that represents saturation
-    sat_val = dqflags.group['SATURATED']
-
-    # Apply the correction function
-    input.data = apply_linearity_func(ramp, dq, lin_coeffs, sat_val)
+    return lin_coeffs
 
 
 def ref_matches_sci(ref_model, sci_model):
@@ -183,6 +213,9 @@ def correct_for_NaN(lin_coeffs, input):
     # If there are NaNs as the correction coefficients, update those
     # coefficients so that those SCI values will be unchanged.
     if len(wh_nan[0]) > 0:
+        if not lin_coeffs.flags.writeable:
+            # Shared with a cached reference model
+            lin_coeffs = lin_coeffs.copy()
         ben_cor = ben_coeffs(lin_coeffs) # get benign coefficients
         num_nan = len(wh_nan[0])
 
@@ -233,6 +266,9 @@ def correct_for_flag(lin_coeffs, lin_dq):
     # If there are pixels flagged as 'NO_LIN_CORR', update the corresponding
     #     coefficients so that those SCI values will be unchanged.
     if (num_flag > 0):
+        if not lin_coeffs.flags.writeable:
+            # Shared with a cached reference model
+            lin_coeffs = lin_coeffs.copy()
         ben_cor = ben_coeffs(lin_coeffs) # get benign coefficients
 
         for ii in range(num_flag):
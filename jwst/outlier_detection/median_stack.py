@@ -0,0 +1,151 @@
+"""
+A stack of resampled images kept in scratch files, for their median.
+
+`create_median` normally holds all of the resampled images, their
+weights and their masks in memory at once.  With a memory budget, each
+resampled image is instead written to a scratch file, with its mask of
+low weight pixels, as soon as it is made, and the median is computed a
+block of rows at a time from the memory-mapped files, so that only the
+median image and one block of rows of the stack are in memory.
+"""
+from __future__ import (division, print_function, unicode_literals,
+    absolute_import)
+
+import tempfile
+
+import numpy as np
+from stsci.image import median
+
+import logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+__all__ = ['MedianStack']
+
+
+class MedianStack(object):
+    """
+    Resampled images and their masks, in scratch files.
+
+    The scratch files are deleted by `close`, or on leaving a ``with``
+    block.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The directory of the scratch files.  By default, the temporary
+        directory of the system (see `tempfile.gettempdir`).
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.shape = None
+        self._files = []
+        self._dtypes = []
+
+    def __len__(self):
+        return len(self._files)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, image, badmask):
+        """
+        Add an image to the stack.
+
+        Parameters
+        ----------
+        image : 2d array
+            The resampled image.
+
+        badmask : 2d array
+            The pixels of the image not to be used for the median (True).
+        """
+        if self.shape is None:
+            self.shape = image.shape
+        elif image.shape != self.shape:
+            raise ValueError("Image shape {} does not match the stack "
+                             "shape {}".format(image.shape, self.shape))
+
+        image = np.ascontiguousarray(image)
+        badmask = np.ascontiguousarray(badmask, dtype=bool)
+
+        scratch = tempfile.TemporaryFile(prefix='outlier_median_',
+                                         dir=self.directory)
+        self._files.append(scratch)
+        image.tofile(scratch)
+        badmask.tofile(scratch)
+        scratch.flush()
+        self._dtypes.append(image.dtype)
+
+    def _read_rows(self, index, rows):
+        """
+        The image and mask of rows `rows` of image `index`, mapped from its
+        scratch file only while they are copied, so that the pages read do
+        not stay in the memory of the process.
+        """
+        scratch = self._files[index]
+        dtype = self._dtypes[index]
+        nrows = rows.stop - rows.start
+        ncols = self.shape[1]
+        image_bytes = self.shape[0] * ncols * dtype.itemsize
+        image = np.array(np.memmap(scratch, dtype=dtype, mode='r',
+                                   offset=rows.start * ncols * dtype.itemsize,
+                                   shape=(nrows, ncols)))
+        mask = np.array(np.memmap(scratch, dtype=bool, mode='r',
+                                  offset=image_bytes + rows.start * ncols,
+                                  shape=(nrows, ncols)))
+        return image, mask
+
+    def rows_per_block(self, max_bytes):
+        """
+        The number of rows of the stack, at least 1, whose images and masks
+        fit in `max_bytes`.
+        """
+        row_bytes = sum((dtype.itemsize + 1) * self.shape[1]
+                        for dtype in self._dtypes)
+        return int(max(1, min(self.shape[0], max_bytes // row_bytes)))
+
+    def median(self, nlow=0, nhigh=0, max_bytes=256 * 1024 * 1024):
+        """
+        The median of the stack, computed a block of rows at a time.
+
+        Parameters
+        ----------
+        nlow, nhigh : int
+            The numbers of lowest and highest values of each pixel
+            excluded from its median (see `stsci.image.median`).
+
+        max_bytes : int
+            The memory for a block of rows of the images and masks.
+
+        Returns
+        -------
+        median_image : 2d array
+            The median image, as computed by `stsci.image.median` from all
+            of the images at once.
+        """
+        if not self._files:
+            raise ValueError("No images to combine")
+
+        nrows = self.rows_per_block(max_bytes)
+        log.debug("Median of {} images, {} rows at a time".format(len(self),
+            nrows))
+
+        median_image = np.empty(self.shape, dtype=self._dtypes[0])
+        for start in range(0, self.shape[0], nrows):
+            rows = slice(start, min(start + nrows, self.shape[0]))
+            images, masks = zip(*[self._read_rows(index, rows)
+                                  for index in range(len(self))])
+            median(images, output=median_image[rows], nlow=nlow,
+                nhigh=nhigh, badmasks=masks)
+        return median_image
+
+    def close(self):
+        """Delete the scratch files."""
+        self._dtypes = []
+        for scratch in self._files:
+            scratch.close()
+        self._files = []
@@ -2,6 +2,7 @@ from __future__ import (division, print_function, unicode_literals,
     absolute_import)
 
 
+import itertools
 import time
 import numpy as np
 from collections import OrderedDict
@@ -12,7 +13,9 @@ from astropy.stats import sigma_clipped_stats
 from scipy import ndimage
 
 from .. import datamodels
+from ..lib import parallel
 from ..resample import resample, gwcs_blot
+from . import median_stack
 
 import logging
 log = logging.getLogger(__name__)
@@ -116,27 +119,26 @@ class OutlierDetection(object):
             # Start by creating resampled/mosaic images for each group of exposures
             sdriz = resample.ResampleData(self.input_models, single=True,
                 blendheaders=False, **pars)
-            sdriz.do_drizzle(**pars)
-            drizzled_models = sdriz.output_models
-            for model in drizzled_models:
-                model.meta.filename += ".fits"
-            if save_intermediate_results:
-                log.info("Writing out resampled exposures...")
-                drizzled_models.save()
+            drizzled_models = resampled_outputs(sdriz,
+                save_intermediate_results)
         else:
             drizzled_models = self.input_models
             for i in range(len(self.input_models)):
                 drizzled_models[i].wht = resample.build_driz_weight(self.input_models[i], wht_type='exptime', good_bits=pars['good_bits'])
 
         # Initialize intermediate products used in the outlier detection
-        median_model = datamodels.ImageModel(init=drizzled_models[0].data.shape)
-        median_model.meta = drizzled_models[0].meta
+        drizzled_models = iter(drizzled_models)
+        first_model = next(drizzled_models)
+        median_model = datamodels.ImageModel(init=first_model.data.shape)
+        median_model.meta = first_model.meta
         base_filename = self.input_models[0].meta.filename
         median_model.meta.filename = '_'.join(base_filename.split('_')[:2] +
             ['median.fits'])
 
         # Perform median combination on set of drizzled mosaics
-        median_model.data = create_median(drizzled_models, **pars)
+        median_model.data = create_median(
+            itertools.chain([first_model], drizzled_models), **pars)
+        del first_model, drizzled_models
 
         if save_intermediate_results:
             log.info("Writing out MEDIAN image to: {}".format(median_model.meta.filename))
@@ -144,24 +146,45 @@ class OutlierDetection(object):
 
         if pars['resample_data'] is True:
             # Blot the median image back to recreate each input image specified in
-            # the original input list/ASN/ModelContainer
-            blot_models = blot_median(median_model, self.input_models, **pars)
-            if save_intermediate_results:
-                log.info("Writing out BLOT images...")
-                blot_models.save()
+            # the original input list/ASN/ModelContainer, and perform outlier
+            # detection using statistical comparisons between each original
+            # input image and its blotted version of the median image
+            blot_and_flag(median_model, self.input_models, self.reffiles,
+                max_cores=pars.get('maximum_cores'),
+                save_blots=save_intermediate_results, **self.outlierpars)
         else:
             # Median image will serve as blot image
-            blot_models = datamodels.ModelContainer()
-            for i in range(len(self.input_models)):
-                blot_models.append(median_model)
-
-        # Perform outlier detection using statistical comparisons between
-        # each original input image and its blotted version of the median image
-        detect_outliers(self.input_models, blot_models,
-            self.reffiles, **self.outlierpars)
+            blots = [(median_model.data, None)] * len(self.input_models)
+            detect_outliers(self.input_models, blots,
+                self.reffiles, **self.outlierpars)
 
         # clean-up (just to be explicit about being finished with these results)
-        del median_model, blot_models
+        del median_model
+
+
+def resampled_outputs(sdriz, save_intermediate_results=False):
+    """Generate the singly resampled images, one at a time
+
+    Each image is saved as soon as it is drizzled, if requested.
+    """
+    for model in sdriz.drizzle_outputs():
+        model.meta.filename += ".fits"
+        if save_intermediate_results:
+            log.info("Writing out resampled exposure {}".format(
+                model.meta.filename))
+            model.save(model.meta.filename)
+        yield model
+
+
+def low_weight_mask(wht, maskpt):
+    """Mask the pixels whose weight is below `maskpt` times the mean weight
+    """
+    mean_weight, _, _ = sigma_clipped_stats(wht, sigma=3.0, mask_value=0.)
+    weight_threshold = mean_weight * maskpt
+    # Mask pixels were weight falls below MASKPT percent of the mean weight
+    mask = np.less(wht, weight_threshold)
+    log.debug("Number of pixels with low weight: {}".format(np.sum(mask)))
+    return mask
 
 
 def create_median(resampled_models, **pars):
@@ -171,25 +194,31 @@ def create_median(resampled_models, **pars):
         following ways:
         - type of combination: fixed to 'median'
         - 'minmed' not implemented as an option
-        - does not use buffers to try to minimize memory usage
         - astropy.stats.sigma_clipped_stats replaces stsci.imagestats.ImageStats
         - stsci.image.median replaces stsci.image.numcombine.numCombine
-    """
-    resampled_sci = [i.data for i in resampled_models]
-    resampled_wht = [i.wht for i in resampled_models]
 
+    If the ``median_buffer_mb`` parameter is positive, the resampled
+    images, which may then be generated one at a time, are written to
+    scratch files in ``scratch_dir`` as they come, and the median is
+    computed a block of rows at a time, with that many megabytes of the
+    images in memory (see `median_stack.MedianStack`).  Otherwise, all of
+    the images are combined at once, in memory.  The median is the same.
+    """
     nlow = pars.get('nlow', 0)
     nhigh = pars.get('nhigh', 0)
     maskpt = pars.get('maskpt', 0.7)
+    buffer_mb = pars.get('median_buffer_mb') or 0.
 
-    badmasks = []
-    for w in resampled_wht:
-        mean_weight, _, _ = sigma_clipped_stats(w, sigma=3.0, mask_value=0.)
-        weight_threshold = mean_weight * maskpt
-        # Mask pixels were weight falls below MASKPT percent of the mean weight
-        mask = np.less(w, weight_threshold)
-        log.debug("Number of pixels with low weight: {}".format(np.sum(mask)))
-        badmasks.append(mask)
+    if buffer_mb > 0:
+        with median_stack.MedianStack(pars.get('scratch_dir')) as stack:
+            for model in resampled_models:
+                stack.append(model.data, low_weight_mask(model.wht, maskpt))
+            return stack.median(nlow=nlow, nhigh=nhigh,
+                max_bytes=int(buffer_mb * 1024 * 1024))
+
+    resampled_models = list(resampled_models)
+    resampled_sci = [i.data for i in resampled_models]
+    badmasks = [low_weight_mask(i.wht, maskpt) for i in resampled_models]
 
     # Compute median of stack os images using BADMASKS to remove low weight
     # values
@@ -199,40 +228,150 @@ def create_median(resampled_models, **pars):
     return median_image
 
 
-def blot_median(median_model, input_models, **pars):
-    """Blot resampled median image back to the detector images
+def blot_and_find_cr(blot, model, gain_image, readnoise_image,
+    keep_blot=False, **pars):
+    """Blot the median image back to one detector image and find its outliers
+
+    Only the section of the detector image covered by the median image is
+    blotted (see `gwcs_blot.GWCSBlot.extract_region`) and searched.
+
+    Parameters
+    ----------
+    blot : `gwcs_blot.GWCSBlot`
+        The median image to blot.
+
+    model : ImageModel
+        The detector image; it is not modified.
+
+    gain_image, readnoise_image : GainModel, ReadnoiseModel
+        The reference data of the detector image.
+
+    keep_blot : bool
+        Return the blotted median, e.g. to save it, instead of dropping it
+        once the outliers are found.
+
+    Returns
+    -------
+    blot_data : 2d array or None
+        The blotted median over the section, if kept.
+
+    section : tuple of slices or None
+        The section (y, x) of the detector image covered by the median
+        image, or None if it is not covered.
+
+    outliers : 2d bool array or None
+        The outliers in the section (see `find_cr`).
     """
-    interp = pars.get('interp', 'poly5')
-    sinscl = pars.get('sinscl', 1.0)
+    blot_data, section = blot.extract_region(model,
+        interp=pars.get('interp', 'poly5'), sinscl=pars.get('sinscl', 1.0),
+        pixmap_tolerance=pars.get('pixmap_tolerance', 0.))
+    if blot_data is None:
+        return None, None, None
 
-    # Initialize container for output blot images
-    blot_models = datamodels.ModelContainer()
+    outliers = find_cr(model, blot_data, gain_image, readnoise_image,
+        section=section, **pars)
+    if not keep_blot:
+        blot_data = None
+    return blot_data, section, outliers
 
-    log.info("Blotting median...")
-    blot = gwcs_blot.GWCSBlot(median_model)
 
-    for model in input_models:
-        blotted_median = model.copy()
-        blot_root = '_'.join(model.meta.filename.replace('.fits', '').split('_')[:-1])
-        blotted_median.meta.filename = '{}_blot.fits'.format(blot_root)
+# The median, images and reference data of the worker processes of
+# `blot_and_flag`, set by `_init_blot_worker`
+_blot_worker = {}
+
+
+def _init_blot_worker(median_model, input_models, reffiles, pars):
+    _blot_worker['blot'] = gwcs_blot.GWCSBlot(median_model)
+    _blot_worker['input_models'] = input_models
+    _blot_worker['reffiles'] = reffiles
+    _blot_worker['pars'] = pars
+
+
+def _blot_and_find_cr_task(index):
+    reffiles = _blot_worker['reffiles']
+    return blot_and_find_cr(_blot_worker['blot'],
+        _blot_worker['input_models'][index], reffiles['gain'][index],
+        reffiles['readnoise'][index], **_blot_worker['pars'])
+
+
+def blot_and_flag(median_model, input_models, reffiles, max_cores=None,
+    save_blots=False, **pars):
+    """Blot the median image back to each detector image and flag outliers
+
+    The detector images are done one at a time: the median is blotted back
+    to the image, its outliers flagged in its DQ array, and the blot saved
+    if requested and dropped, before the next image, so that the blotted
+    images of the whole association are never held at once.
+
+    Parameters
+    ----------
+    median_model : ImageModel
+        The median of the resampled images.
 
-        # clean out extra data not related to blot result
-        blotted_median.err = None
-        blotted_median.dq = None
-        # apply blot to re-create model.data from median image
-        blotted_median.data = blot.extract_image(model, interp=interp,
-            sinscl=sinscl)
-        blot_models.append(blotted_median)
+    input_models : ModelContainer
+        The detector images, whose DQ arrays are modified in place.
 
-    return blot_models
+    reffiles : dict
+        Contains JWST ModelContainers for 'gain' and 'readnoise' reference files
 
+    max_cores : str or int, optional
+        The number of worker processes blotting the median and finding the
+        outliers (see `jwst.lib.parallel.number_of_processes`); the DQ
+        arrays are updated, and the blots saved, in this process, in the
+        order of the images.
 
-def detect_outliers(input_models, blot_models, reffiles, **pars):
+    save_blots : bool
+        Write each blotted median to a file (see `save_blot`).
+    """
+    log.info("Blotting median...")
+    pars = dict(pars, keep_blot=save_blots)
+    nproc = min(parallel.number_of_processes(max_cores), len(input_models))
+    if nproc > 1:
+        log.info("Flagging outliers in {} images on {} processes".format(
+            len(input_models), nproc))
+
+    results = parallel.imap_ordered(_blot_and_find_cr_task,
+        range(len(input_models)), nproc, initializer=_init_blot_worker,
+        initargs=(median_model, input_models, reffiles, pars))
+    try:
+        for model, (blot_data, section, outliers) in zip(input_models,
+            results):
+            if outliers is None:
+                log.info("Median image does not cover {}".format(
+                    model.meta.filename))
+                continue
+            apply_cr(model, outliers, section)
+            if save_blots:
+                filename = save_blot(model, blot_data, section)
+                log.info("Wrote blotted median {}".format(filename))
+    finally:
+        _blot_worker.clear()
+
+
+def save_blot(model, blot_data, section):
+    """Write the blotted median of an input model to a file
+
+    The file, named after the input model with the suffix ``_blot``, holds
+    the full detector image, zero outside of the blotted section.
+    """
+    blotted_median = datamodels.ImageModel(data=np.zeros(model.data.shape,
+        dtype=np.float32))
+    blotted_median.update(model)
+    blotted_median.meta.wcs = model.meta.wcs
+    if blot_data is not None:
+        blotted_median.data[section] = blot_data
+    blot_root = '_'.join(model.meta.filename.replace('.fits', '').split('_')[:-1])
+    blotted_median.meta.filename = '{}_blot.fits'.format(blot_root)
+    blotted_median.save(blotted_median.meta.filename)
+    return blotted_median.meta.filename
+
+
+def detect_outliers(input_models, blots, reffiles, **pars):
     """
     Flags DQ array for cosmic rays in input images.
 
     The science frame in each ImageModel in input_models is compared to
-    the corresponding blotted median image in blot_models.  The result is
+    the corresponding blotted median image in blots.  The result is
     an updated DQ array in each ImageModel in input_models.
 
     Parameters
@@ -240,9 +379,10 @@ def detect_outliers(input_models, blot_models, reffiles, **pars):
     input_models: JWST ModelContainer object
         data model container holding science ImageModels, modified in place
 
-    blot_models : JWST ModelContainer object
-        data model container holding ImageModels of the median output frame
-        blotted back to the wcs and frame of the ImageModels in input_models
+    blots : list of tuples
+        the median output frame blotted back to the wcs and frame of each
+        ImageModel in input_models, and the section of that frame it covers
+        (None for the whole frame)
 
     reffiles : dict
         Contains JWST ModelContainers for 'gain' and 'readnoise' reference files
@@ -256,25 +396,76 @@ def detect_outliers(input_models, blot_models, reffiles, **pars):
     gain_models = reffiles['gain']
     rn_models = reffiles['readnoise']
 
-    for image, blot, gain, rn in zip(input_models, blot_models, gain_models,
-        rn_models):
-        flag_cr(image, blot, gain, rn, **pars)
+    for image, (blot_data, section), gain, rn in zip(input_models, blots,
+        gain_models, rn_models):
+        if blot_data is None:
+            log.info("Median image does not cover {}".format(
+                image.meta.filename))
+            continue
+        flag_cr(image, blot_data, gain, rn, section=section, **pars)
 
 
-def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
+def flag_cr(sci_image, blot_data, gain_image, readnoise_image, section=None,
+    **pars):
     """
     Masks outliers in science image
 
     Mask blemishes in dithered data by comparing a science image
     with a model image and the derivative of the model image.
 
+    The DQ array of the science image is updated in place, with the
+    outliers found by `find_cr`, which has the same parameters.
+    """
+    outliers = find_cr(sci_image, blot_data, gain_image, readnoise_image,
+        section=section, **pars)
+    apply_cr(sci_image, outliers, section)
+
+
+def apply_cr(sci_image, outliers, section=None):
+    """
+    Flag outliers in the DQ array of a science image, in place
+
     Parameters
     ----------
     sci_image : ImageModel
         the science data
 
-    blot_image : ImageModel
-        the blotted median image of the dithered science frames
+    outliers : 2d bool array
+        the outliers, over `section` of the science image
+
+    section : tuple of slices, optional
+        the section (y, x) of the science image covered by `outliers`.
+        By default, the whole image.
+    """
+    if section is None:
+        section = (slice(None), slice(None))
+
+    dq = sci_image.dq[section]
+    count_sci = np.count_nonzero(dq)
+    count_cr = np.count_nonzero(outliers)
+    log.debug("Pixels in input DQ: {}".format(count_sci))
+    log.debug("Pixels in cr_mask:  {}".format(count_cr))
+
+    # Update the DQ array in the input image in place
+    np.bitwise_or(dq, outliers * CRBIT, dq)
+
+
+def find_cr(sci_image, blot_data, gain_image, readnoise_image, section=None,
+    **pars):
+    """
+    Find the outliers in a science image
+
+    Outliers are found by comparing a science image with a model image and
+    the derivative of the model image.
+
+    Parameters
+    ----------
+    sci_image : ImageModel
+        the science data
+
+    blot_data : 2d array
+        the blotted median image of the dithered science frames, over
+        `section` of the science image
 
     gain_image : GainModel
         the 2-D gain array
@@ -282,6 +473,11 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
     readnoise_image : ReadnoiseModel
         the 2-D read noise array
 
+    section : tuple of slices, optional
+        the section (y, x) of the science image covered by `blot_data`;
+        only that section is compared and flagged.  By default, the
+        whole image.
+
     pars : dict
         the user parameters for Outlier Detection
 
@@ -292,6 +488,11 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
     snr      = "5.0 4.0"       # Signal-to-noise ratio
     scale    = "1.2 0.7"       # scaling factor applied to the derivative
     backg    = 0               # Background value
+
+    Returns
+    -------
+    outliers : 2d bool array
+        the outliers (True) over `section` of the science image
     """
 
     grow = pars.get('grow', 1)
@@ -310,8 +511,11 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
 
     exptime = sci_image.meta.exposure.exposure_time
 
-    sci_data = sci_image.data * exptime
-    blot_data = blot_image.data * exptime
+    if section is None:
+        section = (slice(None), slice(None))
+
+    sci_data = sci_image.data[section] * exptime
+    blot_data = blot_data * exptime
     blot_deriv = abs_deriv(blot_data)
 
     # This mask can take into account any crbits values
@@ -323,11 +527,11 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
     # modes such as CORONOGRAPHIC data
     # logic copied from jwst.jump step...
     # Get subarray limits from metadata of input model
-    xstart = blot_image.meta.subarray.xstart
-    xsize  = blot_image.data.shape[1]
+    xstart = sci_image.meta.subarray.xstart
+    xsize  = sci_image.data.shape[1]
     xstop  = xstart + xsize - 1
-    ystart = blot_image.meta.subarray.ystart
-    ysize  = blot_image.data.shape[0]
+    ystart = sci_image.meta.subarray.ystart
+    ysize  = sci_image.data.shape[0]
     ystop  = ystart + ysize - 1
     if (readnoise_image.meta.subarray.xstart==xstart and
         readnoise_image.meta.subarray.xsize==xsize   and
@@ -342,13 +546,15 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
         log.debug('Extracting readnoise and gain subarrays to match science data')
         rn = readnoise_image.data[ystart-1:ystop,xstart-1:xstop]
         gain = gain_image.data[ystart-1:ystop,xstart-1:xstop]
+    rn = rn[section]
+    gain = gain[section]
         
     # TODO: for JWST, the actual readnoise at a given pixel depends on the
     # number of reads going into that pixel.  So we need to account for that
     # using the meta.exposure.nints, ngroups and nframes keywords.
 
     # Define output cosmic ray mask to populate
-    cr_mask = np.zeros(sci_image.shape, dtype=np.uint8)
+    cr_mask = np.zeros(sci_data.shape, dtype=np.uint8)
 
     ##################   COMPUTATION PART I    ###################
     # Model the noise and create a CR mask
@@ -416,13 +622,7 @@ def flag_cr(sci_image, blot_image, gain_image, readnoise_image, **pars):
     np.logical_and(where_cr_ctegrow_kernel_conv, where_cr_grow_kernel_conv, cr_mask)
     cr_mask = cr_mask.astype(bool)
 
-    count_sci = np.count_nonzero(sci_image.dq)
-    count_cr = np.count_nonzero(cr_mask)
-    log.debug("Pixels in input DQ: {}".format(count_sci))
-    log.debug("Pixels in cr_mask:  {}".format(count_cr))
-
-    # Update the DQ array in the input image in place
-    np.bitwise_or(sci_image.dq, np.invert(cr_mask) * CRBIT, sci_image.dq)
+    return np.invert(cr_mask)
 
 
 def build_mask(dqarr, bitvalue):
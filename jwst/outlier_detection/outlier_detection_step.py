@@ -3,6 +3,7 @@ from __future__ import (division, print_function, unicode_literals,
 
 from ..stpipe import Step, cmdline
 from .. import datamodels
+from ..resample import pixmap_cache
 from . import outlier_detection
 
 
@@ -34,6 +35,11 @@ class OutlierDetectionStep(Step):
         save_intermediate_results = boolean(default=False)
         resample_data = boolean(default=True)
         good_bits = integer(default=4)
+        pixmap_tolerance = float(default=0.) # Error (pixels) of the interpolated pixel maps; 0 for exact maps
+        pixmap_cache_mb = float(default=0) # Size (MB) of the cache of pixel maps, shared with resample; 0 for no cache
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of processes to use to drizzle the images and flag their outliers
+        median_buffer_mb = float(default=0) # Memory (MB) for the median of the resampled images, kept in scratch files; 0 to combine them in memory
+        scratch_dir = string(default=None) # Directory of the scratch files; the system temporary directory if None
     """
     reference_file_types = ['gain', 'readnoise']
 
@@ -68,9 +74,15 @@ class OutlierDetectionStep(Step):
                 'backg': self.backg,
                 'save_intermediate_results': self.save_intermediate_results,
                 'resample_data': self.resample_data,
-                'good_bits': self.good_bits
+                'good_bits': self.good_bits,
+                'pixmap_tolerance': self.pixmap_tolerance,
+                'maximum_cores': self.maximum_cores,
+                'median_buffer_mb': self.median_buffer_mb,
+                'scratch_dir': self.scratch_dir
                 }
 
+            pixmap_cache.set_max_bytes(int(self.pixmap_cache_mb * 1024 * 1024))
+
             # Set up outlier detection, then do detection
             step = outlier_detection.OutlierDetection(self.input_models,
                 reffiles=reffiles, **pars)
@@ -0,0 +1,78 @@
+"""Test blotting the median and flagging outliers one image at a time"""
+import os
+
+import numpy as np
+import pytest
+
+from astropy.modeling.models import AffineTransformation2D
+from gwcs import WCS
+
+from ... import datamodels
+from ...resample import gwcs_blot
+from ..outlier_detection import blot_and_flag, CRBIT
+
+MOSAIC_SHAPE = (120, 150)
+SHAPE = (40, 50)
+OFFSETS = [(10., 20.), (60., 45.), (95., 70.)]
+
+
+def make_wcs(offset):
+    affine = AffineTransformation2D(translation=offset)
+    return WCS(forward_transform=affine, output_frame='world')
+
+
+def make_median():
+    y, x = np.indices(MOSAIC_SHAPE)
+    median = datamodels.ImageModel(
+        data=(100. + 10. * np.sin(x / 7.) * np.cos(y / 11.)).astype(np.float32))
+    median.meta.wcs = make_wcs((0., 0.))
+    median.meta.wcsinfo.cdelt1 = 1.
+    return median
+
+
+def make_inputs(median):
+    blot = gwcs_blot.GWCSBlot(median)
+    images = datamodels.ModelContainer()
+    gains = datamodels.ModelContainer()
+    readnoises = datamodels.ModelContainer()
+    for i, offset in enumerate(OFFSETS):
+        image = datamodels.ImageModel(SHAPE)
+        image.meta.filename = 'image{}_cal.fits'.format(i)
+        image.meta.wcs = make_wcs(offset)
+        image.meta.wcsinfo.cdelt1 = 1.
+        image.meta.exposure.exposure_time = 1.
+        image.meta.subarray.xstart = 1
+        image.meta.subarray.ystart = 1
+        image.data = blot.extract_image(image)
+        image.data[5 + i, 7 + 2 * i] += 1000.
+        images.append(image)
+        for container, model_class, value in [
+                (gains, datamodels.GainModel, 1.),
+                (readnoises, datamodels.ReadnoiseModel, 5.)]:
+            ref = model_class(data=np.full(SHAPE, value, dtype=np.float32))
+            ref.meta.subarray.xstart = 1
+            ref.meta.subarray.ystart = 1
+            ref.meta.subarray.xsize = SHAPE[1]
+            ref.meta.subarray.ysize = SHAPE[0]
+            container.append(ref)
+    return images, {'gain': gains, 'readnoise': readnoises}
+
+
+@pytest.mark.parametrize('max_cores', [None, 2])
+def test_blot_and_flag(tmpdir, max_cores):
+    median = make_median()
+    images, reffiles = make_inputs(median)
+
+    cwd = os.getcwd()
+    tmpdir.chdir()
+    try:
+        blot_and_flag(median, images, reffiles, max_cores=max_cores,
+                      save_blots=True, grow=1, snr='4.0 3.0',
+                      scale='0.5 0.4', backg=0.)
+    finally:
+        os.chdir(cwd)
+
+    for i, image in enumerate(images):
+        flagged = np.argwhere(image.dq & CRBIT)
+        assert flagged.tolist() == [[5 + i, 7 + 2 * i]]
+        assert tmpdir.join('image{}_blot.fits'.format(i)).check()
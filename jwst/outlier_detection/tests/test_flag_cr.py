@@ -0,0 +1,45 @@
+"""Test flagging outliers against a blotted median over part of an image"""
+import numpy as np
+
+from ... import datamodels
+from ..outlier_detection import flag_cr, CRBIT
+
+SHAPE = (64, 70)
+PARS = {'grow': 1, 'snr': '4.0 3.0', 'scale': '0.5 0.4', 'backg': 0.}
+
+
+def make_science():
+    image = datamodels.ImageModel(data=np.full(SHAPE, 10., dtype=np.float32))
+    image.meta.exposure.exposure_time = 10.
+    image.meta.subarray.xstart = 1
+    image.meta.subarray.ystart = 1
+    image.data[10, 10] += 500.
+    image.data[40, 50] += 800.
+    return image
+
+
+def make_reference(model_class, value):
+    model = model_class(data=np.full(SHAPE, value, dtype=np.float32))
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.xsize = SHAPE[1]
+    model.meta.subarray.ysize = SHAPE[0]
+    return model
+
+
+def test_flag_cr_section():
+    gain = make_reference(datamodels.GainModel, 1.)
+    readnoise = make_reference(datamodels.ReadnoiseModel, 5.)
+    blot = np.full(SHAPE, 10., dtype=np.float32)
+
+    full = make_science()
+    flag_cr(full, blot, gain, readnoise, **PARS)
+    flagged = np.argwhere(full.dq & CRBIT)
+    assert flagged.tolist() == [[10, 10], [40, 50]]
+
+    # Only the section covered by the blot is flagged
+    section = (slice(20, 60), slice(30, 70))
+    part = make_science()
+    flag_cr(part, blot[section], gain, readnoise, section=section, **PARS)
+    flagged = np.argwhere(part.dq & CRBIT)
+    assert flagged.tolist() == [[40, 50]]
@@ -0,0 +1,50 @@
+"""Test the median of the resampled images, in memory and in blocks"""
+import numpy as np
+import pytest
+
+from ... import datamodels
+from .. import median_stack
+from ..outlier_detection import create_median
+
+SHAPE = (53, 40)
+
+
+def make_resampled(nmodels, seed=1):
+    rng = np.random.RandomState(seed)
+    models = []
+    for i in range(nmodels):
+        data = rng.normal(5., 1., SHAPE).astype(np.float32)
+        wht = rng.uniform(0.5, 1., SHAPE).astype(np.float32)
+        # Some low weight pixels, masked from the median
+        wht[rng.uniform(size=SHAPE) < 0.1] = 0.
+        models.append(datamodels.DrizProductModel(data=data, wht=wht))
+    return models
+
+
+@pytest.mark.parametrize('nlow, nhigh', [(0, 0), (1, 1)])
+def test_buffered_median(tmpdir, nlow, nhigh):
+    models = make_resampled(5)
+    expected = create_median(models, nlow=nlow, nhigh=nhigh, maskpt=0.7)
+
+    # A budget of a few rows at a time, from a generator of the images
+    buffered = create_median((model for model in models), nlow=nlow,
+                             nhigh=nhigh, maskpt=0.7,
+                             median_buffer_mb=7. * 5 * 5 * SHAPE[1] / 2 ** 20,
+                             scratch_dir=str(tmpdir))
+    assert np.array_equal(buffered, expected)
+    # The scratch files are gone
+    assert tmpdir.listdir() == []
+
+
+def test_median_stack_blocks(tmpdir):
+    with median_stack.MedianStack(str(tmpdir)) as stack:
+        for model in make_resampled(3):
+            stack.append(model.data, model.wht == 0)
+        assert len(stack) == 3
+        assert stack.rows_per_block(0) == 1
+        assert stack.rows_per_block(3 * 5 * SHAPE[1] * 10) == 10
+        assert stack.rows_per_block(10 ** 9) == SHAPE[0]
+
+        with pytest.raises(ValueError):
+            stack.append(np.zeros((2, 2), dtype=np.float32),
+                         np.zeros((2, 2), dtype=bool))
@@ -3,6 +3,7 @@ from __future__ import (absolute_import, unicode_literals, division,
 #
 #  Module for correcting for persistence
 
+from collections import namedtuple
 import math
 import numpy as np
 import logging
@@ -16,6 +17,20 @@ log.setLevel(logging.DEBUG)
 # from traps, compared with photon-generated charges.
 SCALEFACTOR = 2.
 
+# Factors of the charge capture model that depend only on the trap
+# parameters and the timing of the exposure, one row per trap family:
+#   ramp: (nfamilies, ngroups + 1), the capture during the linear portion
+#       of the ramp, by number of saturated groups, without the trap
+#       density and slope terms
+#   saturation: (nfamilies, ngroups + 1), the fraction of the empty traps
+#       filled while saturated, by number of saturated groups
+#   cr: (nfamilies, ngroups), the capture after a cosmic-ray jump, by
+#       group of the jump, without the trap density and jump terms
+CaptureFactors = namedtuple("CaptureFactors", ["ramp", "saturation", "cr"])
+
+# CaptureFactors, by trap parameters and exposure timing
+_capture_factors = {}
+
 def no_NaN(input_model, fill_value,
            zap_nan=False, zap_zero=False):
     """Replace NaNs and/or zeros with a fill value."""
@@ -110,7 +125,7 @@ class DataSet():
         self.nresets = 0
 
 
-    def do_all(self):
+    def do_all(self, family_loop=False):
         """
         Short Summary
         -------------
@@ -118,6 +133,11 @@ class DataSet():
 
         Parameters
         ----------
+        family_loop: bool
+            If True, compute the decays and captures one trap family at a
+            time (the original implementation).  Otherwise all the trap
+            families are computed at once, with the exponential factors of
+            the capture model tabulated by number of saturated groups.
 
         Returns
         -------
@@ -261,6 +281,11 @@ class DataSet():
         # start of an integration to the current group (in the loop below).
         decayed = np.zeros((nfamilies, det_ny, det_nx), dtype=np.float64)
 
+        # Fraction of the filled traps of each family decaying in a group.
+        decay_param = np.asarray(par[3], dtype=np.float64)
+        group_decay = decay_factors(decay_param, t_group,
+                                    self.traps_filled.data.dtype)
+
         # self.traps_filled will be updated with each integration, to
         # account for charge capture and decay of traps.
         filled = -1                             # just to ensure that it exists
@@ -272,53 +297,64 @@ class DataSet():
             # The slope is needed for computing charge captures.
             (grp_slope, slope) = self.compute_slope(integ)
             for group in range(ngroups):
-                persistence[:, :] = 0.          # initialize
-                for k in range(nfamilies):
-                    decay_param_k = self.get_decay_param(par, k)
-                    # Compute and subtract the decays during the reset.
-                    # Decays during the reset at the beginning of the
-                    # first integration have already been accounted for.
-                    if integ > 0 and group == 0 and self.nresets > 0:
-                        reset_time = self.tframe * self.nresets
-                        decay_during_reset = \
+                if family_loop:
+                    persistence[:, :] = 0.          # initialize
+                    for k in range(nfamilies):
+                        decay_param_k = self.get_decay_param(par, k)
+                        # Compute and subtract the decays during the reset.
+                        # Decays during the reset at the beginning of
+                        # the first integration have already been
+                        # accounted for.
+                        if integ > 0 and group == 0 and self.nresets > 0:
+                            reset_time = self.tframe * self.nresets
+                            decay_during_reset = \
+                                self.compute_decay(self.traps_filled.data[k],
+                                                   decay_param_k, reset_time)
+                            self.traps_filled.data[k, :, :] -= \
+                                decay_during_reset
+                        # Decays during current group, for current family.
+                        decayed_in_group = \
                             self.compute_decay(self.traps_filled.data[k],
-                                               decay_param_k, reset_time)
-                        self.traps_filled.data[k, :, :] -= decay_during_reset
-                    # Decays during current group, for current trap family.
-                    decayed_in_group = \
-                        self.compute_decay(self.traps_filled.data[k],
-                                           decay_param_k, t_group)
-                    # Cumulative decay to the end of the current group.
-                    decayed[k, :, :] += decayed_in_group
-                    self.traps_filled.data[k, :, :] -= decayed_in_group
-                    if is_subarray:
-                        persistence += decayed[k, save_slice[0], save_slice[1]]
-                    else:
-                        persistence += decayed[k, :, :]
-                    del decayed_in_group
-
-                # Persistence was computed in DN.
-                self.output_obj.data[integ, group, :, :] -= persistence
-                if self.save_persistence:
-                    self.output_pers.data[integ, group, :, :] = \
-                        persistence.copy()
-                if persistence.max() >= self.flag_pers_cutoff:
-                    mask = (persistence >= self.flag_pers_cutoff)
-                    self.output_obj.pixeldq[mask] |= dqflags.pixel['DO_NOT_USE']
+                                               decay_param_k, t_group)
+                        # Cumulative decay to the end of the current group.
+                        decayed[k, :, :] += decayed_in_group
+                        self.traps_filled.data[k, :, :] -= decayed_in_group
+                        if is_subarray:
+                            persistence += decayed[k, save_slice[0],
+                                                   save_slice[1]]
+                        else:
+                            persistence += decayed[k, :, :]
+                        del decayed_in_group
+                else:
+                    persistence[:, :] = self.decay_families(
+                                decayed, decay_param, group_decay,
+                                integ, group, save_slice, is_subarray)
+
+                self.subtract_persistence(persistence, integ, group)
 
             # Update traps_filled with the number of traps that captured
             # a charge during the current integration.
-            for k in range(nfamilies):
-                capture_param_k = self.get_capture_param(par, k)
-                # This may be a subarray.
-                filled = self.predict_capture(capture_param_k,
-                                              self.trap_density.data,
-                                              integ, grp_slope, slope)
+            if family_loop:
+                for k in range(nfamilies):
+                    capture_param_k = self.get_capture_param(par, k)
+                    # This may be a subarray.
+                    filled = self.predict_capture(capture_param_k,
+                                                  self.trap_density.data,
+                                                  integ, grp_slope, slope)
+                    if is_subarray:
+                        self.traps_filled.data[k, save_slice[0],
+                                                  save_slice[1]] += filled
+                    else:
+                        self.traps_filled.data[k, :, :] += filled
+            else:
+                filled = self.predict_capture_families(
+                                par, self.trap_density.data,
+                                integ, grp_slope, slope)
                 if is_subarray:
-                    self.traps_filled.data[k, save_slice[0],
+                    self.traps_filled.data[:, save_slice[0],
                                               save_slice[1]] += filled
                 else:
-                    self.traps_filled.data[k, :, :] += filled
+                    self.traps_filled.data += filled
 
         del filled
 
@@ -337,6 +373,88 @@ class DataSet():
         return (self.output_obj, self.traps_filled, self.output_pers, skipped)
 
 
+    def subtract_persistence(self, persistence, integ, group):
+        """Subtract the persistence from a group, and flag large values.
+
+        Parameters
+        ----------
+        persistence: 2-D ndarray
+            The persistence (DN) at the end of the group.
+
+        integ: int
+            Integration number.
+
+        group: int
+            Group number.
+        """
+
+        # Persistence was computed in DN.
+        self.output_obj.data[integ, group, :, :] -= persistence
+        if self.save_persistence:
+            self.output_pers.data[integ, group, :, :] = \
+                persistence.copy()
+        if persistence.max() >= self.flag_pers_cutoff:
+            mask = (persistence >= self.flag_pers_cutoff)
+            self.output_obj.pixeldq[mask] |= dqflags.pixel['DO_NOT_USE']
+
+
+    def decay_families(self, decayed, decay_param, group_decay,
+                       integ, group, save_slice, is_subarray):
+        """Compute the trap decays of all the trap families in a group.
+
+        self.traps_filled is updated in-place.
+
+        Parameters
+        ----------
+        decayed: 3-D ndarray
+            The cumulative decays since the start of the integration, one
+            full-frame plane for each trap family; this is updated
+            in-place.
+
+        decay_param: 1-D ndarray
+            The decay parameter of each trap family.
+
+        group_decay: 3-D ndarray
+            The fraction of the filled traps decaying in one group, for
+            each trap family (see `decay_factors`).
+
+        integ, group: int
+            Integration and group numbers.
+
+        save_slice: tuple of two slice objects
+            The Y and X slices of the science data in a full-frame image.
+
+        is_subarray: bool
+            True if the science data are a subarray.
+
+        Returns
+        -------
+        2-D ndarray
+            The persistence (DN) at the end of the group, the decays of
+            all the trap families since the start of the integration.
+        """
+
+        traps_filled = self.traps_filled.data
+        # Compute and subtract the decays during the reset.
+        # Decays during the reset at the beginning of the
+        # first integration have already been accounted for.
+        if integ > 0 and group == 0 and self.nresets > 0:
+            reset_time = self.tframe * self.nresets
+            traps_filled -= traps_filled * \
+                decay_factors(decay_param, reset_time, traps_filled.dtype)
+        # Decays during current group.
+        decayed_in_group = traps_filled * group_decay
+        # Cumulative decay to the end of the current group.
+        decayed += decayed_in_group
+        traps_filled -= decayed_in_group
+        del decayed_in_group
+
+        if is_subarray:
+            return decayed[:, save_slice[0], save_slice[1]].sum(axis=0)
+        else:
+            return decayed.sum(axis=0)
+
+
     def get_slice(self, ref, sci):
         """Find the 2-D slice for a reference file.
 
@@ -653,6 +771,130 @@ class DataSet():
                 self.nresets = 1
 
 
+    def predict_capture_families(self, par, trap_density, integ,
+                                 grp_slope, slope):
+        """Compute the number of traps filled, for all the trap families.
+
+        This gives the same result as `predict_capture` for each family,
+        but the factors that depend only on the timing are tabulated once
+        (see `capture_factors`), and the saturated groups and cosmic-ray
+        jumps are found once for all the families.
+
+        Parameters
+        ----------
+        par: tuple of ndarray
+            The columns of the traps reference table, one row for each
+            trap family.
+
+        trap_density: 2-D ndarray
+            Image of the total number of traps per pixel.
+
+        integ: int
+            Integration number.
+
+        grp_slope: 2-D ndarray
+            The slope of the ramp at each pixel, in units of counts (DN)
+            per group.
+
+        slope: 2-D ndarray
+            The slope of the ramp at each pixel, in units of
+            (fraction of the persistence saturation limit) per second.
+
+        Returns
+        -------
+        3-D ndarray
+            The computed traps_filled at the end of the integration, one
+            plane for each trap family.
+        """
+
+        data = self.output_obj.data[integ, :, :, :]
+        ngroups = self.ngroups
+        factors = capture_factors(par, self.tframe, self.tgroup,
+                                  ngroups, self.nresets)
+        (par0, par2) = (np.asarray(par[0], dtype=np.float64),
+                        np.asarray(par[2], dtype=np.float64))
+
+        # Number of groups exceeding the persistence saturation limit.
+        sat_count = (data > self.persistencesat.data).sum(axis=0,
+                                                          dtype=np.intp)
+
+        # Traps that were filled due to the linear portion of the ramp.
+        filled = trap_density * slope**2 * factors.ramp[:, sat_count]
+
+        # Traps that were filled due to the saturated portion of the ramp.
+        # For each pixel that had no ramp before saturation, fill all the
+        # instantaneous traps.
+        flag = (sat_count == ngroups)
+        filled[:, flag] = par2[:, np.newaxis] * trap_density[flag]
+        # Empty traps, of those possible to fill exponentially.
+        empty_traps = trap_density * par0[:, np.newaxis, np.newaxis] - \
+            (filled - trap_density * par2[:, np.newaxis, np.newaxis])
+        filled += empty_traps * factors.saturation[:, sat_count]
+        del empty_traps
+
+        # Traps that were filled due to cosmic-ray jumps.
+        filled += self.cr_capture_families(factors.cr, trap_density,
+                                           integ, grp_slope)
+
+        return filled
+
+
+    def cr_capture_families(self, cr_factors, trap_density, integ,
+                            grp_slope):
+        """Compute number of traps filled due to cosmic-ray jumps, for all
+        the trap families.
+
+        See `delta_fcn_capture`.
+
+        Parameters
+        ----------
+        cr_factors: 2-D ndarray
+            The capture factor for a jump in each group, for each trap
+            family (see `capture_factors`).
+
+        trap_density: 2-D ndarray
+            Image of the total number of traps per pixel.
+
+        integ: int
+            Integration number.
+
+        grp_slope: 2-D ndarray
+            The slope of the ramp at each pixel, in units of counts (DN)
+            per group.
+
+        Returns
+        -------
+        3-D ndarray
+            The computed cr_filled at the end of the integration, one
+            plane for each trap family.
+        """
+
+        data = self.output_obj.data[integ, :, :, :]
+        gdq = self.output_obj.groupdq[integ, :, :, :]
+        nfamilies = cr_factors.shape[0]
+        (ny, nx) = trap_density.shape
+        cr_filled = np.zeros((nfamilies, ny, nx), dtype=np.float64)
+
+        # If there's a CR hit in the first group, we can't determine its
+        # amplitude, so skip the first group.
+        (z, y, x) = np.nonzero(np.bitwise_and(gdq[1:, :, :],
+                                              dqflags.group['JUMP_DET']))
+        if len(z) == 0:
+            return cr_filled
+        z += 1
+        jump = (data[z, y, x] - data[z - 1, y, x]) - grp_slope[y, x]
+        jump = np.where(jump < 0., 0., jump)
+        jump = trap_density[y, x] * jump
+        # A pixel may have jumps in several groups.
+        pixel = y * nx + x
+        for k in range(nfamilies):
+            cr_filled[k] = np.bincount(pixel, weights=jump * cr_factors[k, z],
+                                       minlength=ny * nx).reshape((ny, nx))
+
+        cr_filled *= SCALEFACTOR
+        return cr_filled
+
+
     def predict_capture(self, capture_param_k, trap_density, integ,
                         grp_slope, slope):
         """Compute the number of traps that will be filled in time dt.
@@ -958,3 +1200,107 @@ class DataSet():
             decayed = traps_filled * (1. - math.exp(-delta_t / tau))
 
         return decayed
+
+
+def decay_factors(decay_param, delta_t, dtype=np.float64):
+    """Fraction of the filled traps decaying in time delta_t.
+
+    This is the factor applied by `DataSet.compute_decay`, for all the trap
+    families.
+
+    Parameters
+    ----------
+    decay_param: 1-D ndarray
+        The decay parameter of each trap family.
+
+    delta_t: float
+        The time interval (unit = second).
+
+    dtype: data type
+        The data type of the result, that of the traps_filled array.
+
+    Returns
+    -------
+    3-D ndarray
+        The fraction of each family, shape (nfamilies, 1, 1) to be
+        broadcast with the traps_filled array.
+    """
+
+    decay_param = np.asarray(decay_param, dtype=np.float64)
+    factors = np.zeros(decay_param.shape, dtype=np.float64)
+    nonzero = (decay_param != 0.)
+    tau = 1. / np.abs(decay_param[nonzero])
+    factors[nonzero] = 1. - np.exp(-delta_t / tau)
+    return factors.astype(dtype)[:, np.newaxis, np.newaxis]
+
+
+def capture_factors(par, t_frame, t_group, ngroups, nresets):
+    """Tabulate the factors of the charge capture model.
+
+    The capture of `DataSet.predict_capture` depends on the time of each
+    pixel below saturation, which can only take ngroups + 1 values, and
+    on the group of each cosmic-ray jump.  The exponentials of the model
+    are thus computed once for each number of saturated groups and each
+    group, instead of once per pixel and per trap family.  The factors
+    are cached, by trap parameters and exposure timing.
+
+    Parameters
+    ----------
+    par: tuple of ndarray
+        The columns of the traps reference table (capture0, capture1,
+        capture2, decay_param), one row for each trap family.
+
+    t_frame: float
+        The frame time, seconds.
+
+    t_group: float
+        The group time, seconds.
+
+    ngroups: int
+        The number of groups in an integration.
+
+    nresets: int
+        The number of resets at the start of the integration.
+
+    Returns
+    -------
+    CaptureFactors
+        The tabulated factors.
+    """
+
+    (par0, par1, par2) = [np.asarray(p, dtype=np.float64) for p in par[0:3]]
+    key = (tuple(par0), tuple(par1), tuple(par2),
+           t_frame, t_group, ngroups, nresets)
+    if key in _capture_factors:
+        return _capture_factors[key]
+
+    if np.any(par1 == 0.):
+        log.error("Capture parameter is zero for %d trap families",
+                  (par1 == 0.).sum())
+    # arbitrary "big" number where the capture parameter is zero
+    tau = np.where(par1 == 0., 1.e10,
+                   1. / np.where(par1 == 0., 1., np.abs(par1)))
+    (par0, par1, par2, tau) = [p[:, np.newaxis]
+                               for p in (par0, par1, par2, tau)]
+
+    # Time below saturation and time saturated, by number of saturated
+    # groups.  nresets (usually equal to 1) adds an extra frame of soak.
+    totaltime = ngroups * t_group + nresets * t_frame
+    sattime = np.arange(ngroups + 1, dtype=np.float64) * t_group
+    dt = totaltime - sattime
+
+    ramp = (dt**2 * (par0 + par2) / 2.
+            + par0 * (dt * tau + tau**2) * np.exp(-dt / tau)
+            - par0 * tau**2) * SCALEFACTOR
+
+    saturation = 1. - np.exp(-np.abs(par1) * sattime)
+
+    # Time from a jump (in the middle of a group) to the end of the
+    # integration; there is no capture for a jump in the first group.
+    delta_t = (ngroups - np.arange(ngroups, dtype=np.float64) - 0.5) * t_group
+    cr = par0 * (1. - np.exp(par1 * delta_t)) + par2
+    cr[:, 0] = 0.
+
+    factors = CaptureFactors(ramp=ramp, saturation=saturation, cr=cr)
+    _capture_factors[key] = factors
+    return factors
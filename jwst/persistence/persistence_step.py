@@ -3,6 +3,7 @@
 from ..stpipe import Step, cmdline
 from .. import datamodels
 from . import persistence
+from . import trap_state
 
 class PersistenceStep(Step):
     """
@@ -18,9 +19,14 @@ class PersistenceStep(Step):
         # if `save_persistence` is True, the persistence that was
         # subtracted (group by group, integration by integration) will be
         # written to an output file with suffix "_output_pers".
+        # If `trap_state_dir` is set, the trap state is read from and
+        # saved to that directory, instead of trapsfilled files; see
+        # `trap_state.TrapStateStore`.
         input_trapsfilled = string(default="")
         flag_pers_cutoff = float(default=40.)
         save_persistence = boolean(default=False)
+        trap_state_dir = string(default="")
+        trap_state_max = integer(default=5) # states kept per detector
     """
 
     reference_file_types = ["trapdensity", "trappars", "persat"]
@@ -63,11 +69,22 @@ class PersistenceStep(Step):
             output_obj.meta.cal_step.persistence = "SKIPPED"
             return output_obj
 
-        if self.input_trapsfilled is None:
-            traps_filled_model = None
+        if self.trap_state_dir:
+            store = trap_state.TrapStateStore(self.trap_state_dir,
+                                              self.trap_state_max)
         else:
+            store = None
+
+        if self.input_trapsfilled is not None:
             traps_filled_model = datamodels.TrapsFilledModel(
                                         self.input_trapsfilled)
+        elif store is not None:
+            traps_filled_model = store.load(
+                output_obj.meta.instrument.detector,
+                output_obj.meta.exposure.start_time,
+                output_obj.meta.exposure.end_time)
+        else:
+            traps_filled_model = None
         trap_density_model = datamodels.TrapDensityModel(
                                 self.trap_density_filename)
         trappars_model = datamodels.TrapParsModel(self.trappars_filename)
@@ -86,7 +103,10 @@ class PersistenceStep(Step):
 
         if traps_filled_model is not None:      # input traps_filled
             traps_filled_model.close()
-        if traps_filled is not None:            # output traps_filled
+        if traps_filled is not None and store is not None:
+            store.save(traps_filled)
+            traps_filled.close()
+        elif traps_filled is not None:          # output traps_filled
             # Save the traps_filled image, using the input file name but
             # with suffix 'trapsfilled'.
             self.save_model(traps_filled, 'trapsfilled')
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from ... import datamodels
+from ...datamodels import dqflags
+from .. import persistence
+
+NINTS, NGROUPS, NY, NX = 2, 6, 40, 50
+
+
+def make_inputs(seed=1):
+    rng = np.random.RandomState(seed)
+    shape = (NY, NX)
+
+    slope = rng.uniform(10., 3000., shape)
+    data = slope * np.arange(1, NGROUPS + 1)[:, np.newaxis, np.newaxis]
+    model = datamodels.RampModel((NINTS, NGROUPS, NY, NX))
+    model.data[:] = data
+    jumps = rng.uniform(size=model.data.shape) < 0.02
+    model.data[jumps] += 500.
+    model.groupdq[jumps] |= dqflags.group['JUMP_DET']
+    model.groupdq[model.data > 15000.] |= dqflags.group['SATURATED']
+    model.meta.instrument.name = 'NIRCAM'
+    model.meta.instrument.detector = 'NRCA1'
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.exposure.frame_time = 10.7
+    model.meta.exposure.group_time = 21.4
+    model.meta.exposure.ngroups = NGROUPS
+    model.meta.exposure.nframes = 2
+    model.meta.exposure.groupgap = 0
+    model.meta.exposure.start_time = 57000.5
+
+    traps_filled = datamodels.TrapsFilledModel(
+        data=rng.uniform(0., 50., (3,) + shape).astype(np.float32))
+    traps_filled.meta.exposure.end_time = 57000.4
+
+    trap_density = datamodels.TrapDensityModel(
+        data=rng.uniform(100., 200., shape).astype(np.float32))
+    persat = datamodels.PersistenceSatModel(
+        data=np.full(shape, 12000., dtype=np.float32))
+    for ref in (trap_density, persat):
+        ref.meta.subarray.xstart = 1
+        ref.meta.subarray.ystart = 1
+
+    table = np.array([(0.1, -0.01, 0.01, -0.001),
+                      (0.2, -0.002, 0.02, -0.0002),
+                      (0.05, 0., 0.03, 0.)],
+                     dtype=[('capture0', '<f8'), ('capture1', '<f8'),
+                            ('capture2', '<f8'), ('decay_param', '<f8')])
+    trappars = datamodels.TrapParsModel(trappars_table=table)
+
+    return model, traps_filled, trap_density, trappars, persat
+
+
+def run(family_loop):
+    (model, traps_filled, trap_density, trappars, persat) = make_inputs()
+    dataset = persistence.DataSet(model, traps_filled, 40., True,
+                                  trap_density, trappars, persat)
+    return dataset.do_all(family_loop=family_loop)
+
+
+def test_families_match_family_loop():
+    """Computing all the trap families at once matches the loop over
+    families, within rounding errors"""
+    (expected, expected_filled, expected_pers, _) = run(True)
+    (result, filled, pers, skipped) = run(False)
+
+    assert not skipped
+    assert np.allclose(result.data, expected.data, rtol=1.e-6, atol=1.e-2)
+    assert np.allclose(filled.data, expected_filled.data, rtol=1.e-5)
+    assert np.allclose(pers.data, expected_pers.data, rtol=1.e-5,
+                       atol=1.e-4)
+    assert np.array_equal(result.pixeldq, expected.pixeldq)
+
+
+def test_capture_factors_cached():
+    par = (np.array([0.1, 0.2]), np.array([-0.01, 0.]),
+           np.array([0.01, 0.02]), np.array([-0.001, 0.]))
+    factors = persistence.capture_factors(par, 10.7, 21.4, NGROUPS, 1)
+    assert persistence.capture_factors(par, 10.7, 21.4, NGROUPS, 1) \
+        is factors
+    assert factors.ramp.shape == (2, NGROUPS + 1)
+    assert factors.saturation.shape == (2, NGROUPS + 1)
+    assert factors.cr.shape == (2, NGROUPS)
+    # no capture for a jump in the first group
+    assert np.all(factors.cr[:, 0] == 0.)
+    # no time saturated, no capture while saturated
+    assert np.all(factors.saturation[:, 0] == 0.)
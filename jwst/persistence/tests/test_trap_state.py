@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from ... import datamodels
+from .. import trap_state
+
+
+def make_state(end_time, value, detector='NRCA1'):
+    traps_filled = datamodels.TrapsFilledModel(
+        data=np.full((3, 20, 30), value, dtype=np.float32))
+    traps_filled.meta.instrument.detector = detector
+    traps_filled.meta.exposure.start_time = end_time - 0.01
+    traps_filled.meta.exposure.end_time = end_time
+    return traps_filled
+
+
+def test_load_previous_state(tmpdir):
+    store = trap_state.TrapStateStore(str(tmpdir.join('traps')))
+    store.save(make_state(57000.1, 1.))
+    store.save(make_state(57000.2, 2.))
+    store.save(make_state(57000.15, 9., detector='NRCA2'))
+
+    assert store.end_times('NRCA1') == [57000.1, 57000.2]
+    assert store.load('NRCA1', 57000.05) is None
+
+    traps_filled = store.load('NRCA1', 57000.18)
+    assert traps_filled.meta.exposure.end_time == 57000.1
+    assert traps_filled.meta.subarray.xsize == 30
+    assert np.all(traps_filled.data == 1.)
+
+    traps_filled = store.load('NRCA1', 57000.3)
+    assert traps_filled.meta.exposure.end_time == 57000.2
+    assert np.all(traps_filled.data == 2.)
+
+
+def test_prune(tmpdir):
+    store = trap_state.TrapStateStore(str(tmpdir), max_states=2)
+    for k in range(4):
+        store.save(make_state(57000. + k, float(k)))
+    assert store.end_times('NRCA1') == [57002., 57003.]
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_save_failure(tmpdir, monkeypatch):
+    """A state that can't be written leaves no temporary file behind"""
+    store = trap_state.TrapStateStore(str(tmpdir))
+
+    def fail(*args, **kwargs):
+        raise IOError("disk full")
+    monkeypatch.setattr(trap_state.np, 'savez_compressed', fail)
+
+    with pytest.raises(IOError):
+        store.save(make_state(57000.1, 1.))
+    assert tmpdir.listdir() == []
+
+
+def test_prune_deleted_by_another_process(tmpdir, monkeypatch):
+    """A state deleted by another process pruning the store is ignored"""
+    store = trap_state.TrapStateStore(str(tmpdir), max_states=1)
+    store.save(make_state(57000.1, 1.))
+    end_times = store.end_times('NRCA1') + [57000.2]
+    monkeypatch.setattr(store, 'end_times', lambda detector: end_times)
+    store.prune('NRCA1')
+    assert tmpdir.listdir() == []
+
+
+def test_load_out_of_order(tmpdir, caplog):
+    """States of later exposures are reported, but not the exposure's own"""
+    store = trap_state.TrapStateStore(str(tmpdir))
+    store.save(make_state(57000.1, 1.))
+    store.save(make_state(57000.3, 3.))
+
+    caplog.clear()
+    traps_filled = store.load('NRCA1', 57000.29, 57000.3)
+    assert traps_filled.meta.exposure.end_time == 57000.1
+    assert 'time order' not in caplog.text
+
+    store.load('NRCA1', 57000.2, 57000.25)
+    assert 'time order' in caplog.text
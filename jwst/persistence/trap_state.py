@@ -0,0 +1,184 @@
+from __future__ import (absolute_import, unicode_literals, division,
+                        print_function)
+#
+#  Store of the trap state (traps filled) at the end of each exposure,
+#  by detector and end time.
+
+import errno
+import glob
+import logging
+import os
+
+import numpy as np
+
+from .. import datamodels
+from ..lib import file_utils
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# Extension of the files of the store
+EXTENSION = ".npz"
+
+
+class TrapStateStore(object):
+    """
+    A directory of trap states, one compressed file per exposure.
+
+    Each file holds the traps filled at the end of an exposure, one plane
+    for each trap family, with the detector and the start and end times
+    of the exposure.  The file name is made of the detector and the end
+    time, so the state to use for an exposure is found without reading
+    the other files.
+
+    Parameters
+    ----------
+    directory: str
+        The directory of the store; it is created if it does not exist.
+
+    max_states: int
+        The number of states kept for each detector.  When a state is
+        saved, the oldest states beyond this number are deleted.
+    """
+
+    def __init__(self, directory, max_states=5):
+
+        self.directory = directory
+        self.max_states = max_states
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, detector, end_time):
+        return os.path.join(self.directory,
+                            "{0}_{1:.8f}{2}".format(detector, end_time,
+                                                    EXTENSION))
+
+    def end_times(self, detector):
+        """The end times (MJD) of the states saved for a detector, sorted.
+
+        Parameters
+        ----------
+        detector: str
+            The detector name, e.g. 'NRCA1'.
+
+        Returns
+        -------
+        list of float
+        """
+
+        pattern = os.path.join(self.directory, detector + "_*" + EXTENSION)
+        end_times = []
+        for filename in glob.glob(pattern):
+            name = os.path.basename(filename)[:-len(EXTENSION)]
+            try:
+                end_times.append(float(name[len(detector) + 1:]))
+            except ValueError:
+                log.warning("Ignoring %s in the trap state store", filename)
+        return sorted(end_times)
+
+    def load(self, detector, start_time, end_time=None):
+        """Get the state at the end of the last exposure before start_time.
+
+        Parameters
+        ----------
+        detector: str
+            The detector name.
+
+        start_time: float
+            The start time (MJD) of the current exposure.
+
+        end_time: float, optional
+            The end time (MJD) of the current exposure, whose own state,
+            if it was processed before, is not taken for that of a later
+            exposure.
+
+        Returns
+        -------
+        traps_filled: TrapsFilledModel, or None
+            The traps filled at the end of the most recent exposure of the
+            detector that ended before `start_time`, or None if there is
+            no such state.  The decay since then is not applied; that is
+            done by `persistence.DataSet.do_all`, as for a trapsfilled
+            file.
+        """
+
+        end_times = self.end_times(detector)
+        previous = [t for t in end_times if t <= start_time]
+        later = [t for t in end_times
+                 if t > start_time and (end_time is None or
+                                        abs(t - end_time) > 1.e-8)]
+        if later:
+            # A later exposure was done first, so the state of an exposure
+            # between the one found and this one may be missing too
+            log.warning("The trap state store of %s has states of exposures "
+                        "after %.8f; exposures should be processed in time "
+                        "order for their trap states to be chained",
+                        detector, start_time)
+        if not previous:
+            log.info("No trap state for %s before %.8f", detector,
+                     start_time)
+            return None
+
+        filename = self._filename(detector, previous[-1])
+        log.info("Using trap state %s", filename)
+        with np.load(filename) as state:
+            traps_filled = datamodels.TrapsFilledModel(
+                data=state["data"].astype(np.float32))
+            traps_filled.meta.instrument.detector = detector
+            traps_filled.meta.exposure.start_time = float(state["start_time"])
+            traps_filled.meta.exposure.end_time = float(state["end_time"])
+        ny, nx = traps_filled.data.shape[-2:]
+        traps_filled.meta.subarray.xstart = 1
+        traps_filled.meta.subarray.ystart = 1
+        traps_filled.meta.subarray.xsize = nx
+        traps_filled.meta.subarray.ysize = ny
+        return traps_filled
+
+    def save(self, traps_filled):
+        """Add the state at the end of an exposure to the store.
+
+        Parameters
+        ----------
+        traps_filled: TrapsFilledModel
+            The traps filled at the end of the exposure, with the detector
+            and the start and end times of the exposure in its metadata.
+
+        Returns
+        -------
+        str
+            The name of the file written.
+        """
+
+        detector = traps_filled.meta.instrument.detector
+        end_time = traps_filled.meta.exposure.end_time
+        start_time = traps_filled.meta.exposure.start_time
+        if detector is None or end_time is None:
+            raise ValueError("The detector and end time of the trap state "
+                             "must be set to save it")
+        if start_time is None:
+            start_time = end_time
+
+        filename = self._filename(detector, end_time)
+        # Written to a temporary file first, so that a state is never read
+        # while partly written, by this or another process.
+        with file_utils.atomic_write(filename) as fd:
+            np.savez_compressed(fd,
+                                data=traps_filled.data.astype(np.float32),
+                                start_time=start_time,
+                                end_time=end_time)
+        log.info("Saved trap state %s", filename)
+
+        self.prune(detector)
+        return filename
+
+    def prune(self, detector):
+        """Delete the oldest states of a detector beyond max_states."""
+
+        end_times = self.end_times(detector)
+        for end_time in end_times[:-max(1, self.max_states)]:
+            try:
+                os.remove(self._filename(detector, end_time))
+            except OSError as error:
+                # Already deleted by another process saving a state
+                if error.errno != errno.ENOENT:
+                    raise
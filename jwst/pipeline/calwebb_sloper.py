@@ -17,6 +17,7 @@ from ..dark_current import dark_current_step
 from ..persistence import persistence_step
 from ..jump import jump_step
 from ..ramp_fitting import ramp_fit_step
+from . import fused_ramp
 
 
 __version__ = "7.1.0"
@@ -39,6 +40,8 @@ class SloperPipeline(Pipeline):
 
     spec = """
         save_calibrated_ramp = boolean(default=False)
+        fused_corrections = boolean(default=False) # Apply consecutive per-group corrections in a single pass over the ramp
+        fused_block_size = integer(default=1, min=1) # Number of groups per tile of the single pass
     """
 
     # Define aliases to steps
@@ -76,31 +79,26 @@ class SloperPipeline(Pipeline):
             # the steps are in a different order than NIR
             log.debug('Processing a MIRI exposure')
 
-            input = self.group_scale(input)
-            input = self.dq_init(input)
-            input = self.saturation(input)
-            input = self.ipc(input)
-            input = self.linearity(input)
-            input = self.rscd(input)
-            input = self.lastframe(input)
-            input = self.dark_current(input)
-            input = self.refpix(input)
-            input = self.persistence(input)
+            steps = [self.group_scale, self.dq_init, self.saturation,
+                     self.ipc, self.linearity, self.rscd, self.lastframe,
+                     self.dark_current, self.refpix, self.persistence]
 
         else:
 
             # process Near-IR exposures
             log.debug('Processing a Near-IR exposure')
 
-            input = self.group_scale(input)
-            input = self.dq_init(input)
-            input = self.saturation(input)
-            input = self.ipc(input)
-            input = self.superbias(input)
-            input = self.refpix(input)
-            input = self.linearity(input)
-            input = self.persistence(input)
-            input = self.dark_current(input)
+            steps = [self.group_scale, self.dq_init, self.saturation,
+                     self.ipc, self.superbias, self.refpix, self.linearity,
+                     self.persistence, self.dark_current]
+
+        if self.fused_corrections:
+            # stream the ramp through the consecutive per-group
+            # corrections in a single pass
+            input = fused_ramp.run_steps(input, steps, self.fused_block_size)
+        else:
+            for step in steps:
+                input = step(input)
 
         # apply the jump step
         input = self.jump(input)
@@ -0,0 +1,483 @@
+"""
+Fused execution of the detector-level corrections of a ramp.
+
+Several of the calwebb_sloper steps correct each group of a ramp on its
+own: saturation, superbias, linearity, dark_current, lastframe and reset.
+Run one after the other, each of these steps reads and writes the whole
+4-D ramp and makes its own copy of the model. When consecutive steps of
+a pipeline are all of this kind, `run_steps` instead sets up all of them
+(reference files, 2-D DQ flags, metadata) and then streams the ramp one
+(integration, block of groups) tile at a time through all of their
+corrections, in the order of the steps. The ramp is copied once and read
+and written once, and the output is the same as that of the steps run
+one at a time.
+
+Any other step (ipc, refpix, rscd, persistence, ...) needs more than one
+group or integration of the ramp at once and is run as usual; it ends the
+run of fused steps.
+"""
+from __future__ import absolute_import, division
+
+import abc
+import logging
+import os
+import time
+
+from astropy.extern import six
+import numpy as np
+
+from .. import datamodels
+from ..datamodels import dqflags
+from ..saturation import saturation, x_irs2
+from ..saturation.saturation_step import SaturationStep
+from ..superbias import bias_sub
+from ..superbias.superbias_step import SuperBiasStep
+from ..linearity import linearity
+from ..linearity.linearity_func import apply_linearity_func
+from ..linearity.linearity_step import LinearityStep
+from ..dark_current import dark_sub
+from ..dark_current.dark_current_step import DarkCurrentStep
+from ..lastframe.lastframe_step import LastFrameStep
+from ..reset.reset_step import ResetStep
+from ..stpipe import profiling
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class FusedCorrection(object):
+    """
+    The correction of a step, applied one tile of the ramp at a time.
+
+    `setup` does the work of the step that does not depend on the ramp
+    data, and `correct` corrects one tile of the ramp in place.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.log = step.log
+        self.ref_model = None
+        # Time (s) spent in `correct`
+        self.wall_time = 0.
+        self.cpu_time = 0.
+
+    @staticmethod
+    def can_fuse(model):
+        """
+        Whether the correction can be applied one tile at a time to `model`.
+        """
+        return True
+
+    @abc.abstractmethod
+    def setup(self, model):
+        """
+        Get the reference data and update the 2-D arrays and the metadata
+        of `model`.
+
+        Returns
+        -------
+        True if the ramp data need correcting, False if the step is skipped
+        """
+
+    @abc.abstractmethod
+    def correct(self, data, groupdq, integration, first_group):
+        """
+        Correct in place the groups `first_group` onwards of `integration`.
+
+        Parameters
+        ----------
+        data: 3-D array
+            The tile of the SCI array, (groups, rows, columns)
+
+        groupdq: 3-D array
+            The tile of the GROUPDQ array, (groups, rows, columns)
+
+        integration: int
+            Index of the integration of the tile
+
+        first_group: int
+            Index of the first group of the tile
+        """
+
+    def close(self):
+        if self.ref_model is not None:
+            self.ref_model.close()
+            self.ref_model = None
+
+    def get_reference_model(self, model, reftype, model_class, cal_step,
+                            subarray=False):
+        """
+        Open the reference file of the step, as the step would.  With
+        `subarray`, a cached model may be sliced to the subarray of
+        `model` (see `Step.open_reference_model`).
+
+        Returns None, after marking the step as skipped, if there is no
+        reference file.
+        """
+        ref_name = self.step.get_reference_file(model, reftype)
+        self.log.info('Using %s reference file %s', reftype.upper(), ref_name)
+        if ref_name == 'N/A':
+            self.log.warning('No %s reference file found', reftype.upper())
+            self.log.warning('%s step will be skipped', self.step.name)
+            setattr(model.meta.cal_step, cal_step, 'SKIPPED')
+            return None
+        self.ref_name = ref_name
+        self.ref_model = self.step.open_reference_model(
+            ref_name, model_class, model if subarray else None)
+        return self.ref_model
+
+
+class SaturationCorrection(FusedCorrection):
+    """
+    Flag the saturated groups, and all of the following groups.
+    """
+
+    @staticmethod
+    def can_fuse(model):
+        # IRS2 data are reordered for every group
+        return not x_irs2.is_irs2(model)
+
+    def setup(self, model):
+        ref_model = self.get_reference_model(
+            model, 'saturation', datamodels.SaturationModel, 'saturation',
+            subarray=True)
+        if ref_model is None:
+            return False
+
+        self.satmask, dqmask = saturation.get_masks(model, ref_model)
+        model.pixeldq = np.bitwise_or(model.pixeldq, dqmask)
+        model.meta.cal_step.saturation = 'COMPLETE'
+
+        # Flags carried from the tiles of earlier groups of an integration
+        self.flags = np.zeros(model.data.shape[-2:],
+                              dtype=model.groupdq.dtype)
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        if first_group == 0:
+            self.flags[:, :] = 0
+        dq_flag = dqflags.group['SATURATED']
+        for plane in range(data.shape[0]):
+            self.flags[data[plane] >= self.satmask] = dq_flag
+            np.bitwise_or(groupdq[plane], self.flags, groupdq[plane])
+
+
+class SuperBiasCorrection(FusedCorrection):
+    """
+    Subtract the superbias image from each group.
+    """
+
+    def setup(self, model):
+        bias_model = self.get_reference_model(
+            model, 'superbias', datamodels.SuperBiasModel, 'superbias',
+            subarray=True)
+        if bias_model is None:
+            return False
+
+        # Replace NaN's in the superbias with zeros; the data of a cached
+        # superbias are only copied if there are any
+        nans = np.isnan(bias_model.data)
+        if nans.any():
+            bias_model.unshare('data')
+            bias_model.data[nans] = 0.0
+        if not bias_sub.ref_matches_sci(bias_model, model):
+            bias_model = bias_sub.get_subarray(bias_model, model)
+
+        self.bias = bias_model.data
+        model.pixeldq = np.bitwise_or(model.pixeldq, bias_model.dq)
+        model.meta.cal_step.superbias = 'COMPLETE'
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        data -= self.bias
+
+
+class LinearityCorrection(FusedCorrection):
+    """
+    Apply the linearity correction to the groups not flagged as saturated.
+    """
+
+    def setup(self, model):
+        lin_model = self.get_reference_model(
+            model, 'linearity', datamodels.LinearityModel, 'linearity')
+        if lin_model is None:
+            return False
+
+        linearity.propagate_dq_info(model, lin_model)
+        self.coeffs = linearity.get_coeffs(model, lin_model)
+        model.meta.cal_step.linearity = 'COMPLETE'
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        apply_linearity_func(data[np.newaxis], groupdq[np.newaxis],
+                             self.coeffs, dqflags.group['SATURATED'])
+
+
+class DarkCorrection(FusedCorrection):
+    """
+    Subtract the dark current of each group.
+    """
+
+    def setup(self, model):
+        self.instrument = model.meta.instrument.name
+        if self.instrument == 'MIRI':
+            model_class = datamodels.DarkMIRIModel
+        else:
+            model_class = datamodels.DarkModel
+        dark_model = self.get_reference_model(
+            model, 'dark', model_class, 'dark')
+        if dark_model is None:
+            return False
+
+        self.dark = dark_sub.match_dark(model, dark_model,
+                                        self.step.dark_output,
+                                        self.step.get_dark_cache(),
+                                        self.ref_name)
+        if self.dark is None:
+            log.warning("Input will be returned without subtracting "
+                        "dark current.")
+            model.meta.cal_step.dark_sub = 'SKIPPED'
+            return False
+
+        model.pixeldq = np.bitwise_or(
+            model.pixeldq, dark_sub.get_dark_dq(self.dark, self.instrument))
+        model.meta.cal_step.dark_sub = 'COMPLETE'
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        last_group = first_group + data.shape[0]
+        if self.instrument == 'MIRI':
+            dark_int = self.dark.data[min(integration,
+                                          self.dark.data.shape[0] - 1)]
+            data -= dark_int[first_group:last_group]
+        else:
+            data -= self.dark.data[first_group:last_group]
+
+    def close(self):
+        if getattr(self, 'dark', None) is not None:
+            if self.dark is not self.ref_model:
+                self.dark.close()
+            self.dark = None
+        super(DarkCorrection, self).close()
+
+
+class LastFrameCorrection(FusedCorrection):
+    """
+    Flag the last group of each integration as DO_NOT_USE.
+    """
+
+    def setup(self, model):
+        self.last_group = model.data.shape[1] - 1
+        if model.meta.instrument.detector[:3] != 'MIR':
+            self.log.warning('Last Frame Correction is only for MIRI data')
+            self.log.warning('Last frame step will be skipped')
+            model.meta.cal_step.lastframe = 'SKIPPED'
+            return False
+        if self.last_group < 1:
+            self.log.warning("LastFrame Sub: too few groups, skipping step")
+            model.meta.cal_step.lastframe = 'SKIPPED'
+            return False
+
+        model.meta.cal_step.lastframe = 'COMPLETE'
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        if first_group + data.shape[0] - 1 == self.last_group:
+            groupdq[-1] = dqflags.group['DO_NOT_USE']
+
+
+class ResetCorrection(FusedCorrection):
+    """
+    Subtract the reset correction of each group.
+    """
+
+    def setup(self, model):
+        if not model.meta.instrument.detector.startswith('MIR'):
+            self.log.warning('Reset Correction is only for MIRI data')
+            self.log.warning('Reset step will be skipped')
+            model.meta.cal_step.reset = 'SKIPPED'
+            return False
+        reset_model = self.get_reference_model(
+            model, 'reset', datamodels.ResetModel, 'reset')
+        if reset_model is None:
+            return False
+
+        self.reset = reset_model.data
+        model.pixeldq = np.bitwise_or(model.pixeldq, reset_model.dq)
+        model.meta.cal_step.reset = 'COMPLETE'
+        return True
+
+    def correct(self, data, groupdq, integration, first_group):
+        reset_nints, reset_ngroups = self.reset.shape[:2]
+        reset_int = self.reset[min(integration, reset_nints - 1)]
+        for plane in range(data.shape[0]):
+            group = min(first_group + plane, reset_ngroups - 1)
+            data[plane] -= reset_int[group]
+
+
+# The fused correction of each step class
+CORRECTIONS = {
+    SaturationStep: SaturationCorrection,
+    SuperBiasStep: SuperBiasCorrection,
+    LinearityStep: LinearityCorrection,
+    DarkCurrentStep: DarkCorrection,
+    LastFrameStep: LastFrameCorrection,
+    ResetStep: ResetCorrection,
+}
+
+
+def can_fuse(step, model):
+    """
+    Whether `step` can be run on `model` as part of a fused pass.
+
+    Steps that have hooks or save their results are run as usual. A step
+    that is skipped leaves the ramp as it is, and is part of the pass.
+    """
+    if step._pre_hooks or step._post_hooks:
+        return False
+    if step.skip:
+        return True
+    correction_class = CORRECTIONS.get(type(step))
+    if correction_class is None:
+        return False
+    if step.save_results or step.output_file is not None:
+        return False
+    return correction_class.can_fuse(model)
+
+
+def run_steps(model, steps, block_size=1):
+    """
+    Run the steps, in order, on a ramp model, fusing the runs of
+    consecutive steps that correct each group on its own.
+
+    Parameters
+    ----------
+    model: RampModel
+        The input ramp
+
+    steps: list of Step
+        The steps to run
+
+    block_size: int
+        Number of groups in each tile of the fused passes
+
+    Returns
+    -------
+    model: RampModel
+        The output of the last step
+    """
+    i = 0
+    npasses = 0
+    while i < len(steps):
+        fused = []
+        while i < len(steps) and can_fuse(steps[i], model):
+            fused.append(steps[i])
+            i += 1
+        if len([step for step in fused if not step.skip]) > 1:
+            model = run_fused(model, fused, block_size)
+            npasses += 1
+        else:
+            for step in fused:
+                model = step(model)
+        if i < len(steps):
+            model = steps[i](model)
+            i += 1
+    if npasses == 0:
+        log.info('No consecutive per-group corrections to fuse; '
+                 'the steps were run one at a time')
+    return model
+
+
+def run_fused(model, steps, block_size=1):
+    """
+    Run the steps in a single pass over the ramp.
+
+    Parameters
+    ----------
+    model: RampModel
+        The input ramp
+
+    steps: list of Step
+        The steps to run; they must all be fusable (see `can_fuse`).
+        The skipped steps are run after the pass.
+
+    block_size: int
+        Number of groups in each tile
+
+    Returns
+    -------
+    output: RampModel
+        The corrected ramp
+    """
+    skipped = [step for step in steps if step.skip]
+    steps = [step for step in steps if not step.skip]
+    log.info('Running steps %s in a single pass',
+             ', '.join(step.name for step in steps))
+    bytes_copied = datamodels.util.bytes_copied()
+
+    # Create the output as a copy of the input, sharing the arrays
+    # that are not modified
+    output = model.copy(copy_on_write=True)
+    output.unshare('data', 'groupdq')
+
+    corrections = []
+    records = []
+    try:
+        for step in steps:
+            start = profiling.Sample()
+            step.log.info('Step {0} running fused'.format(step.name))
+            step._reference_files_used = []
+            step._reference_time = 0.
+            correction = CORRECTIONS[type(step)](step)
+            corrections.append(correction)
+            if not correction.setup(output):
+                correction.close()
+                corrections.remove(correction)
+            records.append((correction, profiling.make_record(
+                step, start, profiling.Sample(), step._reference_time)))
+
+        if corrections:
+            data = output.data
+            groupdq = output.groupdq
+            nints, ngroups = data.shape[:2]
+            for integration in range(nints):
+                for first_group in range(0, ngroups, block_size):
+                    last_group = min(first_group + block_size, ngroups)
+                    data_tile = data[integration, first_group:last_group]
+                    dq_tile = groupdq[integration, first_group:last_group]
+                    for correction in corrections:
+                        wall_start = time.time()
+                        cpu_start = sum(os.times()[:2])
+                        correction.correct(data_tile, dq_tile,
+                                           integration, first_group)
+                        correction.wall_time += time.time() - wall_start
+                        correction.cpu_time += (sum(os.times()[:2]) -
+                                                cpu_start)
+    finally:
+        for correction in corrections:
+            correction.close()
+
+    # The timing records of the steps are those of their setup and of
+    # their corrections of the tiles; the peak memory and I/O are those of
+    # the setup only.  The steps have no cProfile statistics of their
+    # own: their time is in those of the pipeline.
+    for step, (correction, record) in zip(steps, records):
+        step._update_meta(output, step._reference_files_used)
+        step._reference_files_used = []
+        step.log.info('Step {0} done'.format(step.name))
+        record['wall_time'] += correction.wall_time
+        record['cpu_time'] += correction.cpu_time
+        record['fused'] = True
+        step._root().timings.append(record)
+    output.release_shared()
+    if steps[-1]._is_fast_chained():
+        output._validation_deferred = True
+
+    log.info('Single pass copied {0} bytes of model arrays'.format(
+        datamodels.util.bytes_copied() - bytes_copied))
+
+    for step in skipped:
+        output = step(output)
+
+    return output
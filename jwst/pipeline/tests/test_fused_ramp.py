@@ -0,0 +1,136 @@
+"""Test the fused pass of the per-group ramp corrections"""
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from ... import datamodels
+from ...saturation.saturation_step import SaturationStep
+from ...ipc.ipc_step import IPCStep
+from ...superbias.superbias_step import SuperBiasStep
+from ...linearity.linearity_step import LinearityStep
+from ...dark_current.dark_current_step import DarkCurrentStep
+from .. import fused_ramp
+
+NINTS, NGROUPS, NROWS, NCOLS = 2, 5, 20, 30
+
+
+def make_ramp():
+    np.random.seed(1)
+    model = datamodels.RampModel((NINTS, NGROUPS, NROWS, NCOLS))
+    model.meta.instrument.name = 'NIRCAM'
+    model.meta.instrument.detector = 'NRCA1'
+    model.meta.exposure.nframes = 1
+    model.meta.exposure.groupgap = 0
+    signal = np.random.uniform(50., 300., (NROWS, NCOLS))
+    for group in range(NGROUPS):
+        model.data[:, group] = 1000. + signal * (group + 1)
+    model.data[0, 2, 4, 5] = np.nan
+    return model
+
+
+def make_references(tmpdir):
+    np.random.seed(2)
+    shape = (NROWS, NCOLS)
+
+    sat = datamodels.SaturationModel(
+        data=np.random.uniform(1200., 2500., shape).astype(np.float32),
+        dq=np.zeros(shape, dtype=np.uint32))
+    sat.data[1, 1] = np.nan
+
+    bias = datamodels.SuperBiasModel(
+        data=np.random.uniform(900., 1000., shape).astype(np.float32),
+        dq=np.zeros(shape, dtype=np.uint32))
+    bias.dq[3, 3] = 1
+
+    coeffs = np.zeros((3,) + shape, dtype=np.float32)
+    coeffs[1] = 1.
+    coeffs[2] = np.random.uniform(0., 1.e-5, shape)
+    lin = datamodels.LinearityModel(
+        coeffs=coeffs, dq=np.zeros(shape, dtype=np.uint32))
+    lin.coeffs[2, 6, 6] = np.nan
+
+    dark = datamodels.DarkModel(
+        data=np.random.uniform(0., 5., (NGROUPS,) + shape).astype(np.float32),
+        dq=np.zeros(shape, dtype=np.uint32))
+    dark.meta.exposure.nframes = 1
+    dark.meta.exposure.groupgap = 0
+
+    paths = {}
+    for reftype, model in [('saturation', sat), ('superbias', bias),
+                           ('linearity', lin), ('dark', dark)]:
+        paths[reftype] = str(tmpdir.join(reftype + '.fits'))
+        model.save(paths[reftype])
+    return paths
+
+
+def make_steps(paths):
+    return [
+        SaturationStep(override_saturation=paths['saturation']),
+        IPCStep(skip=True),
+        SuperBiasStep(override_superbias=paths['superbias']),
+        LinearityStep(override_linearity=paths['linearity']),
+        DarkCurrentStep(override_dark=paths['dark']),
+    ]
+
+
+@pytest.mark.parametrize('block_size', [1, 2, NGROUPS])
+def test_fused_matches_steps(tmpdir, block_size):
+    """The fused pass gives the same ramp as the steps run one by one"""
+    paths = make_references(tmpdir)
+    ramp = make_ramp()
+
+    expected = ramp
+    for step in make_steps(paths):
+        expected = step(expected)
+
+    result = fused_ramp.run_steps(ramp, make_steps(paths), block_size)
+
+    # bit-identical
+    assert result.data.tobytes() == expected.data.tobytes()
+    assert np.array_equal(result.groupdq, expected.groupdq)
+    assert np.array_equal(result.pixeldq, expected.pixeldq)
+    assert result.groupdq.any()
+    for cal_step in ['saturation', 'superbias', 'linearity', 'dark_sub']:
+        assert getattr(result.meta.cal_step, cal_step) == 'COMPLETE'
+    assert result.meta.ref_file.dark.name == os.path.abspath(paths['dark'])
+
+    # the input is left as it was
+    assert not ramp.groupdq.any()
+
+
+def test_fused_timings(tmpdir):
+    """The fused steps have timing records"""
+    paths = make_references(tmpdir)
+    steps = make_steps(paths)
+    fused_ramp.run_steps(make_ramp(), steps)
+
+    for step in steps:
+        if step.skip:
+            continue
+        assert len(step.timings) == 1
+        assert step.timings[0]['fused']
+        assert step.timings[0]['wall_time'] >= 0.
+
+
+def test_not_fusable(tmpdir):
+    """Steps saving their results are run on their own"""
+    paths = make_references(tmpdir)
+    steps = make_steps(paths)
+    ramp = make_ramp()
+
+    assert fused_ramp.can_fuse(steps[0], ramp)
+    assert fused_ramp.can_fuse(steps[1], ramp)
+    assert not fused_ramp.can_fuse(steps[0].__class__(save_results=True),
+                                   ramp)
+
+
+def test_nothing_fused(caplog):
+    """Nothing is fused without two consecutive per-group corrections"""
+    ramp = make_ramp()
+    steps = [SaturationStep(skip=True), IPCStep(skip=True)]
+    with caplog.at_level(logging.INFO):
+        result = fused_ramp.run_steps(ramp, steps)
+    assert 'No consecutive per-group corrections to fuse' in caplog.text
+    assert np.array_equal(result.data, ramp.data)
@@ -20,6 +20,7 @@ import logging
 from .. import datamodels
 from ..datamodels import dqflags
 
+from ..lib import parallel
 from . import gls_fit           # used only if algorithm is "GLS"
 from . import utils
 
@@ -35,7 +36,7 @@ LARGE_VARIANCE = 1.e8
 
 
 def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
-              algorithm, weighting):
+              algorithm, weighting, max_cores='none'):
     """
     Extended Summary
     ----------------
@@ -71,6 +72,11 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         'unweighted' specifies that no weighting should be used (default)
         'optimal' specifies that optimal weighting should be used
 
+    max_cores: string or int
+        maximum number of processes used to fit the data sections with the
+        OLS algorithm: 'none' (fit in the calling process), 'quarter',
+        'half', 'all' of the available cores, or a number of processes
+
     Returns
     -------
     new_model: Data Model object
@@ -96,7 +102,8 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     else:
         new_model, int_model, opt_model = ols_ramp_fit(model,
                                 buffsize, save_opt,
-                                readnoise_model, gain_model, weighting)
+                                readnoise_model, gain_model, weighting,
+                                max_cores)
         gls_opt_model = None
 
 
@@ -104,7 +111,7 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
 
 
 def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
-                  weighting):
+                  weighting, max_cores='none'):
     """
     Extended Summary
     ----------------
@@ -134,6 +141,11 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         'unweighted' specifies that no weighting should be used
         'optimal' specifies that optimal weighting should be used
 
+    max_cores: string or int
+        maximum number of processes used to fit the data sections: 'none'
+        (fit in the calling process), 'quarter', 'half', 'all' of the
+        available cores, or a number of processes
+
     Returns
     -------
     new_model: Data Model object
@@ -233,58 +245,50 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
 
     f_max_seg = 0
 
-    # loop over data integrations
-    for num_int in range(0, n_int):
-        # loop over data sections
-        for rlo in range(0, cubeshape[1], nrows):
-            rhi = rlo + nrows
-
-            if rhi > cubeshape[1]:
-                rhi = cubeshape[1]
+    # The (integration, data section) pairs to fit. The sections are
+    #   independent, so they may be fit by a pool of worker processes; the
+    #   results are merged below in this fixed order, so the output does not
+    #   depend on the number of processes.
+    sections = [(num_int, rlo, min(rlo + nrows, cubeshape[1]))
+                for num_int in range(0, n_int)
+                for rlo in range(0, cubeshape[1], nrows)]
 
-            data_sect = model.get_section('data')[num_int, :, rlo:rhi, :]
+    nproc = min(parallel.number_of_processes(max_cores), len(sections))
+    if nproc > 1:
+        log.info('Fitting %d data sections with %d processes',
+                 len(sections), nproc)
 
-            # first frame section for 1st read of current integration
-            ff_sect = model.get_section('data')[num_int,
-                                                0, rlo:rhi, :].astype(np.float32)
-            # get appropriate sections
-            gdq_sect = gdq_cube[num_int, :, rlo:rhi, :]
-            rn_sect = readnoise_2d[rlo:rhi, :]
-            gain_sect = gain_2d[rlo:rhi, :]
+    tasks = section_tasks(model, sections, gdq_cube, pixeldq, readnoise_2d,
+                          gain_2d, frame_time, save_opt, max_seg, ngroups,
+                          weighting)
+    results = parallel.imap_ordered(fit_section, tasks, nproc)
 
-            t_err_cube, t_dq_cube, m_by_var, inv_var, opt_res, f_max_seg = \
-                 calc_slope(data_sect, gdq_sect, frame_time, opt_res, \
-                     rn_sect, gain_sect, max_seg, ngroups, weighting, f_max_seg)
+    for (num_int, rlo, rhi), result in zip(sections, results):
+        t_err_cube, t_dq_cube, m_by_var, inv_var, dq_sect, sect_res, \
+            sect_max_seg = result
 
-            err_cube[num_int, :, rlo:rhi, :] += t_err_cube
-            gdq_cube[num_int, :, rlo:rhi, :] = t_dq_cube
+        f_max_seg = max(f_max_seg, sect_max_seg)
 
-            # Compress 4D->2D dq arrays for saturated and jump-detected pixels
-            pixeldq_sect = pixeldq[rlo:rhi, :].copy()
-            dq_int[num_int, rlo:rhi, :] = \
-                  dq_compress_sect(t_dq_cube, pixeldq_sect).copy()
+        err_cube[num_int, :, rlo:rhi, :] += t_err_cube
+        gdq_cube[num_int, :, rlo:rhi, :] = t_dq_cube
 
-            sect_shape = data_sect.shape[-2:]
-            m_sum_2d[rlo:rhi, :] += m_by_var.reshape(sect_shape)
-            var_sum_2d[rlo:rhi, :] += inv_var.reshape(sect_shape)
+        # 4D->2D compressed dq array for saturated and jump-detected pixels
+        dq_int[num_int, rlo:rhi, :] = dq_sect
 
-            if save_opt: # collect optional results for output
-                # Loop over the segments and copy the reshaped 2D segment-specific
-                #  results for the current data section to the 4D output arrays.
-                opt_res.reshape_res(num_int, rlo, rhi, sect_shape, ff_sect)
+        sect_shape = t_dq_cube.shape[-2:]
+        m_sum_2d[rlo:rhi, :] += m_by_var.reshape(sect_shape)
+        var_sum_2d[rlo:rhi, :] += inv_var.reshape(sect_shape)
 
-                # Calculate difference between each slice and the previous slice
-                #   as approximation to cosmic ray amplitude for those pixels
-                #   having their DQ set for cosmic rays
-                data_diff = data_sect - utils.shift_z(data_sect, -1)
-                dq_cr = np.bitwise_and(dqflags.group['JUMP_DET'], gdq_sect)
+        if save_opt: # collect optional results for output
+            opt_res.merge_sect(sect_res, num_int, rlo, rhi)
 
-                opt_res.cr_mag_seg[num_int, :, rlo:rhi, :] = \
-                           data_diff * (dq_cr != 0)
+        m_by_var_int[num_int, rlo:rhi, :] = m_by_var.reshape(sect_shape)
+        inv_var_int[num_int, rlo:rhi, :] = inv_var.reshape(sect_shape)
 
-            m_by_var_int[num_int, rlo:rhi, :] = m_by_var.reshape(sect_shape)
-            inv_var_int[num_int, rlo:rhi, :] = inv_var.reshape(sect_shape)
+        if rhi < cubeshape[1]:
+            continue
 
+        # All the sections of the current integration have been fit
         slope_int[num_int, :, :] = \
             utils.calc_slope_int(slope_int, m_by_var_int, inv_var_int, num_int)
 
@@ -359,6 +363,126 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     return new_model, int_model, opt_model
 
 
+def section_tasks(model, sections, gdq_cube, pixeldq, readnoise_2d,
+                  gain_2d, frame_time, save_opt, max_seg, ngroups, weighting):
+    """
+    Short Summary
+    -------------
+    Generate the arguments of fit_section for each data section, in the
+    order of `sections`. The sections are generated as they are needed,
+    so that only the sections being fit are held in memory.
+
+    Parameters
+    ----------
+    model: data model
+        input data model, assumed to be of type RampModel
+
+    sections: list of (int, int, int) tuples
+        integration number, first row and last row (exclusive) of each
+        data section
+
+    gdq_cube: int, 4D array
+        GROUPDQ array
+
+    pixeldq: int, 2D array
+        PIXELDQ array
+
+    readnoise_2d: float, 2D array
+        read noise values for all pixels
+
+    gain_2d: float, 2D array
+        gain values for all pixels
+
+    frame_time, save_opt, max_seg, ngroups, weighting:
+        passed to fit_section, see calc_slope
+
+    Returns
+    -------
+    tasks: generator
+        arguments of fit_section for each section
+    """
+    for num_int, rlo, rhi in sections:
+        data_sect = model.get_section('data')[num_int, :, rlo:rhi, :]
+        yield (data_sect, gdq_cube[num_int, :, rlo:rhi, :],
+               pixeldq[rlo:rhi, :].copy(), readnoise_2d[rlo:rhi, :],
+               gain_2d[rlo:rhi, :], frame_time, save_opt, max_seg, ngroups,
+               weighting)
+
+
+def fit_section(args):
+    """
+    Short Summary
+    -------------
+    Fit the ramps of a single data section of a single integration. This
+    is the unit of work of ols_ramp_fit, which may be run in a worker
+    process, so it takes a single tuple of arguments and only uses the
+    data passed in.
+
+    Parameters
+    ----------
+    args: tuple
+        data_sect, gdq_sect, pixeldq_sect, rn_sect, gain_sect, frame_time,
+        save_opt, max_seg, ngroups, weighting; see calc_slope
+
+    Returns
+    -------
+    err_sect: float, 3D array
+        fitting error estimate for pixels in section
+
+    gdq_sect: int, 3D array
+        data quality flags for pixels in section
+
+    m_by_var: float, 1D array
+        values of slope/variance for good pixels
+
+    inv_var: float, 1D array
+        values of 1/variance for good pixels
+
+    dq_sect: int, 2D array
+        PIXELDQ of the section, combined with the compressed GROUPDQ
+
+    sect_res: OptRes object or None
+        optional results for the section (a single integration), or None
+        if save_opt is False
+
+    f_max_seg: int
+        actual maximum number of segments within a ramp of the section
+    """
+    (data_sect, gdq_sect, pixeldq_sect, rn_sect, gain_sect, frame_time,
+     save_opt, max_seg, ngroups, weighting) = args
+
+    nreads = data_sect.shape[0]
+    sect_shape = data_sect.shape[-2:]
+
+    if save_opt:
+        sect_res = utils.OptRes(1, sect_shape, max_seg, nreads)
+    else:
+        sect_res = None
+
+    err_sect, gdq_sect, m_by_var, inv_var, sect_res, f_max_seg = \
+         calc_slope(data_sect, gdq_sect, frame_time, sect_res, rn_sect,
+                    gain_sect, max_seg, ngroups, weighting, 0)
+
+    # Compress 4D->2D dq arrays for saturated and jump-detected pixels
+    dq_sect = dq_compress_sect(gdq_sect, pixeldq_sect)
+
+    if save_opt:
+        # Copy the reshaped 2D segment-specific results to the section's
+        #  4D arrays; first frame for 1st read of current integration
+        ff_sect = data_sect[0, :, :].astype(np.float32)
+        sect_res.reshape_res(0, 0, sect_shape[0], sect_shape, ff_sect)
+
+        # Calculate difference between each slice and the previous slice
+        #   as approximation to cosmic ray amplitude for those pixels
+        #   having their DQ set for cosmic rays
+        data_diff = data_sect - utils.shift_z(data_sect, -1)
+        dq_cr = np.bitwise_and(dqflags.group['JUMP_DET'], gdq_sect)
+
+        sect_res.cr_mag_seg[0, :, :, :] = data_diff * (dq_cr != 0)
+
+    return err_sect, gdq_sect, m_by_var, inv_var, dq_sect, sect_res, f_max_seg
+
+
 def gls_ramp_fit(model,
                  buffsize, save_opt,
                  readnoise_model, gain_model):
@@ -779,7 +903,7 @@ def calc_nrows(model, buffsize, cubeshape, nreads):
 
 
 def calc_slope(data_sect, gdq_sect, frame_time, opt_res, rn_sect, gain_sect,
-                i_max_seg, ngroups, weighting, f_max_seg):
+                i_max_seg, ngroups, weighting, f_max_seg, segment_loop=False):
     """
     Short Summary
     -------------
@@ -823,6 +947,11 @@ def calc_slope(data_sect, gdq_sect, frame_time, opt_res, rn_sect, gain_sect,
         actual maximum number of segments within a ramp, based on the fitting
         of all ramps; later used when truncating arrays before output.
 
+    segment_loop: boolean
+        if True, fit the segments of all the pixels one segment at a time
+        (fit_next_segment) rather than all at once (fit_segments); the two
+        give the same results, the latter is faster for data with jumps
+
     Returns
     -------
     err_sect: float, 3D array
@@ -850,6 +979,460 @@ def calc_slope(data_sect, gdq_sect, frame_time, opt_res, rn_sect, gain_sect,
     imshape = data_sect.shape[-2:]
     cubeshape = (nreads,) + imshape  # cube section shape
 
+    # Create nominal 2D ERR array, which is 1st slice of
+    #    avged_data_cube * readtime
+    err_2d_array = data_sect[0, :, :] * frame_time
+    err_2d_array[err_2d_array < 0] = 0
+
+    if ngroups > 2 and not segment_loop:
+        m_by_var, inv_var, f_max_seg = fit_segments(data_sect, gdq_sect,
+              opt_res, rn_sect, gain_sect, i_max_seg, weighting, f_max_seg)
+    else:
+        m_by_var, inv_var, f_max_seg = fit_segments_loop(data_sect, gdq_sect,
+              opt_res, rn_sect, gain_sect, i_max_seg, ngroups, weighting,
+              f_max_seg)
+
+    err_sect = np.zeros(cubeshape, dtype=np.float32)
+    # For now, making all error array slices within an integration and
+    #  section identical. Update later when use of error array has been decided
+    for ii in range(cubeshape[0]):
+        err_sect[ii, :, :] = err_2d_array
+
+    return err_sect, gdq_sect, m_by_var, inv_var, opt_res, f_max_seg
+
+
+def fit_segments(data_sect, gdq_sect, opt_res, rn_sect, gain_sect, i_max_seg,
+                 weighting, f_max_seg):
+    """
+    Short Summary
+    -------------
+    Fit the segments of the ramps of all pixels in the data cube section
+    at once, for datasets having more than 2 groups per integration.
+    The segments to be fit, and the order in which their slopes are added
+    to the running sums, are found from the GROUPDQ section alone
+    (find_segments); all the segments are then fit in a single batch
+    (fit_segment_lines). The results are the same as those of
+    fit_segments_loop.
+
+    Parameters
+    ----------
+    data_sect: float, 3D array
+        section of input data cube array
+
+    gdq_sect: int, 3D array
+        section of GROUPDQ data quality array
+
+    opt_res: OptRes object
+        contains quantities related to fitting for optional output
+
+    rn_sect: float, 2D array
+        read noise values for all pixels in data section
+
+    gain_sect: float, 2D array
+        gain values for all pixels in data section
+
+    i_max_seg: int
+        used for size of initial allocation of arrays for optional results
+
+    weighting: string
+        'unweighted' specifies that no weighting should be used (default)
+        'optimal' specifies that optimal weighting should be used
+
+    f_max_seg: int
+        actual maximum number of segments within a ramp
+
+    Returns
+    -------
+    m_by_var: float, 1D array
+        values of slope/variance for good pixels
+
+    inv_var: float, 1D array
+        values of 1/variance for good pixels
+
+    f_max_seg: int
+        actual maximum number of segments within a ramp, updated here based on
+        fitting ramps in the current data section
+    """
+    nreads, asize2, asize1 = data_sect.shape
+    npix = asize2 * asize1  # number of pixels in section of 2D array
+
+    inv_var = np.zeros(npix, dtype=np.float64)
+    m_by_var = np.zeros(npix, dtype=np.float64)
+    num_seg = np.zeros(npix, dtype=np.int32)
+
+    if (opt_res is not None):
+        opt_res.init_2d(npix, i_max_seg)
+
+    seg_pix, seg_first, seg_nreads, check_var, seg_step = \
+        find_segments(np.reshape(gdq_sect, (nreads, npix)))
+
+    if len(seg_pix) == 0:
+        return m_by_var, inv_var, f_max_seg
+
+    slope, intercept, variance, sig_intercept, sig_slope = \
+        fit_segment_lines(data_sect, seg_pix, seg_first, seg_nreads,
+                          rn_sect, gain_sect, weighting)
+
+    # Add the segments to the running sums in the order in which they were
+    #   found; each step holds at most one segment per pixel
+    step_bounds = np.concatenate(([0], np.flatnonzero(np.diff(seg_step)) + 1,
+                                  [len(seg_step)]))
+
+    for lo, hi in zip(step_bounds[:-1], step_bounds[1:]):
+        use = ~check_var[lo:hi] | (variance[lo:hi] > 0.)
+        these = np.arange(lo, hi)[use]
+        g_pix = seg_pix[these]
+
+        inv_var[g_pix] += 1.0 / variance[these]
+        m_by_var[g_pix] += slope[these] / variance[these]
+
+        if (opt_res is not None):
+            # Append results to arrays
+            opt_res.interc_2d[num_seg[g_pix], g_pix] = intercept[these]
+            opt_res.slope_2d[num_seg[g_pix], g_pix] = slope[these]
+            opt_res.siginterc_2d[num_seg[g_pix], g_pix] = sig_intercept[these]
+            opt_res.sigslope_2d[num_seg[g_pix], g_pix] = sig_slope[these]
+            opt_res.inv_var_2d[num_seg[g_pix], g_pix] = inv_var[g_pix]
+
+        num_seg[g_pix] += 1
+
+    f_max_seg = max(f_max_seg, num_seg.max())
+
+    return m_by_var, inv_var, f_max_seg
+
+
+def find_segments(gdq_2d):
+    """
+    Extended Summary
+    ----------------
+    Find the ramp segments that contribute to the slopes of the pixels, for
+    datasets having more than 2 groups per integration. The segments are
+    delimited by the flagged (CR, saturated, ...) reads and the final read;
+    a segment starts at the flagged read that ends the previous segment, so
+    that the first read after a jump is included. The end points are
+    visited in increasing order for all pixels at once, with the same
+    classification of the segments (by length, by position in the ramp and
+    by number of good reads) as fit_next_segment. The numbers of good reads
+    in each segment are given by cumulative sums along the group axis, so
+    no data are needed.
+
+    Parameters
+    ----------
+    gdq_2d: int, 2D array
+        GROUPDQ of the data section, shape (nreads, npix)
+
+    Returns
+    -------
+    seg_pix: int, 1D array
+        pixel of each segment
+
+    seg_first: int, 1D array
+        first read of each segment
+
+    seg_nreads: int, 1D array
+        number of reads of each segment (0 if the segment has no good read)
+
+    check_var: boolean, 1D array
+        whether the segment contributes only if its variance is positive
+
+    seg_step: int, 1D array
+        order in which the segments are added to the running sums
+    """
+    nreads, npix = gdq_2d.shape
+    last_read = nreads - 1
+    reads = np.arange(nreads)[:, np.newaxis]
+
+    good = (gdq_2d == 0)
+    total_good = good.sum(axis=0)
+
+    # Number of good reads up to and including each read; last good read
+    #   at or before each read; first good read at or after each read
+    cum_good = np.cumsum(good, axis=0)
+    prev_good = np.maximum.accumulate(np.where(good, reads, -1), axis=0)
+    next_good = np.minimum.accumulate(
+        np.where(good, reads, nreads)[::-1], axis=0)[::-1]
+
+    # End points of the segments, in increasing order: every flagged read
+    #   other than the first, and the final read
+    is_end = ~good
+    is_end[0] = False
+    is_end[-1] = True
+    num_ends = is_end.sum(axis=0)
+    ends = np.sort(np.where(is_end, reads, nreads), axis=0)
+
+    start = np.zeros(npix, dtype=np.int32) # lowest channel in fit
+    pixel_done = np.zeros(npix, dtype=np.bool_)
+
+    seg_pix = []
+    seg_first = []
+    seg_nreads = []
+    check_var = []
+    seg_step = []
+
+    for i_end in range(num_ends.max()):
+        pix = np.flatnonzero(~pixel_done & (num_ends > i_end))
+        if len(pix) == 0:
+            break
+
+        pix_start = start[pix]
+        end_loc = ends[i_end, pix]
+        l_interval = end_loc - pix_start # fitting interval length
+        at_end = (end_loc == last_read)
+        n_tot = total_good[pix]
+
+        # Good reads in the interval; the read preceding the first good read
+        #   is also fit, as it is the first read after a jump
+        n_good = cum_good[end_loc, pix]
+        n_good[pix_start > 0] -= cum_good[pix_start[pix_start > 0] - 1,
+                                          pix[pix_start > 0]]
+        first = np.maximum(next_good[pix_start, pix] - 1, 0)
+        n_fit = np.where(n_good > 0, prev_good[end_loc, pix] - first + 1, 0)
+
+        case_a = (l_interval > 2) & at_end & (n_fit > 0)
+        case_b = (l_interval > 2) & ~at_end
+        case_e = (l_interval == 1) & at_end & (n_fit > 0)
+        case_f = (n_tot == 2) & (l_interval == 2)
+        case_g = (l_interval == 2) & ~at_end & (n_tot > 2)
+        case_h = (n_tot == 1) & (l_interval == 1) & ~at_end & (n_fit == 1)
+        case_i = (l_interval == 2) & at_end & (n_fit > 0)
+
+        # Segments contributing to the sums. Those of cases F and H are added
+        #   whatever their variance; a segment of both case F and case I is
+        #   added twice.
+        got_case = case_a | case_b | case_e | case_f | case_g | case_h | \
+                   case_i
+        twice = case_f & case_i
+        for sel, check in ((got_case, ~(case_f | case_h)),
+                           (twice, np.ones(len(pix), dtype=np.bool_))):
+            if sel.any():
+                seg_pix.append(pix[sel])
+                seg_first.append(first[sel])
+                seg_nreads.append(n_fit[sel])
+                check_var.append(check[sel])
+                seg_step.append(np.zeros(sel.sum(), dtype=np.int32) +
+                                len(seg_step))
+
+        # Advance to the next segment, or set the pixel as done
+        pixel_done[pix[case_a | case_e | case_f | case_h | case_i]] = True
+        next_seg = case_b | case_g
+        start[pix[next_seg]] = end_loc[next_seg]
+        start[pix[~got_case]] = np.minimum(pix_start[~got_case] + 1,
+                                           last_read)
+
+    if len(seg_pix) == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, empty, np.zeros(0, dtype=np.bool_), empty
+
+    return (np.concatenate(seg_pix), np.concatenate(seg_first),
+            np.concatenate(seg_nreads), np.concatenate(check_var),
+            np.concatenate(seg_step))
+
+
+def fit_segment_lines(data_sect, seg_pix, seg_first, seg_nreads, rn_sect,
+                      gain_sect, weighting):
+    """
+    Extended Summary
+    ----------------
+    Fit lines to a batch of ramp segments, using the same fits as fit_lines:
+    a segment having only the 0th read uses that read as the slope, a
+    segment having 2 reads uses their difference, a segment having more
+    reads is fit by least squares, and any other segment gets a slope of 0.
+    The reads of all the segments having more than 2 reads are gathered
+    into a single (segment, read) array, padded to the longest segment.
+
+    Parameters
+    ----------
+    data_sect: float, 3D array
+        section of input data cube array
+
+    seg_pix: int, 1D array
+        pixel of each segment
+
+    seg_first: int, 1D array
+        first read of each segment
+
+    seg_nreads: int, 1D array
+        number of reads of each segment
+
+    rn_sect: float, 2D array
+        read noise values for all pixels in data section
+
+    gain_sect: float, 2D array
+        gain values for all pixels in data section
+
+    weighting: string
+        'unweighted' specifies that no weighting should be used (default)
+        'optimal' specifies that optimal weighting should be used
+
+    Returns
+    -------
+    slope_s: float, 1D array
+       slope of each segment
+
+    intercept_s: float, 1D array
+       y-intercept of each segment
+
+    variance_s: float, 1D array
+       variance of the fit of each segment
+
+    sig_intercept_s: float, 1D array
+       sigma of the y-intercept of each segment
+
+    sig_slope_s: float, 1D array
+       sigma of the slope of each segment
+    """
+    nreads = data_sect.shape[0]
+    data_2d = np.reshape(data_sect, (nreads, -1))
+    nseg = len(seg_pix)
+
+    slope_s = np.zeros(nseg, dtype=np.float64)
+    variance_s = np.zeros(nseg, dtype=np.float64) + MIN_ERR
+    intercept_s = np.zeros(nseg, dtype=np.float64)
+    sig_intercept_s = np.zeros(nseg, dtype=np.float64) + MIN_ERR
+    sig_slope_s = np.zeros(nseg, dtype=np.float64) + MIN_ERR
+
+    # Segments consisting of the 0th read only
+    wh_1r = np.flatnonzero((seg_nreads == 1) & (seg_first == 0))
+    slope_s[wh_1r] = data_2d[0, seg_pix[wh_1r]]
+
+    # Segments having 2 reads
+    wh_2r = np.flatnonzero(seg_nreads == 2)
+    second = seg_first[wh_2r] + 1
+    data_1 = data_2d[seg_first[wh_2r], seg_pix[wh_2r]]
+    data_2 = data_2d[second, seg_pix[wh_2r]]
+    slope_s[wh_2r] = data_2 - data_1
+    intercept_s[wh_2r] = data_2 * (1. - second) + data_1 * second # by geometry
+
+    # Segments having >2 reads
+    good_seg = np.flatnonzero(seg_nreads > 2)
+    if len(good_seg) == 0:
+        return slope_s, intercept_s, variance_s, sig_intercept_s, sig_slope_s
+
+    pix = seg_pix[good_seg]
+    first = seg_first[good_seg]
+    nreads_1d = seg_nreads[good_seg]
+
+    rdnum = np.arange(nreads_1d.max())[np.newaxis, :]
+    in_seg = rdnum < nreads_1d[:, np.newaxis]
+    xvalues = np.minimum(first[:, np.newaxis] + rdnum, nreads - 1)
+    data_masked = data_2d[xvalues, pix[:, np.newaxis]] * in_seg
+    xvalues = xvalues * in_seg
+
+    if weighting.lower() == 'optimal': # fit using optimal weighting
+        rn_2_r = rn_sect.ravel()[pix]**2
+        gain_r = gain_sect.ravel()[pix]
+
+        # SNR from the difference between the last and first reads, where
+        #   this results in a positive SNR; otherwise 0
+        data_diff = (data_masked[np.arange(len(pix)), nreads_1d - 1] -
+                     data_masked[:, 0])
+        sqrt_arg = rn_2_r + data_diff * gain_r
+        wh_pos = (sqrt_arg >= 0.) & (gain_r != 0.)
+        snr = np.zeros(len(pix), dtype=np.float64)
+        snr[wh_pos] = data_diff[wh_pos] / \
+                      (np.sqrt(sqrt_arg[wh_pos]) / gain_r[wh_pos])
+        snr[snr < 0.] = 0.0
+
+        power_wt_r = calc_power(snr)  # get the weighting exponent for this SNR
+
+        # Optimal weights of the reads of each segment
+        nrd_prime = ((data_masked != 0.).sum(axis=1) - 1) / 2.
+        nrd_prime = nrd_prime[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wt_h = np.abs((np.abs(rdnum - nrd_prime) / nrd_prime) **
+                          power_wt_r[:, np.newaxis]) / rn_2_r[:, np.newaxis]
+        wt_h[~np.isfinite(wt_h)] = 0.
+        wt_h *= in_seg
+
+        nreads_wtd = wt_h.sum(axis=1)
+        sumx = (xvalues * wt_h).sum(axis=1)
+        sumxx = (xvalues**2 * wt_h).sum(axis=1)
+        sumy = (data_masked * wt_h).sum(axis=1)
+        sumxy = (xvalues * wt_h * data_masked).sum(axis=1)
+
+        slope, intercept, sig_slope, sig_intercept = \
+               calc_opt_fit(nreads_wtd, sumxx, sumx, sumxy, sumy)
+
+        variance = nreads_wtd / (nreads_wtd * sumxx - sumx**2)
+
+    elif weighting.lower() == 'unweighted': # fit using unweighted weighting
+        sumx, sumxx, sumxy, sumy = calc_unwtd_sums(data_masked.T, xvalues.T)
+
+        slope, intercept, sig_slope, sig_intercept, line_fit = \
+               calc_unwtd_fit(xvalues.T, nreads_1d, sumxx, sumx, sumxy, sumy)
+
+        variance = nreads_1d / (nreads_1d * sumxx - sumx**2)
+
+    else: # unsupported weighting type specified
+        log.error('FATAL ERROR: unsupported weighting type specified.')
+
+    # check to prevent NaN propagation
+    variance = correct_noiseless(variance, nreads_1d, data_sect, pix, rn_sect)
+
+    slope_s[good_seg] = slope
+    variance_s[good_seg] = variance
+    intercept_s[good_seg] = intercept
+    sig_intercept_s[good_seg] = sig_intercept
+    sig_slope_s[good_seg] = sig_slope
+
+    return slope_s, intercept_s, variance_s, sig_intercept_s, sig_slope_s
+
+
+def fit_segments_loop(data_sect, gdq_sect, opt_res, rn_sect, gain_sect,
+                      i_max_seg, ngroups, weighting, f_max_seg):
+    """
+    Short Summary
+    -------------
+    Fit the segments of the ramps of all pixels in the data cube section,
+    one segment per iteration: each iteration fits the current segment of
+    every pixel (fit_next_segment) and advances the pixels to their next
+    segment.
+
+    Parameters
+    ----------
+    data_sect: float, 3D array
+        section of input data cube array
+
+    gdq_sect: int, 3D array
+        section of GROUPDQ data quality array
+
+    opt_res: OptRes object
+        contains quantities related to fitting for optional output
+
+    rn_sect: float, 2D array
+        read noise values for all pixels in data section
+
+    gain_sect: float, 2D array
+        gain values for all pixels in data section
+
+    i_max_seg: int
+        used for size of initial allocation of arrays for optional results
+
+    ngroups: int
+        number of groups per integration
+
+    weighting: string
+        'unweighted' specifies that no weighting should be used (default)
+        'optimal' specifies that optimal weighting should be used
+
+    f_max_seg: int
+        actual maximum number of segments within a ramp
+
+    Returns
+    -------
+    m_by_var: float, 1D array
+        values of slope/variance for good pixels
+
+    inv_var: float, 1D array
+        values of 1/variance for good pixels
+
+    f_max_seg: int
+        actual maximum number of segments within a ramp, updated here based on
+        fitting ramps in the current data section
+    """
+    nreads, asize2, asize1 = data_sect.shape
+    npix = asize2 * asize1  # number of pixels in section of 2D array
+
     all_pix = np.arange(npix)
 
     arange_nreads_col = np.arange(nreads)[:, np.newaxis]
@@ -880,11 +1463,6 @@ def calc_slope(data_sect, gdq_sect, frame_time, opt_res, rn_sect, gain_sect,
     # the number of endpoints per pixel.
     end_heads = np.ones(npix * nreads, dtype=np.int32)
 
-    # Create nominal 2D ERR array, which is 1st slice of
-    #    avged_data_cube * readtime
-    err_2d_array = data_sect[0, :, :] * frame_time
-    err_2d_array[err_2d_array < 0] = 0
-
     # Frames >= start and <= end will be masked. However, the first channel
     #   to be included in fit will be the read in which a cosmic ray has
     #   been flagged
@@ -948,16 +1526,7 @@ def calc_slope(data_sect, gdq_sect, frame_time, opt_res, rn_sect, gain_sect,
         if f_max_seg is None:
             f_max_seg = 1
 
-    arange_nreads_col = 0
-    all_pix = 0
-
-    err_sect = np.zeros(cubeshape, dtype=np.float32)
-    # For now, making all error array slices within an integration and
-    #  section identical. Update later when use of error array has been decided
-    for ii in range(cubeshape[0]):
-        err_sect[ii, :, :] = err_2d_array
-
-    return err_sect, gdq_sect, m_by_var, inv_var, opt_res, f_max_seg
+    return m_by_var, inv_var, f_max_seg
 
 
 def fit_next_segment(start, end_st, end_heads, pixel_done, data_sect, mask_2d,
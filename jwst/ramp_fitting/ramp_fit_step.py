@@ -21,6 +21,7 @@ class RampFitStep (Step):
         int_name = string(default='')
         save_opt = boolean(default=False) # Save optional output
         opt_name = string(default='')
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of processes to use
 
     """
 
@@ -45,12 +46,16 @@ class RampFitStep (Step):
                                                      'gain')
 
             log.info('Using READNOISE reference file: %s', readnoise_filename)
-            readnoise_model = datamodels.ReadnoiseModel(readnoise_filename)
+            readnoise_model = self.open_reference_model(
+                readnoise_filename, datamodels.ReadnoiseModel)
             log.info('Using GAIN reference file: %s', gain_filename)
-            gain_model = datamodels.GainModel(gain_filename)
+            gain_model = self.open_reference_model(
+                gain_filename, datamodels.GainModel)
 
             log.info('Using algorithm = %s' % self.algorithm)
             log.info('Using weighting = %s' % self.weighting)
+            if self.maximum_cores != 'none':
+                log.info('Maximum cores to use = %s' % self.maximum_cores)
 
             buffsize = ramp_fit.BUFSIZE
             if self.algorithm == "GLS":
@@ -59,7 +64,8 @@ class RampFitStep (Step):
                         ramp_fit.ramp_fit(input_model,
                                            buffsize, self.save_opt,
                                            readnoise_model, gain_model,
-                                           self.algorithm, self.weighting)
+                                           self.algorithm, self.weighting,
+                                           max_cores=self.maximum_cores)
 
             readnoise_model.close()
 
@@ -0,0 +1,113 @@
+import numpy as np
+
+from ...datamodels import RampModel, ReadnoiseModel, GainModel, dqflags
+from .. import utils
+from ..ramp_fit import ols_ramp_fit, calc_slope
+
+
+def setup_inputs(nints=2, ngroups=8, nrows=37, ncols=20, seed=1):
+    rng = np.random.RandomState(seed)
+    data = (np.arange(ngroups)[:, np.newaxis, np.newaxis] *
+            rng.uniform(0, 50, size=(nrows, ncols)))
+    data = np.tile(data, (nints, 1, 1, 1))
+    data += rng.normal(0, 3, size=data.shape)
+    gdq = np.zeros(data.shape, dtype=np.uint8)
+    # cosmic rays and saturated pixels
+    crs = rng.uniform(size=data.shape) < 0.03
+    gdq[crs] = dqflags.group['JUMP_DET']
+    data[crs] += 500.
+    gdq[:, 6:, 0:3, 0:5] = dqflags.group['SATURATED']
+
+    model = RampModel(data=data.astype(np.float32),
+                      err=np.zeros(data.shape, dtype=np.float32),
+                      groupdq=gdq,
+                      pixeldq=np.zeros((nrows, ncols), dtype=np.uint32))
+    model.meta.instrument.name = 'NIRCAM'
+    model.meta.exposure.ngroups = ngroups
+    model.meta.exposure.nframes = 1
+    model.meta.exposure.groupgap = 0
+    model.meta.exposure.frame_time = 10.6
+    model.meta.exposure.group_time = 10.6
+    model.meta.exposure.drop_frames1 = 0
+
+    readnoise = ReadnoiseModel(data=np.full((nrows, ncols), 5.,
+                                            dtype=np.float32))
+    gain = GainModel(data=np.full((nrows, ncols), 2., dtype=np.float32))
+    for m in (model, readnoise, gain):
+        m.meta.subarray.xstart = 1
+        m.meta.subarray.ystart = 1
+        m.meta.subarray.xsize = ncols
+        m.meta.subarray.ysize = nrows
+
+    return model, readnoise, gain
+
+
+def test_parallel_sections_match_serial():
+    # a small buffer, so that each integration is fit in several sections
+    buffsize = 800
+    results = []
+    for max_cores in (1, 3):
+        model, readnoise, gain = setup_inputs()
+        results.append(ols_ramp_fit(model, buffsize, True, readnoise, gain,
+                                    'optimal', max_cores=max_cores))
+
+    (serial, serial_int, serial_opt), (pool, pool_int, pool_opt) = results
+
+    for attr in ('data', 'dq', 'err'):
+        assert np.array_equal(getattr(serial, attr), getattr(pool, attr))
+        assert np.array_equal(getattr(serial_int, attr),
+                              getattr(pool_int, attr))
+    for attr in ('slope', 'sigslope', 'yint', 'sigyint', 'weights',
+                 'pedestal', 'crmag'):
+        assert np.array_equal(getattr(serial_opt, attr),
+                              getattr(pool_opt, attr))
+
+
+def random_section(ngroups, nrows=30, ncols=30, seed=2):
+    rng = np.random.RandomState(seed)
+    data = (np.arange(ngroups)[:, np.newaxis, np.newaxis] *
+            rng.uniform(-2, 80, size=(nrows, ncols)))
+    data += rng.normal(0, 4, size=data.shape)
+    gdq = np.zeros(data.shape, dtype=np.uint8)
+    crs = rng.uniform(size=data.shape) < 0.05
+    gdq[crs] = dqflags.group['JUMP_DET']
+    data[crs] += 300.
+    # saturation starting at random groups, including the first ones
+    sat_start = rng.randint(0, ngroups + 4, size=(nrows, ncols))
+    for group in range(ngroups):
+        gdq[group][sat_start <= group] |= dqflags.group['SATURATED']
+    # consecutive jumps, jumps at the ends of the ramp
+    gdq[:, 0, 0:3] = 0
+    gdq[1:3, 0, 0] = dqflags.group['JUMP_DET']
+    gdq[0, 0, 1] = dqflags.group['JUMP_DET']
+    gdq[-2:, 0, 2] = dqflags.group['JUMP_DET']
+    readnoise = rng.uniform(3., 8., size=(nrows, ncols))
+    gain = rng.uniform(1., 3., size=(nrows, ncols))
+    return data, gdq, readnoise, gain
+
+
+def test_batched_segments_match_segment_loop():
+    for ngroups in (3, 4, 7, 15):
+        for weighting in ('optimal', 'unweighted'):
+            data, gdq, readnoise, gain = random_section(ngroups)
+            max_seg = ngroups + 1
+            results = []
+            for segment_loop in (True, False):
+                opt_res = utils.OptRes(1, data.shape[1:], max_seg, ngroups)
+                err, dq, m_by_var, inv_var, opt_res, f_max_seg = \
+                    calc_slope(data, gdq, 10.6, opt_res, readnoise, gain,
+                               max_seg, ngroups, weighting, 0,
+                               segment_loop=segment_loop)
+                results.append((m_by_var, inv_var, f_max_seg, opt_res))
+
+            (m_loop, iv_loop, max_loop, opt_loop), \
+                (m_batch, iv_batch, max_batch, opt_batch) = results
+
+            assert max_loop == max_batch
+            # the loop sums the optimal weights in single precision
+            assert np.allclose(iv_loop, iv_batch, rtol=1e-3, atol=1e-8)
+            assert np.allclose(m_loop, m_batch, rtol=1e-3, atol=1e-5)
+            assert np.allclose(opt_loop.slope_2d, opt_batch.slope_2d,
+                               rtol=1e-3, atol=1e-3)
+            assert np.array_equal(opt_loop.slope_2d != 0,
+                                  opt_batch.slope_2d != 0)
@@ -129,6 +129,41 @@ class OptRes(object):
             self.firstf_int[num_int, rlo:rhi, :] = ff_sect
 
 
+    def merge_sect(self, sect_res, num_int, rlo, rhi):
+        """
+        Short Summary
+        -------------
+        Copy the optional results of a data section, fit separately for a
+        single integration, to the 4D output arrays.
+
+        Parameters
+        ----------
+        sect_res: OptRes object
+            optional results for the data section; its arrays hold a single
+            integration and the rows of the section
+
+        num_int: int
+            integration number
+
+        rlo: int
+            first row of section
+
+        rhi: int
+            last row of section (exclusive)
+
+        Returns
+        -------
+
+        """
+        self.yint_seg[num_int, :, rlo:rhi, :] = sect_res.yint_seg[0]
+        self.slope_seg[num_int, :, rlo:rhi, :] = sect_res.slope_seg[0]
+        self.sigyint_seg[num_int, :, rlo:rhi, :] = sect_res.sigyint_seg[0]
+        self.sigslope_seg[num_int, :, rlo:rhi, :] = sect_res.sigslope_seg[0]
+        self.inv_var_seg[num_int, :, rlo:rhi, :] = sect_res.inv_var_seg[0]
+        self.firstf_int[num_int, rlo:rhi, :] = sect_res.firstf_int[0]
+        self.cr_mag_seg[num_int, :, rlo:rhi, :] = sect_res.cr_mag_seg[0]
+
+
     def append_arr(self, num_seg, g_pix, intercept, slope, sig_intercept,
                     sig_slope, inv_var):
         """
@@ -890,6 +925,8 @@ def get_ref_subs(model, readnoise_model, gain_model):
         ystop = ystart + ysize - 1
         gain_2d = gain_model.data[ystart - 1:ystop, xstart - 1:xstop]
 
-    readnoise_2d *= gain_2d # convert read noise to correct units
+    # convert read noise to correct units, in a new array rather than in
+    # the reference model
+    readnoise_2d = readnoise_2d * gain_2d
 
     return readnoise_2d, gain_2d
@@ -1,16 +1,34 @@
 from __future__ import division
 
 import logging
+import os
 
 import numpy as np
 from scipy.ndimage.filters import convolve1d
 from .. import datamodels
+from ..lib import parallel
+from ..lib.array_cache import ArrayCache
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# The Fourier transforms of the groups are done in blocks of groups whose
+# transforms (complex128) take at most this many bytes, to bound the size
+# of the temporary arrays
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
+
+# The alpha and beta arrays of the reference files, by file path and
+# modification time, within this many bytes (about two reference files)
+MAX_REFERENCE_CACHE_BYTES = 256 * 1024 * 1024
+_reference_arrays = ArrayCache(MAX_REFERENCE_CACHE_BYTES)
+
+# The Fourier filters used to interpolate the reference output, by
+# (scipix_n, refpix_r, pad, ny)
+_filters = {}
+
 def correct_model(input_model, irs2_model,
-                  scipix_n_default=16, refpix_r_default=4, pad=8):
+                  scipix_n_default=16, refpix_r_default=4, pad=8,
+                  max_cores=None, cache=False, ref_path=None):
     """Process IRS^2 data.
 
     Parameters
@@ -34,6 +52,18 @@ def correct_model(input_model, irs2_model,
         of each row (new-row overhead).  The padding is needed to preserve
         the phase of temporally periodic signals.
 
+    max_cores: str or int
+        Maximum number of threads used to correct the four amplifiers
+        (see `jwst.lib.parallel.number_of_processes`).
+
+    cache: bool
+        If True, keep the alpha and beta arrays of the reference file,
+        to be reused for later exposures corrected with the same file.
+
+    ref_path: str
+        The path of the IRS^2 reference file, by which the arrays are
+        cached.
+
     Returns
     -------
     output_model: ramp model
@@ -74,20 +104,7 @@ def correct_model(input_model, irs2_model,
     output_model = input_model.copy()
 
     # Get reference data.
-    nrows = len(irs2_model.irs2_table.field("alpha_0"))
-    if nrows != 712 * 2048:
-        log.warning("Number of rows in reference file = %d,"
-                    " but it should be 1458176." % nrows)
-    alpha = np.ones((4, nrows), dtype=np.complex64)
-    beta = np.zeros((4, nrows), dtype=np.complex64)
-    alpha[0, :] = irs2_model.irs2_table.field("alpha_0")
-    alpha[1, :] = irs2_model.irs2_table.field("alpha_1")
-    alpha[2, :] = irs2_model.irs2_table.field("alpha_2")
-    alpha[3, :] = irs2_model.irs2_table.field("alpha_3")
-    beta[0, :] = irs2_model.irs2_table.field("beta_0")
-    beta[1, :] = irs2_model.irs2_table.field("beta_1")
-    beta[2, :] = irs2_model.irs2_table.field("beta_2")
-    beta[3, :] = irs2_model.irs2_table.field("beta_3")
+    alpha, beta = get_reference_arrays(irs2_model, cache, ref_path)
 
     if beta is None:
         log.info("Using reference pixels only.")
@@ -133,7 +150,9 @@ def correct_model(input_model, irs2_model,
         # below.  The last axis of output_model.data should be 2048.
         data0 = data[integ, :, :, :]
         data0 = subtract_reference(data0, alpha, beta, irs2_mask,
-                                   scipix_n, refpix_r, pad)
+                                   scipix_n, refpix_r, pad,
+                                   nproc=parallel.number_of_processes(
+                                       max_cores))
         data[integ, :, :, nx - ny:] = data0
     temp_data = data[:, :, :, nx - ny:]
     del data
@@ -150,6 +169,57 @@ def correct_model(input_model, irs2_model,
 
     return output_model
 
+def get_reference_arrays(irs2_model, cache=False, ref_path=None):
+    """Get the alpha and beta arrays from the reference file.
+
+    Parameters
+    ----------
+    irs2_model: IRS^2 model
+        The reference file model for IRS^2 correction.
+
+    cache: bool
+        If True, the arrays are kept, within MAX_REFERENCE_CACHE_BYTES,
+        and the arrays kept for the same reference file (path and
+        modification time) are returned.  Nothing is cached without
+        `ref_path`.
+
+    ref_path: str
+        The path of the reference file.
+
+    Returns
+    -------
+    alpha, beta: ndarray
+        2-D complex arrays, with one row per sector.  See
+        `subtract_reference`.
+    """
+
+    key = None
+    if cache and ref_path is not None:
+        path = os.path.abspath(ref_path)
+        key = (path, os.path.getmtime(path))
+        arrays = _reference_arrays.get(key)
+        if arrays is not None:
+            return arrays
+
+    nrows = len(irs2_model.irs2_table.field("alpha_0"))
+    if nrows != 712 * 2048:
+        log.warning("Number of rows in reference file = %d,"
+                    " but it should be 1458176." % nrows)
+    alpha = np.ones((4, nrows), dtype=np.complex64)
+    beta = np.zeros((4, nrows), dtype=np.complex64)
+    alpha[0, :] = irs2_model.irs2_table.field("alpha_0")
+    alpha[1, :] = irs2_model.irs2_table.field("alpha_1")
+    alpha[2, :] = irs2_model.irs2_table.field("alpha_2")
+    alpha[3, :] = irs2_model.irs2_table.field("alpha_3")
+    beta[0, :] = irs2_model.irs2_table.field("beta_0")
+    beta[1, :] = irs2_model.irs2_table.field("beta_1")
+    beta[2, :] = irs2_model.irs2_table.field("beta_2")
+    beta[3, :] = irs2_model.irs2_table.field("beta_3")
+
+    if key is not None:
+        _reference_arrays.put(key, (alpha, beta))
+    return alpha, beta
+
 def make_irs2_mask(output_model, scipix_n, refpix_r):
 
     # Number of (scipix_n + refpix_r) per output, assuming four amplifier
@@ -242,7 +312,8 @@ def exclude_ref(output_model, irs2_mask):
         output_model.err = temp_array[..., irs2_mask]
 
 def subtract_reference(data0, alpha, beta, irs2_mask,
-                       scipix_n, refpix_r, pad):
+                       scipix_n, refpix_r, pad, nproc=1, group_loop=False,
+                       max_block_bytes=MAX_BLOCK_BYTES):
     """Subtract reference output and pixels for the current integration.
 
     Parameters
@@ -282,6 +353,20 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
         The effective number of pixels sampled during the pause at the end
         of each row (new-row overhead).
 
+    nproc: int
+        Number of threads used to correct the four amplifiers.  If 1, the
+        Fourier transforms of all the amplifiers of a block of groups are
+        done at once.
+
+    group_loop: bool
+        If True, interpolate and correct the groups and amplifiers one at
+        a time (the original implementation; the result is the same).
+
+    max_block_bytes: int
+        Unless `group_loop` is True, the groups are interpolated and
+        corrected in blocks of groups whose Fourier transforms take at
+        most this many bytes (and at least one group).
+
     Returns
     -------
     data0: ramp data
@@ -308,6 +393,12 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     # s[2] = shape[1] = ny, the length of the Y axis
     # s[3] = shape[0] = ngroups, the number of groups (or frames)
 
+    # The blocks of groups transformed at once
+    group_bytes = ny * row * np.dtype(np.complex128).itemsize
+    max_groups = max(1, max_block_bytes // group_bytes)
+    blocks = [slice(first, min(first + max_groups, ngroups))
+              for first in range(0, ngroups, max_groups)]
+
     ind_n = np.arange(512, dtype=np.intp)
     ind_ref = np.arange(512 // scipix_n * refpix_r, dtype=np.intp)
 
@@ -402,19 +493,13 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     w_ind = np.arange(1, 32, dtype=np.float32) / 32.
     w = np.sin(w_ind * np.pi)
     kk = 0
-    for jj in range(ngroups):
-        dat = data0[kk, jj, :, :].reshape(row * ny)
-        mask = (dat != 0.).astype(np.float32)
-        numerator = convolve1d(dat, w, mode='wrap')
-        denominator = convolve1d(mask, w, mode='wrap')
-        div_zero = (denominator == 0.)          # check for divide by zero
-        numerator = np.where(div_zero, 0., numerator)
-        denominator = np.where(div_zero, 1., denominator)
-        dat = numerator / denominator
-        dat = dat.reshape(ny, row)
-        mask = mask.reshape(ny, row)
-        # xxx why '+=' instead of just '=' ?
-        data0[kk, jj, :, :] += dat * (1. - mask)
+    if group_loop:
+        for jj in range(ngroups):
+            data0[kk, jj, :, :] += cosine_interp(data0[kk, jj, :, :], w)
+    else:
+        # A block of groups at a time
+        for block in blocks:
+            data0[kk, block, :, :] += cosine_interp(data0[kk, block, :, :], w)
 
     #;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
     # Use Fourier filter/interpolation to replace
@@ -422,32 +507,7 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     # (b) gaps and normal data in the time-ordered reference data
     # This "improves" upon the cosine interpolation performed above.
 
-    # Parameters for the filter to be used.
-    # length of apodization cosine filter
-    elen = 110000 // (scipix_n + refpix_r + 2)
-    # max unfiltered frequency
-    blen = (512 + 512 // scipix_n * (refpix_r + 2) + pad) // \
-           (scipix_n + refpix_r + 2) * ny // 2 - elen // 2
-
-    # Construct the filter [1, cos, 0, cos, 1].
-
-    temp_a1 = (np.cos(np.arange(elen, dtype=np.float32) *
-                      np.pi / float(elen)) + 1.) / 2.
-
-    # elen = 5000
-    # blen = 30268
-    # row * ny // 2 - 2 * blen - 2 * elen = 658552
-    # len(temp_a2) = 729088
-
-    temp_a2 = np.concatenate((np.ones(blen, dtype=np.float32),
-                              temp_a1.copy(),
-                              np.zeros(row * ny // 2 - 2 * blen - 2 * elen,
-                                       dtype=np.float32),
-                              temp_a1[::-1].copy(),
-                              np.ones(blen, dtype=np.float32)))
-    roll_a2 = np.roll(temp_a2, -1)
-    aa = np.concatenate((temp_a2, roll_a2[::-1]))
-    del temp_a1, temp_a2, roll_a2
+    aa = fourier_filter(scipix_n, refpix_r, pad, ny)
 
     # IDL:  aa = a # replicate(1, s[3]) ; for application to the data
     # In IDL, aa is a 2-D array with one column of `a` for each group.  In
@@ -459,7 +519,8 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     #                        row, hnorm, hnorm1, s, aa , n_iter_norm
     fft_interp_norm(dd0, np.ones((ny, nx // 4), dtype=np.int64),
                     row, hnorm, hnorm1,
-                    ny, ngroups, aa, n_iter_norm)
+                    ny, ngroups, aa, n_iter_norm, group_loop=group_loop,
+                    max_groups=max_groups)
     data0[0, :, :, :] = dd0.copy()
     del aa, dd0
 
@@ -522,39 +583,66 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     # FFT.  This really shouldn't matter.
     normalization = float(shape_d[2] * shape_d[3])
 
-    if beta is not None:
+    def reference_output(groups):
+        """The Fourier transform of the reference output of the groups"""
+        if beta is None:
+            return None
         # IDL:  refout0 = reform(data0[*,*,*,0], sd[1] * sd[2], sd[3])
-        refout0 = data0[0, :, :, :].reshape((shape_d[1],
-                                           shape_d[2] * shape_d[3]))
+        refout0 = data0[0, groups, :, :].reshape((-1,
+                                                  shape_d[2] * shape_d[3]))
         # IDL:  refout0 = fft(refout0, dim=1, /over)
         # Divide by the length of the axis to be consistent with IDL.
-        refout0 = np.fft.fft(refout0, axis=1) / normalization
+        return np.fft.fft(refout0, axis=1) / normalization
 
     # IDL:  r0 = reform(r0, sd[1] * sd[2], sd[3], 5, /over)
     r0 = r0.reshape((5, shape_d[1], shape_d[2] * shape_d[3]))
     r0 = r0.astype(np.complex64)
-    r0f = ["dummy", 1, 1, 1, 1]         # elements 1 - 4 populated in loop
-    for k in range(1, 5):
-        r0f[k] = np.fft.fft(r0[k, :, :], axis=1) / normalization
-
-    # IDL:  for k=0,3 do oBridge[k]->Execute,
-    #           "for i=0, s3-1 do r0[*,i] *= alpha"
-    for k in range(1, 5):
-        for i in range(ngroups):
-            # Each element of r0f is the fft of r0[k, :, :], for some k.
-            r0f[k][i, :] *= alpha[k - 1]
-
-    # IDL:  for k=0,3 do oBridge[k]->Execute,
-    #           "for i=0, s3-1 do r0[*,i] += beta * refout0[*,i]"
-    if beta is not None:
+    if group_loop:
+        refout0 = reference_output(slice(None))
+        r0f = ["dummy", 1, 1, 1, 1]     # elements 1 - 4 populated in loop
         for k in range(1, 5):
-            for i in range(ngroups):
-                r0f[k][i, :] += (beta[k - 1] * refout0[i, :])
+            r0f[k] = np.fft.fft(r0[k, :, :], axis=1) / normalization
 
-    # IDL:  for k=0,3 do oBridge[k]->Execute,
-    #           "r0 = fft(r0, 1, dim=1, /overwrite)", /nowait
-    for k in range(1, 5):
-        r0[k, :, :] = np.fft.ifft(r0f[k], axis=1) * normalization
+        # IDL:  for k=0,3 do oBridge[k]->Execute,
+        #           "for i=0, s3-1 do r0[*,i] *= alpha"
+        for k in range(1, 5):
+            for i in range(ngroups):
+                # Each element of r0f is the fft of r0[k, :, :], for some k.
+                r0f[k][i, :] *= alpha[k - 1]
+
+        # IDL:  for k=0,3 do oBridge[k]->Execute,
+        #           "for i=0, s3-1 do r0[*,i] += beta * refout0[*,i]"
+        if beta is not None:
+            for k in range(1, 5):
+                for i in range(ngroups):
+                    r0f[k][i, :] += (beta[k - 1] * refout0[i, :])
+
+        # IDL:  for k=0,3 do oBridge[k]->Execute,
+        #           "r0 = fft(r0, 1, dim=1, /overwrite)", /nowait
+        for k in range(1, 5):
+            r0[k, :, :] = np.fft.ifft(r0f[k], axis=1) * normalization
+    elif nproc <= 1:
+        # All the amplifiers of a block of groups at once
+        for block in blocks:
+            r0[1:, block] = correct_amplifier((r0[1:, block], alpha, beta,
+                                               reference_output(block),
+                                               normalization))
+    else:
+        # One amplifier of a block of groups per thread
+        betas = [None] * 4 if beta is None else beta
+
+        def tasks():
+            for block in blocks:
+                refout0 = reference_output(block)
+                for k in range(1, 5):
+                    yield (r0[k, block], alpha[k - 1], betas[k - 1],
+                           refout0, normalization)
+
+        results = parallel.imap_ordered(correct_amplifier, tasks(),
+                                        min(nproc, 4), threads=True)
+        for block in blocks:
+            for k in range(1, 5):
+                r0[k, block] = next(results)
 
     # sd[1] = shape_d[3]   row (712)
     # sd[2] = shape_d[2]   ny (2048)
@@ -591,11 +679,27 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     return data0
 
 def fft_interp_norm(dd0, mask0, row, hnorm, hnorm1,
-                    ny, ngroups, aa, n_iter_norm):
+                    ny, ngroups, aa, n_iter_norm, group_loop=False,
+                    max_groups=None):
 
     mm = np.zeros((ny, row), dtype=np.int8)
     mm[:, hnorm1] = mask0[:, hnorm]
     hm = (mm != 0)                      # 2-D boolean mask
+    if not group_loop:
+        # Transform blocks of up to max_groups groups at once
+        if max_groups is None:
+            max_groups = ngroups
+        for first in range(0, ngroups, max_groups):
+            block = slice(first, min(first + max_groups, ngroups))
+            dd = dd0[block].reshape((-1, ny * row))
+            p = dd.copy()
+            for it in range(n_iter_norm):
+                pp = np.fft.fft(p, axis=1)
+                pp *= aa
+                p[:] = np.fft.ifft(pp, axis=1).real
+                p[:, hm.ravel()] = dd[:, hm.ravel()]
+            dd0[block] = p.reshape((-1, ny, row))
+        return
     for j in range(ngroups):
         dd = dd0[j, :, :].copy()
         p = dd.flatten()                        # make a copy, not a view
@@ -606,6 +710,111 @@ def fft_interp_norm(dd0, mask0, row, hnorm, hnorm1,
             p[hm.ravel()] = dd[hm]
         dd0[j, :, :] = p.reshape((ny, row))
 
+def cosine_interp(data, w):
+    """Replace the zero values of the time-ordered data by a cosine
+    weighted interpolation.
+
+    Parameters
+    ----------
+    data: ndarray
+        The time-ordered data, (ny, row), or (ngroups, ny, row) to
+        interpolate each group
+
+    w: ndarray
+        The interpolation weights
+
+    Returns
+    -------
+    ndarray
+        The interpolated values at the zero values of `data`, zero
+        elsewhere
+    """
+
+    shape = data.shape
+    dat = data.reshape(shape[:-2] + (shape[-2] * shape[-1],))
+    mask = (dat != 0.).astype(np.float32)
+    numerator = convolve1d(dat, w, axis=-1, mode='wrap')
+    denominator = convolve1d(mask, w, axis=-1, mode='wrap')
+    div_zero = (denominator == 0.)          # check for divide by zero
+    numerator = np.where(div_zero, 0., numerator)
+    denominator = np.where(div_zero, 1., denominator)
+    dat = numerator / denominator
+    # xxx why '+=' instead of just '=' ?
+    return (dat * (1. - mask)).reshape(shape)
+
+def fourier_filter(scipix_n, refpix_r, pad, ny):
+    """The filter used to interpolate the reference output in the Fourier
+    domain.  It is the same for every exposure with the same readout, so
+    it is computed once.
+
+    Returns
+    -------
+    aa: ndarray
+        1-D array with the same length as the time-ordered data of a group.
+    """
+
+    key = (scipix_n, refpix_r, pad, ny)
+    if key in _filters:
+        return _filters[key]
+
+    row = (scipix_n + refpix_r + 2) * 512 // scipix_n + pad
+
+    # Parameters for the filter to be used.
+    # length of apodization cosine filter
+    elen = 110000 // (scipix_n + refpix_r + 2)
+    # max unfiltered frequency
+    blen = (512 + 512 // scipix_n * (refpix_r + 2) + pad) // \
+           (scipix_n + refpix_r + 2) * ny // 2 - elen // 2
+
+    # Construct the filter [1, cos, 0, cos, 1].
+
+    temp_a1 = (np.cos(np.arange(elen, dtype=np.float32) *
+                      np.pi / float(elen)) + 1.) / 2.
+
+    # elen = 5000
+    # blen = 30268
+    # row * ny // 2 - 2 * blen - 2 * elen = 658552
+    # len(temp_a2) = 729088
+
+    temp_a2 = np.concatenate((np.ones(blen, dtype=np.float32),
+                              temp_a1.copy(),
+                              np.zeros(row * ny // 2 - 2 * blen - 2 * elen,
+                                       dtype=np.float32),
+                              temp_a1[::-1].copy(),
+                              np.ones(blen, dtype=np.float32)))
+    roll_a2 = np.roll(temp_a2, -1)
+    aa = np.concatenate((temp_a2, roll_a2[::-1]))
+    aa.flags.writeable = False
+
+    _filters[key] = aa
+    return aa
+
+def correct_amplifier(task):
+    """Correct the time-ordered reference pixels of amplifiers in the
+    Fourier domain, using the reference output.
+
+    Parameters
+    ----------
+    task: tuple
+        (r0, alpha, beta, refout0, normalization): the reference data
+        of one amplifier, (ngroups, npix), or of several amplifiers,
+        (namps, ngroups, npix), with the alpha and beta rows of those
+        amplifiers, the Fourier transform of the reference output,
+        (ngroups, npix), and the FFT normalization.
+
+    Returns
+    -------
+    ndarray
+        The corrected reference data, same shape as r0.
+    """
+
+    r0, alpha, beta, refout0, normalization = task
+    r0f = np.fft.fft(r0, axis=-1) / normalization
+    r0f *= alpha[..., np.newaxis, :]
+    if beta is not None:
+        r0f += beta[..., np.newaxis, :] * refout0
+    return np.fft.ifft(r0f, axis=-1) * normalization
+
 def ols_line(x, y):
     """Fit a straight line using ordinary least squares."""
 
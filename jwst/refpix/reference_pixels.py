@@ -80,6 +80,13 @@ MIR_reference_sections = {'A': {'left': (0, 1024, 0),
                                'data': (0, 1024, 7, 1028, 4)}
                           }
 
+def per_group(refsignal):
+    """Reference signal of each group, shaped to be subtracted from a
+    stack of groups.  A single value is returned as is."""
+    if np.ndim(refsignal) == 0:
+        return refsignal
+    return np.asarray(refsignal)[:, np.newaxis, np.newaxis]
+
 class Dataset(object):
     """Base Class to handle passing stuff from routine to routine
 
@@ -162,6 +169,8 @@ class Dataset(object):
 
         """
 
+        if data.ndim > dq.ndim:
+            return self.sigma_clip_groups(data, dq, low, high)
         #
         # Only calculate the clipped mean for pixels that don't have the DO_NOT_USE
         # DQ bit set
@@ -176,6 +185,57 @@ class Dataset(object):
             mean = data[goodpixels].mean(dtype=np.float64)
         return mean
 
+    def sigma_clip_groups(self, data, dq, low=3.0, high=3.0):
+        """Sigma-clipped means of the pixels of each group of a stack of
+        groups, computed for all the groups at once.  The pixels are
+        clipped as by scipy.stats.sigmaclip, iterating until no more pixels
+        are rejected, but the means are accumulated in double precision.
+
+        Parameters:
+        -----------
+
+        data: NDArray
+            Array of pixels to be sigma-clipped, with the groups along the
+            first axis
+
+        dq: NDArray
+            DQ array for the pixels of one group
+
+        low: float
+            lower clipping boundary, in standard deviations from the mean (default=3.0)
+
+        high: float
+            upper clipping boundary, in standard deviations from the mean (default=3.0)
+
+        Returns:
+        --------
+
+        mean: NDArray
+            1-d array of the clipped means of the groups
+
+        """
+
+        goodpixels = np.bitwise_and(dq, dqflags.pixel['DO_NOT_USE']) == 0
+        values = data[:, goodpixels].astype(np.float64)
+        keep = np.ones(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            while True:
+                npix = keep.sum(axis=1)
+                mean = np.where(keep, values, 0.0).sum(axis=1) / npix
+                deviation = np.where(keep, values - mean[:, np.newaxis], 0.0)
+                std = np.sqrt((deviation ** 2).sum(axis=1) / npix)
+                clipped = (keep &
+                           (values >= (mean - std * low)[:, np.newaxis]) &
+                           (values <= (mean + std * high)[:, np.newaxis]))
+                #
+                # Groups having pixels all with the same value are not
+                # clipped
+                clipped[std == 0.0] = keep[std == 0.0]
+                if np.array_equal(clipped, keep):
+                    break
+                keep = clipped
+        return mean.astype(data.dtype)
+
 
 class NIRDataset(Dataset):
     """Generic NIR detector Class.
@@ -250,7 +310,7 @@ class NIRDataset(Dataset):
         rowstart, rowstop, colstart, colstop = \
             NIR_reference_sections[amplifier][top_or_bottom]
 
-        oddref = group[rowstart:rowstop, colstart:colstop: 2]
+        oddref = group[..., rowstart:rowstop, colstart:colstop: 2]
         odddq = self.pixeldq[rowstart:rowstop, colstart:colstop: 2]
         return oddref, odddq
 
@@ -286,7 +346,7 @@ class NIRDataset(Dataset):
         #
         # Even columns start on the second column
         colstart = colstart + 1
-        evenref = group[rowstart:rowstop, colstart:colstop: 2]
+        evenref = group[..., rowstart:rowstop, colstart:colstop: 2]
         evendq = self.pixeldq[rowstart:rowstop, colstart:colstop: 2]
         return evenref, evendq
 
@@ -388,7 +448,7 @@ class NIRDataset(Dataset):
         else:
             rowstart, rowstop, colstart, colstop = \
                 NIR_reference_sections[amplifier][top_or_bottom]
-            ref = group[rowstart:rowstop, colstart:colstop]
+            ref = group[..., rowstart:rowstop, colstart:colstop]
             dq = self.pixeldq[rowstart:rowstop, colstart:colstop]
             mean = self.sigma_clip(ref, dq)
             return mean
@@ -465,19 +525,22 @@ class NIRDataset(Dataset):
                 # For now, just average the top and bottom corrections
                 oddrefsignal = 0.5 * (oddreftop + oddrefbottom)
                 evenrefsignal = 0.5 * (evenreftop + evenrefbottom)
-                oddslice = (slice(datarowstart, datarowstop, 1),
+                oddslice = (Ellipsis,
+                            slice(datarowstart, datarowstop, 1),
                             slice(datacolstart, datacolstop, 2))
-                evenslice = (slice(datarowstart, datarowstop, 1),
+                evenslice = (Ellipsis,
+                             slice(datarowstart, datarowstop, 1),
                              slice(datacolstart + 1, datacolstop, 2))
-                group[oddslice] = group[oddslice] - oddrefsignal
-                group[evenslice] = group[evenslice] - evenrefsignal
+                group[oddslice] = group[oddslice] - per_group(oddrefsignal)
+                group[evenslice] = group[evenslice] - per_group(evenrefsignal)
             else:
                 reftop = refvalues[amplifier]['top']
                 refbottom = refvalues[amplifier]['bottom']
                 refsignal = 0.5 * (reftop + refbottom)
-                dataslice = (slice(datarowstart, datarowstop, 1),
+                dataslice = (Ellipsis,
+                             slice(datarowstart, datarowstop, 1),
                              slice(datacolstart, datacolstop, 1))
-                group[dataslice] = group[dataslice] - refsignal
+                group[dataslice] = group[dataslice] - per_group(refsignal)
         return
 
     def create_reflected(self, data, smoothing_length):
@@ -506,16 +569,18 @@ class NIRDataset(Dataset):
 
         """
 
-        nrows, ncols = data.shape
+        nrows, ncols = data.shape[-2:]
         if smoothing_length % 2 == 0:
             log.info("Smoothing length must be odd, adding 1")
             smoothing_length = smoothing_length + 1
         newheight = nrows + smoothing_length - 1
-        reflected = np.zeros((newheight, ncols), dtype=data.dtype)
+        reflected = np.zeros(data.shape[:-2] + (newheight, ncols),
+                             dtype=data.dtype)
         bufsize = smoothing_length // 2
-        reflected[bufsize:bufsize + nrows] = data[:]
-        reflected[:bufsize] = data[bufsize:0:-1]
-        reflected[nrows + bufsize:] = data[-1:nrows - 1 - bufsize:-1]
+        reflected[..., bufsize:bufsize + nrows, :] = data
+        reflected[..., :bufsize, :] = data[..., bufsize:0:-1, :]
+        reflected[..., nrows + bufsize:, :] = \
+            data[..., -1:nrows - 1 - bufsize:-1, :]
         return reflected
 
     def median_filter(self, data, dq, smoothing_length):
@@ -541,6 +606,8 @@ class NIRDataset(Dataset):
             1-d array that is a median filtered version of the input data
         """
 
+        if data.ndim > dq.ndim:
+            return self.median_filter_groups(data, dq, smoothing_length)
         augmented_data = self.create_reflected(data, smoothing_length)
         augmented_dq = self.create_reflected(dq, smoothing_length)
         nrows, ncols = data.shape
@@ -554,6 +621,61 @@ class NIRDataset(Dataset):
             result[i] = np.median(window)
         return result
 
+    def median_filter_groups(self, data, dq, smoothing_length):
+        """Median filter of each group of a stack of groups, computed for
+        all the groups at once.  Gives the same result as median_filter
+        run on each group.
+
+        Parameters:
+        -----------
+
+        data: NDArray
+            input 3-d science array, with the groups along the first axis
+
+        dq: NDArray
+            input 2-d dq array
+
+        smoothing_length: integer (should be odd)
+            height of box within which the median value is calculated
+
+        Returns:
+        --------
+
+        result: NDArray
+            2-d array of the median filtered versions of the groups
+        """
+
+        augmented_data = self.create_reflected(data, smoothing_length)
+        ngroups, nrows, ncols = data.shape
+        #
+        # The box starting at row i covers rows i to i + smoothing_length - 1
+        # of the reflected data, but, as in median_filter, the pixels are
+        # selected by the DQ of the same rows of the input, so the boxes
+        # at the end of the input are cut short
+        rows = np.arange(nrows)[:, np.newaxis] + np.arange(smoothing_length)
+        gooddq = np.bitwise_and(dq, dqflags.pixel['DO_NOT_USE']) == 0
+        gooddq = np.concatenate([gooddq, np.zeros((smoothing_length - 1, ncols),
+                                                  dtype=bool)])
+        goodpixels = gooddq[rows].reshape(nrows, smoothing_length * ncols)
+        windows = augmented_data[:, rows].reshape(ngroups, nrows,
+                                                  smoothing_length * ncols)
+        #
+        # Sort the good pixels of each box to the start, and take the
+        # middle one (or the mean of the middle two)
+        hasnan = np.any(np.isnan(windows) & goodpixels, axis=2)
+        windows = np.where(goodpixels, windows, np.nan)
+        windows.sort(axis=2)
+        ngood = goodpixels.sum(axis=1)
+        group_index = np.arange(ngroups)[:, np.newaxis]
+        row_index = np.arange(nrows)
+        lower = windows[group_index, row_index, (ngood - 1) // 2]
+        upper = windows[group_index, row_index, ngood // 2]
+        result = np.where(ngood % 2 == 1, lower,
+                          (lower + upper) / 2).astype(np.float64)
+        result[:, ngood == 0] = np.nan
+        result[hasnan] = np.nan
+        return result
+
     def calculate_side_ref_signal(self, group, colstart, colstop):
         """Calculate the reference pixel signal from the side reference pixels
         by running a box up the side reference pixels and calculating the running
@@ -580,7 +702,7 @@ class NIRDataset(Dataset):
         """
 
         smoothing_length = self.side_smoothing_length
-        data = group[:, colstart:colstop + 1]
+        data = group[..., colstart:colstop + 1]
         dq = self.pixeldq[:, colstart:colstop + 1]
         return self.median_filter(data, dq, smoothing_length)
 
@@ -657,10 +779,13 @@ class NIRDataset(Dataset):
         corrected_group = self.apply_side_correction(group, sidegroup)
         return corrected_group
 
-    def do_corrections(self):
+    def do_corrections(self, group_loop=False):
         """Do Reference Pixels Corrections for all amplifiers, NIR detectors
         First read of each integration is NOT subtracted, as the signal is removed
-        in the superbias subtraction step"""
+        in the superbias subtraction step
+
+        All the groups of an integration are corrected at once, unless
+        group_loop is True"""
 
         #
         #  First transform to detector coordinates
@@ -668,6 +793,18 @@ class NIRDataset(Dataset):
         self.DMS_to_detector()
         (nints, ngroups, nrows, ncols) = self.data.shape
         for integration in range(nints):
+            if not group_loop:
+                groups = self.data[integration]
+                refvalues = self.get_refvalues(groups)
+                self.do_top_bottom_correction(groups, refvalues)
+                if self.use_side_ref_pixels:
+                    left = self.calculate_side_ref_signal(groups, 0, 3)
+                    right = self.calculate_side_ref_signal(groups, 2044, 2047)
+                    sidesignal = 0.5 * (left + right)
+                    np.subtract(groups,
+                                self.side_gain * sidesignal[:, :, np.newaxis],
+                                out=groups, casting='unsafe')
+                continue
             for group in range(ngroups):
                 #
                 # Get the reference values from the top and bottom reference
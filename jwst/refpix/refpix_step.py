@@ -18,6 +18,8 @@ class RefPixStep(Step):
         side_smoothing_length = integer(default=11)
         side_gain = float(default=1.0)
         odd_even_rows = boolean(default=True)
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of threads to use for IRS2
+        cache_irs2_reference = boolean(default=False) # keep the IRS2 reference arrays for later exposures
     """
 
     reference_file_types = ['refpix']
@@ -40,9 +42,15 @@ class RefPixStep(Step):
                     input_model.close()
                     return result
 
+                if self.maximum_cores != 'none':
+                    self.log.info('Maximum cores to use = %s',
+                                  self.maximum_cores)
                 irs2_model = datamodels.IRS2Model(self.irs2_name)
-                result = irs2_subtract_reference.correct_model(input_model,
-                                                               irs2_model)
+                result = irs2_subtract_reference.correct_model(
+                    input_model, irs2_model,
+                    max_cores=self.maximum_cores,
+                    cache=self.cache_irs2_reference,
+                    ref_path=self.irs2_name)
                 result.meta.cal_step.refpix = 'COMPLETE'
                 irs2_model.close()
             else:
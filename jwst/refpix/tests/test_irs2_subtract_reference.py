@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from ... import datamodels
+from .. import irs2_subtract_reference
+
+SCIPIX_N, REFPIX_R, PAD = 16, 4, 8
+
+
+def make_data(ngroups=2, seed=1):
+    rng = np.random.RandomState(seed)
+    model = datamodels.RampModel((1, ngroups, 2048, 3200))
+    irs2_mask = irs2_subtract_reference.make_irs2_mask(model, SCIPIX_N,
+                                                       REFPIX_R)
+    data = rng.normal(1000., 10., (ngroups, 2048, 3200)).astype(np.float32)
+
+    nrows = 712 * 2048
+    shape = (4, nrows)
+    alpha = (1. + 0.01 * rng.normal(size=shape) +
+             0.01j * rng.normal(size=shape)).astype(np.complex64)
+    beta = (0.01 * rng.normal(size=shape) +
+            0.01j * rng.normal(size=shape)).astype(np.complex64)
+    return data, alpha, beta, irs2_mask
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_batched_matches_group_loop(nproc):
+    """Transforming all groups and amplifiers at once gives the same result
+    as the group by group loop"""
+    data, alpha, beta, irs2_mask = make_data()
+
+    expected = irs2_subtract_reference.subtract_reference(
+        data.copy(), alpha, beta, irs2_mask, SCIPIX_N, REFPIX_R, PAD,
+        group_loop=True)
+    result = irs2_subtract_reference.subtract_reference(
+        data.copy(), alpha, beta, irs2_mask, SCIPIX_N, REFPIX_R, PAD,
+        nproc=nproc)
+
+    assert result.shape == (2, 2048, 2048)
+    assert np.array_equal(result, expected)
+
+
+@pytest.mark.parametrize('nproc', [1, 2])
+def test_blocks_match_group_loop(nproc):
+    """Transforming the groups in blocks gives the same result"""
+    data, alpha, beta, irs2_mask = make_data(ngroups=3)
+
+    expected = irs2_subtract_reference.subtract_reference(
+        data.copy(), alpha, beta, irs2_mask, SCIPIX_N, REFPIX_R, PAD,
+        group_loop=True)
+    # One group per block
+    result = irs2_subtract_reference.subtract_reference(
+        data.copy(), alpha, beta, irs2_mask, SCIPIX_N, REFPIX_R, PAD,
+        nproc=nproc, max_block_bytes=1)
+
+    assert np.array_equal(result, expected)
+
+
+def test_reference_arrays_cache(tmpdir):
+    """The reference arrays are cached by path and modification time"""
+    class Table(object):
+        def field(self, name):
+            return np.full(10, float(name[-1]), dtype=np.float32)
+
+    class Model(object):
+        irs2_table = Table()
+
+    path = str(tmpdir.join('irs2.fits'))
+    open(path, 'w').close()
+    alpha, beta = irs2_subtract_reference.get_reference_arrays(
+        Model(), True, path)
+    assert irs2_subtract_reference.get_reference_arrays(
+        Model(), True, path)[0] is alpha
+    os.utime(path, (0, 0))
+    assert irs2_subtract_reference.get_reference_arrays(
+        Model(), True, path)[0] is not alpha
+
+
+def test_fourier_filter_cached():
+    aa = irs2_subtract_reference.fourier_filter(SCIPIX_N, REFPIX_R, PAD, 2048)
+    assert irs2_subtract_reference.fourier_filter(SCIPIX_N, REFPIX_R, PAD,
+                                                  2048) is aa
+    assert aa.shape == (712 * 2048,)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from ... import datamodels
+from ...datamodels import dqflags
+from .. import reference_pixels
+
+
+def make_ramp(detector, ngroups=3, seed=1):
+    rng = np.random.RandomState(seed)
+    model = datamodels.RampModel((1, ngroups, 2048, 2048))
+    model.meta.instrument.detector = detector
+    model.meta.subarray.name = 'FULL'
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.xsize = 2048
+    model.meta.subarray.ysize = 2048
+    model.data[:] = rng.normal(1000., 10., model.data.shape)
+    # a drift of the bias level from group to group
+    model.data += 20. * np.arange(ngroups)[:, np.newaxis, np.newaxis]
+    model.pixeldq[rng.uniform(size=(2048, 2048)) < 0.01] = \
+        dqflags.pixel['DO_NOT_USE']
+    return model
+
+
+def correct(model, group_loop, odd_even_columns, side_smoothing_length):
+    dataset = reference_pixels.create_dataset(
+        model, odd_even_columns, True, side_smoothing_length, 1.0, True)
+    dataset.do_corrections(group_loop=group_loop)
+    return dataset.data
+
+
+@pytest.mark.parametrize('detector', ['NRCA1', 'NRS2'])
+@pytest.mark.parametrize('odd_even_columns, side_smoothing_length',
+                         [(True, 11), (False, 10)])
+def test_groups_match_group_loop(detector, odd_even_columns,
+                                 side_smoothing_length):
+    """Correcting all the groups at once matches the group by group loop"""
+    model = make_ramp(detector)
+    expected = correct(model.copy(), True, odd_even_columns,
+                       side_smoothing_length)
+    result = correct(model.copy(), False, odd_even_columns,
+                     side_smoothing_length)
+
+    # The clipped means are accumulated in double precision
+    assert np.allclose(result, expected, rtol=0, atol=1e-3)
+    # the drift is removed
+    assert np.abs(result.mean(axis=(2, 3))).max() < 1.
+
+
+def test_median_filter_groups():
+    """The median filter of a stack of groups matches that of each group"""
+    model = make_ramp('NRCA1')
+    dataset = reference_pixels.create_dataset(model, True, True, 11, 1.0,
+                                              True)
+    data = model.data[0, :, :, :4].copy()
+    data[1, 20, 2] = np.nan
+    dq = model.pixeldq[:, :4]
+    for smoothing_length in (1, 2, 11):
+        expected = [dataset.median_filter(group, dq, smoothing_length)
+                    for group in data]
+        result = dataset.median_filter(data, dq, smoothing_length)
+        np.testing.assert_array_equal(result, expected)
@@ -15,12 +15,16 @@ from gwcs import wcstools
 from drizzle import util
 from drizzle import doblot
 from drizzle.cdrizzle import tblot
-from . import resample_utils
+from . import pixmap_cache
 
 import logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Margin (pixels) of the resampled image kept around the footprint of an
+# input image, for the interpolation kernels of tblot
+BLOT_MARGIN = 16
+
 
 class GWCSBlot(object):
     """
@@ -52,7 +56,8 @@ class GWCSBlot(object):
         self.source_wcs = product.meta.wcs
         self.source = product.data
 
-    def extract_image(self, blot_img, interp='poly5', sinscl=1.0):
+    def extract_image(self, blot_img, interp='poly5', sinscl=1.0,
+                      pixmap_tolerance=0.):
         """
         Resample the output/resampled image to recreate an input image based on
         the input image's world coordinate system
@@ -73,13 +78,18 @@ class GWCSBlot(object):
 
         sincscl : float, optional
             The scaling factor for sinc interpolation.
+
+        pixmap_tolerance : float, optional
+            If positive, the pixel map is interpolated from a coarse grid,
+            within this error (pixels). The map is taken from the pixmap
+            cache, if enabled: it is the map made to drizzle the image.
         """
         blot_wcs = blot_img.meta.wcs
         outsci = np.zeros(blot_img.shape, dtype=np.float32)
 
         # Compute the mapping between the input and output pixel coordinates
-        pixmap = resample_utils.calc_gwcs_pixmap(blot_wcs, self.source_wcs,
-            outsci.shape)
+        pixmap = pixmap_cache.calc_pixmap(blot_wcs, self.source_wcs,
+            outsci.shape, pixmap_tolerance)
         log.debug("Pixmap shape: {}".format(pixmap[:,:,0].shape))
         log.debug("Sci shape: {}".format(outsci.shape))
 
@@ -92,3 +102,75 @@ class GWCSBlot(object):
                        interp=interp, exptime=1.0, misval=0.0, sinscl=sinscl)
 
         return outsci
+
+    def extract_region(self, blot_img, interp='poly5', sinscl=1.0,
+                       pixmap_tolerance=0.):
+        """
+        Resample the output/resampled image onto the part of an input
+        image that it covers.
+
+        Only the section of the input image whose pixels map onto the
+        resampled image is blotted, from a cutout of the resampled image
+        around the footprint of that section, so that the work and the
+        memory needed do not depend on the size of the resampled image.
+        Within the section, the result agrees with `extract_image` to within
+        the float32 rounding; outside of it, `extract_image` gives zeros.
+
+        Parameters
+        ----------
+
+        blot_img : datamodel
+            Datamodel containing header and WCS to define the 'blotted' image
+
+        interp, sinscl, pixmap_tolerance : optional
+            As for `extract_image`.
+
+        Returns
+        -------
+        outsci : 2d array or None
+            The blotted image over the section, or None if the resampled
+            image does not cover any of the input image.
+
+        section : tuple of slices or None
+            The section (y, x) of the input image that was blotted.
+        """
+        blot_wcs = blot_img.meta.wcs
+        shape = blot_img.shape[-2:]
+
+        pixmap = pixmap_cache.calc_pixmap(blot_wcs, self.source_wcs, shape,
+            pixmap_tolerance)
+
+        # The pixels of the input image that map onto the resampled image
+        ny, nx = self.source.shape
+        with np.errstate(invalid='ignore'):
+            covered = ((pixmap[..., 0] >= -1) & (pixmap[..., 0] <= nx) &
+                       (pixmap[..., 1] >= -1) & (pixmap[..., 1] <= ny))
+        rows = np.flatnonzero(covered.any(axis=1))
+        cols = np.flatnonzero(covered.any(axis=0))
+        if rows.size == 0:
+            log.info('Resampled image does not cover {}'.format(shape))
+            return None, None
+        section = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+
+        # Cutout of the resampled image around the footprint of the section
+        pixmap = pixmap[section]
+        x = pixmap[..., 0][covered[section]]
+        y = pixmap[..., 1][covered[section]]
+        xstart = max(0, int(np.floor(x.min())) - BLOT_MARGIN)
+        xstop = min(nx, int(np.ceil(x.max())) + BLOT_MARGIN + 1)
+        ystart = max(0, int(np.floor(y.min())) - BLOT_MARGIN)
+        ystop = min(ny, int(np.ceil(y.max())) + BLOT_MARGIN + 1)
+        source = np.ascontiguousarray(self.source[ystart:ystop, xstart:xstop])
+        pixmap = pixmap - np.array([xstart, ystart], dtype=pixmap.dtype)
+
+        outsci = np.zeros(pixmap.shape[:2], dtype=np.float32)
+
+        source_pscale = self.source_model.meta.wcsinfo.cdelt1
+        blot_pscale = blot_img.meta.wcsinfo.cdelt1
+
+        pix_ratio = source_pscale / blot_pscale
+        log.info('Blotting {} <-- {}'.format(outsci.shape, source.shape))
+        tblot(source, pixmap, outsci, scale=pix_ratio, kscale=1.0,
+                       interp=interp, exptime=1.0, misval=0.0, sinscl=sinscl)
+
+        return outsci, section
@@ -13,7 +13,7 @@ from gwcs import wcs
 from drizzle import util
 from drizzle import doblot
 from drizzle import cdrizzle
-from . import resample_utils
+from . import pixmap_cache
 
 import logging
 log = logging.getLogger(__name__)
@@ -26,7 +26,7 @@ class GWCSDrizzle(object):
     """
     def __init__(self, product="", outwcs=None, single=False,
                  wt_scl="exptime", pixfrac=1.0, kernel="square",
-                 fillval="INDEF"):
+                 fillval="INDEF", pixmap_tolerance=0.):
         """
         Create a new Drizzle output object and set the drizzle parameters.
 
@@ -72,6 +72,11 @@ class GWCSDrizzle(object):
         fillval : str, otional
             The value a pixel is set to in the output if the input image does
             not overlap it. The default value of INDEF does not set a value.
+
+        pixmap_tolerance : float, optional
+            If positive, the pixel maps from the input images are
+            interpolated from a coarse grid, within this error (output
+            pixels). See `resample_utils.calc_gwcs_pixmap`.
         """
 
         # Initialize the object fields
@@ -88,6 +93,7 @@ class GWCSDrizzle(object):
         self.kernel = kernel
         self.fillval = fillval
         self.pixfrac = float(pixfrac)
+        self.pixmap_tolerance = pixmap_tolerance
 
         self.sciext = "SCI"
         self.whtext = "WHT"
@@ -237,7 +243,8 @@ class GWCSDrizzle(object):
                             pscale_ratio=pscale_ratio, uniqid=self.uniqid,
                             xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
                             pixfrac=self.pixfrac, kernel=self.kernel,
-                            fillval=self.fillval)
+                            fillval=self.fillval,
+                            pixmap_tolerance=self.pixmap_tolerance)
 
 
     def blot_image(self, blotwcs, interp='poly5', sinscl=1.0):
@@ -287,18 +294,151 @@ class GWCSDrizzle(object):
         # Add a new plane to the context image if planeid overflows
 
         if self.outcon.shape[0] == planeid:
-            plane = np.zeros_like(self.outcon[0])
+            plane = np.zeros_like(self.outcon[:1])
             self.outcon = np.append(self.outcon, plane, axis=0)
 
         # Increment the id
         self.uniqid += 1
 
+    def add_tile(self, tile):
+        """
+        Combine an image drizzled on its own by `drizzle_tile` with the
+        output drizzled image.
+
+        The tiles must be added in the order of the images, as with
+        `add_image`, so that the context bits and the rounding of the
+        result do not depend on which worker drizzled which image.
+
+        Parameters
+        ----------
+
+        tile : tuple or None
+            The result of `drizzle_tile`: the position (y, x) of the tile
+            on the output image and its sci, wht and con arrays, or None
+            if the image does not overlap the output image.
+        """
+        self.increment_id()
+        if tile is None:
+            return
+
+        ystart, xstart, tilesci, tilewht, tilecon = tile
+        section = (slice(ystart, ystart + tilesci.shape[0]),
+                   slice(xstart, xstart + tilesci.shape[1]))
+        outsci = self.outsci[section]
+        outwht = self.outwht[section]
+
+        # Weighted mean of the two partial results, as tdriz would have
+        # combined the input pixels with the output image
+        hit = tilewht > 0
+        totwht = outwht[hit] + tilewht[hit]
+        outsci[hit] = ((outsci[hit] * outwht[hit] +
+                        tilesci[hit] * tilewht[hit]) / totwht)
+        outwht[hit] = totwht
+
+        planeid = int((self.uniqid - 1) / 32)
+        self.outcon[planeid][section] |= tilecon
+
+    def fill_empty(self):
+        """
+        Set the output pixels that no tile contributed to to the fill
+        value, which `drizzle_tile` leaves to be done once all of the
+        tiles are added.
+        """
+        if util.is_blank(self.fillval) or \
+                str(self.fillval).upper() == 'INDEF':
+            return
+        self.outsci[self.outwht == 0] = float(self.fillval)
+
+
+def drizzle_tile(insci, inwht, input_wcs, output_wcs, output_shape,
+                 uniqid=1, pscale_ratio=1.0, pixfrac=1.0, kernel='square',
+                 pixmap_tolerance=0.):
+    """
+    Drizzle one image onto the part of the output image that it covers.
+
+    This is the work done for each image when the images are drizzled in
+    parallel (see `GWCSDrizzle.add_tile`).  Only a tile of the output
+    image, around the footprint of the input image, is allocated, so that
+    the worker processes hold and return little more than their image.
+
+    Parameters
+    ----------
+
+    insci, inwht : 2d arrays
+        The input image and its pixel by pixel weighting, as float32
+        count rates (see `dodrizzle`).
+
+    input_wcs, output_wcs : gwcs.WCS objects
+        The world coordinate systems of the input and output images.
+
+    output_shape : tuple
+        The shape of the full output image.
+
+    uniqid : int, optional
+        The id number of the input image; only its bit within its plane
+        of the context image is used.
+
+    pscale_ratio, pixfrac, kernel, pixmap_tolerance : optional
+        As for `dodrizzle`.
+
+    Returns
+    -------
+    The position (y, x) of the tile on the output image and its sci, wht
+    and 2d con arrays, or None if the image does not overlap the output
+    image.  Pixels of the tile not covered are not set to a fill value.
+    """
+    pixmap = pixmap_cache.calc_pixmap(input_wcs, output_wcs, insci.shape,
+                                      pixmap_tolerance)
+
+    finite = np.isfinite(pixmap).all(axis=-1)
+    if not finite.any():
+        return None
+
+    # Margin (output pixels) for the drops of the input pixels on the
+    # edges of the footprint, which spread over the size of an input pixel
+    # (or more for the lanczos and gaussian kernels) around its center
+    margin = int(np.ceil(3 * max(1., 1. / pscale_ratio) *
+                         max(1., pixfrac))) + 2
+    x = pixmap[..., 0][finite]
+    y = pixmap[..., 1][finite]
+    xstart = max(0, int(np.floor(x.min())) - margin)
+    xstop = min(output_shape[1], int(np.ceil(x.max())) + margin + 1)
+    ystart = max(0, int(np.floor(y.min())) - margin)
+    ystop = min(output_shape[0], int(np.ceil(y.max())) + margin + 1)
+    if xstart >= xstop or ystart >= ystop:
+        return None
+
+    # The map is shifted to the tile, which also copies it, so that the
+    # NaNs can be set without changing a map shared with the pixmap cache
+    pixmap = pixmap - np.array([xstart, ystart], dtype=pixmap.dtype)
+    pixmap[~finite] = -10
+
+    shape = (ystop - ystart, xstop - xstart)
+    tilesci = np.zeros(shape, dtype=np.float32)
+    tilewht = np.zeros(shape, dtype=np.float32)
+    tilecon = np.zeros(shape, dtype=np.int32)
+
+    dodrizzle(insci, input_wcs, inwht, output_wcs, tilesci, tilewht, tilecon,
+              1.0, 'cps', 1.0, pscale_ratio=pscale_ratio,
+              uniqid=(uniqid - 1) % 32 + 1, pixfrac=pixfrac, kernel=kernel,
+              fillval='INDEF', pixmap=pixmap)
+
+    return ystart, xstart, tilesci, tilewht, tilecon
+
+
+def drizzle_tile_task(task):
+    """Run `drizzle_tile` on a tuple of its arguments, in a worker."""
+    args, kwargs = task
+    return drizzle_tile(*args, **kwargs)
+
+
 def dodrizzle(insci, input_wcs, inwht,
               output_wcs, outsci, outwht, outcon,
               expin, in_units, wt_scl,
               pscale_ratio=1.0, uniqid=1,
               xmin=0, xmax=0, ymin=0, ymax=0,
-              pixfrac=1.0, kernel='square', fillval="INDEF"):
+              pixfrac=1.0, kernel='square', fillval="INDEF",
+              pixmap_tolerance=0., pixmap=None):
     """
     Low level routine for performing 'drizzle' operation on one image.
 
@@ -403,6 +543,15 @@ def dodrizzle(insci, input_wcs, inwht,
         The value a pixel is set to in the output if the input image does
         not overlap it. The default value of INDEF does not set a value.
 
+    pixmap_tolerance: float, optional
+        If positive, the pixel map is interpolated from a coarse grid,
+        within this error (output pixels). The map is taken from the
+        pixmap cache, if enabled.
+
+    pixmap: 3d array, optional
+        The pixel map from the input to the output image, if already
+        computed, in which case `pixmap_tolerance` is not used.
+
     Returns
     -------
     A tuple with three values: a version string, the number of pixels
@@ -457,11 +606,17 @@ def dodrizzle(insci, input_wcs, inwht,
 
     # Compute the mapping between the input and output pixel coordinates
     # for use in drizzle.cdrizzle.tdriz
-    pixmap = resample_utils.calc_gwcs_pixmap(input_wcs, output_wcs, insci.shape)
+    if pixmap is None:
+        pixmap = pixmap_cache.calc_pixmap(input_wcs, output_wcs, insci.shape,
+                                          pixmap_tolerance)
 
     # Temporary fix for tdriz not handling NaNs correctly; set NaNs to map
-    # off the output image and set the weight to zero
-    pixmap[np.isnan(pixmap)] = -10
+    # off the output image and set the weight to zero.  The map may be
+    # shared with the pixmap cache, so it is copied first.
+    nan_pixels = np.isnan(pixmap)
+    if nan_pixels.any():
+        pixmap = pixmap.copy()
+        pixmap[nan_pixels] = -10
     # print("Number of NaNs: ", len(np.isnan(pixmap)) / 2)
     # inwht[np.isnan(pixmap[:,:,0])] = 0.
 
@@ -0,0 +1,159 @@
+"""
+A cache of the pixel maps between input and output WCS.
+
+Outlier detection maps each exposure to the output frame twice, to
+drizzle it and to blot the median back onto it, and the resample step
+then maps it again to the same output frame.  The pixel maps are kept
+here, within a byte budget, so that they are computed once.
+
+The maps are cached by the ASDF serialization of the input and output
+WCS, so that a map is found again for equal WCS objects, such as the
+output WCS that the resample step computes anew from the same input
+exposures, and by the values of the input to output transform at a few
+pixels over the input bounding box.  A WCS that can't be serialized is
+cached by the identity of the object.
+
+The cache is disabled (a budget of 0) unless `set_max_bytes` is called,
+e.g. by the ``pixmap_cache_mb`` parameter of the steps.
+"""
+from __future__ import (division, print_function, unicode_literals,
+    absolute_import)
+
+from collections import OrderedDict
+import hashlib
+import io
+
+import asdf
+import numpy as np
+
+from . import resample_utils
+
+import logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+__all__ = ['PixmapCache', 'cache', 'calc_pixmap', 'set_max_bytes']
+
+# Number of pixels along each axis at which the transform is evaluated to
+# tell pixel maps apart
+PROBE_SIZE = 5
+
+
+def fingerprint(in_wcs, out_wcs, bounding_box):
+    """
+    The bytes of the transform from `in_wcs` to `out_wcs` evaluated at
+    PROBE_SIZE x PROBE_SIZE pixels spread over the bounding box.
+    """
+    (x0, x1), (y0, y1) = bounding_box
+    x, y = np.meshgrid(np.linspace(x0 + 0.5, x1 - 0.5, PROBE_SIZE),
+                       np.linspace(y0 + 0.5, y1 - 0.5, PROBE_SIZE))
+    probe = resample_utils.reproject(in_wcs, out_wcs)(x, y)
+    return np.ascontiguousarray(np.array(probe, dtype=np.float64)).tobytes()
+
+
+def wcs_identity(wcs):
+    """
+    The SHA-1 digest of the ASDF serialization of `wcs` or, if it can't
+    be serialized, the id of the object.
+    """
+    buff = io.BytesIO()
+    try:
+        asdf.AsdfFile({'wcs': wcs}).write_to(buff)
+    except Exception as error:
+        log.debug("WCS can't be serialized ({0}), cached by "
+                  "identity".format(error))
+        return id(wcs)
+    return hashlib.sha1(buff.getvalue()).hexdigest()
+
+
+class PixmapCache(object):
+    """
+    A least recently used cache of pixel maps within a byte budget.
+
+    The cached maps are read-only.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The budget for the cached maps.  With 0 nothing is cached.
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._pixmaps = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._pixmaps)
+
+    def get(self, in_wcs, out_wcs, shape=None, tolerance=0.):
+        """
+        The pixel map from `in_wcs` to `out_wcs`, from the cache if it is
+        there (see `resample_utils.calc_gwcs_pixmap` for the parameters).
+        """
+        if self.max_bytes <= 0:
+            return resample_utils.calc_gwcs_pixmap(in_wcs, out_wcs, shape,
+                                                   tolerance)
+
+        if shape:
+            bb = resample_utils.bounding_box_from_shape(shape)
+        else:
+            bb = in_wcs.bounding_box
+        in_id, out_id = wcs_identity(in_wcs), wcs_identity(out_wcs)
+        key = hashlib.sha1(fingerprint(in_wcs, out_wcs, bb)).hexdigest()
+        key = (key, in_id, out_id, tuple(bb), tolerance)
+
+        entry = self._pixmaps.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+            log.debug("Pixmap cache hit")
+        else:
+            self.misses += 1
+            pixmap = resample_utils.calc_gwcs_pixmap(in_wcs, out_wcs, shape,
+                                                     tolerance)
+            if pixmap.nbytes > self.max_bytes:
+                return pixmap
+            pixmap.flags.writeable = False
+            self.nbytes += pixmap.nbytes
+            # A WCS cached by identity is kept, so that its id is not
+            # reused by another object while the map is cached
+            keep = None
+            if not (isinstance(in_id, str) and isinstance(out_id, str)):
+                keep = (in_wcs, out_wcs)
+            entry = (pixmap, keep)
+        self._pixmaps[key] = entry
+        self._evict()
+        return entry[0]
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._pixmaps):
+            _, (pixmap, _) = self._pixmaps.popitem(last=False)
+            self.nbytes -= pixmap.nbytes
+
+    def clear(self):
+        """Drop all of the cached maps."""
+        self._pixmaps.clear()
+        self.nbytes = 0
+
+    def set_max_bytes(self, max_bytes):
+        """Change the byte budget, dropping maps as needed."""
+        self.max_bytes = max_bytes
+        if max_bytes <= 0:
+            self.clear()
+        else:
+            self._evict()
+
+
+# The cache of the process
+cache = PixmapCache()
+
+
+def calc_pixmap(in_wcs, out_wcs, shape=None, tolerance=0.):
+    """The pixel map from `in_wcs` to `out_wcs`, through the cache."""
+    return cache.get(in_wcs, out_wcs, shape, tolerance)
+
+
+def set_max_bytes(max_bytes):
+    """Set the byte budget of the cache of the process."""
+    cache.set_max_bytes(max_bytes)
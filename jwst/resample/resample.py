@@ -6,6 +6,7 @@ import numpy as np
 from collections import OrderedDict
 
 from .. import datamodels
+from ..lib import parallel
 
 from . import gwcs_drizzle
 from . import bitmask
@@ -44,7 +45,9 @@ class ResampleData(object):
                 'good_bits': 4,
                 'fillval': 'INDEF',
                 'wht_type': 'exptime',
-                'blendheaders': True}
+                'blendheaders': True,
+                'pixmap_tolerance': 0.,
+                'maximum_cores': 'none'}
 
     def __init__(self, input_models, output=None, ref_filename=None, **pars):
         """
@@ -144,6 +147,17 @@ class ResampleData(object):
     def do_drizzle(self, **pars):
         """ Perform drizzling operation on input images's to create a new output
         """
+        for output_model in self.drizzle_outputs():
+            self.output_models.append(output_model)
+
+
+    def drizzle_outputs(self):
+        """ Drizzle the input images, one output at a time
+
+        This is a generator of the output models, each yielded as soon as
+        its images are drizzled, so that the caller need not hold all of
+        the outputs of single mode at once.
+        """
         # Set up information about what outputs we need to create: single or final
         # Key: value from metadata for output/observation name
         # Value: full filename for output file
@@ -166,50 +180,25 @@ class ResampleData(object):
                 total_exposure_time += exposure[0].meta.exposure.exposure_time
             group_exptime = [total_exposure_time]
         pointings = len(self.input_models.group_names)
+        groups = list(zip(driz_outputs, exposures, group_exptime))
+
+        nimages = sum(len(exposure) for exposure in exposures)
+        nproc = min(parallel.number_of_processes(self.drizpars['maximum_cores']),
+                    nimages)
+        if nproc > 1:
+            log.info('Drizzling {} images on {} processes'.format(nimages,
+                nproc))
+            drizzled = self.drizzle_tiles(groups, nproc)
+        else:
+            drizzled = self.drizzle_serial(groups)
 
-        for obs_product, exposure, texptime in zip(driz_outputs, exposures,
-            group_exptime):
-            output_model = self.blank_output.copy()
-            output_model.meta.filename = obs_product
-
-            if self.drizpars['blendheaders']:
-                self.blend_output_metadata(output_model)
-
-            # Following 2 lines can probably be removed once ASN dicts
-            # are handled properly
-            output_model.meta.asn.pool_name = self.input_models.meta.pool_name
-            output_model.meta.asn.table_name = self.input_models.meta.table_name
-
-            exposure_times = {'start': [], 'end': []}
-
-            # Initialize the output with the wcs
-            driz = gwcs_drizzle.GWCSDrizzle(output_model,
-                                single=self.drizpars['single'],
-                                pixfrac=self.drizpars['pixfrac'],
-                                kernel=self.drizpars['kernel'],
-                                fillval=self.drizpars['fillval'])
-
-            for n, img in enumerate(exposure):
-                exposure_times['start'].append(img.meta.exposure.start_time)
-                exposure_times['end'].append(img.meta.exposure.end_time)
-
-                # apply sky subtraction 
-                if 'skybg' in img.meta._instance:
-                    img.data -= img.meta.skybg
-                    
-                outwcs_pscale = output_model.meta.wcsinfo.cdelt1
-                wcslin_pscale = img.meta.wcsinfo.cdelt1
-
-                inwht = build_driz_weight(img, wht_type=self.drizpars['wht_type'],
-                                    good_bits=self.drizpars['good_bits'])
-                driz.add_image(img.data, img.meta.wcs, inwht=inwht,
-                        expin=img.meta.exposure.exposure_time,
-                        pscale_ratio=outwcs_pscale / wcslin_pscale)
-
+        for output_model, driz, exposure, texptime in drizzled:
             # Update some basic exposure time values based on all the inputs
             output_model.meta.exposure.exposure_time = texptime
-            output_model.meta.exposure.start_time = min(exposure_times['start'])
-            output_model.meta.exposure.end_time = max(exposure_times['end'])
+            output_model.meta.exposure.start_time = min(
+                img.meta.exposure.start_time for img in exposure)
+            output_model.meta.exposure.end_time = max(
+                img.meta.exposure.end_time for img in exposure)
             output_model.meta.resample.product_exposure_time = texptime
             output_model.meta.resample.product_data_extname = driz.sciext
             output_model.meta.resample.product_context_extname = driz.conext
@@ -223,7 +212,118 @@ class ResampleData(object):
             output_model.meta.resample.weight_type = self.drizpars['wht_type']
             output_model.meta.resample.pointings = pointings
 
-            self.output_models.append(output_model)
+            # Planes added to the context image for more than 32 images
+            if driz.outcon.shape[0] > 1:
+                output_model.con = driz.outcon
+
+            yield output_model
+
+
+    def new_output(self, obs_product):
+        """ Create an output model, and its drizzle, from the blank output
+        """
+        output_model = self.blank_output.copy()
+        output_model.meta.filename = obs_product
+
+        if self.drizpars['blendheaders']:
+            self.blend_output_metadata(output_model)
+
+        # Following 2 lines can probably be removed once ASN dicts
+        # are handled properly
+        output_model.meta.asn.pool_name = self.input_models.meta.pool_name
+        output_model.meta.asn.table_name = self.input_models.meta.table_name
+
+        # Initialize the output with the wcs
+        driz = gwcs_drizzle.GWCSDrizzle(output_model,
+                            single=self.drizpars['single'],
+                            pixfrac=self.drizpars['pixfrac'],
+                            kernel=self.drizpars['kernel'],
+                            fillval=self.drizpars['fillval'],
+                            pixmap_tolerance=self.drizpars['pixmap_tolerance'])
+        return output_model, driz
+
+
+    def drizzle_serial(self, groups):
+        """ Drizzle the input images one after another, in this process
+        """
+        for obs_product, exposure, texptime in groups:
+            output_model, driz = self.new_output(obs_product)
+            for img in exposure:
+                insci, inwht, pscale_ratio = self.drizzle_input(img,
+                    output_model)
+                driz.add_image(insci, img.meta.wcs, inwht=inwht,
+                        expin=img.meta.exposure.exposure_time,
+                        pscale_ratio=pscale_ratio)
+            yield output_model, driz, exposure, texptime
+
+
+    def drizzle_input(self, img, output_model):
+        """ Sky-subtract an input image and build its drizzle weight
+
+        Returns the science and weight arrays, as float32, and the ratio of
+        the output to input pixel scales.
+        """
+        # apply sky subtraction
+        if 'skybg' in img.meta._instance:
+            img.data -= img.meta.skybg
+
+        outwcs_pscale = output_model.meta.wcsinfo.cdelt1
+        wcslin_pscale = img.meta.wcsinfo.cdelt1
+
+        inwht = build_driz_weight(img, wht_type=self.drizpars['wht_type'],
+                            good_bits=self.drizpars['good_bits'])
+        return (img.data.astype(np.float32, copy=False),
+                inwht.astype(np.float32, copy=False),
+                outwcs_pscale / wcslin_pscale)
+
+
+    def drizzle_tiles(self, groups, nproc):
+        """ Drizzle the input images on a pool of worker processes
+
+        Each worker drizzles one image at a time onto a tile of the output
+        image covering that image (see `gwcs_drizzle.drizzle_tile`).  The
+        tiles are added to their output image in the order of the images,
+        whichever worker finishes first, so that the result does not
+        depend on the number of processes.  It agrees with drizzling the
+        images one after another to within the float32 rounding.
+        """
+        # All of the outputs are copies of the blank output, with the same
+        # frame and drizzle parameters as the first one
+        first = self.new_output(groups[0][0])
+        template_model, template = first
+        # Taken before any tile is added, as the tasks are generated while
+        # the tiles come back
+        firstid = template.uniqid + 1
+
+        def tasks():
+            for obs_product, exposure, texptime in groups:
+                for uniqid, img in enumerate(exposure, firstid):
+                    insci, inwht, pscale_ratio = self.drizzle_input(img,
+                        template_model)
+                    args = (insci, inwht, img.meta.wcs, template.outwcs,
+                            template.outsci.shape)
+                    kwargs = {'uniqid': uniqid,
+                              'pscale_ratio': pscale_ratio,
+                              'pixfrac': template.pixfrac,
+                              'kernel': template.kernel,
+                              'pixmap_tolerance': template.pixmap_tolerance}
+                    yield args, kwargs
+
+        tiles = parallel.imap_ordered(gwcs_drizzle.drizzle_tile_task,
+                                      tasks(), nproc)
+        for n, (obs_product, exposure, texptime) in enumerate(groups):
+            if n == 0:
+                output_model, driz = first
+            else:
+                output_model, driz = self.new_output(obs_product)
+            for img in exposure:
+                driz.add_tile(next(tiles))
+            driz.fill_empty()
+            yield output_model, driz, exposure, texptime
+
+        # Let the pool finish
+        for tile in tiles:
+            pass
 
 
 def _buildMask(dqarr, bitvalue):
@@ -3,7 +3,7 @@ from __future__ import (division, print_function, unicode_literals,
 
 from ..stpipe import Step, cmdline
 from .. import datamodels
-from . import resample
+from . import pixmap_cache, resample
 
 
 class ResampleStep(Step):
@@ -26,6 +26,9 @@ class ResampleStep(Step):
         fillval = string(default='INDEF')
         good_bits = integer(default=4)
         blendheaders = boolean(default=True)
+        pixmap_tolerance = float(default=0.) # Error (pixels) of the interpolated pixel maps; 0 for exact maps
+        pixmap_cache_mb = float(default=0) # Size (MB) of the cache of pixel maps, shared with outlier_detection; 0 for no cache
+        maximum_cores = option('none','quarter','half','all',default='none') # max number of processes to use to drizzle the images
     """
     reference_file_types = ['drizpars']
 
@@ -54,11 +57,14 @@ class ResampleStep(Step):
                 self.reference_file_types[0]))
 
         # Call the resampling routine
+        pixmap_cache.set_max_bytes(int(self.pixmap_cache_mb * 1024 * 1024))
         resamp = resample.ResampleData(self.input_models,
             ref_filename=self.ref_filename,
             single=self.single, wht_type=self.wht_type, pixfrac=self.pixfrac,
             kernel=self.kernel, fillval=self.fillval, good_bits=self.good_bits,
-            blendheaders=self.blendheaders)
+            blendheaders=self.blendheaders,
+            pixmap_tolerance=self.pixmap_tolerance,
+            maximum_cores=self.maximum_cores)
         resamp.do_drizzle()
 
         if len(resamp.output_models) == 1:
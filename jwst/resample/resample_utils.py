@@ -19,6 +19,9 @@ import logging
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Initial stride (pixels) of the coarse grid of `sparse_pixmap`
+SPARSE_STRIDE = 64
+
 
 def make_output_wcs(input_models):
     """ Generate output WCS here based on footprints of all input WCS objects
@@ -111,8 +114,23 @@ def shape_from_bounding_box(bounding_box):
     return tuple(reversed(size))
 
 
-def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None):
+def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None, tolerance=0.):
     """ Return a pixel grid map from input frame to output frame.
+
+    Parameters
+    ----------
+    in_wcs, out_wcs : `~gwcs.wcs.WCS`
+        The WCS of the input and output frames.
+
+    shape : tuple, optional
+        The shape of the input data; by default, the bounding box of
+        ``in_wcs`` is mapped.
+
+    tolerance : float, optional
+        If positive, the transforms are only evaluated on a coarse grid,
+        and the map interpolated in between (see `sparse_pixmap`), within
+        this error (output pixels).  With 0, they are evaluated at every
+        pixel.
     """
     if shape:
         bb = bounding_box_from_shape(shape)
@@ -122,10 +140,86 @@ def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None):
         log.debug("Bounding box from WCS: {}".format(in_wcs.bounding_box))
 
     grid = wcstools.grid_from_bounding_box(bb, step=(1, 1), center=True)
-    pixmap = np.dstack(reproject(in_wcs, out_wcs)(grid[0], grid[1]))
+    transform = reproject(in_wcs, out_wcs)
+    if tolerance > 0:
+        pixmap = sparse_pixmap(transform, grid[0][0], grid[1][:, 0],
+                               tolerance)
+        if pixmap is not None:
+            return pixmap
+        log.debug("Pixmap evaluated at every pixel")
+    pixmap = np.dstack(transform(grid[0], grid[1]))
     return pixmap
 
 
+def _grid_nodes(n, stride):
+    """Indices every `stride` points along an axis of `n`, and the last."""
+    nodes = np.arange(0, n, stride)
+    if nodes[-1] != n - 1:
+        nodes = np.append(nodes, n - 1)
+    return nodes
+
+
+def sparse_pixmap(transform, x, y, tolerance, stride=SPARSE_STRIDE):
+    """
+    Pixel map from the transform evaluated on a coarse grid.
+
+    The transform is evaluated every `stride` pixels, and interpolated
+    in between with bicubic splines.  The interpolation is checked at
+    the middle of the cells of the grid; while its error is more than
+    `tolerance`, the stride is halved.
+
+    Parameters
+    ----------
+    transform : callable
+        Takes the x, y input pixel coordinates and returns the output
+        ones (see `reproject`).
+
+    x, y : 1-D arrays
+        The input pixel coordinates along each axis.
+
+    tolerance : float
+        The largest error allowed (output pixels).
+
+    stride : int
+        The initial stride of the grid.
+
+    Returns
+    -------
+    pixmap : 3-D array, or None
+        The pixel map, as made by `calc_gwcs_pixmap`, or None if it could
+        not be interpolated within the tolerance, or the transform is not
+        defined everywhere on the grid (e.g. for slit spectra).
+    """
+    while stride >= 2:
+        iy = _grid_nodes(len(y), stride)
+        ix = _grid_nodes(len(x), stride)
+        if len(iy) <= 3 or len(ix) <= 3:
+            # Too few nodes for cubic splines
+            stride //= 2
+            continue
+        gy, gx = y[iy], x[ix]
+        nodes = transform(*np.meshgrid(gx, gy))
+        if not all(np.isfinite(axis).all() for axis in nodes):
+            return None
+        splines = [interpolate.RectBivariateSpline(gy, gx, axis)
+                   for axis in nodes]
+
+        # Check the interpolation half-way between the nodes
+        my = 0.5 * (gy[:-1] + gy[1:])
+        mx = 0.5 * (gx[:-1] + gx[1:])
+        exact = transform(*np.meshgrid(mx, my))
+        if not all(np.isfinite(axis).all() for axis in exact):
+            return None
+        error = np.hypot(splines[0](my, mx) - exact[0],
+                         splines[1](my, mx) - exact[1]).max()
+        log.debug("Pixmap interpolated with stride {0}: error {1:.3g} "
+                  "pixels".format(stride, error))
+        if error <= tolerance:
+            return np.dstack([spline(y, x) for spline in splines])
+        stride //= 2
+    return None
+
+
 def reproject(wcs1, wcs2):
     """
     Given two WCSs return a function which takes pixel coordinates in
@@ -0,0 +1,53 @@
+"""Test blotting the part of an image covered by a resampled image"""
+import numpy as np
+
+from astropy.modeling.models import AffineTransformation2D
+from gwcs import WCS
+
+from ... import datamodels
+from .. import gwcs_blot
+
+MOSAIC_SHAPE = (200, 300)
+SHAPE = (60, 80)
+
+
+def make_wcs(angle, offset):
+    c, s = np.cos(angle), np.sin(angle)
+    affine = AffineTransformation2D(matrix=[[c, -s], [s, c]],
+                                    translation=offset)
+    return WCS(forward_transform=affine, output_frame='world')
+
+
+def make_median():
+    y, x = np.indices(MOSAIC_SHAPE)
+    median = datamodels.DrizProductModel(
+        data=(np.sin(x / 7.) * np.cos(y / 11.)).astype(np.float32))
+    median.meta.wcs = make_wcs(0., (0., 0.))
+    median.meta.wcsinfo.cdelt1 = 1.
+    return median
+
+
+def make_image(angle, offset):
+    image = datamodels.ImageModel(SHAPE)
+    image.meta.wcs = make_wcs(angle, offset)
+    image.meta.wcsinfo.cdelt1 = 1.
+    return image
+
+
+def test_region_matches_full_blot():
+    blot = gwcs_blot.GWCSBlot(make_median())
+
+    # Inside the mosaic, and hanging off two of its edges
+    for angle, offset in [(0.1, (100., 50.)), (-0.2, (250., -20.)),
+                          (0.3, (-30., 170.))]:
+        image = make_image(angle, offset)
+        full = blot.extract_image(image)
+        region, section = blot.extract_region(image)
+        assert np.allclose(region, full[section], rtol=0., atol=1e-5)
+        outside = np.ones(SHAPE, dtype=bool)
+        outside[section] = False
+        assert not full[outside].any()
+
+    # Off the mosaic
+    region, section = blot.extract_region(make_image(0., (1000., 1000.)))
+    assert region is None and section is None
@@ -0,0 +1,59 @@
+"""Test drizzling images onto tiles and adding them to the output"""
+import numpy as np
+
+from astropy.modeling.models import AffineTransformation2D
+from gwcs import WCS
+
+from ... import datamodels
+from .. import gwcs_drizzle
+
+IN_SHAPE = (60, 80)
+OUT_SHAPE = (150, 200)
+
+
+def make_wcs(angle, offset):
+    c, s = np.cos(angle), np.sin(angle)
+    affine = AffineTransformation2D(matrix=[[c, -s], [s, c]],
+                                    translation=offset)
+    return WCS(forward_transform=affine, output_frame='world')
+
+
+def make_output():
+    output = datamodels.DrizProductModel(OUT_SHAPE)
+    output.meta.wcs = make_wcs(0., (0., 0.))
+    return output
+
+
+def test_tiles_match_serial():
+    rng = np.random.RandomState(42)
+    inputs = []
+    # One image falls partly off the output, one is not on it at all
+    for angle, offset in [(0.1, (20., 10.)), (-0.05, (60., 40.)),
+                          (0.3, (150., 120.)), (0., (500., 500.)),
+                          (0.02, (25., 15.))]:
+        data = rng.normal(10., 1., IN_SHAPE).astype(np.float32)
+        wht = rng.uniform(0.5, 1., IN_SHAPE).astype(np.float32)
+        inputs.append((data, wht, make_wcs(angle, offset)))
+
+    serial = make_output()
+    driz = gwcs_drizzle.GWCSDrizzle(serial, fillval='-1')
+    for data, wht, wcs in inputs:
+        driz.add_image(data, wcs, inwht=wht)
+
+    tiled = make_output()
+    driz = gwcs_drizzle.GWCSDrizzle(tiled, fillval='-1')
+    for uniqid, (data, wht, wcs) in enumerate(inputs, 1):
+        tile = gwcs_drizzle.drizzle_tile(data, wht, wcs, driz.outwcs,
+                                         OUT_SHAPE, uniqid=uniqid)
+        if uniqid == 4:
+            assert tile is None
+        else:
+            assert tile[2].size < np.prod(OUT_SHAPE)
+        driz.add_tile(tile)
+    driz.fill_empty()
+
+    assert driz.uniqid == len(inputs)
+    assert np.allclose(tiled.data, serial.data, rtol=1e-5, atol=1e-5)
+    assert np.allclose(tiled.wht, serial.wht, rtol=1e-5, atol=1e-5)
+    assert np.array_equal(tiled.con, serial.con)
+    assert (tiled.data == -1).any()
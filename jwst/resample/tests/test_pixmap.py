@@ -0,0 +1,75 @@
+"""Test the interpolated pixel maps and their cache"""
+import numpy as np
+import pytest
+
+from astropy.modeling.models import AffineTransformation2D, Shift
+from gwcs import WCS
+
+from .. import pixmap_cache, resample_utils
+
+SHAPE = (300, 400)
+
+
+def distortion(x, y):
+    u = x / SHAPE[1] - 0.5
+    v = y / SHAPE[0] - 0.5
+    return (1.01 * x + 0.02 * y + 3. * np.sin(u) * v + 10.,
+            -0.02 * x + 0.99 * y + 2. * u * np.cos(v) - 5.)
+
+
+def make_wcs(angle=0.1, offset=(20., 10.)):
+    c, s = np.cos(angle), np.sin(angle)
+    affine = AffineTransformation2D(matrix=[[c, -s], [s, c]],
+                                    translation=offset)
+    return WCS(forward_transform=affine, output_frame='world')
+
+
+@pytest.mark.parametrize('tolerance', [1e-2, 1e-4])
+def test_sparse_pixmap(tolerance):
+    y, x = np.indices(SHAPE, dtype=np.float64)
+    exact = np.dstack(distortion(x, y))
+
+    pixmap = resample_utils.sparse_pixmap(distortion, x[0], y[:, 0],
+                                          tolerance)
+    assert pixmap.shape == SHAPE + (2,)
+    assert np.abs(pixmap - exact).max() <= 2 * tolerance
+
+
+def test_sparse_pixmap_undefined():
+    """Transforms that are not defined everywhere are not interpolated"""
+    def partial(x, y):
+        xo, yo = distortion(x, y)
+        return np.where(x > 100, np.nan, xo), yo
+
+    y, x = np.indices(SHAPE, dtype=np.float64)
+    assert resample_utils.sparse_pixmap(partial, x[0], y[:, 0], 0.01) is None
+
+
+def test_pixmap_cache():
+    cache = pixmap_cache.PixmapCache(max_bytes=10 ** 8)
+    in_wcs, out_wcs = make_wcs(0.1), make_wcs(0., (0., 0.))
+    expected = resample_utils.calc_gwcs_pixmap(in_wcs, out_wcs, SHAPE)
+
+    first = cache.get(in_wcs, out_wcs, SHAPE)
+    # An equivalent output WCS, made anew, finds the same map
+    second = cache.get(in_wcs, make_wcs(0., (0., 0.)), SHAPE)
+    assert second is first
+    assert np.array_equal(first, expected)
+    assert not first.flags.writeable
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.get(make_wcs(0.2), out_wcs, SHAPE)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # A WCS with another transform is another map, even if the transforms
+    # agree at the pixels probed
+    other = WCS(forward_transform=in_wcs.forward_transform |
+                (Shift(0.) & Shift(0.)), output_frame='world')
+    cache.get(other, out_wcs, SHAPE)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # Over budget, the least recently used map is dropped
+    cache.set_max_bytes(first.nbytes)
+    assert len(cache) == 1
+    cache.set_max_bytes(0)
+    assert len(cache) == 0
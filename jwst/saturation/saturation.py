@@ -39,25 +39,13 @@ def do_correction(input_model, ref_model):
     if is_irs2_format:
         irs2_mask = x_irs2.make_mask(input_model)
 
-   # Create the output model as a copy of the input
-    output_model = input_model.copy()
-    groupdq = output_model.groupdq
+    satmask, dqmask = get_masks(input_model, ref_model)
 
-    # Check for subarray mode
-    if ref_matches_sci(ref_model, input_model):
-        satmask = ref_model.data
-        dqmask = ref_model.dq
-    else:
-        satmask = get_subarray(ref_model.data, input_model)
-        dqmask = get_subarray(ref_model.dq, input_model)
-
-    # For pixels flagged in reference file as NO_SAT_CHECK, set the dq mask
-    #   and saturation mask
-    wh_sat = np.bitwise_and(dqmask, dqflags.pixel['NO_SAT_CHECK'])
-    dqmask[wh_sat == dqflags.pixel['NO_SAT_CHECK']] = dqflags.pixel['NO_SAT_CHECK']
-    satmask[wh_sat == dqflags.pixel['NO_SAT_CHECK']] = HUGE_NUM
-    # Correct saturation values for NaNs in the ref file
-    correct_for_NaN(satmask, dqmask)
+    # Create the output model as a copy of the input, sharing the arrays
+    # that are not modified
+    output_model = input_model.copy(copy_on_write=True)
+    output_model.unshare('groupdq')
+    groupdq = output_model.groupdq
 
     dq_flag = dqflags.group['SATURATED']
 
@@ -84,6 +72,7 @@ def do_correction(input_model, ref_model):
 
     output_model.groupdq = groupdq
     if is_irs2_format:
+        output_model.unshare('pixeldq')
         pixeldq_temp = x_irs2.from_irs2(output_model.pixeldq, irs2_mask,
                                         detector)
         pixeldq_temp = np.bitwise_or(pixeldq_temp, dqmask)
@@ -94,6 +83,53 @@ def do_correction(input_model, ref_model):
     return output_model
 
 
+def get_masks(input_model, ref_model):
+    """
+    Short Summary
+    -------------
+    Get the saturation thresholds and DQ flags from the saturation reference
+    file that match the science data, with the pixels flagged NO_SAT_CHECK
+    or having NaN thresholds set so that they are never flagged.
+
+    Parameters
+    ----------
+    input_model: data model object
+        The input science data
+
+    ref_model: data model object
+        Saturation reference file model object
+
+    Returns
+    -------
+    satmask: 2-d array
+        Saturation thresholds
+
+    dqmask: 2-d array
+        DQ flags to be combined with the PIXELDQ array of the science data
+    """
+
+    # The masks are modified in place
+    ref_model.unshare('data', 'dq')
+
+    # Check for subarray mode
+    if ref_matches_sci(ref_model, input_model):
+        satmask = ref_model.data
+        dqmask = ref_model.dq
+    else:
+        satmask = get_subarray(ref_model.data, input_model)
+        dqmask = get_subarray(ref_model.dq, input_model)
+
+    # For pixels flagged in reference file as NO_SAT_CHECK, set the dq mask
+    #   and saturation mask
+    wh_sat = np.bitwise_and(dqmask, dqflags.pixel['NO_SAT_CHECK'])
+    dqmask[wh_sat == dqflags.pixel['NO_SAT_CHECK']] = dqflags.pixel['NO_SAT_CHECK']
+    satmask[wh_sat == dqflags.pixel['NO_SAT_CHECK']] = HUGE_NUM
+    # Correct saturation values for NaNs in the ref file
+    correct_for_NaN(satmask, dqmask)
+
+    return satmask, dqmask
+
+
 def correct_for_NaN(satmask, dqmask):
     """
     Short Summary
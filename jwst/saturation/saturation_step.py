@@ -29,7 +29,8 @@ class SaturationStep(Step):
                 return result
 
             # Open the reference file data model
-            ref_model = datamodels.SaturationModel(self.ref_name)
+            ref_model = self.open_reference_model(
+                self.ref_name, datamodels.SaturationModel, input_model)
 
             # Do the saturation check
             sat = saturation.do_correction(input_model, ref_model)
@@ -0,0 +1,296 @@
+"""
+Run a Step or Pipeline on many exposures, with a pool of worker processes.
+
+Each worker configures the step once, from the configuration file and
+commandline arguments, and then runs it on one exposure after another,
+so that the imports, the configuration parsing and the caches of the
+step (e.g. the reference model cache) are shared by all of the
+exposures of the worker.  The exposures are handed out largest first,
+which keeps the workers busy until the end of the batch.  A failure
+only affects its own exposure.  A manifest of the outcome and timing of
+each exposure is written at the end.
+"""
+from __future__ import (
+    absolute_import,
+    division,
+    print_function,
+    unicode_literals
+)
+
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from . import cmdline
+from . import log
+from ..lib import parallel
+
+__all__ = ['expand_inputs', 'run_batch', 'main']
+
+# The step of the worker process, configured once by `_init_worker`, or
+# the error raised while configuring it
+_worker_step = None
+_worker_error = None
+
+
+def expand_inputs(patterns, input_list=None):
+    """
+    The input files given by file names, glob patterns and list files.
+
+    Parameters
+    ----------
+    patterns : list of str
+        File names or glob patterns.
+
+    input_list : str, optional
+        A file with one input file name per line.  Blank lines and lines
+        starting with ``#`` are ignored.
+
+    Returns
+    -------
+    inputs : list of str
+        The input files, in the order given, without duplicates.
+    """
+    inputs = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            # Kept, to be reported as failed
+            matches = [pattern]
+        inputs.extend(matches)
+
+    if input_list is not None:
+        with open(input_list) as fd:
+            for line in fd:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    inputs.append(line)
+
+    unique = []
+    for path in inputs:
+        if path not in unique:
+            unique.append(path)
+    return unique
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _init_worker(step_args):
+    """
+    Configure the step of a worker process.
+
+    An error is kept, to fail the exposures of the worker, rather than
+    raised: `multiprocessing.Pool` would start new workers, failing in
+    the same way, for ever.
+    """
+    global _worker_step, _worker_error
+    try:
+        _worker_step = make_step(step_args)
+    except Exception as e:
+        _worker_error = e
+
+
+def make_step(step_args):
+    """
+    Create the step to run from commandline arguments (a configuration
+    file or class, followed by parameters), as ``strun`` does.
+    """
+    step, _, positional, _ = cmdline.just_the_step_from_cmdline(step_args)
+    if positional:
+        raise ValueError(
+            'Input files must be given to the batch, not to the step: '
+            '{0}'.format(positional))
+    if step.output_file is not None:
+        raise ValueError(
+            'output_file can not be set when running a batch; use '
+            'output_dir instead')
+    return step
+
+
+def run_exposure(step, path):
+    """
+    Run a step on one exposure, saving its results.
+
+    Parameters
+    ----------
+    step : Step instance
+        The configured step.  It is reused for the next exposures.
+
+    path : str
+        The input file.
+
+    Returns
+    -------
+    record : dict
+        The input file, its size, the worker process id, the status
+        ('succeeded' or 'failed'), the error message and traceback of a
+        failure, and the wall-clock and CPU times (s) of the run.
+    """
+    record = {
+        'input': path,
+        'size': _file_size(path),
+        'pid': os.getpid(),
+    }
+    start_wall = time.time()
+    start_cpu = sum(os.times()[:2])
+    try:
+        if not os.path.exists(path):
+            raise IOError('No such file: {0}'.format(path))
+        step.set_input_filename(path)
+        step.save_results = True
+        step.run(path)
+    except Exception as e:
+        log.log.error('{0} failed: {1}'.format(path, e))
+        record['status'] = 'failed'
+        record['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    else:
+        record['status'] = 'succeeded'
+    record['wall_time'] = time.time() - start_wall
+    record['cpu_time'] = sum(os.times()[:2]) - start_cpu
+    return record
+
+
+def _run_in_worker(path):
+    if _worker_error is not None:
+        return {
+            'input': path,
+            'size': _file_size(path),
+            'pid': os.getpid(),
+            'status': 'failed',
+            'error': 'Step configuration failed: {0}: {1}'.format(
+                type(_worker_error).__name__, _worker_error),
+            'wall_time': 0.,
+            'cpu_time': 0.,
+        }
+    return run_exposure(_worker_step, path)
+
+
+def run_batch(step_args, inputs, max_cores=None, manifest=None):
+    """
+    Run a step on many exposures.
+
+    Parameters
+    ----------
+    step_args : list of str
+        The configuration file or step class, followed by the step
+        parameters, as for ``strun``.
+
+    inputs : list of str
+        The input files.
+
+    max_cores : str or int
+        The number of worker processes (see
+        `jwst.lib.parallel.number_of_processes`).  With 1, the exposures
+        are run in this process.
+
+    manifest : str, optional
+        The file to which the manifest is written, as JSON.
+
+    Returns
+    -------
+    summary : dict
+        The manifest: the step arguments, the number of processes, the
+        numbers of succeeded and failed exposures, the total wall-clock
+        time (s), and the record of each exposure (see `run_exposure`),
+        in the order of `inputs`.
+    """
+    nproc = min(parallel.number_of_processes(max_cores),
+                max(1, len(inputs)))
+
+    # Largest first, so that the last exposures to run are short ones
+    order = sorted(range(len(inputs)),
+                   key=lambda index: -_file_size(inputs[index]))
+    tasks = [inputs[index] for index in order]
+
+    # Configured here first, so that configuration errors are raised
+    # before any worker is started
+    step = make_step(step_args)
+
+    start = time.time()
+    if nproc == 1:
+        records = [run_exposure(step, path) for path in tasks]
+    else:
+        log.log.info('Running {0} exposures on {1} processes'.format(
+            len(tasks), nproc))
+        pool = multiprocessing.Pool(processes=nproc,
+                                    initializer=_init_worker,
+                                    initargs=(step_args,))
+        try:
+            records = list(pool.imap_unordered(_run_in_worker, tasks,
+                                               chunksize=1))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    position = dict((path, index) for index, path in enumerate(inputs))
+    records.sort(key=lambda record: position[record['input']])
+    nfailed = sum(record['status'] == 'failed' for record in records)
+    summary = {
+        'step_args': list(step_args),
+        'processes': nproc,
+        'succeeded': len(records) - nfailed,
+        'failed': nfailed,
+        'wall_time': time.time() - start,
+        'exposures': records,
+    }
+    log.log.info('{0} exposures succeeded, {1} failed, in {2:.1f} s'.format(
+        summary['succeeded'], nfailed, summary['wall_time']))
+
+    if manifest is not None:
+        with open(manifest, 'w') as fd:
+            json.dump(summary, fd, indent=2, sort_keys=True)
+        log.log.info('Wrote manifest {0}'.format(manifest))
+    return summary
+
+
+def main(args):
+    """
+    Run the batch from commandline arguments.
+
+    Returns
+    -------
+    status : int
+        0 if all exposures succeeded, 1 otherwise.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run an stpipe Step or Pipeline on many exposures. '
+        'Other arguments are passed to the step, as for strun, and must '
+        'be given as --name=value.')
+    parser.add_argument(
+        'cfg_file_or_class', type=str,
+        help='The configuration file or Python class to run')
+    parser.add_argument(
+        'inputs', type=str, nargs='*',
+        help='Input files or glob patterns')
+    parser.add_argument(
+        '--input-list', type=str,
+        help='A file listing one input file per line')
+    parser.add_argument(
+        '--processes', type=str, default='1',
+        help='The number of worker processes, or one of {0} (fraction of '
+        'the cores)'.format(', '.join(parallel.MAX_CORES_OPTIONS)))
+    parser.add_argument(
+        '--manifest', type=str, default='batch_manifest.json',
+        help='The file to which the manifest of the batch is written')
+    known, step_args = parser.parse_known_args(args)
+
+    inputs = expand_inputs(known.inputs, known.input_list)
+    if not inputs:
+        parser.error('No input files')
+
+    summary = run_batch([known.cfg_file_or_class] + step_args, inputs,
+                        known.processes, known.manifest)
+    return 1 if summary['failed'] else 0
@@ -169,6 +169,10 @@ def get_svn_version():
     return crds.__version__
 
 
+def get_crds_path():
+    """Return the root directory of the CRDS cache (CRDS_PATH)."""
+    return config.get_crds_path()
+
 def get_context_used():
     """Return the context (.pmap) used for determining best references."""
     _connected, final_context = crds.heavy_client.get_processing_mode("jwst")
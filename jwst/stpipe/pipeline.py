@@ -54,6 +54,7 @@ class Pipeline(Step):
     output_ext = string(default=".fits")      # Output extension
     suffix = string(default=None)             # Suffix for output file name
     output_use_model = boolean(default=False) # force use `meta.filename` as the output name
+    fast_chaining = boolean(default=False)    # Chain the steps without per-step garbage collection and validation
     """
     # A set of steps used in the Pipeline.  Should be overridden by
     # the subclass.
@@ -133,7 +134,8 @@ class Pipeline(Step):
 
         """
         from .. import datamodels
-        gc.collect()
+        if self._collect_garbage():
+            gc.collect()
         try:
             with datamodels.open(input_file) as model:
                 super(Pipeline, self)._precache_reference_files_opened(model)
@@ -144,7 +146,8 @@ class Pipeline(Step):
             self.log.info(
                 'First argument {0} does not appear to be a '
                 'model'.format(input_file))
-        gc.collect()
+        if self._collect_garbage():
+            gc.collect()
 
     def set_input_filename(self, path):
         self._input_filename = path
@@ -0,0 +1,140 @@
+"""
+Timing and resource usage of the runs of steps.
+
+`Step.run` takes a `Sample` of the process before and after the step,
+and makes a record of the differences with `make_record`.  The records
+of a step and of all of its sub-steps are collected in the `timings`
+list of the outermost step, and may be written as JSON lines with
+`write_records`.
+
+The peak RSS is only available where the `resource` module is (Unix),
+and the bytes read and written only on Linux; otherwise they are None.
+"""
+from __future__ import absolute_import, division, print_function
+
+import cProfile
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ['Sample', 'make_record', 'write_records', 'profiled']
+
+# The cProfile profilers of the steps being run, innermost last
+_profilers = []
+
+
+def _peak_rss():
+    """Peak resident set size of the process, in bytes, or None."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on Mac OS
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+def _io_counters():
+    """Bytes read and written by the process, or (None, None)."""
+    try:
+        with open('/proc/self/io') as fd:
+            counters = dict(line.split(':') for line in fd)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+class Sample(object):
+    """
+    The clocks and resource usage of the process at one time.
+    """
+    def __init__(self):
+        self.time = time.time()
+        self.cpu_time = sum(os.times()[:2])
+        self.peak_rss = _peak_rss()
+        self.bytes_read, self.bytes_written = _io_counters()
+
+
+def make_record(step, start, end, reference_time=0.):
+    """
+    The record of a run of a step.
+
+    Parameters
+    ----------
+    step : Step instance
+        The step.
+
+    start, end : Sample
+        The samples taken before and after the run.
+
+    reference_time : float
+        The time (s) spent getting the reference files.
+
+    Returns
+    -------
+    record : dict
+        The qualified name and class of the step, the start time, the
+        wall-clock and CPU times (s), the increase of the peak RSS and the
+        bytes read and written (bytes), and the reference file time.
+        The times of a pipeline include those of its steps.
+    """
+    return {
+        'step': step.qualified_name,
+        'class': step.__class__.__name__,
+        'start': start.time,
+        'wall_time': end.time - start.time,
+        'cpu_time': end.cpu_time - start.cpu_time,
+        'peak_rss_delta': _difference(end.peak_rss, start.peak_rss),
+        'bytes_read': _difference(end.bytes_read, start.bytes_read),
+        'bytes_written': _difference(end.bytes_written,
+                                     start.bytes_written),
+        'reference_time': reference_time,
+    }
+
+
+def write_records(records, filename):
+    """
+    Write records to a file, as JSON lines.
+    """
+    with open(filename, 'w') as fd:
+        for record in records:
+            fd.write(json.dumps(record, sort_keys=True))
+            fd.write('\n')
+
+
+@contextlib.contextmanager
+def profiled(filename):
+    """
+    Run the enclosed code under cProfile, writing the statistics to
+    `filename` (see `pstats.Stats`).
+
+    When nested, e.g. for the steps of a pipeline, the outer profiler is
+    paused while the inner one runs, so that the time of a step is in
+    its own statistics only.
+    """
+    profiler = cProfile.Profile()
+    if _profilers:
+        _profilers[-1].disable()
+    _profilers.append(profiler)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        _profilers.pop()
+        if _profilers:
+            _profilers[-1].enable()
+        profiler.dump_stats(filename)
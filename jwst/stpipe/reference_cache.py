@@ -0,0 +1,216 @@
+"""
+An in-process cache of opened reference file models.
+
+When many exposures of the same detector configuration are processed in
+one process, their steps use the same reference files.  The cache keeps
+the models opened for earlier exposures, keyed by file path, model
+class and, for models sliced to the science subarray, the subarray, so
+that the files are not read and sliced again.  The least recently used
+models are dropped to keep the arrays within a byte budget.
+
+Steps get reference models through `Step.open_reference_model`.  The
+cache is disabled (a budget of 0) unless the ``reference_cache_mb``
+parameter of a step is set, or `set_max_bytes` is called.
+"""
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+import os
+
+from asdf import treeutil
+import numpy as np
+
+__all__ = ['ReferenceCache', 'cache', 'set_max_bytes']
+
+
+def _model_bytes(model):
+    """Number of bytes of the arrays of a model."""
+    return sum(node.nbytes for node in treeutil.iter_tree(model._instance)
+               if isinstance(node, np.ndarray))
+
+
+def subarray_key(sci_model):
+    """The subarray of the science data, as a tuple."""
+    subarray = sci_model.meta.subarray
+    return (subarray.xstart, subarray.ystart, subarray.xsize, subarray.ysize)
+
+
+def _frame_shape(ref_model):
+    """
+    The shape of the reference frame: the last two axes of the primary
+    array of the model or, for models without one (e.g. LinearityModel),
+    of its first array with at least two dimensions.
+    """
+    arrays = [value for value in ref_model._instance.values()
+              if isinstance(value, np.ndarray) and value.ndim >= 2]
+    primary = ref_model._instance.get(ref_model.get_primary_array_name())
+    if isinstance(primary, np.ndarray) and primary.ndim >= 2:
+        arrays.insert(0, primary)
+    if not arrays:
+        raise ValueError("Reference model has no image array to slice")
+    return arrays[0].shape[-2:]
+
+
+def slice_to_subarray(ref_model, sci_model):
+    """
+    Slice the image arrays of a reference model to the science subarray.
+
+    The arrays whose last two axes have the size of the reference frame
+    are replaced, in place, by copies of their subarray section, and the
+    subarray metadata of the reference model are set to those of the
+    science data.  Nothing is done if the science data do not have the
+    size given by their subarray metadata (e.g. IRS2 data), or if the
+    reference model already matches.
+
+    Returns
+    -------
+    bool
+        True if the model was sliced.
+    """
+    sci = sci_model.meta.subarray
+    ref = ref_model.meta.subarray
+    if None in subarray_key(sci_model):
+        return False
+    if sci_model.data.shape[-2:] != (sci.ysize, sci.xsize):
+        return False
+
+    frame_shape = _frame_shape(ref_model)
+    if ref.xstart is None or ref.ystart is None:
+        ref_x1, ref_y1 = 1, 1
+    else:
+        ref_x1, ref_y1 = ref.xstart, ref.ystart
+    xstart = sci.xstart - ref_x1
+    ystart = sci.ystart - ref_y1
+    if (xstart, ystart) == (0, 0) and frame_shape == (sci.ysize, sci.xsize):
+        return False
+    if (xstart < 0 or ystart < 0 or xstart + sci.xsize > frame_shape[-1] or
+            ystart + sci.ysize > frame_shape[-2]):
+        raise ValueError("Can't extract matching subarray from reference "
+                         "data")
+
+    for name, value in list(ref_model._instance.items()):
+        if (isinstance(value, np.ndarray) and value.ndim >= 2 and
+                value.shape[-2:] == frame_shape):
+            setattr(ref_model, name,
+                    value[..., ystart:ystart + sci.ysize,
+                          xstart:xstart + sci.xsize].copy())
+    ref.xstart = sci.xstart
+    ref.ystart = sci.ystart
+    ref.xsize = sci.xsize
+    ref.ysize = sci.ysize
+    if sci.name is not None:
+        ref.name = sci.name
+    return True
+
+
+class ReferenceCache(object):
+    """
+    A least recently used cache of reference models within a byte budget.
+
+    The cached models are never handed out: `get` returns copy-on-write
+    copies (see `DataModel.copy`), whose arrays are read-only views of
+    the cached ones, so nothing is copied on a hit.  The steps may close
+    the models they get, and change their metadata, but must copy an
+    array with `DataModel.unshare` before modifying it in place.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The budget for the arrays of the cached models.  With 0 nothing
+        is cached.
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._models)
+
+    def get(self, path, model_class, sci_model=None):
+        """
+        Open a reference model, from the cache if it is there.
+
+        Parameters
+        ----------
+        path: str
+            The reference file path.
+
+        model_class: DataModel subclass
+            The class of the model.
+
+        sci_model: DataModel or None
+            If given, the cached reference model is sliced to the
+            subarray of this science model (see `slice_to_subarray`), and
+            it is cached by subarray.  The model is not sliced when the
+            cache is disabled.
+
+        Returns
+        -------
+        DataModel
+            The reference model.
+        """
+        if self.max_bytes <= 0:
+            return model_class(path)
+
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), model_class.__name__,
+               None if sci_model is None else subarray_key(sci_model))
+        model = self._models.pop(key, None)
+        if model is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            model = model_class(path)
+            if sci_model is not None:
+                slice_to_subarray(model, sci_model)
+            nbytes = _model_bytes(model)
+            if nbytes > self.max_bytes:
+                # Too large to be cached
+                return model
+            # The arrays are in memory; the file is not needed anymore.
+            model.close()
+            self.nbytes += nbytes
+        self._models[key] = model
+        self._evict()
+        return model.copy(copy_on_write=True)
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._models):
+            _, model = self._models.popitem(last=False)
+            self.nbytes -= _model_bytes(model)
+            self.evictions += 1
+
+    def clear(self):
+        """Drop all of the cached models."""
+        self._models.clear()
+        self.nbytes = 0
+
+    def set_max_bytes(self, max_bytes):
+        """Change the byte budget, dropping models as needed."""
+        self.max_bytes = max_bytes
+        if max_bytes <= 0:
+            self.clear()
+        else:
+            self._evict()
+
+    def stats(self):
+        """
+        Returns a dict of the hits, misses, evictions, number of models
+        and bytes of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'models': len(self._models),
+                'nbytes': self.nbytes}
+
+
+# The cache of the process
+cache = ReferenceCache()
+
+
+def set_max_bytes(max_bytes):
+    """Set the byte budget of the cache of the process."""
+    cache.set_max_bytes(max_bytes)
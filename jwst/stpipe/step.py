@@ -7,6 +7,7 @@ import gc
 from os.path import dirname, join, basename, splitext, abspath, split
 import re
 import sys
+import time
 
 from astropy.extern import six
 
@@ -19,6 +20,8 @@ except ImportError:
 from . import config_parser
 from . import crds_client
 from . import log
+from . import profiling
+from . import reference_cache
 from . import utilities
 from .. import __version_commit__, __version__
 
@@ -39,6 +42,10 @@ class Step(object):
     skip = boolean(default=False)           # Skip this step
     save_results = boolean(default=False)   # Force save results
     suffix = string(default=None)           # Default suffix for output files
+    collect_garbage = boolean(default=True) # Run garbage collection before the step
+    reference_cache_mb = float(default=None) # Size (MB) of the cache of reference models kept between runs
+    save_timings = boolean(default=False)   # Write the timings of the step and its sub-steps next to the outputs
+    profile_dir = string(default=None)      # Directory in which to write cProfile statistics of each step
     """
 
     reference_file_types = []
@@ -301,8 +308,17 @@ class Step(object):
             self._post_hooks = []
 
         self._reference_files_used = []
+        self._reference_models_opened = 0
+        self._reference_time = 0.
         self._input_filename = None
 
+        # Timing records of the last run of the step and its sub-steps
+        self.timings = []
+
+        # Number of profiled runs of the step and its sub-steps in the last
+        # run, by qualified name
+        self._profile_runs = {}
+
     def _check_args(self, args, discouraged_types, msg):
         if discouraged_types is None:
             return
@@ -323,7 +339,14 @@ class Step(object):
         each step type is done in the `process` method.
         """
         from .. import datamodels
-        gc.collect()
+        start = profiling.Sample()
+        self._reference_time = 0.
+        if self.parent is None:
+            self.timings = []
+            self._profile_runs = {}
+
+        if self._collect_garbage():
+            gc.collect()
 
         # Make generic log messages go to this step's logger
         orig_log = log.delegator.log
@@ -331,9 +354,16 @@ class Step(object):
 
         result = None
 
+        if self.reference_cache_mb is not None:
+            reference_cache.set_max_bytes(
+                int(self.reference_cache_mb * 1024 * 1024))
+        self._reference_models_opened = 0
+
         try:
             if len(args) and len(self.reference_file_types) and not self.skip:
+                precache_start = time.time()
                 self._precache_reference_files(args[0])
+                self._reference_time += time.time() - precache_start
 
             self.log.info(
                 'Step {0} running with args {1}.'.format(
@@ -357,12 +387,31 @@ class Step(object):
                 self.log.info('Step skipped.')
                 result = args[0]
             else:
+                bytes_copied = datamodels.util.bytes_copied()
                 try:
-                    result = self.process(*args)
+                    profile_dir = self.search_attr('profile_dir')
+                    if profile_dir is not None:
+                        with profiling.profiled(
+                                self._profile_path(profile_dir)):
+                            result = self.process(*args)
+                    else:
+                        result = self.process(*args)
                 except TypeError as e:
                     if "process() takes exactly" in str(e):
                         raise TypeError("Incorrect number of arguments to step")
                     raise
+                _release_shared(result)
+                self.log.debug(
+                    'Step {0} copied {1} bytes of model arrays'.format(
+                        self.name,
+                        datamodels.util.bytes_copied() - bytes_copied))
+                if (self._reference_models_opened and
+                        reference_cache.cache.max_bytes > 0):
+                    self.log.info(
+                        'Reference cache: {hits} hits, {misses} misses, '
+                        '{evictions} evictions, {models} models, '
+                        '{nbytes} bytes'.format(
+                            **reference_cache.cache.stats()))
 
             # Warn if returning a discouraged object
             self._check_args(result, DISCOURAGED_TYPES, "Returned")
@@ -383,20 +432,23 @@ class Step(object):
                 results = result
 
             if len(self._reference_files_used) and not self._is_container(args[0]):
-                for result in results:
-                    if isinstance(result, datamodels.DataModel):
-                        for ref_name, filename in self._reference_files_used:
-                            if hasattr(result.meta.ref_file, ref_name):
-                                getattr(result.meta.ref_file, ref_name).name = filename
-                        result.meta.ref_file.crds.sw_version = crds_client.get_svn_version()
-                        result.meta.ref_file.crds.context_used = crds_client.get_context_used()
-                self._reference_files_used = []
-
-            # Mark versions
+                reference_files_used = self._reference_files_used
+            else:
+                reference_files_used = []
+            self._reference_files_used = []
+
+            # Record the reference files and mark versions
+            fast_chained = self._is_fast_chained()
             for result in results:
                 if isinstance(result, datamodels.DataModel):
-                    result.meta.calibration_software_revision = __version_commit__
-                    result.meta.calibration_software_version = __version__
+                    self._update_meta(result, reference_files_used)
+                    if fast_chained:
+                        result._validation_deferred = True
+                    elif result._validation_deferred:
+                        # End of a chain of steps: validate the model
+                        # once, now that all of the steps have run
+                        result._validation_deferred = False
+                        result._validate()
 
             # Save the output file if one was specified
             if not self.skip and (
@@ -420,6 +472,16 @@ class Step(object):
 
             self.log.info(
                 'Step {0} done'.format(self.name))
+
+            # Record the timings, with those of the sub-steps
+            record = profiling.make_record(
+                self, start, profiling.Sample(), self._reference_time)
+            self._root().timings.append(record)
+            self.log.debug('Step {0} timings: {1}'.format(self.name, record))
+            if self.parent is None and self.save_timings:
+                timings_path = self._timings_path(result_return)
+                self.log.info('Saving timings {0}'.format(timings_path))
+                profiling.write_records(self.timings, timings_path)
         finally:
             log.delegator.log = orig_log
 
@@ -427,6 +489,86 @@ class Step(object):
 
     __call__ = run
 
+    def _update_meta(self, model, reference_files_used):
+        """
+        Record the reference files and the software versions used in the
+        metadata of `model`.
+
+        The metadata is validated once, after all of the updates.
+        """
+        from ..datamodels import properties
+        with properties.deferred_validation(model.meta):
+            if len(reference_files_used):
+                for ref_name, filename in reference_files_used:
+                    if hasattr(model.meta.ref_file, ref_name):
+                        getattr(model.meta.ref_file, ref_name).name = filename
+                model.meta.ref_file.crds.sw_version = \
+                    crds_client.get_svn_version()
+                model.meta.ref_file.crds.context_used = \
+                    crds_client.get_context_used()
+            model.meta.calibration_software_revision = __version_commit__
+            model.meta.calibration_software_version = __version__
+
+    def _root(self):
+        """The outermost step of the pipeline of this step."""
+        step = self
+        while step.parent is not None:
+            step = step.parent
+        return step
+
+    def _output_stem(self, result=None):
+        """
+        The base name, without suffix, of the outputs of a run: from the
+        output file, the input file, or the result.
+        """
+        from ..datamodels import DataModel
+        name = self.search_attr('output_file') or self._input_filename
+        if not name and isinstance(result, DataModel):
+            name = result.meta.filename
+        if not name:
+            name = self.name
+        name = splitext(basename(name))[0]
+        return re.match(REMOVE_SUFFIX, name).group(1)
+
+    def _timings_path(self, result=None):
+        """The JSON lines file of the timings of a run."""
+        path = self._output_stem(result) + '_timings.jsonl'
+        output_dir = self.search_attr('output_dir')
+        if output_dir is not None:
+            path = join(output_dir, path)
+        return path
+
+    def _profile_path(self, profile_dir):
+        """
+        The cProfile statistics file of a run.  The second and later runs
+        of a sub-step within a run of the pipeline are numbered, so that
+        they don't overwrite the statistics of the first.
+        """
+        root = self._root()
+        run = root._profile_runs.get(self.qualified_name, 0) + 1
+        root._profile_runs[self.qualified_name] = run
+        name = self.qualified_name
+        if run > 1:
+            name = '{0}_{1}'.format(name, run)
+        return join(profile_dir, '{0}_{1}.prof'.format(
+            root._output_stem(), name))
+
+    def _is_fast_chained(self):
+        """
+        True if the step is run by a pipeline with `fast_chaining` set.
+        """
+        if self.parent is None:
+            return False
+        return bool(self.parent.search_attr('fast_chaining'))
+
+    def _collect_garbage(self):
+        """
+        True if garbage collection is to be run before the step and the
+        reference file fetches. Steps chained with `fast_chaining` leave
+        it to their pipeline.
+        """
+        return self.collect_garbage and not self._is_fast_chained()
+
     def process(self, *args):
         """
         This is where real work happens. Every Step subclass has to
@@ -542,7 +684,8 @@ class Step(object):
 
         returns:  None
         """
-        gc.collect()
+        if self._collect_garbage():
+            gc.collect()
         from .. import datamodels
         try:
             with datamodels.open(input_file) as model:
@@ -551,7 +694,8 @@ class Step(object):
             self.log.info(
                 'First argument {0} does not appear to be a '
                 'model'.format(input_file))
-        gc.collect()
+        if self._collect_garbage():
+            gc.collect()
 
     def _precache_reference_files_opened(self, model_or_container):
         """Pre-fetches references for `model_or_container`.   
@@ -631,25 +775,68 @@ class Step(object):
         -------
         reference_file : path of reference file,  a string
         """
-        override = self._get_ref_override(reference_file_type)
-        if override is not None:
-            if override.strip() != "":
-                self._reference_files_used.append(
-                    (reference_file_type, abspath(override)))
-                reference_name = override
-            else:
-                return ""
-        else:
-            reference_name = crds_client.get_reference_file(
-                input_file, reference_file_type)
-            gc.collect()
-            if reference_name != "N/A":
-                hdr_name = "crds://" + basename(reference_name)
+        start = time.time()
+        try:
+            override = self._get_ref_override(reference_file_type)
+            if override is not None:
+                if override.strip() != "":
+                    self._reference_files_used.append(
+                        (reference_file_type, abspath(override)))
+                    reference_name = override
+                else:
+                    return ""
             else:
-                hdr_name = "N/A"
-            self._reference_files_used.append(
-                (reference_file_type, hdr_name))
-        return crds_client.check_reference_open(reference_name)
+                reference_name = crds_client.get_reference_file(
+                    input_file, reference_file_type)
+                if self._collect_garbage():
+                    gc.collect()
+                if reference_name != "N/A":
+                    hdr_name = "crds://" + basename(reference_name)
+                else:
+                    hdr_name = "N/A"
+                self._reference_files_used.append(
+                    (reference_file_type, hdr_name))
+            return crds_client.check_reference_open(reference_name)
+        finally:
+            self._reference_time += time.time() - start
+
+    def open_reference_model(self, reference_name, model_class,
+                             input_model=None):
+        """
+        Open a reference file as a model, through the reference cache.
+
+        If the cache is enabled (see `reference_cache`), a model opened
+        for an earlier exposure is reused instead of reading the file
+        again.  The model may be closed by the step.  Its arrays are then
+        read-only, shared with the cached model: those the step modifies
+        in place must first be copied with `DataModel.unshare`.
+
+        Parameters
+        ----------
+        reference_name : string
+            The reference file path, as returned by `get_reference_file`.
+
+        model_class : DataModel subclass
+            The class of the reference model.
+
+        input_model : jwst.datamodels.DataModel instance, optional
+            If given, the image arrays of the reference model are sliced
+            to the subarray of this science model, unless they match it
+            already.  Only for steps which compare the subarray metadata
+            or array shapes of the reference and science data.
+
+        Returns
+        -------
+        model : model_class instance
+        """
+        cache = reference_cache.cache
+        hits = cache.hits
+        model = cache.get(reference_name, model_class, input_model)
+        self._reference_models_opened += 1
+        if cache.max_bytes > 0:
+            self.log.debug('Reference cache {0} for {1}'.format(
+                'hit' if cache.hits > hits else 'miss', reference_name))
+        return model
 
     def reference_uri_to_cache_path(self, reference_uri):
         """Convert an abstract CRDS reference URI to an absolute file path in the CRDS
@@ -909,3 +1096,20 @@ def _get_suffix(suffix, step=None, default_suffix=None):
     if suffix is None:
         suffix = default_suffix
     return suffix
+
+
+def _release_shared(result):
+    """End the copy-on-write sharing of the arrays of the returned models
+
+    Parameters
+    ----------
+    result: object
+        The result of a step: a model, or a sequence of models
+    """
+    from .. import datamodels
+
+    if isinstance(result, (tuple, list, datamodels.ModelContainer)):
+        for model in result:
+            _release_shared(model)
+    elif isinstance(result, datamodels.DataModel):
+        result.release_shared()
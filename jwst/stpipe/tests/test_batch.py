@@ -0,0 +1,86 @@
+"""Test running a step on a batch of exposures"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ... import datamodels
+from .. import batch
+
+STEP = 'jwst.stpipe.tests.steps.StepWithModel'
+
+
+def make_inputs(tmpdir):
+    paths = []
+    for index, size in enumerate([10, 30, 20]):
+        model = datamodels.ImageModel(np.zeros((size, size), np.float32))
+        path = str(tmpdir.join('image{0}.fits'.format(index)))
+        model.save(path)
+        paths.append(path)
+    bad = str(tmpdir.join('bad.fits'))
+    with open(bad, 'w') as fd:
+        fd.write('not a FITS file')
+    return paths, bad
+
+
+def test_expand_inputs(tmpdir):
+    paths, bad = make_inputs(tmpdir)
+    input_list = str(tmpdir.join('inputs.txt'))
+    with open(input_list, 'w') as fd:
+        fd.write('# inputs\n{0}\n\n{1}\n'.format(bad, paths[0]))
+
+    inputs = batch.expand_inputs([str(tmpdir.join('image*.fits'))],
+                                 input_list)
+    assert inputs == paths + [bad]
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_run_batch(tmpdir, processes):
+    """Failures are isolated, and the manifest lists all exposures"""
+    paths, bad = make_inputs(tmpdir)
+    output_dir = tmpdir.mkdir('out')
+    manifest = str(tmpdir.join('manifest.json'))
+    missing = str(tmpdir.join('missing.fits'))
+    inputs = [paths[0], bad, paths[1], missing, paths[2]]
+
+    summary = batch.run_batch(
+        [STEP, '--output_dir={0}'.format(output_dir)], inputs, processes,
+        manifest)
+
+    assert summary['succeeded'] == 3
+    assert summary['failed'] == 2
+    with open(manifest) as fd:
+        assert json.load(fd) == summary
+
+    records = summary['exposures']
+    assert [record['input'] for record in records] == inputs
+    assert [record['status'] for record in records] == [
+        'succeeded', 'failed', 'succeeded', 'failed', 'succeeded']
+    assert 'IOError' in records[3]['error'] or 'OSError' in records[3]['error']
+    for record in records:
+        assert record['wall_time'] >= 0.
+    assert len(os.listdir(str(output_dir))) == 3
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_invalid_step_args(tmpdir, processes):
+    """Configuration errors are raised before running any exposure"""
+    paths, bad = make_inputs(tmpdir)
+    with pytest.raises(ValueError):
+        batch.run_batch([STEP, paths[0]], paths, processes)
+    with pytest.raises(ValueError):
+        batch.run_batch(
+            [STEP, '--output_file={0}'.format(tmpdir.join('out.fits'))],
+            paths, processes)
+
+
+def test_main_status(tmpdir):
+    paths, bad = make_inputs(tmpdir)
+    manifest = str(tmpdir.join('manifest.json'))
+    assert batch.main([STEP, paths[0], '--manifest', manifest,
+                       '--output_dir={0}'.format(tmpdir)]) == 0
+    assert batch.main([STEP, bad, '--manifest', manifest,
+                       '--output_dir={0}'.format(tmpdir)]) == 1
@@ -158,6 +158,19 @@ def test_partial_pipeline():
     assert_allclose(np.sum(result.data), 9969.82514685, rtol=1e-4)
     os.remove('stpipe.MyLinearPipeline.fits')
 
+def test_fast_chaining():
+    pipe = MyLinearPipeline(fast_chaining=True)
+    assert pipe._collect_garbage()
+    assert not pipe.multiply._collect_garbage()
+
+    result = pipe.run(abspath(join(dirname(__file__), 'data', 'science.fits')))
+
+    # The result is validated, and back to normal, at the end of the chain
+    assert not result._validation_deferred
+    assert result.meta.calibration_software_version is not None
+    assert_allclose(np.sum(result.data), 9969.82514685, rtol=1e-4)
+
+
 def test_pipeline_commandline():
     args = [
         abspath(join(dirname(__file__), 'steps', 'python_pipeline.cfg')),
@@ -225,3 +238,55 @@ def test_pipeline_commandline_invalid_args():
 
     # Make sure the comments made it into the help message
     assert "Multiply by this number" in help
+
+
+def test_timings(tmpdir):
+    import glob
+    import json
+
+    pipe = MyLinearPipeline(save_timings=True, output_dir=str(tmpdir),
+                            profile_dir=str(tmpdir))
+    pipe.run(abspath(join(dirname(__file__), 'data', 'science.fits')))
+
+    # One record per step, the pipeline last
+    names = [record['step'] for record in pipe.timings]
+    assert names == [pipe.multiply.qualified_name,
+                     pipe.multiply2.qualified_name,
+                     pipe.multiply3.qualified_name,
+                     pipe.qualified_name]
+    for record in pipe.timings:
+        assert record['wall_time'] >= 0.
+        assert record['cpu_time'] >= 0.
+    assert pipe.timings[-1]['wall_time'] >= sum(
+        record['wall_time'] for record in pipe.timings[:-1])
+
+    timings_files = glob.glob(str(tmpdir.join('*_timings.jsonl')))
+    assert len(timings_files) == 1
+    with open(timings_files[0]) as fd:
+        assert [json.loads(line) for line in fd] == pipe.timings
+
+    assert len(glob.glob(str(tmpdir.join('*.prof')))) == 4
+
+
+class MultiplyTwicePipeline(Pipeline):
+    """
+    A pipeline running the same step twice.
+    """
+
+    step_defs = {
+        'multiply': MultiplyBy2,
+        }
+
+    def process(self, input):
+        return self.multiply(self.multiply(input))
+
+
+def test_profile_repeated_step(tmpdir):
+    import glob
+
+    pipe = MultiplyTwicePipeline(profile_dir=str(tmpdir))
+    pipe.run(abspath(join(dirname(__file__), 'data', 'science.fits')))
+
+    # One file per run of the step, and one for the pipeline
+    assert len(glob.glob(str(tmpdir.join('*.prof')))) == 3
+    assert len(glob.glob(str(tmpdir.join('*multiply_2.prof')))) == 1
@@ -0,0 +1,149 @@
+"""Test the cache of reference models"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+
+from ... import datamodels
+from .. import reference_cache
+
+SHAPE = (20, 30)
+
+
+def make_reference(tmpdir, name, value=1.):
+    model = datamodels.SaturationModel(
+        data=np.full(SHAPE, value, dtype=np.float32),
+        dq=np.zeros(SHAPE, dtype=np.uint32))
+    model.data[5, 7] = 3.
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.xsize = SHAPE[1]
+    model.meta.subarray.ysize = SHAPE[0]
+    path = str(tmpdir.join(name))
+    model.save(path)
+    return path
+
+
+def make_science(xstart, ystart, xsize, ysize):
+    model = datamodels.RampModel((1, 2, ysize, xsize))
+    model.meta.subarray.xstart = xstart
+    model.meta.subarray.ystart = ystart
+    model.meta.subarray.xsize = xsize
+    model.meta.subarray.ysize = ysize
+    return model
+
+
+def test_hits_and_misses(tmpdir):
+    path = make_reference(tmpdir, 'sat.fits')
+    cache = reference_cache.ReferenceCache(max_bytes=10 ** 6)
+
+    first = cache.get(path, datamodels.SaturationModel)
+    second = cache.get(path, datamodels.SaturationModel)
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['models'] == 1
+    assert first is not second
+    assert np.array_equal(first.data, second.data)
+
+    # The copies share the cached arrays, read-only, until they are
+    # unshared to be modified
+    copied = datamodels.util.bytes_copied()
+    assert not second.data.flags.writeable
+    with pytest.raises(ValueError):
+        second.data[0, 0] = 42.
+    assert datamodels.util.bytes_copied() == copied
+    first.unshare('data')
+    first.data[0, 0] = 42.
+    third = cache.get(path, datamodels.SaturationModel)
+    assert third.data[0, 0] == 1.
+    assert second.data[0, 0] == 1.
+
+
+def test_disabled(tmpdir):
+    path = make_reference(tmpdir, 'sat.fits')
+    cache = reference_cache.ReferenceCache()
+
+    model = cache.get(path, datamodels.SaturationModel,
+                      make_science(3, 2, 10, 5))
+    # Not cached, nor sliced
+    assert model.data.shape == SHAPE
+    assert len(cache) == 0
+    assert cache.stats()['misses'] == 0
+
+
+def test_eviction(tmpdir):
+    paths = [make_reference(tmpdir, 'sat{0}.fits'.format(i), i)
+             for i in range(3)]
+    model_bytes = 2 * SHAPE[0] * SHAPE[1] * 4
+    cache = reference_cache.ReferenceCache(max_bytes=2 * model_bytes)
+
+    for path in paths:
+        cache.get(path, datamodels.SaturationModel)
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+    assert cache.nbytes == 2 * model_bytes
+
+    # The least recently used was dropped
+    cache.get(paths[0], datamodels.SaturationModel)
+    assert cache.stats()['misses'] == 4
+
+    cache.set_max_bytes(0)
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_too_large(tmpdir):
+    path = make_reference(tmpdir, 'sat.fits')
+    cache = reference_cache.ReferenceCache(max_bytes=100)
+
+    model = cache.get(path, datamodels.SaturationModel)
+    assert model.data.shape == SHAPE
+    assert len(cache) == 0
+    model.close()
+
+
+def test_subarray(tmpdir):
+    path = make_reference(tmpdir, 'sat.fits')
+    cache = reference_cache.ReferenceCache(max_bytes=10 ** 6)
+
+    sci = make_science(6, 4, 10, 5)
+    model = cache.get(path, datamodels.SaturationModel, sci)
+    assert model.data.shape == (5, 10)
+    assert model.dq.shape == (5, 10)
+    assert model.data[5 - 3, 7 - 5] == 3.
+    assert model.meta.subarray.xstart == 6
+    assert model.meta.subarray.ysize == 5
+
+    # Each subarray is cached on its own
+    cache.get(path, datamodels.SaturationModel, make_science(1, 1, 10, 5))
+    cache.get(path, datamodels.SaturationModel, sci)
+    assert cache.stats()['misses'] == 2
+    assert cache.stats()['hits'] == 1
+
+    # Full frame data are not sliced
+    full = cache.get(path, datamodels.SaturationModel,
+                     make_science(1, 1, SHAPE[1], SHAPE[0]))
+    assert full.data.shape == SHAPE
+
+    with pytest.raises(ValueError):
+        cache.get(path, datamodels.SaturationModel,
+                  make_science(25, 1, 10, 5))
+
+
+def test_subarray_without_data_array(tmpdir):
+    """Models without a DATA array, like LinearityModel, are sliced too"""
+    coeffs = np.zeros((3,) + SHAPE, dtype=np.float32)
+    coeffs[1] = 1.
+    coeffs[2, 5, 7] = 3.
+    model = datamodels.LinearityModel(
+        coeffs=coeffs, dq=np.zeros(SHAPE, dtype=np.uint32))
+    path = str(tmpdir.join('lin.fits'))
+    model.save(path)
+    cache = reference_cache.ReferenceCache(max_bytes=10 ** 6)
+
+    model = cache.get(path, datamodels.LinearityModel,
+                      make_science(6, 4, 10, 5))
+    assert model.coeffs.shape == (3, 5, 10)
+    assert model.dq.shape == (5, 10)
+    assert model.coeffs[2, 5 - 3, 7 - 5] == 3.
+    assert model.meta.subarray.xstart == 6
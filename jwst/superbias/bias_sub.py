@@ -33,8 +33,12 @@ def do_correction(input_model, bias_model):
 
     """
 
-    # Replace NaN's in the superbias with zeros
-    bias_model.data[np.isnan(bias_model.data)] = 0.0
+    # Replace NaN's in the superbias with zeros; the data of a cached
+    # superbias are only copied if there are any
+    nans = np.isnan(bias_model.data)
+    if nans.any():
+        bias_model.unshare('data')
+        bias_model.data[nans] = 0.0
 
     # Check for subarray mode and extract subarray from the
     # bias reference data if necessary
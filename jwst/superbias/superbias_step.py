@@ -33,7 +33,8 @@ class SuperBiasStep(Step):
                 return result
 
             # Open the superbias ref file data model
-            bias_model = datamodels.SuperBiasModel(self.bias_name)
+            bias_model = self.open_reference_model(
+                self.bias_name, datamodels.SuperBiasModel, input_model)
 
             # Do the bias subtraction
             result = bias_sub.do_correction(input_model, bias_model)